@@ -26,6 +26,7 @@ ZERO_WIDTH_SPACE = "\ufeff"
 SHY_HYPHEN = "\u00ad"
 FUNCTION_APPLICATION = "\u2061"
 NO_BREAK_HYPHEN = "\u2011"
+WORD_CACHE_SIZE = 200000 # How many words per-word caches, like syllable counts and hyphenations, remember; far more than the vocabulary of a book, but a long-running process that reads many books mustn't grow without bound
 IGNORED_FILENAMES = ["colophon.xhtml", "titlepage.xhtml", "imprint.xhtml", "uncopyright.xhtml", "halftitle.xhtml", "toc.xhtml", "loi.xhtml"]
 # The `re` namespace enables regex functions in xpaths in lxml
 XHTML_NAMESPACES = {"xhtml": "http://www.w3.org/1999/xhtml", "epub": "http://www.idpf.org/2007/ops", "z3998": "http://www.daisy.org/z3998/2012/vocab/structure/", "se": "https://standardebooks.org/vocab/1.0", "dc": "http://purl.org/dc/elements/1.1/", "opf": "http://www.idpf.org/2007/opf", "container": "urn:oasis:names:tc:opendocument:xmlns:container", "m": "http://www.w3.org/1998/Math/MathML", "re": "http://exslt.org/regular-expressions"}
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 """
-Defines functions for interacting with headless browser sessions.
+Defines functions and classes for interacting with headless browser sessions.
 """
 
+import atexit
 import os
 import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Iterator, List, Optional
 
 from selenium import webdriver
 from selenium.common.exceptions import WebDriverException
@@ -47,3 +51,170 @@ def initialize_selenium_firefox_webdriver() -> webdriver:
 		raise se.MissingDependencyException("Selenium Firefox web driver is not installed. To install it on Linux, download the appropriate zip file from [url][link=https://github.com/mozilla/geckodriver/releases/latest]https://github.com/mozilla/geckodriver/releases/latest[/][/] and place the [bash]geckodriver[/] executable in your [path]$PATH[/] (for example, in [path]~/.local/bin/[/] or [path]/usr/local/bin/[/]). To install it on macOS, run [bash]brew install geckodriver[/].")
 
 	return driver
+
+BROWSER_POOL_MAX_PAGES = 200 # Drivers are quit and replaced after loading this many pages, to bound the browser's memory use
+
+class _PooledDriver:
+	"""
+	Wraps a webdriver handed out by a `BrowserPool`, and counts the pages it has loaded.
+
+	Every other attribute is passed through to the wrapped driver. Don't call `quit()` on a pooled driver; the pool does that.
+	"""
+
+	def __init__(self, driver):
+		self.driver = driver
+		self.pages = 0
+
+	def get(self, url: str) -> None:
+		"""
+		Load a page, counting it against the driver's page limit.
+		"""
+
+		self.pages += 1
+		self.driver.get(url)
+
+	def __getattr__(self, name: str):
+		return getattr(self.driver, name)
+
+class BrowserPool:
+	"""
+	A pool of warm headless browser sessions.
+
+	Starting Firefox often takes longer than whatever we want it to render, so instead of starting a browser for each job, borrow one from a pool.
+	A long-running process (like a build daemon) that renders many books can keep one pool alive for its whole life; see `get_browser_pool()`.
+
+	Drivers are reset to a blank page with no cookies before they're handed out again, and they're quit and replaced after
+	`max_pages` page loads. A driver that was in use when an exception was raised is quit instead of being returned to the pool,
+	because we can't know what state it's in.
+	"""
+
+	def __init__(self, max_pages: int = BROWSER_POOL_MAX_PAGES, driver_factory: Callable = initialize_selenium_firefox_webdriver):
+		self.max_pages = max_pages
+		self.driver_factory = driver_factory
+		self.drivers_started = 0
+		self._idle_drivers: List[_PooledDriver] = []
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def driver(self) -> Iterator[_PooledDriver]:
+		"""
+		Borrow a driver from the pool for the duration of a `with` block.
+
+		INPUTS
+		None.
+
+		OUTPUTS
+		A context manager yielding a webdriver.
+		"""
+
+		driver = self.acquire()
+
+		try:
+			yield driver
+		except BaseException:
+			self._quit(driver)
+			raise
+
+		self.release(driver)
+
+	def acquire(self) -> _PooledDriver:
+		"""
+		Take a driver from the pool, starting a new one if there are no idle drivers.
+
+		Drivers taken with `acquire()` must be given back with `release()`.
+
+		INPUTS
+		None.
+
+		OUTPUTS
+		A webdriver.
+		"""
+
+		with self._lock:
+			if self._idle_drivers:
+				return self._idle_drivers.pop()
+
+		driver = _PooledDriver(self.driver_factory())
+
+		with self._lock:
+			self.drivers_started += 1
+
+		return driver
+
+	def release(self, driver: _PooledDriver) -> None:
+		"""
+		Return a driver to the pool.
+
+		INPUTS
+		driver: A driver taken from this pool with `acquire()`
+
+		OUTPUTS
+		None.
+		"""
+
+		if driver.pages >= self.max_pages:
+			self._quit(driver)
+			return
+
+		# Reset the driver so that nothing from this use can leak into the next one.
+		# Loading the blank page doesn't count against the driver's page limit.
+		try:
+			driver.delete_all_cookies()
+			driver.driver.get("about:blank")
+		except Exception:
+			self._quit(driver)
+			return
+
+		with self._lock:
+			self._idle_drivers.append(driver)
+
+	def close(self) -> None:
+		"""
+		Quit all of the idle drivers in the pool.
+
+		INPUTS
+		None.
+
+		OUTPUTS
+		None.
+		"""
+
+		with self._lock:
+			drivers = self._idle_drivers
+			self._idle_drivers = []
+
+		for driver in drivers:
+			self._quit(driver)
+
+	@staticmethod
+	def _quit(driver: _PooledDriver) -> None:
+		try:
+			driver.driver.quit()
+		except Exception:
+			# The browser may already be gone, for example if we got here because of ctrl + c
+			pass
+
+_BROWSER_POOL: Optional[BrowserPool] = None
+_BROWSER_POOL_LOCK = threading.Lock()
+
+def get_browser_pool() -> BrowserPool:
+	"""
+	Return the process-wide browser pool, creating it if necessary.
+
+	The pool's drivers are quit when the process exits, so a long-running process can keep using the same browsers for every job it runs.
+
+	INPUTS
+	None.
+
+	OUTPUTS
+	A BrowserPool.
+	"""
+
+	global _BROWSER_POOL # pylint: disable=global-statement
+
+	with _BROWSER_POOL_LOCK:
+		if _BROWSER_POOL is None:
+			_BROWSER_POOL = BrowserPool()
+			atexit.register(_BROWSER_POOL.close)
+
+		return _BROWSER_POOL
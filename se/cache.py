@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Defines the BuildCache class, an on-disk cache of the output of the build's per-file transforms.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+import se
+
+BUILD_CACHE_MAX_SIZE = 512 * 1024 * 1024 # The cache is pruned back to this many bytes at the end of each build
+
+_SOURCE_HASH: Optional[str] = None
+_SOURCE_HASH_LOCK = threading.Lock()
+
+def get_cache_directory() -> Path:
+	"""
+	Return the directory the build cache lives in, following the XDG base directory spec.
+	"""
+
+	cache_home = os.environ.get("XDG_CACHE_HOME")
+
+	return (Path(cache_home) if cache_home else Path.home() / ".cache") / "se" / "build"
+
+def get_source_hash() -> str:
+	"""
+	Return a hash of every file in the installed `se` package, including its data files.
+
+	The hash is part of every cache key, so that changing any code or data the tools run, even in a Git checkout or an editable install
+	where the version number stays the same, means that nothing cached by the old code is reused. It's calculated once per process.
+
+	INPUTS
+	None
+
+	OUTPUTS
+	A string representing the hash.
+	"""
+
+	global _SOURCE_HASH # pylint: disable=global-statement
+
+	with _SOURCE_HASH_LOCK:
+		if _SOURCE_HASH is None:
+			package_directory = Path(se.__file__).parent
+			source_hash = hashlib.sha256()
+
+			for path in sorted(package_directory.rglob("*")):
+				if "__pycache__" in path.parts or not path.is_file():
+					continue
+
+				source_hash.update(f"{path.relative_to(package_directory).as_posix()}\0{path.stat().st_size}\0".encode("utf-8"))
+				source_hash.update(path.read_bytes())
+
+			_SOURCE_HASH = source_hash.hexdigest()
+
+		return _SOURCE_HASH
+
+class BuildCache:
+	"""
+	A content-addressed, on-disk cache of the output of the build's per-file transforms.
+
+	An entry is keyed by the hash of its input, the name and version of the transform that produced it, the version of the se tools,
+	a hash of the source of the se tools, and any context the transform depends on (like the CSS selectors used to simplify an XHTML
+	file). So, entries are never stale, even when the code changes without a version being bumped. Entries that go unused are evicted,
+	oldest first, by `prune()`.
+
+	The cache is best-effort: if it can't be read or written, transforms simply run as if it were empty.
+	"""
+
+	def __init__(self, directory: Optional[Path] = None, max_size: int = BUILD_CACHE_MAX_SIZE, enabled: bool = True):
+		self.directory = directory if directory else get_cache_directory()
+		self.max_size = max_size
+		self.enabled = enabled
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+	def get_key(self, transform: str, version: int, data: Union[str, bytes], *context: Union[str, bytes]) -> str:
+		"""
+		Return the cache key for the output of a transform.
+
+		INPUTS
+		transform: The name of the transform
+		version: The version of the transform; bump it when the transform's output changes
+		data: The input to the transform
+		context: Anything else the transform's output depends on
+
+		OUTPUTS
+		A string representing the cache key.
+		"""
+
+		key_hash = hashlib.sha256(f"{transform}\0{version}\0{se.VERSION}\0{get_source_hash()}\0".encode("utf-8"))
+
+		for value in (data,) + context:
+			value = value.encode("utf-8") if isinstance(value, str) else value
+			key_hash.update(f"{len(value)}\0".encode("utf-8"))
+			key_hash.update(value)
+
+		return key_hash.hexdigest()
+
+	def _get_entry_path(self, key: str) -> Path:
+		return self.directory / key[0:2] / key
+
+	def get(self, key: str) -> Optional[bytes]:
+		"""
+		Return the cached value for a key, or None if there isn't one.
+		"""
+
+		if not self.enabled:
+			return None
+
+		path = self._get_entry_path(key)
+
+		try:
+			value = path.read_bytes()
+			# Touch the entry so that `prune()` evicts the least recently used entries first
+			os.utime(path)
+		except OSError:
+			value = None
+
+		with self._lock:
+			if value is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+
+		return value
+
+	def put(self, key: str, value: bytes) -> None:
+		"""
+		Store a value in the cache.
+		"""
+
+		if not self.enabled:
+			return
+
+		path = self._get_entry_path(key)
+
+		temp_path = None
+
+		try:
+			path.parent.mkdir(parents=True, exist_ok=True)
+
+			# Write to a temporary file and then move it into place, so that concurrent builds never see a partial entry
+			with tempfile.NamedTemporaryFile(dir=path.parent, prefix=".", delete=False) as file:
+				temp_path = Path(file.name)
+				file.write(value)
+
+			os.replace(temp_path, path)
+		except OSError:
+			if temp_path:
+				se.quiet_remove(temp_path)
+
+	def apply(self, transform: str, version: int, function: Callable, data: Union[str, bytes], *context: Union[str, bytes]) -> Union[str, bytes]:
+		"""
+		Return the output of `function(data)`, from the cache if possible.
+
+		If `data` is a string, `function` must return a string; if it's bytes, `function` must return bytes.
+
+		INPUTS
+		transform: The name of the transform
+		version: The version of the transform; bump it when the transform's output changes
+		function: A function that takes `data` and returns the transformed output
+		data: The input to the transform
+		context: Anything else the transform's output depends on
+
+		OUTPUTS
+		The transformed output.
+		"""
+
+		if not self.enabled:
+			return function(data)
+
+		key = self.get_key(transform, version, data, *context)
+		value = self.get(key)
+
+		if value is not None:
+			return value.decode("utf-8") if isinstance(data, str) else value
+
+		output = function(data)
+
+		self.put(key, output.encode("utf-8") if isinstance(output, str) else output)
+
+		return output
+
+	def prune(self) -> None:
+		"""
+		Evict the least recently used entries until the cache is no bigger than its maximum size.
+		"""
+
+		if not self.enabled or not self.directory.is_dir():
+			return
+
+		entries: List[Tuple[float, int, Path]] = []
+		size = 0
+
+		for path in self.directory.glob("*/*"):
+			try:
+				stat = path.stat()
+			except OSError:
+				continue
+
+			entries.append((stat.st_mtime, stat.st_size, path))
+			size += stat.st_size
+
+		entries.sort()
+
+		for _, entry_size, path in entries:
+			if size <= self.max_size:
+				break
+
+			se.quiet_remove(path)
+			size -= entry_size
@@ -3,13 +3,47 @@ This module implements the `se build` command.
 """
 
 import argparse
+import json
 from pathlib import Path
 
 from rich.console import Console
+from rich.table import Table
 
 import se
 from se.se_epub import SeEpub
 
+def _format_bytes(size: int) -> str:
+	"""
+	Format a number of bytes in human-readable units.
+	"""
+
+	for unit in ["B", "KB", "MB", "GB"]:
+		if size < 1024 or unit == "GB":
+			break
+		size = size / 1024
+
+	return f"{size:,.1f} {unit}" if unit != "B" else f"{size:,} {unit}"
+
+def _print_timings_table(console: Console, stats) -> None:
+	"""
+	Print a table of the build's stage timings.
+	"""
+
+	table = Table(show_header=True, header_style="bold")
+	table.add_column("Stage", no_wrap=True)
+	table.add_column("Wall (s)", justify="right")
+	table.add_column("CPU (s)", justify="right")
+	table.add_column("Files", justify="right")
+	table.add_column("Bytes", justify="right")
+
+	for timing in stats.get_timings():
+		table.add_row(timing.name, f"{timing.wall_time:.3f}", f"{timing.cpu_time:.3f}", f"{timing.files:,}", _format_bytes(timing.bytes))
+
+	# Stages run concurrently, so the total is the build's wall time, not the sum of the stages
+	table.add_row("[bold]total[/]", f"{stats.wall_time:.3f}", "", f"{stats.input_files:,}", _format_bytes(stats.input_bytes))
+
+	console.print(table)
+
 def build() -> int:
 	"""
 	Entry point for `se build`
@@ -18,10 +52,16 @@ def build() -> int:
 	parser = argparse.ArgumentParser(description="Build compatible .epub and pure .epub3 ebooks from a Standard Ebook source directory. Output is placed in the current directory, or the target directory with --output-dir.")
 	parser.add_argument("-b", "--kobo", dest="build_kobo", action="store_true", help="also build a .kepub.epub file for Kobo")
 	parser.add_argument("-c", "--check", action="store_true", help="use epubcheck to validate the compatible .epub file; if --kindle is also specified and epubcheck fails, don’t create a Kindle file")
+	parser.add_argument("--compression-level", metavar="LEVEL", type=int, choices=range(0, 10), default=None, help="the zlib compression level for the output files, from 0 (fastest) to 9 (smallest); defaults to 6")
 	parser.add_argument("-k", "--kindle", dest="build_kindle", action="store_true", help="also build an .azw3 file for Kindle")
+	parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="don’t reuse the output of per-file transforms from earlier builds, and don’t save it for later builds")
 	parser.add_argument("-o", "--output-dir", metavar="DIRECTORY", type=str, default="", help="a directory to place output files in; will be created if it doesn’t exist")
+	parser.add_argument("--rev", metavar="REVISION", type=str, default=None, help="build the ebook as of this Git revision, like a commit hash or a tag, reading it straight from the repository without checking it out")
+	parser.add_argument("--preview", action="store_true", help="quickly build only a pure .epub3 with proofreading CSS, to check changes while proofreading; can’t be used with --check, --covers, --kindle, --kobo, or --targets")
 	parser.add_argument("-p", "--proof", action="store_true", help="insert additional CSS rules that are helpful for proofreading; output filenames will end in .proof")
 	parser.add_argument("-t", "--covers", dest="build_covers", action="store_true", help="output the cover and a cover thumbnail; can only be used when there is a single build target")
+	parser.add_argument("--targets", metavar="TARGET[,TARGET...]", type=str, default=None, help="a comma-separated list of artifacts to build, from epub, epub3, kepub, and azw3; defaults to epub,epub3; --kobo and --kindle add kepub and azw3")
+	parser.add_argument("--timings", nargs="?", const="table", choices=["table", "json"], help="print the time spent in each stage of the build, and the files and bytes it processed, as a table or as one line of JSON per build")
 	parser.add_argument("-v", "--verbose", action="store_true", help="increase output verbosity")
 	parser.add_argument("directories", metavar="DIRECTORY", nargs="+", help="a Standard Ebooks source directory")
 	args = parser.parse_args()
@@ -34,6 +74,15 @@ def build() -> int:
 		se.print_error("[bash]--covers[/] option specified, but more than one build target specified.")
 		return se.InvalidInputException.code
 
+	if args.preview:
+		if args.check or args.build_covers or args.build_kindle or args.build_kobo or args.targets:
+			se.print_error("[bash]--preview[/] option specified with [bash]--check[/], [bash]--covers[/], [bash]--kindle[/], [bash]--kobo[/], or [bash]--targets[/].")
+			return se.InvalidInputException.code
+
+		# A preview is a proofreading build of just the pure epub3, which skips the whole compatibility pipeline
+		args.proof = True
+		args.targets = "epub3"
+
 	for directory in args.directories:
 		exception = None
 
@@ -44,8 +93,8 @@ def build() -> int:
 			console.print(f"Building [path][link=file://{directory}]{directory}[/][/] ... ", end="")
 
 		try:
-			se_epub = SeEpub(directory)
-			se_epub.build(args.check, args.build_kobo, args.build_kindle, Path(args.output_dir), args.proof, args.build_covers)
+			se_epub = SeEpub(directory, args.rev)
+			stats = se_epub.build(args.check, args.build_kobo, args.build_kindle, Path(args.output_dir), args.proof, args.build_covers, [target.strip() for target in args.targets.split(",")] if args.targets else None, args.use_cache, args.compression_level)
 		except se.SeException as ex:
 			exception = ex
 			return_code = se.BuildFailedException.code
@@ -60,7 +109,18 @@ def build() -> int:
 				console.print("")
 			se.print_error(exception, args.verbose)
 			last_output_was_exception = True
-		elif args.verbose:
-			console.print("OK")
+		else:
+			if args.verbose:
+				console.print("OK")
+				console.print(f"{se.MESSAGE_INDENT}Read {stats.input_files:,} files ({_format_bytes(stats.input_bytes)}) from the build input manifest; skipped {stats.skipped_files:,} files ({_format_bytes(stats.skipped_bytes)}) not needed for the build.")
+
+				if args.use_cache:
+					console.print(f"{se.MESSAGE_INDENT}Reused {stats.cache_hits:,} cached transform outputs; ran {stats.cache_misses:,} transforms.")
+
+			if args.timings == "json":
+				# Print JSON directly instead of through rich, so that brackets aren't treated as markup
+				print(json.dumps({"directory": str(directory), **stats.to_dict()}))
+			elif args.timings:
+				_print_timings_table(console, stats)
 
 	return return_code
@@ -3,10 +3,13 @@ This module implements the `se clean` command.
 """
 
 import argparse
+from pathlib import Path
+from typing import List, Tuple
 
 from rich.console import Console
 
 import se
+import se.cache
 import se.formatting
 
 
@@ -16,24 +19,44 @@ def clean() -> int:
 	"""
 
 	parser = argparse.ArgumentParser(description="Prettify and canonicalize individual XHTML, SVG, or CSS files, or all XHTML, SVG, or CSS files in a source directory. Note that this only prettifies the source code; it doesn’t perform typography changes.")
+	parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="format every file, instead of skipping files that earlier runs found already clean, and don’t remember which files are clean")
 	parser.add_argument("-v", "--verbose", action="store_true", help="increase output verbosity")
 	parser.add_argument("targets", metavar="TARGET", nargs="+", help="an XHTML, SVG, or CSS file, or a directory containing XHTML, SVG, or CSS files")
 	args = parser.parse_args()
 
 	console = Console(highlight=False, theme=se.RICH_THEME, force_terminal=se.is_called_from_parallel()) # Syntax highlighting will do weird things when printing paths; force_terminal prints colors when called from GNU Parallel
 
+	# Files that the cache knows are already clean are skipped without parsing them, and the rest are formatted in parallel
+	cache = se.cache.BuildCache(enabled=args.use_cache)
+	files: List[Tuple[Path, str, bool]] = []
+
 	for filepath in se.get_target_filenames(args.targets, (".xhtml", ".svg", ".opf", ".ncx", ".xml"), []):
+		with open(filepath, "r", encoding="utf-8") as file:
+			xml = file.read()
+
+		files.append((filepath, xml, not se.formatting.is_known_formatted(cache, xml, filepath.suffix)))
+
+	processed_xmls = se.formatting.format_xml_strings([(xml, filepath.suffix) for filepath, xml, needs_formatting in files if needs_formatting])
+
+	for filepath, xml, needs_formatting in files:
 		if args.verbose:
 			console.print(f"Processing [path][link=file://{filepath}]{filepath}[/][/] ...", end="")
 
-		try:
-			se.formatting.format_xml_file(filepath)
-		except se.MissingDependencyException as ex:
-			se.print_error(ex)
-			return ex.code
-		except se.SeException as ex:
-			se.print_error(f"File: [path][link=file://{filepath}]{filepath}[/][/]. Exception: {ex}", args.verbose)
-			return ex.code
+		if needs_formatting:
+			try:
+				processed_xml = next(processed_xmls)
+			except se.MissingDependencyException as ex:
+				se.print_error(ex)
+				return ex.code
+			except se.SeException as ex:
+				se.print_error(f"File: [path][link=file://{filepath}]{filepath}[/][/]. Exception: {ex}", args.verbose)
+				return ex.code
+
+			if processed_xml == xml:
+				se.formatting.mark_known_formatted(cache, xml, filepath.suffix)
+			else:
+				with open(filepath, "w", encoding="utf-8") as file:
+					file.write(processed_xml)
 
 		if args.verbose:
 			console.print(" OK")
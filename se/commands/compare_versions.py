@@ -29,6 +29,16 @@ def _resize_canvas(image: Image, new_width: int, new_height: int) -> Image:
 
 	return temp_image
 
+def _save_screenshot(pool: se.browser.BrowserPool, filename: Path, screenshot_path: Path) -> None:
+	"""
+	Render an XHTML file with a browser from the pool, and save a screenshot of it.
+	"""
+
+	with pool.driver() as driver:
+		driver.get(f"file://{filename}")
+		# We have to take a screenshot of the html element, because otherwise we screenshot the viewport, which would result in a truncated image
+		driver.find_element_by_tag_name("html").screenshot(str(screenshot_path))
+
 def compare_versions() -> int:
 	"""
 	Entry point for `se compare-versions`
@@ -43,12 +53,15 @@ def compare_versions() -> int:
 
 	console = Console(highlight=False, theme=se.RICH_THEME, force_terminal=se.is_called_from_parallel()) # Syntax highlighting will do weird things when printing paths; force_terminal prints colors when called from GNU Parallel
 
-	# We wrap this whole thing in a try block, because we need to call
-	# driver.quit() if execution is interrupted (like by ctrl + c, or by an unhandled exception). If we don't call driver.quit(),
+	# We wrap this whole thing in a try block, because we need to quit the browsers
+	# if execution is interrupted (like by ctrl + c, or by an unhandled exception). If we don't quit them,
 	# Firefox will stay around as a zombie process even if the Python script is dead.
+	pool = se.browser.get_browser_pool()
+
 	try:
 		try:
-			driver = se.browser.initialize_selenium_firefox_webdriver()
+			# Start a browser right away, so that we fail early if Firefox isn't installed
+			pool.release(pool.acquire())
 		except se.MissingDependencyException as ex:
 			se.print_error(ex)
 			return ex.code
@@ -97,9 +110,7 @@ def compare_versions() -> int:
 						if args.verbose:
 							console.print(f"\tProcessing original [path][link=file://{filename}]{filename.name}[/][/] ...")
 
-						driver.get(f"file://{filename}")
-						# We have to take a screenshot of the html element, because otherwise we screenshot the viewport, which would result in a truncated image
-						driver.find_element_by_tag_name("html").screenshot(f"{temp_directory_name}/{filename.name}-original.png")
+						_save_screenshot(pool, filename, Path(temp_directory_name) / (filename.name + "-original.png"))
 
 					# Pop the stash
 					git_command.stash("pop")
@@ -115,9 +126,7 @@ def compare_versions() -> int:
 						if args.verbose:
 							console.print(f"\tProcessing new [path][link=file://{filename}]{filename.name}[/][/] ...")
 
-						driver.get(f"file://{filename}")
-						# We have to take a screenshot of the html element, because otherwise we screenshot the viewport, which would result in a truncated image
-						driver.find_element_by_tag_name("html").screenshot(str(file_new_screenshot_path))
+						_save_screenshot(pool, filename, file_new_screenshot_path)
 
 						has_difference = False
 						original_image = Image.open(file_original_screenshot_path)
@@ -188,13 +197,9 @@ def compare_versions() -> int:
 							file.write(html)
 							file.truncate()
 	except KeyboardInterrupt as ex:
-		# Bubble the exception up, but proceed to `finally` so we quit the driver
+		# Bubble the exception up, but proceed to `finally` so we quit the browsers
 		raise ex
 	finally:
-		try:
-			driver.quit()
-		except Exception:
-			# We might get here if we ctrl + c before selenium has finished initializing the driver
-			pass
+		pool.close()
 
 	return 0
@@ -38,8 +38,9 @@ def prepare_release() -> int:
 				if args.verbose:
 					console.print("\tUpdating word count and reading ease ...", end="")
 
-				se_epub.update_word_count()
-				se_epub.update_flesch_reading_ease()
+				text_statistics = se_epub.get_text_statistics()
+				se_epub.update_word_count(text_statistics)
+				se_epub.update_flesch_reading_ease(text_statistics)
 
 				if args.verbose:
 					console.print(" OK")
@@ -4,14 +4,35 @@ This module implements the `se typogrify` command.
 
 import argparse
 import html
+from typing import Dict, Optional
 
 import regex
 from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
 
 import se
 import se.typography
 
 
+def _print_timings_table(console: Console, timings: Dict[str, float]) -> None:
+	"""
+	Print a table of the time spent in each typography rule, slowest first.
+	"""
+
+	table = Table(show_header=True, header_style="bold")
+	table.add_column("Rule")
+	table.add_column("Time (s)", justify="right")
+
+	for name, seconds in sorted(timings.items(), key=lambda timing: timing[1], reverse=True):
+		# Show invisible characters like word joiners and no-break spaces as escape sequences
+		name = "".join(character if character.isprintable() else f"\\u{ord(character):04x}" for character in name)
+		table.add_row(escape(name), f"{seconds:.3f}")
+
+	table.add_row("[bold]total[/]", f"{sum(timings.values()):.3f}")
+
+	console.print(table)
+
 def typogrify() -> int:
 	"""
 	Entry point for `se typogrify`
@@ -19,6 +40,7 @@ def typogrify() -> int:
 
 	parser = argparse.ArgumentParser(description="Apply some scriptable typography rules from the Standard Ebooks typography manual to XHTML files.")
 	parser.add_argument("-n", "--no-quotes", dest="quotes", action="store_false", help="don’t convert to smart quotes before doing other adjustments")
+	parser.add_argument("--timings", action="store_true", help="print the time spent in each typography rule, slowest first")
 	parser.add_argument("-v", "--verbose", action="store_true", help="increase output verbosity")
 	parser.add_argument("targets", metavar="TARGET", nargs="+", help="an XHTML file, or a directory containing XHTML files")
 	args = parser.parse_args()
@@ -27,6 +49,7 @@ def typogrify() -> int:
 	return_code = 0
 	ignored_filenames = se.IGNORED_FILENAMES
 	ignored_filenames.remove("toc.xhtml")
+	timings: Optional[Dict[str, float]] = {} if args.timings else None
 
 	for filename in se.get_target_filenames(args.targets, (".xhtml", ".opf"), ignored_filenames):
 		if args.verbose:
@@ -47,7 +70,7 @@ def typogrify() -> int:
 
 						processed_long_description = html.unescape(long_description)
 
-						processed_long_description = se.typography.typogrify(long_description)
+						processed_long_description = se.typography.typogrify(long_description, timings=timings)
 
 						# Tweak: Word joiners and nbsp don't go in the long description
 						processed_long_description = processed_long_description.replace(se.WORD_JOINER, "")
@@ -62,7 +85,7 @@ def typogrify() -> int:
 
 					if matches:
 						description = matches[1].strip()
-						processed_description = se.typography.typogrify(description)
+						processed_description = se.typography.typogrify(description, timings=timings)
 
 						# Tweak: Word joiners and nbsp don't go in the regular description
 						processed_description = processed_description.replace(se.WORD_JOINER, "")
@@ -70,7 +93,7 @@ def typogrify() -> int:
 
 						processed_xhtml = processed_xhtml.replace(description, processed_description)
 				else:
-					processed_xhtml = se.typography.typogrify(xhtml, args.quotes)
+					processed_xhtml = se.typography.typogrify(xhtml, args.quotes, timings)
 
 					if filename.name == "toc.xhtml":
 						# Tweak: Word joiners and nbsp don't go in the ToC
@@ -89,4 +112,7 @@ def typogrify() -> int:
 			se.print_error(f"Couldn’t open file: [path][link=file://{filename}]{filename}[/][/].")
 			return_code = se.InvalidInputException.code
 
+	if timings is not None:
+		_print_timings_table(console, timings)
+
 	return return_code
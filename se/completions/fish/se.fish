@@ -17,11 +17,17 @@ complete -c se -A -n "__fish_seen_subcommand_from british2american" -s v -l verb
 complete -c se -n "__fish_se_no_subcommand" -a build -d "Build an ebook from a Standard Ebook source directory."
 complete -c se -A -n "__fish_seen_subcommand_from build" -s b -l kobo -d "also build a .kepub.epub file for Kobo"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s c -l check -d "use epubcheck to validate the compatible .epub file; if --kindle is also specified and epubcheck fails, don’t create a Kindle file"
+complete -c se -A -n "__fish_seen_subcommand_from build" -l compression-level -x -a "0 1 2 3 4 5 6 7 8 9" -d "the zlib compression level for the output files, from 0 (fastest) to 9 (smallest); defaults to 6"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s h -l help -x -d "show this help message and exit"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s k -l kindle -d "also build an .azw3 file for Kindle."
+complete -c se -A -n "__fish_seen_subcommand_from build" -l no-cache -d "don’t reuse the output of per-file transforms from earlier builds, and don’t save it for later builds"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s o -l output-dir -d "a directory to place output files in; will be created if it doesn’t exist"
+complete -c se -A -n "__fish_seen_subcommand_from build" -l preview -d "quickly build only a pure .epub3 with proofreading CSS, to check changes while proofreading"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s p -l proof -d "insert additional CSS rules that are helpful for proofreading; output filenames will end in .proof"
+complete -c se -A -n "__fish_seen_subcommand_from build" -l rev -x -d "build the ebook as of this Git revision, reading it straight from the repository without checking it out"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s t -l covers -d "output the cover and a cover thumbnail; can only be used when there is a single build target"
+complete -c se -A -n "__fish_seen_subcommand_from build" -l targets -x -a "epub epub3 kepub azw3" -d "a comma-separated list of artifacts to build; defaults to epub,epub3"
+complete -c se -A -n "__fish_seen_subcommand_from build" -l timings -a "table json" -d "print the time spent in each stage of the build, and the files and bytes it processed"
 complete -c se -A -n "__fish_seen_subcommand_from build" -s v -l verbose -d "increase output verbosity"
 
 complete -c se -n "__fish_se_no_subcommand" -a build-images -d "Build ebook cover and titlepage images in a Standard Ebook source directory."
@@ -30,6 +36,7 @@ complete -c se -A -n "__fish_seen_subcommand_from build-images" -s v -l verbose
 
 complete -c se -n "__fish_se_no_subcommand" -a clean -d "Prettify and canonicalize individual XHTML or SVG files."
 complete -c se -A -n "__fish_seen_subcommand_from clean" -s h -l help -x -d "show this help message and exit"
+complete -c se -A -n "__fish_seen_subcommand_from clean" -l no-cache -d "format every file, instead of skipping files that earlier runs found already clean, and don’t remember which files are clean"
 complete -c se -A -n "__fish_seen_subcommand_from clean" -s v -l verbose -d "increase output verbosity"
 
 complete -c se -n "__fish_se_no_subcommand" -a compare-versions -d "Render and compare XHTML files in an ebook repository."
@@ -145,6 +152,7 @@ complete -c se -A -n "__fish_seen_subcommand_from titlecase" -s n -l no-newline
 complete -c se -n "__fish_se_no_subcommand" -a typogrify -d "Apply some scriptable typography rules from the Standard Ebooks typography manual to a Standard Ebook source directory."
 complete -c se -A -n "__fish_seen_subcommand_from typogrify" -s h -l help -x -d "show this help message and exit"
 complete -c se -A -n "__fish_seen_subcommand_from typogrify" -s n -l no-quotes -d "don’t convert to smart quotes before doing other adjustments"
+complete -c se -A -n "__fish_seen_subcommand_from typogrify" -l timings -d "print the time spent in each typography rule, slowest first"
 complete -c se -A -n "__fish_seen_subcommand_from typogrify" -s v -l verbose -d "increase output verbosity"
 
 complete -c se -n "__fish_se_no_subcommand" -a unicode-names -d "Display Unicode code points, descriptions, and links to more details for each character in a string."
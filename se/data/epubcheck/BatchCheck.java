@@ -0,0 +1,45 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.nio.charset.StandardCharsets;
+
+import com.adobe.epubcheck.api.EpubCheck;
+import com.adobe.epubcheck.util.DefaultReportImpl;
+
+/**
+ * Validate one epub after another in a single JVM, so that the JVM and epubcheck only start up once.
+ *
+ * This is run by `se.epubcheck.EpubcheckRunner` as a single-file source program (Java 11+), with epubcheck.jar on the classpath:
+ *
+ *	java -cp epubcheck.jar BatchCheck.java BOUNDARY
+ *
+ * It prints `BOUNDARY ready` once it has started. Then, for each epub path read from stdin, one per line, it prints epubcheck's
+ * messages for that epub, followed by a line of `BOUNDARY passed` or `BOUNDARY failed`.
+ */
+public class BatchCheck {
+	public static void main(String[] args) throws Exception {
+		String boundary = args[0];
+		BufferedReader input = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+
+		System.out.println(boundary + " ready");
+		System.out.flush();
+
+		String path;
+
+		while ((path = input.readLine()) != null) {
+			boolean passed;
+
+			try {
+				passed = new EpubCheck(new File(path), new DefaultReportImpl(path, null, true)).validate();
+			} catch (Exception ex) {
+				System.out.println("FATAL: " + ex);
+				passed = false;
+			}
+
+			// Messages may have gone to stderr, which the caller reads from the same pipe, so flush it before the result
+			System.err.flush();
+			System.out.println(boundary + (passed ? " passed" : " failed"));
+			System.out.flush();
+		}
+	}
+}
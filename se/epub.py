@@ -4,72 +4,300 @@ Defines several functions that are useful for interacting with epub files.
 """
 
 import os
+from contextlib import contextmanager
 from pathlib import Path
+import threading
 import zipfile
 import itertools
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+import git
 import regex
 from lxml import etree
+from natsort import natsorted, ns
 import se
 import se.easy_xml
+import se.resources
 
 
-def convert_toc_to_ncx(epub_root_absolute_path: Path, toc_filename: str, xsl_filename: Path) -> se.easy_xml.EasyXhtmlTree:
+BUILD_TREE_URL_PREFIX = "se-build:/"
+EPUB_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0) # The earliest date a zip file can store; used for every file in an epub unless a date is given, so that builds are reproducible
+EPUB_STORED_EXTENSIONS = (".gif", ".jpeg", ".jpg", ".png", ".woff", ".woff2") # Files in these formats are already compressed, so deflating them again only costs time
+
+class BuildTree:
+	"""
+	An in-memory representation of an unzipped epub, used by the build pipeline.
+
+	Files are stored as a map of POSIX-style paths relative to the epub root (like `epub/text/chapter-1.xhtml`)
+	to their contents as bytes. Because bytes are immutable, `copy()` is a cheap copy-on-write branch: both trees
+	share file contents until one of them writes a file.
+
+	The tree also tracks which files are known to be pretty-printed, so that a formatting pass can skip files that
+	no stage has written since the last one.
+	"""
+
+	def __init__(self, files: Optional[Dict[str, bytes]] = None, formatted_paths: Optional[Set[str]] = None):
+		self._files: Dict[str, bytes] = dict(files) if files else {}
+		self._formatted_paths: Set[str] = set(formatted_paths) if formatted_paths else set()
+
+	@classmethod
+	def from_directory(cls, directory: Path, paths: Optional[List[str]] = None) -> "BuildTree":
+		"""
+		Read files in a directory into a new BuildTree.
+
+		INPUTS
+		directory: The root directory of an unzipped epub
+		paths: A list of paths relative to `directory` to read, like the build input manifest; files in the list that don't exist are skipped. If None, read every file in the directory.
+
+		OUTPUTS
+		A BuildTree containing the requested files
+		"""
+
+		tree = cls()
+
+		if paths is None:
+			paths = []
+			for root, _, filenames in os.walk(directory):
+				for filename in filenames:
+					paths.append((Path(root) / filename).relative_to(directory).as_posix())
+
+		for path in paths:
+			try:
+				with open(directory / path, "rb") as file:
+					tree.write(path, file.read())
+			except FileNotFoundError:
+				pass
+
+		return tree
+
+	@classmethod
+	def from_git(cls, tree: git.Tree, paths: Optional[List[str]] = None) -> "BuildTree":
+		"""
+		Read files from a tree in a Git commit into a new BuildTree, without checking them out.
+
+		INPUTS
+		tree: A GitPython tree object, like the `src` directory of a commit
+		paths: A list of paths relative to `tree` to read, like the build input manifest; files in the list that don't exist are skipped. If None, read every file in the tree.
+
+		OUTPUTS
+		A BuildTree containing the requested files
+		"""
+
+		build_tree = cls()
+
+		if paths is None:
+			blobs = [item for item in tree.traverse() if item.type == "blob"]
+		else:
+			blobs = []
+			for path in paths:
+				try:
+					blobs.append(tree / path)
+				except KeyError:
+					pass
+
+		# Blobs are streamed straight from the repository's object database
+		for blob in blobs:
+			build_tree.write(Path(blob.path).relative_to(tree.path).as_posix(), blob.data_stream.read())
+
+		return build_tree
+
+	def __contains__(self, path: str) -> bool:
+		return path in self._files
+
+	def __len__(self) -> int:
+		return len(self._files)
+
+	@property
+	def size(self) -> int:
+		"""
+		The total size of the files in the tree, in bytes.
+		"""
+
+		return sum(len(data) for data in self._files.values())
+
+	def read(self, path: str) -> bytes:
+		"""
+		Return the contents of a file in the tree.
+		"""
+
+		try:
+			return self._files[path]
+		except KeyError:
+			raise se.InvalidFileException(f"Couldn’t find file in build: [path]{path}[/].")
+
+	def read_text(self, path: str) -> str:
+		"""
+		Return the contents of a file in the tree as a UTF-8 string.
+		"""
+
+		return self.read(path).decode("utf-8")
+
+	def write(self, path: str, data: bytes) -> None:
+		"""
+		Create or replace a file in the tree.
+		"""
+
+		self._files[path] = data
+		self._formatted_paths.discard(path)
+
+	def write_text(self, path: str, text: str) -> None:
+		"""
+		Create or replace a file in the tree from a string, encoded as UTF-8.
+		"""
+
+		self.write(path, text.encode("utf-8"))
+
+	def remove(self, path: str) -> None:
+		"""
+		Remove a file from the tree, if it exists.
+		"""
+
+		self._files.pop(path, None)
+		self._formatted_paths.discard(path)
+
+	def paths(self, allowed_extensions: tuple = ()) -> List[str]:
+		"""
+		Return a naturally-sorted list of the paths in the tree.
+
+		INPUTS
+		allowed_extensions: A tuple of filename extensions to filter by, like (".xhtml", ".svg"); pass an empty tuple to return every path
+
+		OUTPUTS
+		A list of paths relative to the epub root
+		"""
+
+		return natsorted([path for path in self._files if not allowed_extensions or path.endswith(allowed_extensions)], alg=ns.PATH)
+
+	def copy(self) -> "BuildTree":
+		"""
+		Return a copy-on-write branch of this tree.
+		"""
+
+		return BuildTree(self._files, self._formatted_paths)
+
+	def is_formatted(self, path: str) -> bool:
+		"""
+		Return True if a file is known to be pretty-printed, because it was marked as formatted and hasn't been written since.
+		"""
+
+		return path in self._formatted_paths
+
+	def mark_formatted(self, path: str) -> None:
+		"""
+		Mark a file as pretty-printed, until it's next written.
+		"""
+
+		if path in self._files:
+			self._formatted_paths.add(path)
+
+class _BuildTreeResolver(etree.Resolver):
+	"""
+	An lxml resolver that lets XSLT `document()` calls read files from a BuildTree.
+
+	The resolver is shared by the stylesheets that use it, so the tree it reads from is set per thread, for the duration of a transform.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self._local = threading.local()
+
+	@contextmanager
+	def reading(self, tree: BuildTree) -> Iterator[None]:
+		"""
+		A context manager that makes this thread's transforms read from a BuildTree.
+		"""
+
+		self._local.tree = tree
+
+		try:
+			yield
+		finally:
+			self._local.tree = None
+
+	def resolve(self, system_url, public_id, context): # pylint: disable=unused-argument
+		tree = getattr(self._local, "tree", None)
+
+		if tree is not None and system_url and system_url.startswith(BUILD_TREE_URL_PREFIX):
+			return self.resolve_string(tree.read(system_url[len(BUILD_TREE_URL_PREFIX):]), context)
+
+		return None
+
+_BUILD_TREE_RESOLVER = _BuildTreeResolver()
+
+def convert_toc_to_ncx(tree: BuildTree, toc_filename: str, xsl_filename: Optional[Path] = None) -> se.easy_xml.EasyXhtmlTree:
 	"""
 	Take an epub3 HTML5 ToC file and convert it to an epub2 NCX file. NCX output is written to the same directory as the ToC file, in a file named "toc.ncx".
 
 	epub structure must be in the SE format.
 
 	INPUTS
-	epub_root_absolute_path: The root directory of an unzipped epub
+	tree: A BuildTree representing an unzipped epub
 	toc_filename: The filename of the ToC file
-	xsl_filename: The filename for the XSL file used to perform the transformation
+	xsl_filename: The filename for the XSL file used to perform the transformation; if None, the bundled `navdoc2ncx.xsl` compiled by se.resources
 
 	OUTPUTS
 	An se.easy_xml.EasyXhtmlTree representing the HTML5 ToC file
 	"""
 
 	# Use an XSLT transform to generate the NCX
-	with open(epub_root_absolute_path / "epub" / toc_filename, "r", encoding="utf-8") as file:
-		xhtml = file.read()
+	xhtml = tree.read_text(f"epub/{toc_filename}")
 
 	toc_tree = se.easy_xml.EasyXhtmlTree(xhtml)
-	transform = etree.XSLT(etree.parse(str(xsl_filename)))
-	ncx_tree = transform(etree.fromstring(str.encode(xhtml)), cwd=f"'{epub_root_absolute_path}{os.path.sep}'")
 
-	with open(epub_root_absolute_path / "epub" / "toc.ncx", "w", encoding="utf-8") as file:
-		ncx_xhtml = etree.tostring(ncx_tree, encoding="unicode", pretty_print=True, with_tail=False)
-		ncx_xhtml = regex.sub(r" xml:lang=\"\?\?\"", "", ncx_xhtml)
+	# The transform reads container.xml and content.opf with `document()`, so point it at the build tree instead of the disk
+	if xsl_filename:
+		parser = etree.XMLParser()
+		parser.resolvers.add(_BUILD_TREE_RESOLVER)
+		transform = etree.XSLT(etree.parse(str(xsl_filename), parser))
+	else:
+		transform = se.resources.get_xslt("navdoc2ncx.xsl", _BUILD_TREE_RESOLVER)
+
+	with _BUILD_TREE_RESOLVER.reading(tree):
+		ncx_tree = transform(etree.fromstring(str.encode(xhtml)), cwd=f"'{BUILD_TREE_URL_PREFIX}'")
 
-		# Make nicely incrementing navpoint IDs and playOrders
-		ncx_xhtml = regex.sub(r"<navMap id=\".*\">", "<navMap id=\"navmap\">", ncx_xhtml)
+	ncx_xhtml = etree.tostring(ncx_tree, encoding="unicode", pretty_print=True, with_tail=False)
+	ncx_xhtml = regex.sub(r" xml:lang=\"\?\?\"", "", ncx_xhtml)
 
-		counter = itertools.count(1)
-		ncx_xhtml = regex.sub(r"<navPoint id=\"id[\p{Letter}0-9]+?\"", lambda x: "<navPoint id=\"navpoint-{count}\" playOrder=\"{count}\"".format(count=next(counter)), ncx_xhtml)
+	# Make nicely incrementing navpoint IDs and playOrders
+	ncx_xhtml = regex.sub(r"<navMap id=\".*\">", "<navMap id=\"navmap\">", ncx_xhtml)
 
-		ncx_xhtml = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n{ncx_xhtml}"
+	counter = itertools.count(1)
+	ncx_xhtml = regex.sub(r"<navPoint id=\"id[\p{Letter}0-9]+?\"", lambda x: "<navPoint id=\"navpoint-{count}\" playOrder=\"{count}\"".format(count=next(counter)), ncx_xhtml)
 
-		file.write(ncx_xhtml)
+	ncx_xhtml = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n{ncx_xhtml}"
+
+	tree.write_text("epub/toc.ncx", ncx_xhtml)
 
 	return toc_tree
 
-def write_epub(epub_root_absolute_path: Path, output_absolute_path: Path) -> None:
+def write_epub(epub: Union[BuildTree, Path], output_absolute_path: Path, compression_level: Optional[int] = None, date_time: Tuple[int, int, int, int, int, int] = EPUB_ZIP_DATE_TIME) -> None:
 	"""
-	Given a root directory, compress it into a final epub file.
+	Given a BuildTree or a root directory, compress it into a final epub file.
+
+	Files are written in a fixed order with a fixed timestamp, so the same input always results in a byte-identical epub.
 
 	INPUTS
-	epub_root_absolute_path: The root directory of an unzipped epub
+	epub: A BuildTree, or the root directory of an unzipped epub
 	output_absolute_path: The filename of the output file
+	compression_level: The zlib compression level to deflate files with, from 0 (fastest) to 9 (smallest); None for zlib's default. Requires Python 3.7+.
+	date_time: The modification time to store for every file, as a (year, month, day, hour, minute, second) tuple
 
 	OUTPUTS
 	None
 	"""
 
+	if not isinstance(epub, BuildTree):
+		epub = BuildTree.from_directory(epub)
+
+	zip_options = {} if compression_level is None else {"compresslevel": compression_level}
+
 	# We can't enable global compression here because according to the spec, the `mimetype` file must be uncompressed.  The rest of the files, however, can be compressed.
-	with zipfile.ZipFile(output_absolute_path, mode="w") as epub:
-		epub.write(epub_root_absolute_path / "mimetype", "mimetype")
-		epub.write(epub_root_absolute_path / "META-INF" / "container.xml", "META-INF/container.xml", compress_type=zipfile.ZIP_DEFLATED)
-
-		for root, _, files in os.walk(epub_root_absolute_path):
-			for file in files:
-				if file not in ("mimetype", "container.xml"):
-					epub.write(Path(root) / file, (Path(root) / file).relative_to(epub_root_absolute_path), compress_type=zipfile.ZIP_DEFLATED)
+	with zipfile.ZipFile(output_absolute_path, mode="w") as epub_file:
+		for path in ["mimetype", "META-INF/container.xml"] + [path for path in epub.paths() if path not in ("mimetype", "META-INF/container.xml")]:
+			zip_info = zipfile.ZipInfo(path, date_time=date_time)
+			zip_info.create_system = 3 # Unix, regardless of the platform we're building on
+			zip_info.external_attr = 0o644 << 16
+
+			if path != "mimetype" and not path.lower().endswith(EPUB_STORED_EXTENSIONS):
+				zip_info.compress_type = zipfile.ZIP_DEFLATED
+
+			epub_file.writestr(zip_info, epub.read(path), **zip_options)
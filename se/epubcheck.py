@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Defines functions and classes for validating epubs with epubcheck.
+"""
+
+import atexit
+import secrets
+import subprocess
+import threading
+import zipfile
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import importlib_resources
+import regex
+
+
+_EPUBCHECK_VERSIONS: Dict[str, str] = {}
+
+def get_epubcheck_version(jar_path: Path, java: str = "java") -> str:
+	"""
+	Return the version of an epubcheck jar, reading it from the jar's Maven metadata so that we don't have to start a JVM to ask.
+
+	The version is remembered for the life of the process.
+
+	INPUTS
+	jar_path: The path to epubcheck.jar
+	java: The Java executable to ask for the version if the jar doesn't have Maven metadata
+
+	OUTPUTS
+	A string representing the version, like `4.2.4`.
+	"""
+
+	version = _EPUBCHECK_VERSIONS.get(str(jar_path))
+
+	if version is None:
+		try:
+			with zipfile.ZipFile(jar_path) as jar:
+				version = regex.search(r"^version=(.+)$", jar.read("META-INF/maven/org.w3c/epubcheck/pom.properties").decode(), flags=regex.MULTILINE).group(1).strip()
+		except (OSError, KeyError, AttributeError, zipfile.BadZipFile):
+			# Path arguments must be cast to string for Windows compatibility.
+			version_output = subprocess.run([java, "-jar", str(jar_path), "--version"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False).stdout.decode().strip()
+			version = regex.search(r"[0-9]+\.([0-9]+\.?)*", version_output, flags=regex.MULTILINE).group(0)
+
+		_EPUBCHECK_VERSIONS[str(jar_path)] = version
+
+	return version
+
+class EpubcheckRunner:
+	"""
+	Validates epubs with epubcheck in one long-lived JVM, so that validating many epubs only starts Java and epubcheck once.
+
+	Epub paths are sent to `BatchCheck.java`, a small program run with epubcheck on its classpath, one path at a time. If that
+	program can't be started, for example because the installed Java is older than 11 or can't compile source files, each epub
+	is validated by running `java -jar epubcheck.jar` instead.
+	"""
+
+	def __init__(self, jar_path: Optional[Path] = None, java: str = "java"):
+		self.java = java
+		self.jvms_started = 0
+		self._resources = ExitStack()
+		self.jar_path = jar_path if jar_path else self._resources.enter_context(importlib_resources.path("se.data.epubcheck", "epubcheck.jar"))
+		self._boundary = secrets.token_hex(16)
+		self._process: Optional[subprocess.Popen] = None
+		self._batch_available = True
+		self._lock = threading.Lock()
+
+	@property
+	def version(self) -> str:
+		"""
+		The version of epubcheck.
+		"""
+
+		return get_epubcheck_version(self.jar_path, self.java)
+
+	def check(self, epub_path: Path) -> Tuple[bool, str]:
+		"""
+		Validate an epub.
+
+		Only one epub is validated at a time, so callers on other threads wait their turn.
+
+		INPUTS
+		epub_path: The path to the epub to validate
+
+		OUTPUTS
+		A tuple of True if the epub passed, and epubcheck's messages about the epub.
+		"""
+
+		with self._lock:
+			# Paths are sent one per line, so a path with a line break has to be validated on its own
+			if "\n" not in str(epub_path) and self._start_batch_process():
+				try:
+					return self._check_in_batch_process(epub_path)
+				except (OSError, EOFError):
+					# The JVM died, so start a new one for the next epub
+					self._stop_batch_process()
+
+			return self._check_in_new_process(epub_path)
+
+	def close(self) -> None:
+		"""
+		Stop the JVM, if it's running.
+
+		INPUTS
+		None.
+
+		OUTPUTS
+		None.
+		"""
+
+		with self._lock:
+			self._stop_batch_process()
+
+		self._resources.close()
+
+	def _start_batch_process(self) -> bool:
+		"""
+		Start the JVM if it isn't running, and return True if it's running.
+		"""
+
+		if self._process is None and self._batch_available:
+			with importlib_resources.path("se.data.epubcheck", "BatchCheck.java") as source_path:
+				try:
+					# Path arguments must be cast to string for Windows compatibility.
+					self._process = subprocess.Popen([self.java, "-Dfile.encoding=UTF-8", "-cp", str(self.jar_path), str(source_path), self._boundary], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8", errors="replace")
+				except OSError:
+					self._batch_available = False
+					return False
+
+				self.jvms_started += 1
+
+				# Java compiles the source file before it runs it, so wait until it's ready before the source file can go away.
+				# Java may print notices before that, and if it can't run the file, it exits without saying it's ready.
+				for line in self._process.stdout:
+					if line.strip() == f"{self._boundary} ready":
+						break
+				else:
+					self._batch_available = False
+					self._stop_batch_process()
+
+		return self._process is not None
+
+	def _stop_batch_process(self) -> None:
+		if self._process:
+			try:
+				self._process.stdin.close()
+				self._process.wait(timeout=10)
+			except (OSError, subprocess.TimeoutExpired):
+				self._process.kill()
+				self._process.wait()
+
+			self._process.stdout.close()
+			self._process = None
+
+	def _check_in_batch_process(self, epub_path: Path) -> Tuple[bool, str]:
+		self._process.stdin.write(f"{epub_path}\n")
+		self._process.stdin.flush()
+
+		lines: List[str] = []
+
+		for line in self._process.stdout:
+			if line.startswith(f"{self._boundary} "):
+				return (line.strip() == f"{self._boundary} passed", "".join(lines).strip())
+
+			lines.append(line)
+
+		raise EOFError("epubcheck stopped before it finished.")
+
+	def _check_in_new_process(self, epub_path: Path) -> Tuple[bool, str]:
+		# Path arguments must be cast to string for Windows compatibility.
+		result = subprocess.run([self.java, "-jar", str(self.jar_path), "--quiet", str(epub_path)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+		self.jvms_started += 1
+
+		# The last two lines from epubcheck output are not necessary. Remove them here.
+		# Remove them as lines instead of as a matching regex to work with localized output strings.
+		output = "\n".join(result.stdout.decode().strip().split("\n")[:-2]).strip()
+
+		return (result.returncode == 0, output)
+
+_EPUBCHECK_RUNNER: Optional[EpubcheckRunner] = None
+_EPUBCHECK_RUNNER_LOCK = threading.Lock()
+
+def get_epubcheck_runner() -> EpubcheckRunner:
+	"""
+	Return the process-wide epubcheck runner, creating it if necessary.
+
+	Its JVM is stopped when the process exits, so building many books in one process, like `se build --check` with many
+	directories, only starts one JVM.
+
+	INPUTS
+	None.
+
+	OUTPUTS
+	An EpubcheckRunner.
+	"""
+
+	global _EPUBCHECK_RUNNER # pylint: disable=global-statement
+
+	with _EPUBCHECK_RUNNER_LOCK:
+		if _EPUBCHECK_RUNNER is None:
+			_EPUBCHECK_RUNNER = EpubcheckRunner()
+			atexit.register(_EPUBCHECK_RUNNER.close)
+
+		return _EPUBCHECK_RUNNER
@@ -4,11 +4,16 @@ Defines functions useful for formatting code or text according to SE standards,
 several text-level statistics like reading ease, and for adding semantics.
 """
 
+import collections
+import concurrent.futures
+import functools
 import html.entities
 import math
+import os
 import string
 import unicodedata
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import regex
 import roman
@@ -19,8 +24,11 @@ from titlecase import titlecase as pip_titlecase
 #from se.vendor.titlecase import titlecase as pip_titlecase
 
 import se
+import se.cache
 
 
+FORMAT_CACHE_VERSION = 1 # Bump when the output of `format_xml_for_suffix()` changes, so that XML the cache knows as formatted is checked again
+
 # This list of phrasing tags is not intended to be exhaustive. The list is only used
 # to resolve the uncommon situation where there is no plain text in a paragraph. The
 # span and br tags are explicitly omitted because of how they are used in poetry formatting,
@@ -36,225 +44,350 @@ PHRASING_TAGS = [
 	"{http://www.w3.org/1999/xhtml}strong",
 ]
 
-def semanticate(xhtml: str) -> str:
+def _compile_semantic_rule(pattern: str, replacement: str) -> Tuple[regex.Pattern, str]:
 	"""
-	Add semantics to well-formed XHTML
+	Compile a rule for `semanticate()` that only matches text, not tags, comments, or the text of the <title> element.
 
 	INPUTS
-	xhtml: A string of well-formed XHTML
+	pattern: A regex to match
+	replacement: The replacement for each match
 
 	OUTPUTS
-	A string of XHTML with semantics added.
+	A tuple of the compiled regex and its replacement.
 	"""
 
+	return (regex.compile(fr"(?:{pattern})(?![^<>]*>|[^<]*</title>)"), replacement)
+
+# Abbreviations that `semanticate()` wraps in a plain <abbr>
+_SEMANTIC_ABBREVIATIONS = ("Mr", "Mrs", "Ms", "Dr", "Drs", "Prof", "Rev", "Hon", "Lieut", "Fr", "Lt", "Capt", "Pvt", "Esq", "Bros", "Mt", "MM", "Mme", "Mmes", "Mon", "Mlle", "Mdlle", "Mlles", "Messrs", "Messers", "Co", "Inc", "Ltd", "St", "Col")
+
+# The rules `semanticate()` applies, in order, as tuples of a compiled regex and its replacement.
+# Rules that add semantics to text are compiled with `_compile_semantic_rule()`; the rest tidy up the tags they added.
+_SEMANTIC_RULES = [
 	# Some common abbreviations
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mr\.", r"<abbr>Mr.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mrs\.", r"<abbr>Mrs.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Ms\.", r"<abbr>Ms.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Dr\.", r"<abbr>Dr.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Drs\.", r"<abbr>Drs.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Prof\.", r"<abbr>Prof.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Rev\.", r"<abbr>Rev.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Hon\.", r"<abbr>Hon.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Lieut\.", r"<abbr>Lieut.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Fr\.", r"<abbr>Fr.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Lt\.", r"<abbr>Lt.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Capt\.", r"<abbr>Capt.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Pvt\.", r"<abbr>Pvt.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Esq\.", r"<abbr>Esq.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Bros\.", r"<abbr>Bros.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mt\.", r"<abbr>Mt.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)MM\.", r"<abbr>MM.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mme\.", r"<abbr>Mme.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mmes\.", r"<abbr>Mmes.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mon\.", r"<abbr>Mon.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mlle\.", r"<abbr>Mlle.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mdlle\.", r"<abbr>Mdlle.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Mlles\.", r"<abbr>Mlles.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Messrs\.", r"<abbr>Messrs.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Messers\.", r"<abbr>Messers.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr[^\>]*?\>)(P\.(?:P\.)?S\.(?:S\.)?)", r"""<abbr class="initialism">\1</abbr>""", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Co\.", r"<abbr>Co.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Inc\.", r"<abbr>Inc.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Ltd\.", r"<abbr>Ltd.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)St\.", r"<abbr>St.</abbr>", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)([Gg])ov\.", r"<abbr>\1ov.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)Col\.", r"<abbr>Col.</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)MS(S?)\.", r"""<abbr>MS\1.</abbr>""", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)([Vv])iz\.", r"<abbr>\1iz.</abbr>", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)etc\.", r"<abbr>etc.</abbr>", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)([Cc])f\.", r"<abbr>\1f.</abbr>", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)p\.([\s0-9])", r"<abbr>p.</abbr>\1", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)ed\.", r"<abbr>ed.</abbr>", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="initialism( eoc)?"\>)([Ii])\.e\.""", r"""<abbr class="initialism">\1.e.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="initialism( eoc)?"\>)([Ee])\.g\.""", r"""<abbr class="initialism">\1.g.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="initialism( eoc)?"\>)\bN\.?B\.\b""", r"""<abbr class="initialism">N.B.</abbr>""", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)(Jan\.|Feb\.|Mar\.|Apr\.|Jun\.|Jul\.|Aug\.|Sep\.|Sept\.|Oct\.|Nov\.|Dec\.)", r"<abbr>\1</abbr>", xhtml)
-	xhtml = regex.sub(r"(?<!\<abbr\>)No\.(\s+[0-9]+)", r"<abbr>No.</abbr>\1", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="degree( eoc)?"\>)Ph\.?\s*D\.?""", r"""<abbr class="degree">Ph. D.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="initialism( eoc)?"\>)I\.?O\.?U\.?\b""", r"""<abbr class="initialism">I.O.U.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(\s)(?<!\<abbr class="era( eoc)?"\>)A\.?D""", r"""\1<abbr class="era">AD</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(\s)(?<!\<abbr class="era( eoc)?"\>)B\.?C""", r"""\1<abbr class="era">BC</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="time( eoc)?"\>)([ap])\.\s?m\.""", r"""<abbr class="time">\2.m.</abbr>""", xhtml)
-	xhtml = regex.sub(r"\b(?<!\<abbr\>)([Vv])s\.", r"<abbr>\1s.</abbr>", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="name( eoc)?"\>)Thos\.""", r"""<abbr class="name">Thos.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="name( eoc)?"\>)Jas\.""", r"""<abbr class="name">Jas.</abbr>""", xhtml)
-	xhtml = regex.sub(r"""(?<!\<abbr class="name (eoc)?"\>)Chas\.""", r"""<abbr class="name">Chas.</abbr>""", xhtml)
+	_compile_semantic_rule(r"(?<!\<abbr\>)(" + "|".join(_SEMANTIC_ABBREVIATIONS) + r")\.", r"<abbr>\1.</abbr>"),
+	_compile_semantic_rule(r"(?<!\<abbr[^\>]*?\>)(P\.(?:P\.)?S\.(?:S\.)?)", r"""<abbr class="initialism">\1</abbr>"""),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)([Gg])ov\.", r"<abbr>\1ov.</abbr>"),
+	_compile_semantic_rule(r"(?<!\<abbr\>)MS(S?)\.", r"<abbr>MS\1.</abbr>"),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)([Vv])iz\.", r"<abbr>\1iz.</abbr>"),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)etc\.", r"<abbr>etc.</abbr>"),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)([Cc])f\.", r"<abbr>\1f.</abbr>"),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)p\.(?=[\s0-9])", r"<abbr>p.</abbr>"),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)ed\.", r"<abbr>ed.</abbr>"),
+	_compile_semantic_rule(r"""(?<!\<abbr class="initialism(?: eoc)?"\>)([Ii])\.e\.""", r"""<abbr class="initialism">\1.e.</abbr>"""),
+	_compile_semantic_rule(r"""(?<!\<abbr class="initialism(?: eoc)?"\>)([Ee])\.g\.""", r"""<abbr class="initialism">\1.g.</abbr>"""),
+	_compile_semantic_rule(r"""(?<!\<abbr class="initialism(?: eoc)?"\>)\bN\.?B\.\b""", r"""<abbr class="initialism">N.B.</abbr>"""),
+	_compile_semantic_rule(r"(?<!\<abbr\>)((?:Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sept?|Oct|Nov|Dec)\.)", r"<abbr>\1</abbr>"),
+	_compile_semantic_rule(r"(?<!\<abbr\>)No\.(?=\s+[0-9]+)", r"<abbr>No.</abbr>"),
+	_compile_semantic_rule(r"""(?<!\<abbr class="degree(?: eoc)?"\>)Ph\.?\s*D\.?""", r"""<abbr class="degree">Ph. D.</abbr>"""),
+	_compile_semantic_rule(r"""(?<!\<abbr class="initialism(?: eoc)?"\>)I\.?O\.?U\.?\b""", r"""<abbr class="initialism">I.O.U.</abbr>"""),
+	_compile_semantic_rule(r"(?<=\s)A\.?D", r"""<abbr class="era">AD</abbr>"""),
+	_compile_semantic_rule(r"(?<=\s)B\.?C", r"""<abbr class="era">BC</abbr>"""),
+	_compile_semantic_rule(r"""(?<!\<abbr class="time(?: eoc)?"\>)([ap])\.\s?m\.""", r"""<abbr class="time">\1.m.</abbr>"""),
+	_compile_semantic_rule(r"\b(?<!\<abbr\>)([Vv])s\.", r"<abbr>\1s.</abbr>"),
+	*[_compile_semantic_rule(fr"""(?<!\<abbr class="name(?: eoc)?"\>){name}\.""", f"""<abbr class="name">{name}.</abbr>""") for name in ("Thos", "Jas", "Chas")],
 
 	# Wrap £sd shorthand
-	xhtml = regex.sub(r"([0-9½¼⅙⅚⅛⅜⅝]+)([sd⅞]\.)", r"\1<abbr>\2</abbr>", xhtml)
+	_compile_semantic_rule(r"(?<=[0-9½¼⅙⅚⅛⅜⅝])[sd⅞]\.", r"<abbr>\g<0></abbr>"),
 
 	# Guess at adding eoc (End Of Clause) class
-	xhtml = regex.sub(r"""<abbr>([\p{Letter}\.]+?\.)</abbr></p>""", r"""<abbr class="eoc">\1</abbr></p>""", xhtml)
-	xhtml = regex.sub(r"""<abbr class="(.+?)">([\p{Letter}\.]+?\.)</abbr></p>""", r"""<abbr class="\1 eoc">\2</abbr></p>""", xhtml)
-	xhtml = regex.sub(r"""<abbr>etc\.</abbr>(\s+[\p{Uppercase_Letter}])""", r"""<abbr class="eoc">etc.</abbr>\1""", xhtml)
-	xhtml = regex.sub(r"""<abbr>etc\.</abbr>(”?)</p>""", r"""<abbr class="eoc">etc.</abbr>\1</p>""", xhtml)
+	(regex.compile(r"""<abbr>([\p{Letter}\.]+?\.)</abbr></p>"""), r"""<abbr class="eoc">\1</abbr></p>"""),
+	(regex.compile(r"""<abbr class="(.+?)">([\p{Letter}\.]+?\.)</abbr></p>"""), r"""<abbr class="\1 eoc">\2</abbr></p>"""),
+	(regex.compile(r"""<abbr>etc\.</abbr>(\s+[\p{Uppercase_Letter}])"""), r"""<abbr class="eoc">etc.</abbr>\1"""),
+	(regex.compile(r"""<abbr>etc\.</abbr>(”?)</p>"""), r"""<abbr class="eoc">etc.</abbr>\1</p>"""),
 
 	# We may have added eoc classes twice, so remove duplicates here
-	xhtml = regex.sub(r"""<abbr class="(.*) eoc(\s+eoc)+">""", r"""<abbr class="\1 eoc">""", xhtml)
+	(regex.compile(r"""<abbr class="(.*) eoc(\s+eoc)+">"""), r"""<abbr class="\1 eoc">"""),
 
 	# Clean up nesting errors
-	xhtml = regex.sub(r"""<abbr class="eoc"><abbr>([^<]+)</abbr></abbr>""", r"""<abbr class="eoc">\1</abbr>""", xhtml)
-	xhtml = regex.sub(r"""class="eoc eoc""", r"""class="eoc""", xhtml)
+	(regex.compile(r"""<abbr class="eoc"><abbr>([^<]+)</abbr></abbr>"""), r"""<abbr class="eoc">\1</abbr>"""),
+	(regex.compile(r"""class="eoc eoc"""), r"""class="eoc"""),
 
 	# Get Roman numerals >= 2 characters
 	# We only wrap these if they're standalone (i.e. not already wrapped in a tag) to prevent recursion in multiple runs
-	xhtml = regex.sub(r"([^\p{Letter}>])([ixvIXV]{2,})(\b|st\b|nd\b|rd\b|th\b)", r"""\1<span epub:type="z3998:roman">\2</span>\3""", xhtml)
+	_compile_semantic_rule(r"(?<=[^\p{Letter}>])([ixvIXV]{2,})(\b|st\b|nd\b|rd\b|th\b)", r"""<span epub:type="z3998:roman">\1</span>\2"""),
 
 	# Get Roman numerals that are X or V and single characters.  We can't do I for obvious reasons.
-	xhtml = regex.sub(r"""([^\p{Letter}>\"])([vxVX])(\b|st\b|nd\b|rd\b|th\b)""", r"""\1<span epub:type="z3998:roman">\2</span>\3""", xhtml)
+	_compile_semantic_rule(r"""(?<=[^\p{Letter}>\"])([vxVX])(\b|st\b|nd\b|rd\b|th\b)""", r"""<span epub:type="z3998:roman">\1</span>\2"""),
 
 	# Add abbrevations around some SI measurements
-	xhtml = regex.sub(r"([0-9]+)\s*([cmk][mgl])\b", fr"\1{se.NO_BREAK_SPACE}<abbr>\2</abbr>", xhtml)
+	_compile_semantic_rule(r"([0-9]+)\s*([cmk][mgl])\b", fr"\1{se.NO_BREAK_SPACE}<abbr>\2</abbr>"),
 
 	# Add abbrevations around Imperial measurements
-	xhtml = regex.sub(r"([0-9]+)\s*(ft|in|yd|mi|pt|qt|gal|oz|lbs)\.?\b", fr"\1{se.NO_BREAK_SPACE}<abbr>\2.</abbr>", xhtml)
+	_compile_semantic_rule(r"([0-9]+)\s*(ft|in|yd|mi|pt|qt|gal|oz|lbs)\.?\b", fr"\1{se.NO_BREAK_SPACE}<abbr>\2.</abbr>"),
 
 	# Tweak some other Imperial measurements
-	xhtml = regex.sub(r"([0-9]+)\s*m\.?p\.?h\.?", fr"\1{se.NO_BREAK_SPACE}<abbr>mph</abbr>", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"([0-9]+)\s*h\.?p\.?", fr"\1{se.NO_BREAK_SPACE}<abbr>hp</abbr>", xhtml, flags=regex.IGNORECASE)
+	_compile_semantic_rule(r"([0-9]+)\s*(?i:m\.?p\.?h\.?)", fr"\1{se.NO_BREAK_SPACE}<abbr>mph</abbr>"),
+	_compile_semantic_rule(r"([0-9]+)\s*(?i:h\.?p\.?)", fr"\1{se.NO_BREAK_SPACE}<abbr>hp</abbr>")
+]
+
+def semanticate(xhtml: str) -> str:
+	"""
+	Add semantics to well-formed XHTML
+
+	INPUTS
+	xhtml: A string of well-formed XHTML
+
+	OUTPUTS
+	A string of XHTML with semantics added.
+	"""
 
-	# We may have added HTML tags within title tags.  Remove those here
-	matches = regex.findall(r"<title>.+?</title>", xhtml)
-	if matches:
-		xhtml = regex.sub(r"<title>.+?</title>", f"<title>{se.formatting.remove_tags(matches[0])}</title>", xhtml)
+	for pattern, replacement in _SEMANTIC_RULES:
+		xhtml = pattern.sub(replacement, xhtml)
 
 	return xhtml
 
-def get_flesch_reading_ease(xhtml: str) -> float:
+_TITLE_REGEX = regex.compile(r"<title>.+?</title>")
+_MATHML_REGEX = regex.compile(r"<(m:)?math.+?</(m:)?math>")
+_TAG_REGEX = regex.compile(r"<.+?>", flags=regex.DOTALL)
+_WORD_SEPARATOR_REGEX = regex.compile(r"[…–—― ‘’“”\{\}\(\)]")
+_WORD_CONNECTOR_REGEX = regex.compile(r"[\p{Letter}0-9][\-\'\,\.\/][\p{Letter}0-9]")
+_WORD_REGEX = regex.compile(r"\b\w+\b")
+_SENTENCE_END_REGEX = regex.compile(r" *[\.\?!]['\"\)\]]* *")
+
+class _ReadingEaseCharacters(dict):
 	"""
-	Get the Flesch reading ease of some XHTML.
+	A `str.translate()` table that prepares lowercase text for the Flesch reading ease: it replaces dashes and line breaks with
+	spaces, removes punctuation that doesn't end a sentence, and removes accents.
+
+	Each character is looked up the first time it's seen, so a whole file is translated in one call.
+	"""
+
+	_INCLUDED_CHARACTERS = frozenset(string.whitespace + string.digits + ":;.?!")
+
+	def __missing__(self, code_point: int) -> str:
+		character = chr(code_point)
+
+		if character in "—–\n":
+			translation = " "
+		elif character.isalpha() or character in self._INCLUDED_CHARACTERS:
+			translation = "".join(c for c in unicodedata.normalize("NFD", character) if unicodedata.category(c) != "Mn")
+		else:
+			translation = ""
+
+		self[code_point] = translation
+
+		return translation
+
+_READING_EASE_CHARACTERS = _ReadingEaseCharacters()
+
+class TextStatistics:
+	"""
+	The word, sentence, and syllable counts of some XHTML, used to calculate its word count and Flesch reading ease.
+
+	Adding the statistics of two strings of XHTML gives the statistics of the two strings joined together, so files can be
+	counted separately and their statistics added up in order.
+	"""
+
+	def __init__(self, word_count: int = 0, reading_ease_word_count: int = 0, syllable_count: int = 0, sentence_count: int = 0, first_sentence_word_count: int = 0, last_sentence_word_count: Optional[int] = None):
+		self.word_count = word_count
+		self.reading_ease_word_count = reading_ease_word_count # Words are counted differently for the reading ease, after punctuation is removed
+		self.syllable_count = syllable_count
+
+		# Sentences can run over from one string to the next, so the sentences at either end are kept apart until they're added up.
+		# `sentence_count` is the number of sentences in between that are long enough to count. If the text has no sentence
+		# ends at all, it's all one sentence, and `last_sentence_word_count` is None.
+		self.sentence_count = sentence_count
+		self.first_sentence_word_count = first_sentence_word_count
+		self.last_sentence_word_count = last_sentence_word_count
+
+	def __add__(self, other: "TextStatistics") -> "TextStatistics":
+		if self.last_sentence_word_count is None:
+			# Our text is all part of the other's first sentence
+			sentence_count = other.sentence_count
+			first_sentence_word_count = self.first_sentence_word_count + other.first_sentence_word_count
+			last_sentence_word_count = other.last_sentence_word_count
+		elif other.last_sentence_word_count is None:
+			# The other's text is all part of our last sentence
+			sentence_count = self.sentence_count
+			first_sentence_word_count = self.first_sentence_word_count
+			last_sentence_word_count = self.last_sentence_word_count + other.first_sentence_word_count
+		else:
+			sentence_count = self.sentence_count + other.sentence_count + _is_sentence(self.last_sentence_word_count + other.first_sentence_word_count)
+			first_sentence_word_count = self.first_sentence_word_count
+			last_sentence_word_count = other.last_sentence_word_count
+
+		return TextStatistics(self.word_count + other.word_count, self.reading_ease_word_count + other.reading_ease_word_count, self.syllable_count + other.syllable_count, sentence_count, first_sentence_word_count, last_sentence_word_count)
+
+	@property
+	def flesch_reading_ease(self) -> float:
+		"""
+		The Flesch reading ease of the text.
+		"""
+
+		word_count = max(self.reading_ease_word_count, 1)
+		sentence_count = self.sentence_count + _is_sentence(self.first_sentence_word_count)
+
+		if self.last_sentence_word_count is not None:
+			sentence_count += _is_sentence(self.last_sentence_word_count)
+
+		sentence_count = max(sentence_count, 1)
+
+		average_sentence_length = round(float(word_count) / float(sentence_count), 1)
+		average_syllables_per_word = round(float(self.syllable_count) / float(word_count), 1)
+
+		return round(206.835 - float(1.015 * average_sentence_length) - float(84.6 * average_syllables_per_word), 2)
+
+def _is_sentence(word_count: int) -> int:
+	"""
+	Return 1 if a sentence with the given number of words counts towards the reading ease, or 0 if it's too short, like a heading.
+	"""
+
+	return 1 if word_count > 2 else 0
+
+def _count_words(text: str) -> int:
+	"""
+	Count the words in a string of text that has had its tags removed.
+	"""
+
+	# Replace some formatting characters
+	text = _WORD_SEPARATOR_REGEX.sub(" ", text)
+
+	# Remove word-connecting dashes, apostrophes, commas, and slashes (and/or), they count as a word boundry but they shouldn't
+	text = _WORD_CONNECTOR_REGEX.sub("aa", text)
+
+	return len(_WORD_REGEX.findall(text))
+
+def get_text_statistics(xhtml: str) -> TextStatistics:
+	"""
+	Get the word, sentence, and syllable counts of an XHTML string, for its word count and Flesch reading ease.
 
 	INPUTS
-	text: A string of XHTML to calculate the reading ease of.
+	xhtml: A string of XHTML
 
 	OUTPUTS
-	A float representing the Flesch reading ease of the text.
+	A TextStatistics object.
 	"""
 
-	# Remove HTML tags
-	text = regex.sub(r"<title>.+?</title>", " ", xhtml)
-	text = regex.sub(r"<.+?>", " ", text, flags=regex.DOTALL)
+	# Remove HTML tags, leaving the text nodes separated by spaces
+	text = _TAG_REGEX.sub(" ", _TITLE_REGEX.sub(" ", xhtml))
 
-	# Remove non-sentence-ending punctuation from source text
-	included_characters = list(string.whitespace) + list(string.digits) + [":", ";", ".", "?", "!"]
-	processed_text = regex.sub(r"[—–\n]", " ", text.lower())
-	processed_text = "".join(c for c in processed_text if c.isalpha() or c in included_characters).strip()
+	# MathML doesn't count towards the word count, but it does towards the reading ease
+	word_count = get_word_count(xhtml) if "math" in xhtml else _count_words(text)
 
-	# Remove accents
-	processed_text = "".join(c for c in unicodedata.normalize("NFD", processed_text) if unicodedata.category(c) != "Mn")
+	# Remove non-sentence-ending punctuation and accents
+	text = text.lower().translate(_READING_EASE_CHARACTERS)
+	reading_ease_word_count = len(_WORD_REGEX.findall(_WORD_CONNECTOR_REGEX.sub("aa", text)))
 
-	# Get word count
-	word_count = se.formatting.get_word_count(processed_text)
-	if word_count <= 0:
-		word_count = 1
+	syllable_count = sum(_get_syllable_count(word) * count for word, count in collections.Counter(text.split()).items())
 
-	# Get average sentence length
-	ignore_count = 0
-	sentences = regex.split(r" *[\.\?!]['\"\)\]]* *", processed_text)
-	for sentence in sentences:
-		if se.formatting.get_word_count(sentence) <= 2:
-			ignore_count = ignore_count + 1
-	sentence_count = len(sentences) - ignore_count
+	# Periods were the only word-connecting punctuation left, so the words in each sentence can be counted directly
+	sentence_word_counts = [len(_WORD_REGEX.findall(sentence)) for sentence in _SENTENCE_END_REGEX.split(text)]
 
-	if sentence_count <= 0:
-		sentence_count = 1
+	if len(sentence_word_counts) == 1:
+		return TextStatistics(word_count, reading_ease_word_count, syllable_count, 0, sentence_word_counts[0], None)
 
-	average_sentence_length = round(float(word_count) / float(sentence_count), 1)
+	return TextStatistics(word_count, reading_ease_word_count, syllable_count, sum(_is_sentence(count) for count in sentence_word_counts[1:-1]), sentence_word_counts[0], sentence_word_counts[-1])
 
-	# Get average syllables per word
-	syllable_count = 0
-	for word in processed_text.split():
-		syllable_count += _get_syllable_count(word)
+def _get_file_text_statistics(filename: Path) -> TextStatistics:
+	"""
+	Get the text statistics of an XHTML file.
+	"""
 
-	average_syllables_per_word = round(float(syllable_count) / float(word_count), 1)
+	with open(filename, "r", encoding="utf-8") as file:
+		return get_text_statistics(file.read())
 
-	return round(206.835 - float(1.015 * average_sentence_length) - float(84.6 * average_syllables_per_word), 2)
+def get_text_statistics_for_files(filenames: Sequence[Path]) -> Iterator[TextStatistics]:
+	"""
+	Get the word, sentence, and syllable counts of several XHTML files, in separate processes if there's more than one.
 
-def _get_syllable_count(word: str) -> int:
+	INPUTS
+	filenames: A sequence of XHTML filenames
+
+	OUTPUTS
+	An iterator over TextStatistics objects, in the same order as `filenames`. Add them up to get the statistics of all of the files.
 	"""
-	Helper function to get the syllable count of a word.
+
+	if len(filenames) < 2:
+		for filename in filenames:
+			yield _get_file_text_statistics(filename)
+
+		return
+
+	# Counting is mostly pure Python, so count in separate processes instead of threads
+	with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(filenames), os.cpu_count() or 1)) as executor:
+		yield from executor.map(_get_file_text_statistics, filenames)
+
+def get_flesch_reading_ease(xhtml: str) -> float:
 	"""
+	Get the Flesch reading ease of some XHTML.
 
-	# See http://eayd.in/?p=232
-	exception_add = ["serious", "crucial"]
-	exception_del = ["fortunately", "unfortunately"]
+	INPUTS
+	text: A string of XHTML to calculate the reading ease of.
 
-	co_one = ["cool", "coach", "coat", "coal", "count", "coin", "coarse", "coup", "coif", "cook", "coign", "coiffe", "coof", "court"]
-	co_two = ["coapt", "coed", "coinci"]
+	OUTPUTS
+	A float representing the Flesch reading ease of the text.
+	"""
 
-	pre_one = ["preach"]
+	return get_text_statistics(xhtml).flesch_reading_ease
+
+# Exceptions to the syllable counting rules; see http://eayd.in/?p=232
+_SYLLABLE_EXCEPTIONS_ADD = frozenset(["serious", "crucial"])
+_SYLLABLE_EXCEPTIONS_DEL = frozenset(["fortunately", "unfortunately"])
+_SYLLABLE_CO_ONE = frozenset(["cool", "coach", "coat", "coal", "count", "coin", "coarse", "coup", "coif", "cook", "coign", "coiffe", "coof", "court"])
+_SYLLABLE_CO_TWO = frozenset(["coapt", "coed", "coinci"])
+_SYLLABLE_PRE_ONE = frozenset(["preach"])
+_SYLLABLE_LE_EXCEPTIONS = frozenset(["whole", "mobile", "pole", "male", "female", "hale", "pale", "tale", "sale", "aisle", "whale", "while"])
+_SYLLABLE_NEGATIVES = frozenset(["doesn't", "isn't", "shouldn't", "couldn't", "wouldn't", "doesn’t", "isn’t", "shouldn’t", "couldn’t", "wouldn’t"])
+_SYLLABLE_ES_ED_EXCEPTIONS = ("ted", "tes", "ses", "ied", "ies")
+_VOWEL_GROUP_REGEX = regex.compile(r"[eaoui]+")
+_INNER_Y_REGEX = regex.compile(r"(?<=[^aeoui])y(?=[^aeoui])")
+
+@functools.lru_cache(maxsize=se.WORD_CACHE_SIZE)
+def _get_syllable_count(word: str) -> int:
+	"""
+	Helper function to get the syllable count of a word.
 
-	syls = 0 # Added syllable number
-	disc = 0 # Discarded syllable number
+	Books reuse the same words over and over, so the counts of the most recently used words are remembered.
+	"""
 
 	# 1) if letters < 3: return 1
 	if len(word) <= 3:
-		syls = 1
-		return syls
+		return 1
+
+	syls = 0 # Added syllable number
+	disc = 0 # Discarded syllable number
+
+	# Scan the groups of consecutive vowels once. In a group of n vowels, there are n // 2 separate pairs and n // 3 separate triplets.
+	num_vowels = 0
+	double_and_triple = 0
+	tripple = 0
+	vowels_before_consonants = 0
+
+	for match in _VOWEL_GROUP_REGEX.finditer(word):
+		group_length = match.end() - match.start()
+		num_vowels += group_length
+		double_and_triple += group_length // 2
+		tripple += group_length // 3
+
+		if match.end() < len(word):
+			vowels_before_consonants += 1
 
 	# 2) if doesn't end with "ted" or "tes" or "ses" or "ied" or "ies", discard "es" and "ed" at the end.
 	# if it has only 1 vowel or 1 set of consecutive vowels, discard. (like "speed", "fled" etc.)
-	if word[-2:] == "es" or word[-2:] == "ed":
-		double_and_triple_1 = len(regex.findall(r"[eaoui][eaoui]", word))
-		if double_and_triple_1 > 1 or len(regex.findall(r"[eaoui][^eaoui]", word)) > 1:
-			if word[-3:] == "ted" or word[-3:] == "tes" or word[-3:] == "ses" or word[-3:] == "ied" or word[-3:] == "ies":
-				pass
-			else:
-				disc += 1
+	if word[-2:] in ("es", "ed") and (double_and_triple > 1 or vowels_before_consonants > 1) and word[-3:] not in _SYLLABLE_ES_ED_EXCEPTIONS:
+		disc += 1
 
 	# 3) discard trailing "e", except where ending is "le"
-	le_except = ["whole", "mobile", "pole", "male", "female", "hale", "pale", "tale", "sale", "aisle", "whale", "while"]
-
-	if word[-1:] == "e":
-		if word[-2:] == "le" and word not in le_except:
-			pass
-
-		else:
-			disc += 1
+	if word[-1] == "e" and (word[-2:] != "le" or word in _SYLLABLE_LE_EXCEPTIONS):
+		disc += 1
 
 	# 4) check if consecutive vowels exists, triplets or pairs, count them as one.
-	double_and_triple = len(regex.findall(r"[eaoui][eaoui]", word))
-	tripple = len(regex.findall(r"[eaoui][eaoui][eaoui]", word))
 	disc += double_and_triple + tripple
 
-	# 5) count remaining vowels in word.
-	num_vowels = len(regex.findall(r"[eaoui]", word))
+	# 5) count remaining vowels in word (counted above)
 
 	# 6) add one if starts with "mc"
 	if word[:2] == "mc":
 		syls += 1
 
 	# 7) add one if ends with "y" but is not surrouned by vowel
-	if word[-1:] == "y" and word[-2] not in "aeoui":
+	if word[-1] == "y" and word[-2] not in "aeoui":
 		syls += 1
 
 	# 8) add one if "y" is surrounded by non-vowels and is not in the last word.
-	for i, j in enumerate(word):
-		if j == "y":
-			if (i != 0) and (i != len(word) - 1): # pylint: disable=consider-using-in
-				if word[i - 1] not in "aeoui" and word[i + 1] not in "aeoui":
-					syls += 1
+	if "y" in word:
+		syls += len(_INNER_Y_REGEX.findall(word))
 
 	# 9) if starts with "tri-" or "bi-" and is followed by a vowel, add one.
 	if word[:3] == "tri" and word[3] in "aeoui":
@@ -264,44 +397,31 @@ def _get_syllable_count(word: str) -> int:
 		syls += 1
 
 	# 10) if ends with "-ian", should be counted as two syllables, except for "-tian" and "-cian"
-	if word[-3:] == "ian":
-	# and (word[-4:] != "cian" or word[-4:] != "tian"):
-		if word[-4:] == "cian" or word[-4:] == "tian":
-			pass
-		else:
-			syls += 1
+	if word[-3:] == "ian" and word[-4:] not in ("cian", "tian"):
+		syls += 1
 
 	# 11) if starts with "co-" and is followed by a vowel, check if exists in the double syllable dictionary, if not, check if in single dictionary and act accordingly.
 	if word[:2] == "co" and word[2] in "eaoui":
-
-		if word[:4] in co_two or word[:5] in co_two or word[:6] in co_two:
+		if word[:4] in _SYLLABLE_CO_TWO or word[:5] in _SYLLABLE_CO_TWO or word[:6] in _SYLLABLE_CO_TWO:
 			syls += 1
-		elif word[:4] in co_one or word[:5] in co_one or word[:6] in co_one:
+		elif word[:4] in _SYLLABLE_CO_ONE or word[:5] in _SYLLABLE_CO_ONE or word[:6] in _SYLLABLE_CO_ONE:
 			pass
 		else:
 			syls += 1
 
 	# 12) if starts with "pre-" and is followed by a vowel, check if exists in the double syllable dictionary, if not, check if in single dictionary and act accordingly.
-	if word[:3] == "pre" and word[3] in "eaoui":
-		if word[:6] in pre_one:
-			pass
-		else:
-			syls += 1
+	if word[:3] == "pre" and word[3] in "eaoui" and word[:6] not in _SYLLABLE_PRE_ONE:
+		syls += 1
 
 	# 13) check for "-n't" and cross match with dictionary to add syllable.
-	negative = ["doesn't", "isn't", "shouldn't", "couldn't", "wouldn't", "doesn’t", "isn’t", "shouldn’t", "couldn’t", "wouldn’t"]
-
-	if word[-3:] == "n't" or word[-3:] == "n’t":
-		if word in negative:
-			syls += 1
-		else:
-			pass
+	if word in _SYLLABLE_NEGATIVES:
+		syls += 1
 
 	# 14) Handling the exceptional words.
-	if word in exception_del:
+	if word in _SYLLABLE_EXCEPTIONS_DEL:
 		disc += 1
 
-	if word in exception_add:
+	if word in _SYLLABLE_EXCEPTIONS_ADD:
 		syls += 1
 
 	# Calculate the output
@@ -319,23 +439,13 @@ def get_word_count(xhtml: str) -> int:
 	"""
 
 	# Remove MathML
-	xhtml = regex.sub(r"<(m:)?math.+?</(m:)?math>", " ", xhtml)
+	xhtml = _MATHML_REGEX.sub(" ", xhtml)
 
 	# Remove HTML tags
-	xhtml = regex.sub(r"<title>.+?</title>", " ", xhtml)
-	xhtml = regex.sub(r"<.+?>", " ", xhtml, flags=regex.DOTALL)
-
-	# Replace some formatting characters
-	xhtml = regex.sub(r"[…–—― ‘’“”\{\}\(\)]", " ", xhtml, flags=regex.IGNORECASE | regex.DOTALL)
-
-	# Remove word-connecting dashes, apostrophes, commas, and slashes (and/or), they count as a word boundry but they shouldn't
-	xhtml = regex.sub(r"[\p{Letter}0-9][\-\'\,\.\/][\p{Letter}0-9]", "aa", xhtml, flags=regex.IGNORECASE | regex.DOTALL)
-
-	# Replace sequential spaces with one space
-	xhtml = regex.sub(r"\s+", " ", xhtml, flags=regex.IGNORECASE | regex.DOTALL)
+	xhtml = _TITLE_REGEX.sub(" ", xhtml)
+	xhtml = _TAG_REGEX.sub(" ", xhtml)
 
-	# Get the word count
-	return len(regex.findall(r"\b\w+\b", xhtml, flags=regex.IGNORECASE | regex.DOTALL))
+	return _count_words(xhtml)
 
 def _replace_character_references(match_object) -> str:
 	"""Replace most XML character references with literal characters.
@@ -366,120 +476,520 @@ def _replace_character_references(match_object) -> str:
 
 	return retval
 
-def _indent(tree, space="\t"):
+_XHTML_BR_TAG = "{http://www.w3.org/1999/xhtml}br"
+_OPF_PACKAGE_TAG = "{http://www.idpf.org/2007/opf}package"
+_OPF_METADATA_TAG = "{http://www.idpf.org/2007/opf}metadata"
+_OPF_META_TAG = "{http://www.idpf.org/2007/opf}meta"
+_SVG_SVG_TAG = "{http://www.w3.org/2000/svg}svg"
+_SVG_STYLE_TAG = "{http://www.w3.org/2000/svg}style"
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+_LEADING_LINE_WRAP_REGEX = regex.compile(r"^\n[\n\t ]*")
+_TRAILING_LINE_WRAP_REGEX = regex.compile(r"\n[\n\t ]*$")
+_LINE_WRAP_REGEX = regex.compile(r" *\n[\n\t ]*")
+_SPACES_REGEX = regex.compile(r"[\t ]+")
+_UPPERCASE_REGEX = regex.compile(r"[A-Z]")
+_NAMESPACE_DECLARATION_REGEX = regex.compile(r"\sxmlns(:.+?)?=\"[^\"]+?\"")
+
+def _is_indentation(text: str) -> bool:
 	"""
-	Indent an lxml tree using the given space characters.
+	Return True if a string is made up only of newlines, tabs, and spaces.
 	"""
 
-	if len(tree) > 0:
-		level = 0
-		indentation = "\n" + level * space
-		_indent_children(tree, 1, space, [indentation, indentation + space])
-	else:
-		tree.text = "\n"
+	return not text.strip("\n\t ")
+
+def _unwrap_text(text: str, remove_trailing_space: bool) -> str:
+	"""
+	Remove line wraps from the text content of an element.
+	"""
+
+	if "\n" not in text:
+		return text
+
+	text = _LEADING_LINE_WRAP_REGEX.sub("", text)
+	if remove_trailing_space:
+		text = _TRAILING_LINE_WRAP_REGEX.sub("", text)
+	return _LINE_WRAP_REGEX.sub(" ", text)
+
+def _unwrap_tail(tag, tail: str, remove_trailing_space: bool) -> str:
+	"""
+	Remove line wraps from the tail content of an element.
+	"""
+
+	if "\n" not in tail:
+		return tail
+
+	tail = _LEADING_LINE_WRAP_REGEX.sub("" if tag == _XHTML_BR_TAG else " ", tail)
+	if remove_trailing_space:
+		tail = _TRAILING_LINE_WRAP_REGEX.sub("", tail)
+	return _LINE_WRAP_REGEX.sub(" ", tail)
+
+def _escape_text(text: str) -> str:
+	"""
+	Escape a string for use as XML text content, the same way lxml does.
+	"""
+
+	if "&" in text:
+		text = text.replace("&", "&amp;")
+	if "<" in text:
+		text = text.replace("<", "&lt;")
+	if ">" in text:
+		text = text.replace(">", "&gt;")
+	if "\r" in text:
+		text = text.replace("\r", "&#13;")
+
+	return text
+
+def _escape_attribute(value: str) -> str:
+	"""
+	Escape a string for use as an XML attribute value, the same way lxml does.
+	"""
+
+	return _escape_text(value).replace("\"", "&quot;").replace("\n", "&#10;").replace("\t", "&#9;")
+
+def _split_name(name: str) -> Tuple[str, str]:
+	"""
+	Split a tag or attribute name in Clark notation, like `{http://www.w3.org/1999/xhtml}p`, into its namespace URI and local name.
+	"""
+
+	if name[0] == "{":
+		uri, local_name = name[1:].split("}", 1)
+		return (uri, local_name)
+
+	return ("", name)
+
+def _get_attribute_sort_key(item: Tuple[str, str]) -> Tuple[str, str]:
+	"""
+	Return the key c14n sorts attributes by: their namespace URI, then their local name. Attributes without a namespace come first.
+	"""
+
+	return _split_name(item[0])
 
-def _indent_children(elem, level, one_space, indentations, has_child_tails=False):
+def _detach_from_root_default_namespace(root: etree.ElementBase) -> Set[etree.ElementBase]:
 	"""
-	Recursive helper function implementing indent levels for lxml tree.
+	Move the elements below the root's children out of the root's default namespace, the way c14n does when the root element has
+	siblings, like a comment, a processing instruction, or a doctype.
+
+	In that case libxml2 doesn't see the root's default namespace declaration from the grandchildren of the root on, so it gives each
+	of them `xmlns=""`. Our output has always gone through c14n, and some of our own files, like the Kindle ToC that has been through
+	BeautifulSoup, depend on that; so this reproduces it.
+
+	INPUTS
+	root: The root element of the tree, which is changed in place
+
+	OUTPUTS
+	The set of elements that must declare `xmlns=""`.
 	"""
 
-	# Reuse indentation strings for speed.
-	if len(indentations) <= level:
-		indentations.append(indentations[-1] + one_space)
+	elements: Set[etree.ElementBase] = set()
+	root_namespace = None
+	declares_default_namespace = False
+	in_scope_stack: List[bool] = [] # Whether each open element is in the scope of the root's default namespace declaration
+
+	for event, elem in etree.iterwalk(root, events=("start-ns", "start", "end")):
+		if event == "start-ns":
+			if elem[0] == "":
+				declares_default_namespace = True
+
+				if not in_scope_stack:
+					root_namespace = elem[1]
+
+			continue
 
-	# Start a new indentation level for the first child.
-	child_indentation = indentations[level]
+		if event == "end":
+			in_scope_stack.pop()
+			continue
 
-	# Check if any children have tail content
-	if not has_child_tails:
-		if len(elem) > 0 and elem.text and not regex.match(r"^[\n\t ]+$", elem.text):
-			has_child_tails = True
+		if not in_scope_stack:
+			if not root_namespace:
+				break
+
+			in_scope = True
 		else:
-			for child in elem:
-				if (child.tail and not regex.match(r"^[\n\t ]+$", child.tail)):
-					has_child_tails = True
+			in_scope = in_scope_stack[-1] and not declares_default_namespace
+
+		declares_default_namespace = False
+
+		if in_scope and len(in_scope_stack) > 1:
+			if elem.prefix is None:
+				elem.tag = _split_name(elem.tag)[1]
+
+			elements.add(elem)
+
+		in_scope_stack.append(in_scope)
+
+	return elements
+
+class _XmlFrame:
+	"""
+	An element whose children are being written by _XmlWriter.
+	"""
+
+	def __init__(self, elem: etree.ElementBase, name: str, level: int, has_child_tails: bool, output: List[str]):
+		self.elem = elem
+		self.name = name
+		self.level = level
+		self.has_child_tails = has_child_tails
+		self.child_indentation = "\n" + "\t" * level
+		self.output = output
+		self.preceding_text = "" # The text node before the next child; this is how <style> elements find their indentation
+		self.is_long_description = False
+
+class _XmlWriter:
+	"""
+	Write a parsed XML tree in house style, in a single pass.
+
+	The output is the same as canonicalizing the tree with c14n, re-parsing it, indenting it with tabs, trimming white space
+	around attribute values, and serializing it with lxml; but the tree is only walked once, and it isn't changed.
+	"""
+
+	def __init__(self, lowercase_names: bool = False, format_style_elements: bool = False, fix_svg_viewbox: bool = False, escape_long_description: bool = False):
+		self.lowercase_names = lowercase_names
+		self.format_style_elements = format_style_elements
+		self.fix_svg_viewbox = fix_svg_viewbox
+		self.escape_long_description = escape_long_description
+		self._namespace_counter = 0
+		self._detached_elements: Set[etree.ElementBase] = set()
+
+	def write(self, root: etree.ElementBase, doctype: Optional[str] = None) -> str:
+		"""
+		Return a tree as a string of pretty-printed XML, including the XML declaration.
+
+		INPUTS
+		root: The root element of the tree
+		doctype: An optional doctype to write before the root element
+
+		OUTPUTS
+		A string of pretty-printed XML.
+		"""
+
+		output = ["<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"]
+		self._namespace_counter = 0
+		self._detached_elements = set()
+
+		if root.getprevious() is not None or root.getnext() is not None or root.getroottree().docinfo.internalDTD is not None:
+			self._detached_elements = _detach_from_root_default_namespace(root)
+
+		if doctype:
+			output.append(doctype + "\n")
+
+		frames: List[_XmlFrame] = []
+		namespaces_stack: List[Dict[str, str]] = [{}]
+		declared_namespaces: Dict[str, str] = {}
+
+		for event, elem in etree.iterwalk(root, events=("start-ns", "start", "end", "comment", "pi")):
+			if event == "start-ns":
+				declared_namespaces[elem[0]] = elem[1]
+				continue
+
+			frame = frames[-1] if frames else None
+			frame_output = frame.output if frame else output
+
+			if event == "start":
+				parent_namespaces = namespaces_stack[-1]
+				namespaces = parent_namespaces
+
+				if declared_namespaces:
+					namespaces = {**parent_namespaces, **declared_namespaces}
+					declared_namespaces = {}
+
+				start_tag, name, namespaces = self._get_start_tag(elem, frame, parent_namespaces, namespaces)
+				namespaces_stack.append(namespaces)
+				is_long_description = self.escape_long_description and self._is_long_description(elem, frames)
+
+				if len(elem) > 0:
+					if frame:
+						has_child_tails = frame.has_child_tails
+						level = frame.level if has_child_tails else frame.level + 1
+					else:
+						has_child_tails = False
+						level = 1
+
+					new_frame = _XmlFrame(elem, name, level, has_child_tails, frame_output)
+					text = self._start_children(new_frame)
+				else:
+					new_frame = None
+					text = elem.text
+
+				if frame:
+					text = self._clean_child_text(elem, text, frame)
+				elif new_frame is None:
+					# A root element without children is just given a line break
+					text = "\n"
+
+				if self.format_style_elements and elem.tag.lower() == _SVG_STYLE_TAG:
+					text = self._format_style_element(text, frame)
+
+				if new_frame:
+					new_frame.preceding_text = text
+					frames.append(new_frame)
+
+					if is_long_description:
+						# The children of the long description are written as its escaped text
+						new_frame.is_long_description = True
+						new_frame.output = [text]
+						frame_output.append(start_tag + ">")
+					else:
+						frame_output.append(start_tag + ">" + _escape_text(text))
+				elif text is None and not is_long_description:
+					frame_output.append(start_tag + "/>")
+				else:
+					frame_output.append(start_tag + ">" + _escape_text(text or "") + f"</{name}>")
+
+				continue
+
+			if event == "end":
+				namespaces_stack.pop()
+
+				# Childless elements were closed when they were started
+				if len(elem) > 0:
+					child_frame = frames.pop()
+					frame = frames[-1] if frames else None
+					frame_output = frame.output if frame else output
+
+					if child_frame.is_long_description:
+						frame_output.append(_escape_text(_NAMESPACE_DECLARATION_REGEX.sub("", "".join(child_frame.output))))
+
+					frame_output.append(f"</{child_frame.name}>")
+
+				if frame is None:
+					# That was the root element, so we're done
 					break
+			else:
+				# Comments and processing instructions are started and ended at once
+				text = self._clean_child_text(elem, elem.text, frame)
 
-	# If elem text is empty, start a new indentation level
-	if not elem.text or regex.match(r"^[\n\t ]+$", elem.text):
-		if has_child_tails:
-			elem.text = ""
-		else:
-			elem.text = child_indentation
-	else:
-		_unwrap_text(elem, remove_trailing_space=False)
+				if event == "comment":
+					frame.output.append(f"<!--{text}-->")
+				else:
+					frame.output.append(f"<?{elem.target} {text}?>" if text else f"<?{elem.target}?>")
+
+			self._end_child(elem, frame)
+
+		return unicodedata.normalize("NFC", "".join(output) + "\n")
+
+	def _get_prefix(self, uri: str, namespaces: Dict[str, str], is_attribute: bool) -> Tuple[str, Dict[str, str], str]:
+		"""
+		Find the prefix bound to a namespace, the way lxml does when a tag or attribute name is changed; or if there isn't one, bind a new `ns0`-style prefix.
+
+		OUTPUTS
+		A tuple of the prefix, the namespaces in scope including the new prefix, and the new prefix's declaration (or an empty string).
+		"""
+
+		if uri == _XML_NAMESPACE:
+			return ("xml", namespaces, "")
+
+		for prefix, prefix_uri in namespaces.items():
+			# Attributes can't be in the default namespace
+			if prefix_uri == uri and (prefix or not is_attribute):
+				return (prefix, namespaces, "")
+
+		while True:
+			prefix = f"ns{self._namespace_counter}"
+			self._namespace_counter += 1
+
+			if prefix not in namespaces:
+				return (prefix, {**namespaces, prefix: uri}, f" xmlns:{prefix}=\"{_escape_attribute(uri)}\"")
+
+	def _get_start_tag(self, elem: etree.ElementBase, frame: Optional[_XmlFrame], parent_namespaces: Dict[str, str], namespaces: Dict[str, str]) -> Tuple[str, str, Dict[str, str]]:
+		"""
+		Return the start tag of an element without the closing `>`, the element's name, and the namespaces in scope for its children.
+		"""
+
+		# Like c14n, only declare namespaces that are different from the parent's, with the default namespace first
+		declarations = ""
+		is_detached = elem in self._detached_elements
+
+		if is_detached:
+			namespaces = {**namespaces, "": ""}
+
+		if namespaces is not parent_namespaces:
+			for prefix in sorted(namespaces):
+				uri = namespaces[prefix]
+
+				if uri != parent_namespaces.get(prefix, "" if prefix == "" else None) or (is_detached and prefix == ""):
+					declarations += f" xmlns:{prefix}=\"{_escape_attribute(uri)}\"" if prefix else f" xmlns=\"{_escape_attribute(uri)}\""
+
+		uri, local_name = _split_name(elem.tag)
+		prefix = elem.prefix
+
+		if self.lowercase_names and _UPPERCASE_REGEX.search(local_name):
+			local_name = local_name.lower()
+
+			# Lowercasing the whole tag can change its namespace too
+			if uri != uri.lower():
+				prefix, namespaces, declaration = self._get_prefix(uri.lower(), namespaces, False)
+				declarations += declaration
+
+		name = f"{prefix}:{local_name}" if prefix else local_name
+		attributes = elem.items()
+
+		if not attributes:
+			return ("<" + name + declarations, name, namespaces)
+
+		if len(attributes) > 1:
+			attributes.sort(key=_get_attribute_sort_key)
+
+		if self.fix_svg_viewbox and frame is None and elem.tag == _SVG_SVG_TAG:
+			for index, (attribute, value) in enumerate(attributes):
+				if attribute.lower() == "viewbox":
+					del attributes[index]
+					attributes.append(("viewBox", value))
+					break
+
+		# If any attribute name has uppercase letters, all of them are lowercased
+		lowercase_attributes = self.lowercase_names and any(_UPPERCASE_REGEX.search(_split_name(attribute)[1]) for attribute, _ in attributes)
+		attributes_xml = ""
 
-	# Recursively indent all children.
-	for child in elem:
-		if len(child) > 0:
-			if has_child_tails:
-				next_level = level
+		for attribute, value in attributes:
+			if lowercase_attributes:
+				attribute = attribute.lower()
+
+			uri, attribute = _split_name(attribute)
+
+			if uri:
+				attribute_prefix, namespaces, declaration = self._get_prefix(uri, namespaces, True)
+				attribute = f"{attribute_prefix}:{attribute}"
+				declarations += declaration
+
+			attributes_xml += f" {attribute}=\"{_escape_attribute(value.strip())}\""
+
+		return ("<" + name + declarations + attributes_xml, name, namespaces)
+
+	def _start_children(self, frame: _XmlFrame) -> str:
+		"""
+		Work out whether an element has mixed content, and return its indented text.
+		"""
+
+		elem = frame.elem
+
+		if not frame.has_child_tails:
+			if elem.text and not _is_indentation(elem.text):
+				frame.has_child_tails = True
 			else:
-				next_level = level + 1
-			_indent_children(child, next_level, one_space, indentations, has_child_tails)
-
-		next_child = child.getnext()
-
-		# Remove line wraps and extra whitespace from child text (except meta tags)
-		if child.text and not regex.match(r"^[\n\t ]+$", child.text):
-			if child.tag is etree.Comment:
-				child.text = regex.sub(r" *\n[\n\t ]*", child_indentation, child.text)
-			elif child.tag != "{http://www.idpf.org/2007/opf}meta":
-				_unwrap_text(child, remove_trailing_space=True)
-				child.text = regex.sub(r"[\t ]+", " ", child.text)
-
-		# Handle different cases for indentation in child tail content
-		if not child.tail or regex.match(r"^[\n\t ]+$", child.tail):
-			if next_child is None:
-				if has_child_tails:
-					child.tail = ""
+				for child in elem:
+					if child.tail and not _is_indentation(child.tail):
+						frame.has_child_tails = True
+						break
+
+		if not elem.text or _is_indentation(elem.text):
+			return "" if frame.has_child_tails else frame.child_indentation
+
+		return _unwrap_text(elem.text, remove_trailing_space=False)
+
+	def _clean_child_text(self, elem: etree.ElementBase, text: Optional[str], frame: _XmlFrame) -> Optional[str]:
+		"""
+		Remove line wraps and extra white space from the text of an element's child (except meta tags).
+		"""
+
+		if not text or _is_indentation(text):
+			return text
+
+		if elem.tag is etree.Comment:
+			return _LINE_WRAP_REGEX.sub(frame.child_indentation, text)
+
+		if elem.tag == _OPF_META_TAG:
+			return text
+
+		text = _unwrap_text(text, remove_trailing_space=True)
+
+		return _SPACES_REGEX.sub(" ", text) if "\t" in text or "  " in text else text
+
+	def _end_child(self, elem: etree.ElementBase, frame: _XmlFrame) -> None:
+		"""
+		Write the indented tail of an element's child.
+		"""
+
+		tail = elem.tail
+		next_elem = elem.getnext()
+
+		if not tail or _is_indentation(tail):
+			if next_elem is None:
+				if frame.has_child_tails:
+					tail = ""
 				else:
-					child_indentation = indentations[level - 1]
-					child.tail = child_indentation
-			elif child.tag == "{http://www.w3.org/1999/xhtml}br":
-				if has_child_tails:
-					child_indentation = indentations[level - 1]
-				child.tail = child_indentation
-			elif not has_child_tails and next_child.tag == "{http://www.w3.org/1999/xhtml}br":
-				child.tail = child_indentation
-			elif not has_child_tails and not child.tail and next_child.tag in PHRASING_TAGS:
-				child.tail = ""
-			elif has_child_tails:
-				if not child.tail or next_child.tag == "{http://www.w3.org/1999/xhtml}br":
-					child.tail = ""
+					frame.child_indentation = "\n" + "\t" * (frame.level - 1)
+					tail = frame.child_indentation
+			elif elem.tag == _XHTML_BR_TAG:
+				if frame.has_child_tails:
+					frame.child_indentation = "\n" + "\t" * (frame.level - 1)
+				tail = frame.child_indentation
+			elif not frame.has_child_tails and next_elem.tag == _XHTML_BR_TAG:
+				tail = frame.child_indentation
+			elif not frame.has_child_tails and not tail and next_elem.tag in PHRASING_TAGS:
+				tail = ""
+			elif frame.has_child_tails:
+				if not tail or next_elem.tag == _XHTML_BR_TAG:
+					tail = ""
 				else:
-					child.tail = " "
+					tail = " "
 			else:
-				child.tail = child_indentation
+				tail = frame.child_indentation
 		else:
-			# Remove line wraps and extra whitespace in child tail
-			_unwrap_tail(child, remove_trailing_space=next_child is None)
-			child.tail = regex.sub(r"[\t ]+", " ", child.tail)
+			# Remove line wraps and extra white space in the tail
+			tail = _unwrap_tail(elem.tag, tail, remove_trailing_space=next_elem is None)
+			tail = _SPACES_REGEX.sub(" ", tail)
 			# Add special indentation for br tag with non-empty tail
-			if child.tag == "{http://www.w3.org/1999/xhtml}br":
-				child_indentation = indentations[level - 1]
-				child.tail = child_indentation + child.tail
+			if elem.tag == _XHTML_BR_TAG:
+				frame.child_indentation = "\n" + "\t" * (frame.level - 1)
+				tail = frame.child_indentation + tail
 
-def _unwrap_text(elem: etree.Element, remove_trailing_space: bool):
-	"""
-	Remove line wraps from text content of element.
-	"""
-	elem.text = regex.sub(r"^\n[\n\t ]*", "", elem.text)
-	if remove_trailing_space:
-		elem.text = regex.sub(r"\n[\n\t ]*$", "", elem.text)
-	elem.text = regex.sub(r" *\n[\n\t ]*", " ", elem.text)
+		frame.output.append(_escape_text(tail))
+		frame.preceding_text = tail
+
+	def _is_long_description(self, elem: etree.ElementBase, frames: List[_XmlFrame]) -> bool:
+		"""
+		Return True if an element is the `se:long-description` meta element of an OPF file.
+		"""
+
+		return elem.tag == _OPF_META_TAG and len(frames) == 2 and frames[0].elem.tag == _OPF_PACKAGE_TAG and frames[1].elem.tag == _OPF_METADATA_TAG and (elem.get("property") or "").strip() == "se:long-description"
+
+	def _format_style_element(self, css: Optional[str], frame: Optional[_XmlFrame]) -> str:
+		"""
+		Return the pretty-printed text of a <style> element, indented one level deeper than the element.
+		"""
+
+		try:
+			css = format_css(css)
+
+			if frame is None:
+				raise se.InvalidXmlException("<style> element has no preceding text.")
+
+			# Get the <style> element's indentation
+			indent = frame.preceding_text.replace("\n", "")
 
-def _unwrap_tail(elem: etree.Element, remove_trailing_space: bool):
+			# Indent the CSS one level deeper than the <style> element
+			css = "".join(indent + "\t" + line + "\n" for line in css.splitlines())
+			css = css.strip("\n")
+			css = regex.sub(r"^\s+$", "", css, flags=regex.MULTILINE) # Remove indents from lines that are just white space
+
+			return "\n" + css + "\n" + indent
+		except se.InvalidCssException as ex:
+			raise ex
+		except Exception as ex:
+			raise se.InvalidCssException(f"Couldn’t parse CSS. Exception: {ex}")
+
+def format_xml_for_suffix(xml: str, suffix: str) -> str:
 	"""
-	Remove line wraps from tail content of element.
+	Pretty-print well-formed XML, adjusting formatting for the type of file it came from.
+
+	INPUTS
+	xml: A string of well-formed XML
+	suffix: The filename suffix of the source file, like `.xhtml`, `.svg`, or `.opf`; other suffixes are formatted as plain XML
+
+	OUTPUTS
+	A string of pretty-printed XML.
 	"""
-	if elem.tag == "{http://www.w3.org/1999/xhtml}br":
-		elem.tail = regex.sub(r"^\n[\n\t ]*", "", elem.tail)
-	else:
-		elem.tail = regex.sub(r"^\n[\n\t ]*", " ", elem.tail)
-	if remove_trailing_space:
-		elem.tail = regex.sub(r"\n[\n\t ]*$", "", elem.tail)
-	elem.tail = regex.sub(r" *\n[\n\t ]*", " ", elem.tail)
+
+	if suffix == ".xhtml":
+		return se.formatting.format_xhtml(xml)
+
+	if suffix == ".svg":
+		return se.formatting.format_svg(xml)
+
+	if suffix == ".opf":
+		return se.formatting.format_opf(xml)
+
+	return se.formatting.format_xml(xml)
 
 def format_xml_file(filename: Path) -> None:
 	"""
@@ -496,92 +1006,68 @@ def format_xml_file(filename: Path) -> None:
 	with open(filename, "r+", encoding="utf-8") as file:
 		xml = file.read()
 
-		if filename.suffix == ".xhtml":
-			processed_xml = se.formatting.format_xhtml(xml)
-		elif filename.suffix == ".svg":
-			processed_xml = se.formatting.format_svg(xml)
-		elif filename.suffix == ".opf":
-			processed_xml = se.formatting.format_opf(xml)
-		else:
-			processed_xml = se.formatting.format_xml(xml)
+		processed_xml = format_xml_for_suffix(xml, filename.suffix)
+
 		if processed_xml != xml:
 			file.seek(0)
 			file.write(processed_xml)
 			file.truncate()
 
-def _format_style_elements(tree: etree.ElementTree):
+def is_known_formatted(cache: se.cache.BuildCache, xml: Union[str, bytes], suffix: str) -> bool:
 	"""
-	Find <style> elements in an XML etree, and pretty-print the CSS inside of them.
-	The passed tree is modified in-place.
+	Return True if the cache knows that a string of XML is already pretty-printed.
+
+	This only hashes the XML, so it's much faster than formatting it to find out.
 
 	INPUTS
-	tree: An XML etree.
+	cache: The cache to look in
+	xml: A string of XML
+	suffix: The filename suffix of the source file, like `.xhtml`
 
 	OUTPUTS
-	None.
+	True if `format_xml_for_suffix(xml, suffix)` is known to return `xml` unchanged.
 	"""
 
-	try:
-		for node in tree.xpath("//svg:style", namespaces={"xhtml": "http://www.w3.org/1999/xhtml", "svg": "http://www.w3.org/2000/svg"}):
-			css = format_css(node.text)
+	return cache.get(cache.get_key("formatted", FORMAT_CACHE_VERSION, xml, suffix)) is not None
 
-			# Get the <style> element's indentation
-			indent = node.xpath("preceding-sibling::text()[1]")[0].replace("\n", "")
-
-			# Indent the CSS one level deeper than the <style> element
-			css = ''.join(indent + "\t" + line + "\n" for line in css.splitlines())
-			css = css.strip("\n")
-			css = regex.sub(r"^\s+$", "", css, flags=regex.MULTILINE) # Remove indents from lines that are just white space
-
-			node.text = "\n" + css + "\n" + indent
-	except se.InvalidCssException as ex:
-		raise ex
-	except Exception as ex:
-		raise se.InvalidCssException(f"Couldn’t parse CSS. Exception: {ex}")
-
-def _format_xml_str(xml: str) -> etree.ElementTree:
+def mark_known_formatted(cache: se.cache.BuildCache, xml: Union[str, bytes], suffix: str) -> None:
 	"""
-	Given a string of well-formed XML, return a pretty-printed etree.
+	Record in the cache that a string of XML is already pretty-printed, so that `is_known_formatted()` returns True for it.
+
+	Only mark XML that `format_xml_for_suffix()` returned unchanged.
 
 	INPUTS
-	xml: A string of well-formed XML.
+	cache: The cache to record in
+	xml: A string of XML
+	suffix: The filename suffix of the source file, like `.xhtml`
 
 	OUTPUTS
-	An etree representing the pretty-printed XML.
+	None.
 	"""
 
-	tree = etree.fromstring(str.encode(xml))
-	canonical_bytes = etree.tostring(tree, method="c14n")
-	tree = etree.fromstring(canonical_bytes)
-	_indent(tree, space="\t")
-
-	# Remove white space around attribute values
-	for node in tree.xpath("//*[attribute::*[re:test(., '^\\s+') or re:test(., '\\s+$')]]", namespaces={"re": "http://exslt.org/regular-expressions"}):
-		for attribute in node.keys():
-			value = node.get(attribute)
-			value = regex.sub(r"^\s+", "", value)
-			value = regex.sub(r"\s+$", "", value)
-			node.set(attribute, value)
+	cache.put(cache.get_key("formatted", FORMAT_CACHE_VERSION, xml, suffix), b"")
 
-	return tree
-
-def _xml_tree_to_string(tree: etree.ElementTree, doctype: str = None) -> str:
+def format_xml_strings(xmls: Sequence[Tuple[str, str]]) -> Iterator[str]:
 	"""
-	Given an XML etree, return a string representing the etree's XML.
+	Pretty-print several strings of well-formed XML, in separate processes if there's more than one.
 
 	INPUTS
-	tree: An XML etree.
+	xmls: A sequence of tuples of a string of XML and the filename suffix of its source file, like `.xhtml`
 
 	OUTPUTS
-	A string representing the etree's XML.
+	An iterator over the pretty-printed XML, in the same order as `xmls`. If formatting a string raises an exception,
+	it's raised when the iterator reaches that string.
 	"""
 
-	xml = """<?xml version="1.0" encoding="utf-8"?>\n""" + etree.tostring(tree, encoding="unicode", doctype=doctype) + "\n"
+	if len(xmls) < 2:
+		for xml, suffix in xmls:
+			yield format_xml_for_suffix(xml, suffix)
 
-	# Normalize unicode characters
-	xml = unicodedata.normalize("NFC", xml)
+		return
 
-	return xml
+	# Formatting is mostly pure Python, so format in separate processes instead of threads
+	with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(xmls), os.cpu_count() or 1)) as executor:
+		yield from executor.map(format_xml_for_suffix, *zip(*xmls))
 
 def format_xml(xml: str) -> str:
 	"""
@@ -595,15 +1081,14 @@ def format_xml(xml: str) -> str:
 	"""
 
 	try:
-		tree = _format_xml_str(xml)
+		tree = etree.fromstring(str.encode(xml))
 	except Exception as ex:
 		raise se.InvalidXmlException(f"Couldn’t parse XML file. Exception: {ex}")
 
-
 	# Pull out the doctype if there is one, as etree seems to eat it
 	doctypes = regex.search(r"<!doctype[^>]+?>", xml, flags=regex.IGNORECASE)
 
-	return _xml_tree_to_string(tree, doctypes.group(0) if doctypes else None)
+	return _XmlWriter().write(tree, doctypes.group(0) if doctypes else None)
 
 def format_xhtml(xhtml: str) -> str:
 	"""
@@ -630,25 +1115,15 @@ def format_xhtml(xhtml: str) -> str:
 	xhtml = regex.sub(r"([^\s>])\s+(</[^>]+?>)", r"\1\2", xhtml, flags=regex.IGNORECASE)
 
 	try:
-		tree = _format_xml_str(xhtml)
+		tree = etree.fromstring(str.encode(xhtml))
 	except Exception as ex:
 		raise se.InvalidXhtmlException(f"Couldn’t parse XHTML file. Exception: {ex}")
 
-	# Lowercase attribute names
-	for node in tree.xpath("//*[attribute::*[re:test(local-name(), '[A-Z]')]]", namespaces=se.XHTML_NAMESPACES):
-		for key, value in node.items(): # Iterate over attributes
-			node.attrib.pop(key) # Remove the attribute
-			node.attrib[key.lower()] = value # Re-add the attribute, lowercased
-
-	# Lowercase tag names
-	for node in tree.xpath("//*[re:test(local-name(), '[A-Z]')]", namespaces=se.XHTML_NAMESPACES):
-		node.tag = node.tag.lower()
-
-	# Format <style> elements
-	_format_style_elements(tree)
+	# Lowercase tag and attribute names, and format <style> elements
+	xhtml = _XmlWriter(lowercase_names=True, format_style_elements=True).write(tree)
 
 	# Remove white space between non-tags and <br/>
-	xhtml = regex.sub(r"([^>\s])\s+<br/>", r"\1<br/>", _xml_tree_to_string(tree))
+	xhtml = regex.sub(r"([^>\s])\s+<br/>", r"\1<br/>", xhtml)
 
 	return xhtml
 
@@ -671,33 +1146,13 @@ def format_opf(xml: str) -> str:
 	xml = xml.replace("&gt;", ">")
 	xml = xml.replace("&amp;amp;", "&amp;") # Unescape escaped ampersands, which appear in the long description only
 
-	# Canonicalize and format XML
 	try:
-		tree = _format_xml_str(xml)
+		tree = etree.fromstring(str.encode(xml))
 	except Exception as ex:
 		raise se.InvalidXmlException(f"Couldn’t parse OPF file. Exception: {ex}")
 
 	# Format the long description, then escape it
-	for node in tree.xpath("/opf:package/opf:metadata/opf:meta[@property='se:long-description']", namespaces={"opf": "http://www.idpf.org/2007/opf"}):
-		# Convert the node contents to escaped text.
-		xhtml = node.text # This preserves the initial newline and indentation
-
-		if xhtml is None:
-			xhtml = ""
-
-		for child in node:
-			xhtml += etree.tostring(child, encoding="unicode")
-
-		# After composing the string, lxml adds namespaces to every tag. The only way to remove them is with regex.
-		xhtml = regex.sub(r"\sxmlns(:.+?)?=\"[^\"]+?\"", "", xhtml)
-
-		# Remove the children so that we can replace them with the escaped xhtml
-		for child in node:
-			node.remove(child)
-
-		node.text = xhtml
-
-	return _xml_tree_to_string(tree)
+	return _XmlWriter(escape_long_description=True).write(tree)
 
 def format_svg(svg: str) -> str:
 	"""
@@ -711,22 +1166,12 @@ def format_svg(svg: str) -> str:
 	"""
 
 	try:
-		tree = _format_xml_str(svg)
+		tree = etree.fromstring(str.encode(svg))
 	except Exception as ex:
 		raise se.InvalidXmlException(f"Couldn’t parse SVG file. Exception: {ex}")
 
-	# Make sure viewBox is correctly-cased
-	for node in tree.xpath("/svg:svg", namespaces={"svg": "http://www.w3.org/2000/svg"}):
-		for key, value in node.items(): # Iterate over attributes
-			if key.lower() == "viewbox":
-				node.attrib.pop(key) # Remove the attribute
-				node.attrib["viewBox"] = value # Re-add the attribute, correctly-cased
-				break
-
-	# Format <style> elements
-	_format_style_elements(tree)
-
-	return _xml_tree_to_string(tree)
+	# Make sure viewBox is correctly-cased, and format <style> elements
+	return _XmlWriter(fix_svg_viewbox=True, format_style_elements=True).write(tree)
 
 def _format_css_component_list(content: list, in_selector=False, in_paren_block=False) -> str:
 	"""
@@ -3,19 +3,20 @@
 Defines various functions useful for image processing tasks common to epubs.
 """
 
+import io
 from pathlib import Path
 import tempfile
 import struct
 
 from html import unescape
-from typing import List, Callable, Dict
+from typing import List, Callable, Dict, Tuple
 import regex
 from PIL import Image, ImageMath, PngImagePlugin, UnidentifiedImageError
-import importlib_resources
 from lxml import etree
 
 import se
 import se.formatting
+import se.resources
 
 def _color_to_alpha(image: Image, color=None) -> Image:
 	"""
@@ -105,38 +106,77 @@ def _color_to_alpha(image: Image, color=None) -> Image:
 	return new_image
 
 # Note: We can't type hint driver, because we conditionally import selenium for performance reasons
-def render_mathml_to_png(driver, mathml: str, output_filename: Path, output_filename_2x: Path) -> None:
+def _process_mathml_screenshot(screenshot: bytes) -> Tuple[bytes, bytes]:
 	"""
-	Render a string of MathML into a transparent PNG file.
+	Turn a screenshot of rendered MathML into transparent PNG images, cropped to the MathML.
 
 	INPUTS
-	driver: A Selenium webdriver, usually initialized from se.browser.initialize_selenium_firefox_webdriver
-	mathml: A string of MathML
-	output_filename: A filename to store PNG output to
-	output_filename_2x: A filename to store hiDPI PNG output to
+	screenshot: The PNG bytes of a screenshot taken at 2x resolution
 
 	OUTPUTS
-	None.
+	A tuple of (PNG bytes, hiDPI 2x PNG bytes).
+	"""
+
+	# Save hiDPI 2x version
+	image = Image.open(io.BytesIO(screenshot))
+	image = _color_to_alpha(image, (255, 255, 255, 255))
+	image = image.crop(image.getbbox())
+	png_2x = io.BytesIO()
+	image.save(png_2x, format="PNG")
+
+	# Save normal version
+	image = image.resize((image.width // 2, image.height // 2))
+	png = io.BytesIO()
+	image.save(png, format="PNG")
+
+	return (png.getvalue(), png_2x.getvalue())
+
+def render_mathml_to_pngs(driver, mathml_list: List[str]) -> List[Tuple[bytes, bytes]]:
+	"""
+	Render a list of MathML strings into transparent PNG images, using a single page load.
+
+	INPUTS
+	driver: A Selenium webdriver, usually borrowed from se.browser.get_browser_pool()
+	mathml_list: A list of strings of MathML
+
+	OUTPUTS
+	A list of (PNG bytes, hiDPI 2x PNG bytes) tuples, in the same order as `mathml_list`.
 	"""
 
+	if not mathml_list:
+		return []
+
+	# Put each MathML string in its own block, so that we can take a screenshot of just that block
+	fragments = "".join(f"<div>{mathml}</div>" for mathml in mathml_list)
+
 	with tempfile.NamedTemporaryFile(mode="w+") as mathml_file:
-		with tempfile.NamedTemporaryFile(mode="w+", suffix=".png") as png_file:
-			mathml_file.write(f"<!doctype html><html><head><meta charset=\"utf-8\"><title>MathML fragment</title></head><body>{mathml}</body></html>")
-			mathml_file.seek(0)
+		mathml_file.write(f"<!doctype html><html><head><meta charset=\"utf-8\"><title>MathML fragments</title></head><body>{fragments}</body></html>")
+		mathml_file.seek(0)
+
+		driver.get(f"file://{mathml_file.name}")
+
+		elements = driver.find_elements_by_css_selector("body > div")
 
-			driver.get(f"file://{mathml_file.name}")
-			# We have to take a screenshot of the html element, because otherwise we screenshot the viewport, which would result in a truncated image
-			driver.find_element_by_tag_name("html").screenshot(png_file.name)
+		if len(elements) != len(mathml_list):
+			raise se.InvalidXhtmlException(f"Couldn’t render MathML: expected [text]{len(mathml_list)}[/] expressions, but found [text]{len(elements)}[/]. Is the MathML well-formed?")
 
-			# Save hiDPI 2x version
-			image = Image.open(png_file.name)
-			image = _color_to_alpha(image, (255, 255, 255, 255))
-			image = image.crop(image.getbbox())
-			image.save(output_filename_2x)
+		return [_process_mathml_screenshot(element.screenshot_as_png) for element in elements]
 
-			# Save normal version
-			image = image.resize((image.width // 2, image.height // 2))
-			image.save(output_filename)
+def render_mathml_to_png(driver, mathml: str) -> Tuple[bytes, bytes]:
+	"""
+	Render a string of MathML into transparent PNG images.
+
+	To render more than one string of MathML, use `render_mathml_to_pngs()`, which only loads one page.
+
+	INPUTS
+	driver: A Selenium webdriver, usually borrowed from se.browser.get_browser_pool()
+	mathml: A string of MathML
+
+	OUTPUTS
+	A tuple of (PNG bytes, hiDPI 2x PNG bytes).
+	"""
+
+	return render_mathml_to_pngs(driver, [mathml])[0]
 
 def remove_image_metadata(filename: Path) -> None:
 	"""
@@ -250,16 +290,7 @@ def svg_text_to_paths(in_svg: Path, out_svg: Path, remove_style=True) -> None:
 	None.
 	"""
 
-	font_paths = []
-	name_list = {"league-spartan": ["league-spartan-bold.svg"], "sorts-mill-goudy": ["sorts-mill-goudy-italic.svg", "sorts-mill-goudy.svg"]}
-	for font_family, font_names in name_list.items():
-		for font_name in font_names:
-			with importlib_resources.path(f"se.data.fonts.{font_family}", font_name) as font_path:
-				font_paths.append(font_path)
-	fonts = []
-	for font_path in font_paths:
-		font = _parse_font(font_path)
-		fonts.append(font)
+	fonts = se.resources.get_svg_fonts()
 	svg_in_raw = open(in_svg, "rt").read()
 
 	try:
@@ -541,7 +572,17 @@ def _d_apply_matrix(d_attrib: str, matrix: List) -> str:
 	shapes = [_d_apply_matrix_one_shape(shape, matrix) for shape in matches if shape]
 	return " ".join(shapes).strip()
 
-def _parse_font(font_path: Path) -> dict:
+def parse_svg_font(font_path: Path) -> dict:
+	"""
+	Parse an SVG font into a dict of its glyphs, kerning pairs, and metadata, for use by `svg_text_to_paths()`.
+
+	INPUTS
+	font_path: Path for the SVG font file
+
+	OUTPUTS
+	A dict with `glyphs`, `hkern`, and `meta` keys.
+	"""
+
 	font_svg_raw = open(font_path, "rt").read()
 	xml = etree.fromstring(str.encode(font_svg_raw))
 	font: Dict = {"glyphs": {}, "hkern": {}, "meta": {}}
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Defines a process-wide bundle of the data files the tools use over and over: compiled XSLTs, templates, parsed SVG fonts, and dictionaries.
+
+Each resource is loaded the first time it's asked for, and then shared by every caller in the process. Worker processes
+started with `fork` inherit whatever was loaded before they started, so call `preload()` before starting a process pool.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+import importlib_resources
+from lxml import etree
+
+
+SVG_FONTS = {"league-spartan": ["league-spartan-bold.svg"], "sorts-mill-goudy": ["sorts-mill-goudy-italic.svg", "sorts-mill-goudy.svg"]} # The fonts used to convert SVG text to paths, by font family
+BUILD_XSLTS = ("mathmlcontent2presentation.xsl",) # XSLTs the build uses that don't need a resolver
+BUILD_TEMPLATES = ("compatibility.css", "kindle.css", "proofreading.css") # Templates the build adds to its output
+
+_RESOURCES: Dict[Hashable, Any] = {}
+_RESOURCE_LOAD_TIMES: Dict[str, float] = {}
+_RESOURCES_LOCK = threading.RLock()
+
+def _get_resource(key: Hashable, name: str, loader: Callable[[], Any]) -> Any:
+	"""
+	Return a resource, loading it and recording how long that took if this is the first time it's been asked for.
+	"""
+
+	# Checking without the lock is safe, because entries are only ever added
+	if key in _RESOURCES:
+		return _RESOURCES[key]
+
+	with _RESOURCES_LOCK:
+		if key not in _RESOURCES:
+			start = time.perf_counter()
+			_RESOURCES[key] = loader()
+			_RESOURCE_LOAD_TIMES[name] = time.perf_counter() - start
+
+		return _RESOURCES[key]
+
+def get_template(filename: str) -> str:
+	"""
+	Return the contents of a file in `se.data.templates`.
+
+	INPUTS
+	filename: The filename of the template, like `compatibility.css`
+
+	OUTPUTS
+	A string representing the template.
+	"""
+
+	def load() -> str:
+		with importlib_resources.open_text("se.data.templates", filename, encoding="utf-8") as file:
+			return file.read()
+
+	return _get_resource(("template", filename), f"templates/{filename}", load)
+
+def get_xslt(filename: str, resolver: Optional[etree.Resolver] = None) -> etree.XSLT:
+	"""
+	Return a compiled XSLT from `se.data`.
+
+	A stylesheet resolves `document()` calls with the resolvers of the parser it was read with, so a stylesheet compiled with a
+	resolver is cached separately from the same stylesheet without one.
+
+	INPUTS
+	filename: The filename of the XSL file, like `navdoc2ncx.xsl`
+	resolver: An optional lxml resolver for the stylesheet to use
+
+	OUTPUTS
+	An lxml XSLT object.
+	"""
+
+	def load() -> etree.XSLT:
+		parser = etree.XMLParser()
+
+		if resolver:
+			parser.resolvers.add(resolver)
+
+		with importlib_resources.path("se.data", filename) as xsl_filename:
+			return etree.XSLT(etree.parse(str(xsl_filename), parser))
+
+	return _get_resource(("xslt", filename, resolver), f"xslt/{filename}", load)
+
+def get_svg_fonts() -> Tuple[Dict, ...]:
+	"""
+	Return the parsed SVG fonts used to convert SVG text to paths.
+
+	The fonts are shared, so callers must not change them.
+
+	INPUTS
+	None
+
+	OUTPUTS
+	A tuple of dicts, one for each font in SVG_FONTS, in order.
+	"""
+
+	# We import this late because se.images imports this module
+	import se.images # pylint: disable=import-outside-toplevel
+
+	fonts = []
+
+	for font_family, font_names in SVG_FONTS.items():
+		for font_name in font_names:
+			def load(font_family=font_family, font_name=font_name) -> Dict:
+				with importlib_resources.path(f"se.data.fonts.{font_family}", font_name) as font_path:
+					return se.images.parse_svg_font(font_path)
+
+			fonts.append(_get_resource(("svg-font", font_family, font_name), f"fonts/{font_name}", load))
+
+	return tuple(fonts)
+
+def get_words() -> Set[str]:
+	"""
+	Return the dictionary of English words used to modernize spelling, in lowercase.
+
+	INPUTS
+	None
+
+	OUTPUTS
+	A set of words.
+	"""
+
+	def load() -> Set[str]:
+		with importlib_resources.open_text("se.data", "words") as dictionary:
+			return {line.strip().lower() for line in dictionary}
+
+	return _get_resource("words", "words", load)
+
+def preload(xslts: Iterable[str] = (), templates: Iterable[str] = (), svg_fonts: bool = False, words: bool = False) -> None:
+	"""
+	Load resources now, so that threads and forked worker processes share them instead of loading them on demand.
+
+	INPUTS
+	xslts: The filenames of XSLTs to compile
+	templates: The filenames of templates to read
+	svg_fonts: True to parse the SVG fonts
+	words: True to read the dictionary
+
+	OUTPUTS
+	None.
+	"""
+
+	for filename in xslts:
+		get_xslt(filename)
+
+	for filename in templates:
+		get_template(filename)
+
+	if svg_fonts:
+		get_svg_fonts()
+
+	if words:
+		get_words()
+
+def get_load_times() -> Dict[str, float]:
+	"""
+	Return how long each resource loaded so far in this process took to load.
+
+	INPUTS
+	None
+
+	OUTPUTS
+	A dict of resource names, like `xslt/navdoc2ncx.xsl`, to the number of seconds it took to load them, in the order they were loaded.
+	"""
+
+	with _RESOURCES_LOCK:
+		return dict(_RESOURCE_LOAD_TIMES)
+
+def clear() -> None:
+	"""
+	Forget every loaded resource and its load time, so that they're loaded again the next time they're asked for.
+
+	INPUTS
+	None
+
+	OUTPUTS
+	None.
+	"""
+
+	with _RESOURCES_LOCK:
+		_RESOURCES.clear()
+		_RESOURCE_LOAD_TIMES.clear()
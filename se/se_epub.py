@@ -11,7 +11,7 @@ import fnmatch
 import html
 import os
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from bs4 import BeautifulSoup, Tag
 import git
@@ -91,28 +91,71 @@ class SeEpub:
 	_generated_github_repo_url = None
 	_repo = None # git.Repo object
 	_last_commit = None # GitCommit object
+	_commit = None # git.Commit object, if we're reading from a revision instead of the working tree
 	__endnotes_soup = None # bs4 soup object of the endnotes.xhtml file
 	_endnotes: Optional[List[Endnote]] = None # List of Endnote objects
 
-	def __init__(self, epub_root_directory: Union[str, Path]):
+	def __init__(self, epub_root_directory: Union[str, Path], rev: Optional[str] = None):
+		"""
+		INPUTS
+		epub_root_directory: The root directory of an SE ebook repository
+		rev: A Git revision, like a commit hash or a tag; if set, the ebook's source files are read from that commit instead of from the working tree
+		"""
+
 		try:
 			self.path = Path(epub_root_directory).resolve()
 
 			if not self.path.is_dir():
 				raise se.InvalidSeEbookException(f"Not a directory: [path][link=file://{self.path}]{self.path}[/][/].")
+		except:
+			raise se.InvalidSeEbookException(f"Not a Standard Ebooks source directory: [path][link=file://{self.path}]{self.path}[/][/].")
 
-			with open(self.path / "src" / "META-INF" / "container.xml", "r", encoding="utf-8") as file:
-				container_tree = se.easy_xml.EasyXmlTree(file.read())
-				self.metadata_file_path = self.path / "src" / container_tree.xpath("/container:container/container:rootfiles/container:rootfile[@media-type=\"application/oebps-package+xml\"]/@full-path")[0]
+		if rev:
+			try:
+				self._commit = self.repo.commit(rev)
+			except se.InvalidSeEbookException as ex:
+				raise ex
+			except Exception:
+				raise se.InvalidSeEbookException(f"Couldn’t find Git revision [text]{rev}[/] in [path][link=file://{self.path}]{self.path}[/][/].")
 
-			with open(self.metadata_file_path, "r", encoding="utf-8") as file:
-				self.metadata_xml = file.read()
+		try:
+			container_tree = se.easy_xml.EasyXmlTree(self.read_source_file("src/META-INF/container.xml"))
+			self.metadata_file_path = self.path / "src" / container_tree.xpath("/container:container/container:rootfiles/container:rootfile[@media-type=\"application/oebps-package+xml\"]/@full-path")[0]
+
+			self.metadata_xml = self.read_source_file(self.metadata_file_path.relative_to(self.path).as_posix())
 
 			if "<dc:identifier id=\"uid\">url:https://standardebooks.org/ebooks/" not in self.metadata_xml:
 				raise se.InvalidSeEbookException
 		except:
 			raise se.InvalidSeEbookException(f"Not a Standard Ebooks source directory: [path][link=file://{self.path}]{self.path}[/][/].")
 
+	@property
+	def commit(self) -> Optional[git.Commit]:
+		"""
+		Accessor
+
+		The Git commit the ebook's source files are read from, or None if they're read from the working tree.
+		"""
+
+		return self._commit
+
+	def read_source_file(self, path: str) -> str:
+		"""
+		Return the contents of a file in the ebook's repository, from the working tree or from the commit given when this object was created.
+
+		INPUTS
+		path: The path of the file relative to the repository root, like `src/epub/content.opf`
+
+		OUTPUTS
+		The contents of the file as a string
+		"""
+
+		if self._commit:
+			return (self._commit.tree / path).data_stream.read().decode("utf-8")
+
+		with open(self.path / path, "r", encoding="utf-8") as file:
+			return file.read()
+
 	@property
 	def repo(self) -> git.Repo:
 		"""
@@ -143,7 +186,7 @@ class SeEpub:
 					del os.environ['GIT_DIR']
 
 				git_command = git.cmd.Git(self.path)
-				output = git_command.show("-s", "--format=%h %ct", "HEAD").split()
+				output = git_command.show("-s", "--format=%h %ct", self._commit.hexsha if self._commit else "HEAD").split()
 
 				self._last_commit = GitCommit(output[0], datetime.datetime.fromtimestamp(int(output[1]), datetime.timezone.utc))
 			except Exception:
@@ -622,51 +665,62 @@ class SeEpub:
 				file.write(xhtml)
 				file.truncate()
 
-	def update_flesch_reading_ease(self) -> None:
+	def get_text_statistics(self) -> Dict[Path, se.formatting.TextStatistics]:
 		"""
-		Calculate a new reading ease for this ebook and update the metadata file.
+		Calculate the word, sentence, and syllable counts of each XHTML file in this ebook, in parallel.
 		Ignores SE boilerplate files like the imprint.
 
 		INPUTS
 		None
 
+		OUTPUTS
+		A dict of XHTML file paths to their TextStatistics, sorted by filename.
+		"""
+
+		filenames = se.get_target_filenames([self.path], (".xhtml",))
+
+		return dict(zip(filenames, se.formatting.get_text_statistics_for_files(filenames)))
+
+	def update_flesch_reading_ease(self, text_statistics: Optional[Dict[Path, se.formatting.TextStatistics]] = None) -> None:
+		"""
+		Calculate a new reading ease for this ebook and update the metadata file.
+		Ignores SE boilerplate files like the imprint.
+
+		INPUTS
+		text_statistics: The result of `get_text_statistics()`, if it's already been called; if None, it's called here
+
 		OUTPUTS
 		None.
 		"""
 
-		text = ""
+		if text_statistics is None:
+			text_statistics = self.get_text_statistics()
 
-		for filename in se.get_target_filenames([self.path], (".xhtml",)):
-			with open(filename, "r", encoding="utf-8") as file:
-				text += " " + file.read()
+		flesch_reading_ease = sum(text_statistics.values(), se.formatting.TextStatistics()).flesch_reading_ease
 
-		self.metadata_xml = regex.sub(r"<meta property=\"se:reading-ease\.flesch\">[^<]*</meta>", f"<meta property=\"se:reading-ease.flesch\">{se.formatting.get_flesch_reading_ease(text)}</meta>", self.metadata_xml)
+		self.metadata_xml = regex.sub(r"<meta property=\"se:reading-ease\.flesch\">[^<]*</meta>", f"<meta property=\"se:reading-ease.flesch\">{flesch_reading_ease}</meta>", self.metadata_xml)
 
 		with open(self.metadata_file_path, "w", encoding="utf-8") as file:
 			file.seek(0)
 			file.write(self.metadata_xml)
 			file.truncate()
 
-	def update_word_count(self) -> None:
+	def update_word_count(self, text_statistics: Optional[Dict[Path, se.formatting.TextStatistics]] = None) -> None:
 		"""
 		Calculate a new word count for this ebook and update the metadata file.
 		Ignores SE boilerplate files like the imprint, as well as any endnotes.
 
 		INPUTS
-		None
+		text_statistics: The result of `get_text_statistics()`, if it's already been called; if None, it's called here
 
 		OUTPUTS
 		None.
 		"""
 
-		word_count = 0
+		if text_statistics is None:
+			text_statistics = self.get_text_statistics()
 
-		for filename in se.get_target_filenames([self.path], (".xhtml",)):
-			if filename.name == "endnotes.xhtml":
-				continue
-
-			with open(filename, "r", encoding="utf-8") as file:
-				word_count += se.formatting.get_word_count(file.read())
+		word_count = sum(statistics.word_count for filename, statistics in text_statistics.items() if filename.name != "endnotes.xhtml")
 
 		self.metadata_xml = regex.sub(r"<meta property=\"se:word-count\">[^<]*</meta>", f"<meta property=\"se:word-count\">{word_count}</meta>", self.metadata_xml)
 
@@ -898,16 +952,18 @@ class SeEpub:
 
 		return lint(self, skip_lint_ignore)
 
-	def build(self, run_epubcheck: bool, build_kobo: bool, build_kindle: bool, output_directory: Path, proof: bool, build_covers: bool) -> None:
+	def build(self, run_epubcheck: bool, build_kobo: bool, build_kindle: bool, output_directory: Path, proof: bool, build_covers: bool, targets: Optional[List[str]] = None, use_cache: bool = True, compression_level: Optional[int] = None):
 		"""
 		The build() function is very big so for readability and maintainability
 		it's broken out to a separate file. Strictly speaking that file can be inlined
 		into this class.
+
+		Returns a `se.se_epub_build.BuildStats` object.
 		"""
 
 		from se.se_epub_build import build # pylint: disable=import-outside-toplevel
 
-		build(self, run_epubcheck, build_kobo, build_kindle, output_directory, proof, build_covers)
+		return build(self, run_epubcheck, build_kobo, build_kindle, output_directory, proof, build_covers, targets, use_cache, compression_level)
 
 	def generate_toc(self) -> str:
 		"""
@@ -6,19 +6,21 @@ Strictly speaking, the build() function should be a class member of SeEpub. But
 the function is very big and it makes editing easier to put it in a separate file.
 """
 
-import fnmatch
+import concurrent.futures
+import io
 import os
 import shutil
 import subprocess
 import tempfile
-from distutils.dir_util import copy_tree
+import threading
+import time
+from contextlib import contextmanager
 from hashlib import sha1
 from pathlib import Path
-from typing import List
-import importlib_resources
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+from urllib.parse import unquote
 
 from bs4 import BeautifulSoup
-from cairosvg import svg2png
 from natsort import natsorted
 from PIL import Image
 import lxml.cssselect
@@ -26,10 +28,13 @@ import lxml.etree as etree
 import regex
 
 import se
+import se.cache
 import se.easy_xml
 import se.epub
+import se.epubcheck
 import se.formatting
 import se.images
+import se.resources
 import se.typography
 from se.vendor.kobo_touch_extended import kobo
 from se.vendor.mobi import mobi
@@ -39,141 +44,711 @@ COVER_THUMBNAIL_WIDTH = int(se.COVER_WIDTH / 4) # Cast to int required for PIL
 COVER_THUMBNAIL_HEIGHT = int(se.COVER_HEIGHT / 4) # Cast to int required for PIL
 SVG_OUTER_STROKE_WIDTH = 2
 SVG_TITLEPAGE_OUTER_STROKE_WIDTH = 4
+BUILD_TARGETS = ["epub", "epub3", "kepub", "azw3"]
 ARIA_ROLES = ["afterword", "appendix", "biblioentry", "bibliography", "chapter", "colophon", "conclusion", "dedication", "epilogue", "foreword", "introduction", "noteref", "part", "preface", "prologue", "subtitle", "toc"]
 
-def build(self, run_epubcheck: bool, build_kobo: bool, build_kindle: bool, output_directory: Path, proof: bool, build_covers: bool) -> None:
+# `time.thread_time()` is Python 3.7+
+_thread_time = getattr(time, "thread_time", time.process_time)
+
+class BuildTiming:
 	"""
-	Entry point for `se build`
+	The time spent in, and the amount of work done by, one named span of a build.
+
+	CPU time is the CPU time of the thread that ran the span, so it doesn't include external programs like epubcheck.
 	"""
 
-	# Check for some required tools
-	if build_kindle:
-		which_ebook_convert = shutil.which("ebook-convert")
-		if which_ebook_convert:
-			ebook_convert_path = Path(which_ebook_convert)
-		else:
-			# Look for default Mac calibre app path if none found in path
-			ebook_convert_path = Path("/Applications/calibre.app/Contents/MacOS/ebook-convert")
-			if not ebook_convert_path.exists():
-				raise se.MissingDependencyException("Couldn’t locate [bash]ebook-convert[/]. Is [bash]calibre[/] installed?")
+	def __init__(self, name: str):
+		self.name = name
+		self.wall_time = 0.0
+		self.cpu_time = 0.0
+		self.files = 0
+		self.bytes = 0
 
-	if run_epubcheck:
-		if not shutil.which("java"):
-			raise se.MissingDependencyException("Couldn’t locate [bash]java[/]. Is it installed?")
+	def add_file(self, data: Union[str, bytes]) -> None:
+		"""
+		Count one file, with the given contents, as processed by this span.
+		"""
 
-	# Check the output directory and create it if it doesn't exist
+		self.files += 1
+		self.bytes += len(data.encode("utf-8") if isinstance(data, str) else data)
+
+	def to_dict(self) -> Dict[str, Any]:
+		"""
+		Return this timing as a dict suitable for JSON output.
+		"""
+
+		return {"name": self.name, "wall_time": round(self.wall_time, 6), "cpu_time": round(self.cpu_time, 6), "files": self.files, "bytes": self.bytes}
+
+class BuildStats:
+	"""
+	Statistics about a build, returned by `build()` so that callers can report on it.
+	"""
+
+	def __init__(self):
+		self.input_files = 0
+		self.input_bytes = 0
+		self.skipped_files = 0
+		self.skipped_bytes = 0
+		self.cache_hits = 0
+		self.cache_misses = 0
+		self.wall_time = 0.0
+		self.resource_load_times: Dict[str, float] = {}
+		self._timings: List[BuildTiming] = []
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def span(self, name: str) -> Iterator[BuildTiming]:
+		"""
+		A context manager that times a named span of the build.
+
+		Stages can run on different threads, so spans may overlap. Use `add_file()` on the yielded BuildTiming to record the work the span did.
+		"""
+
+		timing = BuildTiming(name)
+
+		with self._lock:
+			self._timings.append(timing)
+
+		wall_start = time.perf_counter()
+		cpu_start = _thread_time()
+
+		try:
+			yield timing
+		finally:
+			timing.wall_time = time.perf_counter() - wall_start
+			timing.cpu_time = _thread_time() - cpu_start
+
+	def to_dict(self) -> Dict[str, Any]:
+		"""
+		Return these statistics as a dict suitable for JSON output.
+		"""
+
+		return {"version": se.VERSION, "wall_time": round(self.wall_time, 6), "input_files": self.input_files, "input_bytes": self.input_bytes, "skipped_files": self.skipped_files, "skipped_bytes": self.skipped_bytes, "cache_hits": self.cache_hits, "cache_misses": self.cache_misses, "stages": [timing.to_dict() for timing in self.get_timings()], "resources": {name: round(load_time, 6) for name, load_time in self.resource_load_times.items()}}
+
+	def get_timings(self) -> List[BuildTiming]:
+		"""
+		Return the build's timings, with spans of the same name added together, in the order each span name first started.
+		"""
+
+		timings: Dict[str, BuildTiming] = {}
+
+		with self._lock:
+			for timing in self._timings:
+				total = timings.setdefault(timing.name, BuildTiming(timing.name))
+				total.wall_time += timing.wall_time
+				total.cpu_time += timing.cpu_time
+				total.files += timing.files
+				total.bytes += timing.bytes
+
+		return list(timings.values())
+
+class _RewriteEngine:
+	"""
+	A set of regex rewrite rules that are applied to a string in a single scan, instead of in one `regex.sub()` pass per rule.
+
+	Each rule is a pattern and a callback that takes the match, plus any extra arguments passed to `sub()`, and returns the replacement.
+	The patterns are combined into one alternation, so at each position the first rule that matches wins, and text replaced by one rule
+	is never seen by another. A rule that depends on another rule's output has to apply it in its own callback.
+
+	Patterns must use named groups that are unique across all the rules, not numbered groups.
+	"""
+
+	def __init__(self, rules: List[Tuple[str, Callable[..., str]]], flags: int = 0):
+		self._callbacks: Dict[str, Callable[..., str]] = {}
+		patterns = []
+
+		for index, (pattern, callback) in enumerate(rules):
+			self._callbacks[f"rule{index}"] = callback
+			patterns.append(f"(?P<rule{index}>{pattern})")
+
+		self._regex = regex.compile("|".join(patterns), flags)
+
+	def sub(self, string: str, *args: Any) -> str:
+		"""
+		Apply the rules to a string.
+
+		INPUTS
+		string: The string to rewrite
+		args: Extra arguments to pass to each rule's callback
+
+		OUTPUTS
+		The rewritten string.
+		"""
+
+		# The rule's own group wraps all of its named groups, so it's always the last group to close
+		return self._regex.sub(lambda match: self._callbacks[match.lastgroup](match, *args), string)
+
+def _add_aria_roles(match: regex.Match, filename: str) -> str:
+	"""
+	Add ARIA roles to an epub:type attribute.
+	"""
+
+	epub_type = match.group("roles_epub_type")
+
+	# Since we added an outlining stroke to the titlepage/publisher logo images, we
+	# want to remove the se:color-depth.black-on-transparent semantic
+	if filename in ("colophon.xhtml", "imprint.xhtml", "titlepage.xhtml"):
+		epub_type = regex.sub(r"\s*se:color-depth\.black-on-transparent\s*", "", epub_type)
+
+	# Roles are added in reverse, matching the order they came out in when each role was added directly after epub:type by its own pass
+	roles = "".join(f" role=\"doc-{role}\"" for role in reversed(ARIA_ROLES) if role in epub_type)
+
+	return f"epub:type=\"{epub_type}\"{roles}"
+
+def _add_page_break_alias(match: regex.Match) -> str:
+	"""
+	Add a page-break-* alias after a break-* declaration.
+	"""
+
+	whitespace = match.group("break_whitespace")
+	declaration = match.group("break_declaration")
+
+	# `page-break-*: page;` should be come `page-break-*: always;`
+	alias = regex.sub(r"^page-break-(before|after):\s+page;", "page-break-\\1: always;", f"page-break-{declaration}")
+
+	return f"{whitespace}break-{declaration}\t{whitespace}{alias}"
+
+def _add_hyphens_aliases(match: regex.Match) -> str:
+	"""
+	Add vendor-prefixed aliases after a hyphens declaration.
+	"""
+
+	value = match.group("hyphens_value")
+	css = f"\thyphens: {value}\n\tadobe-hyphenate: {value}\n\t-webkit-hyphens: {value}\n\t-epub-hyphens: {value}\n\t-moz-hyphens: {value}"
+	css = regex.sub(r"^\s*hyphens\s*:\s*none;", "\thyphens: none;\n\tadobe-text-layout: optimizeSpeed; /* For Nook */", css)
+
+	# A page-break-* declaration later on the same line gets its column break alias after all of the hyphens aliases
+	column_break = regex.search(r"page\-break\-(before|after|inside)\s*:\s*(.+)", value)
+	if column_break:
+		css = css + f"\n\t-webkit-column-break-{column_break.group(1)}: {column_break.group(2)} /* For Readium */"
+
+	return css
+
+# Rewrites for compatible XHTML, before we remove ARIA roles from elements they can't apply to
+_XHTML_ROLES_REWRITER = _RewriteEngine([
+	# Add ARIA roles, which are just mostly duplicate attributes to epub:type
+	(r"epub:type=\"(?P<roles_epub_type>[^\"]*)\"", _add_aria_roles),
+	# iOS renders the left-arrow-hook character as an emoji; this fixes it and forces it to render as text.
+	# See https://github.com/standardebooks/tools/issues/73
+	# See http://mts.io/2015/04/21/unicode-symbol-render-text-emoji/
+	("\u21a9", lambda match, filename: "\u21a9\ufe0e" if filename == "endnotes.xhtml" else match.group())
+])
+
+# Rewrites for compatible XHTML, after we remove ARIA roles from elements they can't apply to
+_XHTML_FOOTNOTES_REWRITER = _RewriteEngine([
+	# To get popup footnotes in iBooks, we have to change epub:endnote to epub:footnote.
+	# Remember to get our custom style selectors too.
+	(r"epub:type=\"(?P<footnote_epub_type>[^\"]*)\"", lambda match: "epub:type=\"{}\"".format(match.group("footnote_epub_type").replace("endnote", "footnote", 1))),
+	(r"class=\"(?P<footnote_class>[^\"]*)\"", lambda match: "class=\"{}\"".format(match.group("footnote_class").replace("epub-type-endnote", "epub-type-footnote", 1))),
+	# Include extra lang tag for accessibility compatibility.
+	(r"xml:lang=\"(?P<lang>[^\"]+)\"", lambda match: "lang=\"{lang}\" xml:lang=\"{lang}\"".format(lang=match.group("lang")))
+])
+
+# Rewrites for compatible CSS
+_CSS_PAGE_BREAK_REWRITER = _RewriteEngine([
+	# page-break-* is deprecated in favor of break-*. Add page-break-* aliases for compatibility in older ereaders.
+	(r"(?P<break_whitespace>\s+)break-(?P<break_declaration>.+?:\s.+?;)", _add_page_break_alias),
+	# `page-break-*: page;` should be come `page-break-*: always;`
+	(r"(?P<page_break_whitespace>\s+)page-break-(?P<page_break_side>before|after):\s+page;", lambda match: "{}page-break-{}: always;".format(match.group("page_break_whitespace"), match.group("page_break_side")))
+])
+
+# Rewrites for epub2 CSS
+_CSS_EPUB2_REWRITER = _RewriteEngine([
+	(r"(?P<column_break>page\-break\-(?P<column_break_side>before|after|inside)\s*:\s*(?P<column_break_value>.+))", lambda match: "{}\n\t-webkit-column-break-{}: {} /* For Readium */".format(match.group("column_break"), match.group("column_break_side"), match.group("column_break_value"))),
+	(r"^\s*hyphens\s*:\s*(?P<hyphens_value>.+)", _add_hyphens_aliases)
+], regex.MULTILINE)
+
+def _get_build_input_paths(self) -> List[str]:
+	"""
+	Return the build input manifest: the paths, relative to `./src/`, of the files that actually go into the epub.
+
+	That's the epub's fixed files, everything listed in the content.opf manifest, and any local files referenced by
+	<link> elements in the metadata (like onix.xml). Everything else in the repository, like `.git` or cover sources, is never read.
+	"""
+
+	paths = ["mimetype", "META-INF/container.xml", "epub/content.opf"]
+
+	for href in self.metadata_dom.xpath("/package/manifest/item/@href") + self.metadata_dom.xpath("/package/metadata/link/@href"):
+		if "://" not in href:
+			paths.append(f"epub/{unquote(href)}")
+
+	return paths
+
+class _BuildGraph:
+	"""
+	A directed acyclic graph of build stages.
+
+	Each stage is a function that receives the results of the stages it depends on as positional arguments, in the order the
+	dependencies were given. Running the graph runs only the stages that the requested targets need, and runs every stage
+	whose dependencies are satisfied concurrently.
+
+	Stages must not modify their inputs; a stage that needs to change a BuildTree it was given works on a `copy()` of it.
+	"""
+
+	def __init__(self):
+		self._stages: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+
+	def add_stage(self, name: str, function: Callable, dependencies: Tuple[str, ...] = ()) -> None:
+		"""
+		Add a stage to the graph. Dependencies must already be in the graph.
+		"""
+
+		for dependency in dependencies:
+			if dependency not in self._stages:
+				raise se.InvalidArgumentsException(f"Build stage [text]{name}[/] depends on unknown stage [text]{dependency}[/].")
+
+		self._stages[name] = (function, dependencies)
+
+	def _get_required_stages(self, targets: List[str]) -> Set[str]:
+		"""
+		Return the names of the stages needed to produce the given targets, including the targets themselves.
+		"""
+
+		required: Set[str] = set()
+		pending = list(targets)
+
+		while pending:
+			name = pending.pop()
+			if name not in required:
+				required.add(name)
+				pending.extend(self._stages[name][1])
+
+		return required
+
+	def run(self, targets: List[str]) -> Dict[str, Any]:
+		"""
+		Run the stages needed to produce the given targets.
+
+		If a stage raises an exception, stages that haven't started yet are cancelled, stages that are already running are
+		allowed to finish, and then the exception is raised.
+
+		INPUTS
+		targets: A list of stage names to run
+
+		OUTPUTS
+		A dict of stage names to the results of those stages
+		"""
+
+		required = self._get_required_stages(targets)
+		results: Dict[str, Any] = {}
+		running: Dict[concurrent.futures.Future, str] = {}
+
+		with concurrent.futures.ThreadPoolExecutor() as executor:
+			try:
+				while len(results) < len(required):
+					# Start every stage whose dependencies are done. Stages are started in the order they were added to the graph.
+					for name, (function, dependencies) in self._stages.items():
+						if name in required and name not in results and name not in running.values() and all(dependency in results for dependency in dependencies):
+							running[executor.submit(function, *[results[dependency] for dependency in dependencies])] = name
+
+					done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+					for future in done:
+						results[running.pop(future)] = future.result()
+			except BaseException:
+				for future in running:
+					future.cancel()
+				raise
+
+		return results
+
+def _write_epub(stats: BuildStats, span_name: str, build_tree: se.epub.BuildTree, output_path: Path, compression_level: Optional[int]) -> None:
+	"""
+	Zip a build tree into an epub file with the given zlib compression level, timing it as a span named `span_name`.
+	"""
+
+	with stats.span(span_name) as span:
+		se.epub.write_epub(build_tree, output_path, compression_level)
+		span.files = len(build_tree)
+		span.bytes = build_tree.size
+
+def _add_svg_outer_stroke(svg: str, stroke_width: int) -> str:
+	"""
+	Give an SVG a white stroke outside of its paths, for night mode compatibility.
+
+	INPUTS
+	svg: The SVG to add a stroke to
+	stroke_width: The width of the duplicate stroke; the visible stroke is half as wide
+
+	OUTPUTS
+	The SVG with an outer stroke.
+	"""
+
+	paths = svg
+
+	# What we're doing here is faking the `stroke-align: outside` property, which is an unsupported draft spec right now.
+	# We do this by duplicating all the SVG paths, and giving the duplicates a 2px stroke.  The originals are directly on top,
+	# so the 2px stroke becomes a 1px stroke that's *outside* of the path instead of being *centered* on the path border.
+	# This looks much nicer, but we also have to increase the image size by 2px in both directions, and re-center the whole thing.
+
+	# First, strip out non-path, non-group elements
+	paths = regex.sub(r"<\?xml[^<]+?\?>", "", paths)
+	paths = regex.sub(r"</?svg[^<]*?>", "", paths)
+	paths = regex.sub(r"<title>[^<]+?</title>", "", paths)
+	paths = regex.sub(r"<desc>[^<]+?</desc>", "", paths)
+
+	# `paths` is now our "duplicate".  Add a 2px stroke.
+	paths = paths.replace("<path", f"<path style=\"stroke: #ffffff; stroke-width: {stroke_width}px;\"")
+
+	# Inject the duplicate under the old SVG paths.  We do this by only replacing the first regex match for <g> or <path>
+	svg = regex.sub(r"(<g|<path)", f"{paths}\\1", svg, 1)
+
+	# If this SVG specifies height/width, then increase height and width by 2 pixels and translate everything by 1px
 	try:
-		output_directory = output_directory.resolve()
-		output_directory.mkdir(parents=True, exist_ok=True)
-	except Exception:
-		raise se.FileExistsException(f"Couldn’t create output directory: [path][link=file://{output_directory}]{output_directory}[/][/].")
+		height = int(regex.search(r"<svg[^>]+?height=\"([0-9]+)\"", svg).group(1)) + stroke_width
+		svg = regex.sub(r"<svg([^<]*?)height=\"[0-9]+\"", f"<svg\\1height=\"{height}\"", svg)
 
-	# All clear to start building!
-	metadata_xml = self.metadata_xml
+		width = int(regex.search(r"<svg[^>]+?width=\"([0-9]+)\"", svg).group(1)) + stroke_width
+		svg = regex.sub(r"<svg([^<]*?)width=\"[0-9]+\"", f"<svg\\1width=\"{width}\"", svg)
+
+		# Add a grouping element to translate everything over 1px
+		svg = regex.sub(r"(<g|<path)", "<g transform=\"translate({amount}, {amount})\">\n\\1".format(amount=(stroke_width / 2)), svg, 1)
+		svg = svg.replace("</svg>", "</g>\n</svg>")
+	except AttributeError:
+		# Thrown when the regex doesn't match (i.e. SVG doesn't specify height/width)
+		pass
+
+	return svg
+
+def _rasterize_svg(svg: bytes, scale: float) -> bytes:
+	"""
+	Render an SVG to a PNG.
+
+	This has to be a top-level function to be able to be called by `executor`.
+	"""
+
+	# We import this late because cairo is slow to load, and builds that don't rasterize SVGs (like previews) don't need it
+	from cairosvg import svg2png # pylint: disable=import-outside-toplevel
+
+	return svg2png(bytestring=svg, scale=scale)
+
+def _rasterize_svgs(cache: se.cache.BuildCache, svgs: Dict[str, bytes], scale: float) -> Dict[str, bytes]:
+	"""
+	Render a set of SVGs to PNGs. PNGs are reused from the build cache where possible, and the rest are rendered in parallel.
+
+	INPUTS
+	cache: The build cache
+	svgs: A dict of paths to SVG contents
+	scale: The scale to render the SVGs at
+
+	OUTPUTS
+	A dict of the same paths to PNG contents.
+	"""
+
+	keys: Dict[str, str] = {}
+	pngs: Dict[str, bytes] = {}
+	svgs_to_render: Dict[str, bytes] = {}
+
+	for path, svg in svgs.items():
+		key = cache.get_key("svg-to-png", 1, svg, str(scale))
+		keys[path] = key
+
+		if key not in pngs and key not in svgs_to_render:
+			png = cache.get(key)
+
+			# Identical SVGs are only rendered once
+			if png is None:
+				svgs_to_render[key] = svg
+			else:
+				pngs[key] = png
+
+	if len(svgs_to_render) > 1:
+		# cairosvg does most of its work in Python, so render in separate processes instead of threads
+		with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(svgs_to_render), os.cpu_count() or 1)) as executor:
+			rendered_pngs = dict(zip(svgs_to_render, executor.map(_rasterize_svg, svgs_to_render.values(), [scale] * len(svgs_to_render))))
+	else:
+		rendered_pngs = {key: _rasterize_svg(svg, scale) for key, svg in svgs_to_render.items()}
 
-	with tempfile.TemporaryDirectory() as temp_directory:
-		work_directory = Path(temp_directory)
-		work_epub_root_directory = work_directory / "src"
+	for key, png in rendered_pngs.items():
+		cache.put(key, png)
+		pngs[key] = png
 
-		copy_tree(self.path, str(work_directory))
+	return {path: pngs[key] for path, key in keys.items()}
+
+def _render_cover(stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree) -> bytes:
+	"""
+	Render the SVG cover to the JPG used by compatible builds.
+	"""
+
+	with stats.span("cover") as span:
+		if "epub/images/cover.svg" not in build_tree:
+			raise se.MissingDependencyException("Cover image is missing. Did you run [bash]se build-images[/]?")
+
+		cover = Image.open(io.BytesIO(_rasterize_svgs(cache, {"cover.svg": build_tree.read("epub/images/cover.svg")}, 1)["cover.svg"]))
+		cover = cover.convert("RGB") # Remove alpha channel from PNG if necessary
+		cover_jpg = io.BytesIO()
+		cover.save(cover_jpg, format="JPEG")
+
+		span.add_file(build_tree.read("epub/images/cover.svg"))
+
+	return cover_jpg.getvalue()
+
+def _output_covers(stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, cover_jpg: bytes, output_directory: Path) -> None:
+	"""
+	Write the cover and a cover thumbnail to the output directory, for `se build --covers`.
+	"""
+
+	with stats.span("covers"):
+		with open(output_directory / "cover.jpg", "wb") as file:
+			file.write(cover_jpg)
+
+		# The cover stage already rendered this, so it's usually in the cache
+		cover = Image.open(io.BytesIO(_rasterize_svgs(cache, {"cover.svg": build_tree.read("epub/images/cover.svg")}, 1)["cover.svg"]))
+		cover = cover.resize((COVER_THUMBNAIL_WIDTH, COVER_THUMBNAIL_HEIGHT))
+		cover = cover.convert("RGB") # Remove alpha channel from PNG if necessary
+		cover.save(output_directory / "cover-thumbnail.jpg")
+
+def _format_tree(stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, paths: List[str]) -> None:
+	"""
+	Pretty-print XML files in a build tree, in place.
+
+	Files that no stage has written since they were last formatted are skipped, and so are files that the cache knows are already
+	formatted. The rest are formatted from the cache if possible, or else in parallel.
+	"""
+
+	with stats.span("format") as span:
+		keys: Dict[str, str] = {}
+		files_to_format: Dict[str, Tuple[str, str]] = {}
+
+		for path in paths:
+			if build_tree.is_formatted(path):
+				continue
+
+			xml = build_tree.read(path)
+			suffix = Path(path).suffix
+			span.add_file(xml)
+
+			if se.formatting.is_known_formatted(cache, xml, suffix):
+				build_tree.mark_formatted(path)
+				continue
+
+			keys[path] = cache.get_key("format", 1, xml, suffix)
+			processed_xml = cache.get(keys[path])
+
+			if processed_xml is None:
+				files_to_format[path] = (xml.decode("utf-8"), suffix)
+			else:
+				build_tree.write(path, processed_xml)
+				build_tree.mark_formatted(path)
+
+		for path, processed_xml in zip(files_to_format, se.formatting.format_xml_strings(list(files_to_format.values()))):
+			xml, suffix = files_to_format[path]
+
+			# Formatting already-formatted XML doesn't change it, so remember that instead of caching a second copy
+			if processed_xml == xml:
+				se.formatting.mark_known_formatted(cache, xml, suffix)
+			else:
+				cache.put(keys[path], processed_xml.encode("utf-8"))
+				build_tree.write_text(path, processed_xml)
+
+			build_tree.mark_formatted(path)
+
+def _simplify_xhtml_css(xhtml: str, selectors: List[str], filename: Path) -> str:
+	"""
+	Add classes to the elements of an XHTML file that match the CSS selectors we simplified, and convert <abbr> elements to <span> elements.
+
+	INPUTS
+	xhtml: The XHTML to simplify
+	selectors: The selectors from the ebook's original CSS
+	filename: The path of the XHTML file, for error messages
+
+	OUTPUTS
+	The simplified XHTML.
+	"""
+
+	# The file is parsed once; classes are added and elements renamed in the tree, and the tree is serialized once at the end.
+
+	# We have to remove the default namespace declaration from our document, otherwise
+	# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
+	unnamespaced_xhtml = xhtml.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")
+
+	try:
+		tree = etree.fromstring(str.encode(unnamespaced_xhtml))
+	except Exception as ex:
+		raise se.InvalidXhtmlException(f"Error parsing XHTML file: [path][link=file://{filename}]{filename}[/][/]. Exception: {ex}")
+
+	# Now iterate over each CSS selector and see if it's used in any of the files we found
+	for selector in selectors:
 		try:
-			shutil.rmtree(work_directory / ".git")
-		except Exception:
+			# Add classes to elements that match any of our selectors to simplify. For example, if we select :first-child, add a "first-child" class to all elements that match that.
+			for selector_to_simplify in se.SELECTORS_TO_SIMPLIFY:
+				while selector_to_simplify in selector:
+					# Potentially the pseudoclass we’ll simplify isn’t at the end of the selector,
+					# so we need to temporarily remove the trailing part to target the right elements.
+					split_selector = regex.split(fr"({selector_to_simplify}(\(.*?\))?)", selector, 1)
+					target_element_selector = ''.join(split_selector[0:2])
+
+					replacement_class = split_selector[1].replace(":", "").replace("(", "-").replace("n-", "n-minus-").replace("n+", "n-plus-").replace(")", "")
+					selector = selector.replace(split_selector[1], "." + replacement_class, 1)
+					sel = se.easy_xml.css_selector(target_element_selector)
+					for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
+						current_class = element.get("class")
+						if current_class is not None and replacement_class not in current_class:
+							current_class = current_class + " " + replacement_class
+						else:
+							current_class = replacement_class
+
+						element.set("class", current_class)
+
+		except lxml.cssselect.ExpressionError:
+			# This gets thrown if we use pseudo-elements, which lxml doesn't support
 			pass
+		except lxml.cssselect.SelectorSyntaxError as ex:
+			raise se.InvalidCssException(f"Couldn’t parse CSS in or near this line: [css]{selector}[/]. Exception: {ex}")
 
-		# By convention the ASIN is set to the SHA-1 sum of the book's identifying URL
+		# We've already replaced attribute/namespace selectors with classes in the CSS, now add those classes to the matching elements
+		if "[epub|type" in selector:
+			for namespace_selector in regex.findall(r"\[epub\|type\~\=\"[^\"]*?\"\]", selector):
+				sel = se.easy_xml.css_selector(namespace_selector)
+
+				for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
+					new_class = regex.sub(r"^\.", "", se.formatting.namespace_to_class(namespace_selector))
+					current_class = element.get("class", "")
+
+					if new_class not in current_class:
+						current_class = f"{current_class} {new_class}".strip()
+						element.set("class", current_class)
+
+	# Now that every class is in place, convert <abbr> elements styled by CSS to <span> elements.
+	# We rename them in the tree, so later selectors match against the renamed elements.
+	for selector in selectors:
 		try:
-			identifier = self.metadata_dom.xpath("//dc:identifier")[0].inner_xml().replace("url:", "")
-			asin = sha1(identifier.encode("utf-8")).hexdigest()
-		except:
-			raise se.InvalidSeEbookException(f"Missing [xml]<dc:identifier>[/] element in [path][link=file://{self.metadata_file_path}]{self.metadata_file_path}[/][/].")
-
-		if not self.metadata_dom.xpath("//dc:title"):
-			raise se.InvalidSeEbookException(f"Missing [xml]<dc:title>[/] element in [path][link=file://{self.metadata_file_path}]{self.metadata_file_path}[/][/].")
-
-		output_filename = identifier.replace("https://standardebooks.org/ebooks/", "").replace("/", "_")
-		url_author = ""
-		for author in self.metadata_dom.xpath("//dc:creator"):
-			url_author = url_author + se.formatting.make_url_safe(author.inner_xml()) + "_"
-
-		url_author = url_author.rstrip("_")
-
-		epub_output_filename = f"{output_filename}{'.proof' if proof else ''}.epub"
-		epub3_output_filename = f"{output_filename}{'.proof' if proof else ''}.epub3"
-		kobo_output_filename = f"{output_filename}{'.proof' if proof else ''}.kepub.epub"
-		kindle_output_filename = f"{output_filename}{'.proof' if proof else ''}.azw3"
-
-		# Clean up old output files if any
-		se.quiet_remove(output_directory / f"thumbnail_{asin}_EBOK_portrait.jpg")
-		se.quiet_remove(output_directory / "cover.jpg")
-		se.quiet_remove(output_directory / "cover-thumbnail.jpg")
-		se.quiet_remove(output_directory / epub_output_filename)
-		se.quiet_remove(output_directory / epub3_output_filename)
-		se.quiet_remove(output_directory / kobo_output_filename)
-		se.quiet_remove(output_directory / kindle_output_filename)
-
-		# Are we including proofreading CSS?
-		if proof:
-			with open(work_epub_root_directory / "epub" / "css" / "local.css", "a", encoding="utf-8") as local_css_file:
-				with importlib_resources.open_text("se.data.templates", "proofreading.css", encoding="utf-8") as proofreading_css_file:
-					local_css_file.write(proofreading_css_file.read())
-
-		# Update the release date in the metadata and colophon
-		if self.last_commit:
-			last_updated_iso = regex.sub(r"\.[0-9]+$", "", self.last_commit.timestamp.isoformat()) + "Z"
-			last_updated_iso = regex.sub(r"\+.+?Z$", "Z", last_updated_iso)
-			# In the line below, we can't use %l (unpadded 12 hour clock hour) because it isn't portable to Windows.
-			# Instead we use %I (padded 12 hour clock hour) and then do a string replace to remove leading zeros.
-			last_updated_friendly = f"{self.last_commit.timestamp:%B %e, %Y, %I:%M <abbr class=\"time eoc\">%p</abbr>}".replace(" 0", " ")
-			last_updated_friendly = regex.sub(r"\s+", " ", last_updated_friendly).replace("AM", "a.m.").replace("PM", "p.m.").replace(" <abbr", " <abbr")
-
-			# Set modified date in content.opf
-			self.metadata_xml = regex.sub(r"<meta property=\"dcterms:modified\">[^<]+?</meta>", f"<meta property=\"dcterms:modified\">{last_updated_iso}</meta>", self.metadata_xml)
-
-			with open(work_epub_root_directory / "epub" / "content.opf", "w", encoding="utf-8") as file:
-				file.seek(0)
-				file.write(self.metadata_xml)
-				file.truncate()
-
-			# Update the colophon with release info
-			with open(work_epub_root_directory / "epub" / "text" / "colophon.xhtml", "r+", encoding="utf-8") as file:
-				xhtml = file.read()
-
-				xhtml = xhtml.replace("<p>The first edition of this ebook was released on<br/>", f"<p>This edition was released on<br/>\n\t\t\t<b>{last_updated_friendly}</b><br/>\n\t\t\tand is based on<br/>\n\t\t\t<b>revision {self.last_commit.short_sha}</b>.<br/>\n\t\t\tThe first edition of this ebook was released on<br/>")
-
-				file.seek(0)
-				file.write(xhtml)
-				file.truncate()
-
-		# Output the pure epub3 file
-		se.epub.write_epub(work_epub_root_directory, output_directory / epub3_output_filename)
-
-		# Now add epub2 compatibility.
+			sel = se.easy_xml.css_selector(selector)
+		except lxml.cssselect.ExpressionError:
+			# This gets thrown if we use pseudo-elements, which lxml doesn't support
+			continue
+		except lxml.cssselect.SelectorSyntaxError as ex:
+			raise se.InvalidCssException(f"Couldn’t parse CSS in or near this line: [css]{selector}[/]. Exception: {ex}")
+
+		if "abbr" in selector:
+			for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
+				for abbr in element.iter("abbr"):
+					abbr.tag = "span"
+
+	# Now we just remove all stray abbr tags that were not styled by CSS, keeping their contents
+	etree.strip_tags(tree, "abbr")
 
+	# Remove datetime="" attribute in <time> tags, which is not always understood by epubcheck
+	for element in tree.xpath("//*[@datetime]"):
+		if element.get("datetime"):
+			del element.attrib["datetime"]
+
+	processed_xhtml = "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n" + etree.tostring(tree, encoding=str, pretty_print=True)
+
+	if processed_xhtml != unnamespaced_xhtml:
+		return processed_xhtml.replace("<html", "<html xmlns=\"http://www.w3.org/1999/xhtml\"")
+
+	return xhtml
+
+
+def _make_xhtml_compatible(xhtml: str, filename: str) -> str:
+	"""
+	Make the compatibility replacements every non-epub3 build needs in an XHTML file: presentational MathML, ARIA roles, footnotes instead of endnotes, and so on.
+
+	INPUTS
+	xhtml: The XHTML to make compatible
+	filename: The filename of the XHTML file, like `endnotes.xhtml`
+
+	OUTPUTS
+	The compatible XHTML.
+	"""
+
+	processed_xhtml = xhtml
+
+	# Check if there's any MathML to convert.
+	# We expect MathML to be the "content" type (versus the "presentational" type).
+	# We use an XSL transform to convert from "content" to "presentational" MathML.
+	# If we start with presentational, then nothing will be changed.
+	# Kobo supports presentational MathML. After we build kobo, we convert the presentational MathML to PNG for the rest of the builds.
+	for line in regex.findall(r"<(?:m:)?math[^>]*?>(.+?)</(?:m:)?math>", processed_xhtml, flags=regex.DOTALL):
+		mathml_content_tree = se.easy_xml.EasyXhtmlTree("<?xml version=\"1.0\" encoding=\"utf-8\"?><math xmlns=\"http://www.w3.org/1998/Math/MathML\">{}</math>".format(regex.sub(r"<(/?)m:", "<\\1", line)))
+
+		# Transform the mathml and get a string representation
+		# XSLT comes from https://github.com/fred-wang/webextension-content-mathml-polyfill
+		mathml_presentation_tree = se.resources.get_xslt("mathmlcontent2presentation.xsl")(mathml_content_tree.etree)
+		mathml_presentation_xhtml = etree.tostring(mathml_presentation_tree, encoding="unicode", pretty_print=True, with_tail=False).strip()
+
+		# Plop our string back in to the XHTML we're processing
+		processed_xhtml = regex.sub(r"<(?:m:)?math[^>]*?>\{}\</(?:m:)?math>".format(regex.escape(line)), mathml_presentation_xhtml, processed_xhtml, flags=regex.MULTILINE)
+
+	# Add ARIA roles, remove the se:color-depth.black-on-transparent semantic, and fix endnote backlinks for iOS
+	processed_xhtml = _XHTML_ROLES_REWRITER.sub(processed_xhtml, filename)
+
+	# Some ARIA roles can't apply to some elements.
+	# For example, epilogue can't apply to <article>
+	processed_xhtml = regex.sub(r"<article ([^>]*?)role=\"doc-epilogue\"", "<article \\1", processed_xhtml)
+
+	if filename == "toc.xhtml":
+		landmarks_xhtml = regex.findall(r"<nav epub:type=\"landmarks\">.*?</nav>", processed_xhtml, flags=regex.DOTALL)
+		landmarks_xhtml = regex.sub(r" role=\"doc-.*?\"", "", landmarks_xhtml[0])
+		processed_xhtml = regex.sub(r"<nav epub:type=\"landmarks\">.*?</nav>", landmarks_xhtml, processed_xhtml, flags=regex.DOTALL)
+
+	# But, remove ARIA roles we added to h# tags, because tyically those roles are for sectioning content.
+	# For example, we might have an h2 that is both a title and dedication. But ARIA can't handle it being a dedication.
+	# See The Man Who Was Thursday by G K Chesterton
+	processed_xhtml = regex.sub(r"(<h[1-6] [^>]*) role=\".*?\">", "\\1>", processed_xhtml)
+
+	# Google Play Books chokes on https XML namespace identifiers (as of at least 2017-07)
+	processed_xhtml = processed_xhtml.replace("https://standardebooks.org/vocab/1.0", "http://standardebooks.org/vocab/1.0")
+
+	# We converted svgs to pngs, so replace references
+	processed_xhtml = processed_xhtml.replace("cover.svg", "cover.jpg")
+	processed_xhtml = processed_xhtml.replace(".svg", ".png")
+
+	# Change endnotes to footnotes for iBooks, and include an extra lang attribute for accessibility
+	processed_xhtml = _XHTML_FOOTNOTES_REWRITER.sub(processed_xhtml)
+
+	# Typography: replace double and triple em dash characters with extra em dashes.
+	processed_xhtml = processed_xhtml.replace("⸺", f"—{se.WORD_JOINER}—")
+	processed_xhtml = processed_xhtml.replace("⸻", f"—{se.WORD_JOINER}—{se.WORD_JOINER}—")
+
+	# Typography: replace some other less common characters.
+	processed_xhtml = processed_xhtml.replace("⅒", "1/10")
+	processed_xhtml = processed_xhtml.replace("℅", "c/o")
+	processed_xhtml = processed_xhtml.replace("✗", "×")
+	processed_xhtml = processed_xhtml.replace(" ", f"{se.NO_BREAK_SPACE}{se.NO_BREAK_SPACE}") # em-space to two nbsps
+
+	# Many e-readers don't support the word joiner character (U+2060).
+	# They DO, however, support the now-deprecated zero-width non-breaking space (U+FEFF)
+	# For epubs, do this replacement.  Kindle now seems to handle everything fortunately.
+	processed_xhtml = processed_xhtml.replace(se.WORD_JOINER, se.ZERO_WIDTH_SPACE)
+
+	# Some minor code style cleanup
+	processed_xhtml = processed_xhtml.replace(" >", ">")
+	processed_xhtml = regex.sub(r"""\s*epub:type=""\s*""", "", processed_xhtml)
+
+	return processed_xhtml
+
+
+def _build_compatibility_tree(self, stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, metadata_xml: str, cover_jpg: bytes) -> Tuple[se.epub.BuildTree, str]:
+	"""
+	Apply the compatibility changes that every non-epub3 build shares: simplified CSS, PNG images instead of SVGs, ARIA roles, and so on.
+
+	OUTPUTS
+	A tuple of (the compatible BuildTree, the compatible content.opf metadata).
+	"""
+
+	build_tree = build_tree.copy()
+
+	with stats.span("css-simplification") as span:
 		# Include compatibility CSS
-		with open(work_epub_root_directory / "epub" / "css" / "core.css", "a", encoding="utf-8") as core_css_file:
-			with importlib_resources.open_text("se.data.templates", "compatibility.css", encoding="utf-8") as compatibility_css_file:
-				core_css_file.write(compatibility_css_file.read())
+		build_tree.write_text("epub/css/core.css", build_tree.read_text("epub/css/core.css") + se.resources.get_template("compatibility.css"))
 
 		# Simplify CSS and tags
 		total_css = ""
 
 		# Simplify the CSS first.  Later we'll update the document to match our simplified selectors.
 		# While we're doing this, we store the original css into a single variable so we can extract the original selectors later.
-		for root, _, filenames in os.walk(work_epub_root_directory):
-			for filename_string in fnmatch.filter(filenames, "*.css"):
-				filename = Path(root) / filename_string
-				with open(filename, "r+", encoding="utf-8") as file:
-					css = file.read()
+		for path in build_tree.paths((".css",)):
+			css = build_tree.read_text(path)
+			span.add_file(css)
 
-					# Before we do anything, we process a special case in core.css
-					if filename.name == "core.css":
-						css = regex.sub(r"abbr{.+?}", "", css, flags=regex.DOTALL)
+			# Before we do anything, we process a special case in core.css
+			if Path(path).name == "core.css":
+				css = regex.sub(r"abbr{.+?}", "", css, flags=regex.DOTALL)
 
-					total_css = total_css + css + "\n"
-					file.seek(0)
-					file.write(se.formatting.simplify_css(css))
-					file.truncate()
+			total_css = total_css + css + "\n"
+			build_tree.write_text(path, se.formatting.simplify_css(css))
 
 		# Now get a list of original selectors
 		# Remove @supports(){}
@@ -191,762 +766,796 @@ def build(self, run_epubcheck: bool, build_kobo: bool, build_kindle: bool, outpu
 		# Remove @ defines
 		total_css = regex.sub(r"^@.+", "", total_css, flags=regex.MULTILINE)
 
-		# Construct a dictionary of the original selectors
-		selectors = {line for line in total_css.splitlines() if line != ""}
+		# Construct a list of the original selectors. Sort it so that the simplified XHTML, and its cache key, don't depend on set order.
+		selectors = sorted({line for line in total_css.splitlines() if line != ""})
 
 		# Get a list of .xhtml files to simplify
-		for root, _, filenames in os.walk(work_epub_root_directory):
-			for filename_string in fnmatch.filter(filenames, "*.xhtml"):
-				filename = (Path(root) / filename_string).resolve()
-
-				# Don't mess with the ToC, since if we have ol/li > first-child selectors we could screw it up
-				if filename.name == "toc.xhtml":
-					continue
-
-				with open(filename, "r+", encoding="utf-8") as file:
-					# We have to remove the default namespace declaration from our document, otherwise
-					# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
-					xhtml = file.read().replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")
-					processed_xhtml = xhtml
-					try:
-						tree = etree.fromstring(str.encode(xhtml))
-					except Exception as ex:
-						raise se.InvalidXhtmlException(f"Error parsing XHTML file: [path][link=file://{filename}]{filename}[/][/]. Exception: {ex}")
-
-					# Now iterate over each CSS selector and see if it's used in any of the files we found
-					for selector in selectors:
-						try:
-							# Add classes to elements that match any of our selectors to simplify. For example, if we select :first-child, add a "first-child" class to all elements that match that.
-							for selector_to_simplify in se.SELECTORS_TO_SIMPLIFY:
-								while selector_to_simplify in selector:
-									# Potentially the pseudoclass we’ll simplify isn’t at the end of the selector,
-									# so we need to temporarily remove the trailing part to target the right elements.
-									split_selector = regex.split(fr"({selector_to_simplify}(\(.*?\))?)", selector, 1)
-									target_element_selector = ''.join(split_selector[0:2])
-
-									replacement_class = split_selector[1].replace(":", "").replace("(", "-").replace("n-", "n-minus-").replace("n+", "n-plus-").replace(")", "")
-									selector = selector.replace(split_selector[1], "." + replacement_class, 1)
-									sel = se.easy_xml.css_selector(target_element_selector)
-									for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
-										current_class = element.get("class")
-										if current_class is not None and replacement_class not in current_class:
-											current_class = current_class + " " + replacement_class
-										else:
-											current_class = replacement_class
-
-										element.set("class", current_class)
-
-						except lxml.cssselect.ExpressionError:
-							# This gets thrown if we use pseudo-elements, which lxml doesn't support
-							pass
-						except lxml.cssselect.SelectorSyntaxError as ex:
-							raise se.InvalidCssException(f"Couldn’t parse CSS in or near this line: [css]{selector}[/]. Exception: {ex}")
-
-						# We've already replaced attribute/namespace selectors with classes in the CSS, now add those classes to the matching elements
-						if "[epub|type" in selector:
-							for namespace_selector in regex.findall(r"\[epub\|type\~\=\"[^\"]*?\"\]", selector):
-								sel = se.easy_xml.css_selector(namespace_selector)
-
-								for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
-									new_class = regex.sub(r"^\.", "", se.formatting.namespace_to_class(namespace_selector))
-									current_class = element.get("class", "")
-
-									if new_class not in current_class:
-										current_class = f"{current_class} {new_class}".strip()
-										element.set("class", current_class)
-
-					processed_xhtml = "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n" + etree.tostring(tree, encoding=str, pretty_print=True)
-
-					# We do this round in a second pass because if we modify the tree like this, it screws up how lxml does processing later.
-					# If it's all done in one pass, we wind up in a race condition where some elements are fixed and some not
-					tree = etree.fromstring(str.encode(processed_xhtml))
-
-					for selector in selectors:
-						try:
-							sel = se.easy_xml.css_selector(selector)
-						except lxml.cssselect.ExpressionError:
-							# This gets thrown if we use pseudo-elements, which lxml doesn't support
-							continue
-						except lxml.cssselect.SelectorSyntaxError as ex:
-							raise se.InvalidCssException(f"Couldn’t parse CSS in or near this line: [css]{selector}[/]. Exception: {ex}")
-
-						# Convert <abbr> to <span>
-						if "abbr" in selector:
-							for element in tree.xpath(sel.path, namespaces=se.XHTML_NAMESPACES):
-								# Why would you want the tail to output by default?!?
-								raw_string = etree.tostring(element, encoding=str, with_tail=False)
-
-								# lxml--crap as usual--includes a bunch of namespace information in every element we print.
-								# Remove it here.
-								raw_string = raw_string.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")
-								raw_string = raw_string.replace(" xmlns:epub=\"http://www.idpf.org/2007/ops\"", "")
-								raw_string = raw_string.replace(" xmlns:m=\"http://www.w3.org/1998/Math/MathML\"", "")
-
-								# Now lxml doesn't let us modify the tree, so we just do a straight up regex replace to turn this into a span
-								processed_string = raw_string.replace("<abbr", "<span")
-								processed_string = processed_string.replace("</abbr", "</span")
-
-								# Now we have a nice, fixed string.  But, since lxml can't replace elements, we write it ourselves.
-								processed_xhtml = processed_xhtml.replace(raw_string, processed_string)
-
-								tree = etree.fromstring(str.encode(processed_xhtml))
-
-					# Now we just remove all stray abbr tags that were not styled by CSS
-					processed_xhtml = regex.sub(r"</?abbr[^>]*?>", "", processed_xhtml)
-
-					# Remove datetime="" attribute in <time> tags, which is not always understood by epubcheck
-					processed_xhtml = regex.sub(r" datetime=\"[^\"]+?\"", "", processed_xhtml)
-
-					tree = etree.fromstring(str.encode(processed_xhtml))
-
-					if processed_xhtml != xhtml:
-						file.seek(0)
-						file.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n" + etree.tostring(tree, encoding=str, pretty_print=True).replace("<html", "<html xmlns=\"http://www.w3.org/1999/xhtml\""))
-						file.truncate()
-
-		# Done simplifying CSS and tags!
-
-		# Extract cover and cover thumbnail
-		cover_svg_file = work_epub_root_directory / "epub" / "images" / "cover.svg"
-		if not os.path.isfile(cover_svg_file):
-			raise se.MissingDependencyException("Cover image is missing. Did you run [bash]se build-images[/]?")
+		for path in build_tree.paths((".xhtml",)):
+			filename = self.path / "src" / path
 
-		svg2png(url=str(cover_svg_file), write_to=str(work_directory / "cover.png"))
-		cover = Image.open(work_directory / "cover.png")
-		cover = cover.convert("RGB") # Remove alpha channel from PNG if necessary
-		cover.save(work_epub_root_directory / "epub" / "images" / "cover.jpg")
-		(work_directory / "cover.png").unlink()
-
-		if build_covers:
-			shutil.copy2(work_epub_root_directory / "epub" / "images" / "cover.jpg", output_directory / "cover.jpg")
-			shutil.copy2(cover_svg_file, output_directory / "cover-thumbnail.svg")
-			# Path arguments must be cast to string
-			svg2png(url=str(output_directory / "cover-thumbnail.svg"), write_to=str(work_directory / "cover-thumbnail.png"))
-			cover = Image.open(work_directory / "cover-thumbnail.png")
-			cover = cover.resize((COVER_THUMBNAIL_WIDTH, COVER_THUMBNAIL_HEIGHT))
-			cover = cover.convert("RGB") # Remove alpha channel from PNG if necessary
-			cover.save(output_directory / "cover-thumbnail.jpg")
-			(work_directory / "cover-thumbnail.png").unlink()
-			(output_directory / "cover-thumbnail.svg").unlink()
-
-		cover_svg_file.unlink()
-
-		# Massage image references in content.opf
-		metadata_xml = metadata_xml.replace("cover.svg", "cover.jpg")
-		metadata_xml = metadata_xml.replace(".svg", ".png")
-		metadata_xml = metadata_xml.replace("id=\"cover.jpg\" media-type=\"image/svg+xml\"", "id=\"cover.jpg\" media-type=\"image/jpeg\"")
-		metadata_xml = metadata_xml.replace("image/svg+xml", "image/png")
-		metadata_xml = regex.sub(r" properties=\"([^\"]*?)svg([^\"]*?)\"", r''' properties="\1\2"''', metadata_xml) # We may also have the `mathml` property
-		metadata_xml = regex.sub(r" properties=\"([^\s]*?)\s\"", r''' properties="\1"''', metadata_xml) # Clean up trailing white space in property attributes introduced by the above line
-		metadata_xml = regex.sub(r" properties=\"\s*\"", "", metadata_xml) # Remove any now-empty property attributes
-
-		# Add an element noting the version of the se tools that built this ebook
-		metadata_xml = regex.sub(r"<dc:publisher", f"<meta property=\"se:built-with\">{se.VERSION}</meta>\n\t\t<dc:publisher", metadata_xml)
-
-		# Google Play Books chokes on https XML namespace identifiers (as of at least 2017-07)
-		metadata_xml = metadata_xml.replace("https://standardebooks.org/vocab/1.0", "http://standardebooks.org/vocab/1.0")
-
-		# Output the modified content.opf so that we can build the kobo book before making more epub2 compatibility hacks
-		with open(work_epub_root_directory / "epub" / "content.opf", "w", encoding="utf-8") as file:
-			file.write(metadata_xml)
-			file.truncate()
-
-		# Recurse over xhtml files to make some compatibility replacements
-		for root, _, filenames in os.walk(work_epub_root_directory):
-			for filename_string in filenames:
-				filename = Path(root) / filename_string
-
-				if filename.suffix == ".svg":
-					# For night mode compatibility, give the titlepage a 1px white stroke attribute
-					if filename.name in("titlepage.svg", "logo.svg"):
-						with open(filename, "r+", encoding="utf-8") as file:
-							svg = file.read()
-							paths = svg
-
-							# What we're doing here is faking the `stroke-align: outside` property, which is an unsupported draft spec right now.
-							# We do this by duplicating all the SVG paths, and giving the duplicates a 2px stroke.  The originals are directly on top,
-							# so the 2px stroke becomes a 1px stroke that's *outside* of the path instead of being *centered* on the path border.
-							# This looks much nicer, but we also have to increase the image size by 2px in both directions, and re-center the whole thing.
-
-							if filename.name == "titlepage.svg":
-								stroke_width = SVG_TITLEPAGE_OUTER_STROKE_WIDTH
-							else:
-								stroke_width = SVG_OUTER_STROKE_WIDTH
-
-							# First, strip out non-path, non-group elements
-							paths = regex.sub(r"<\?xml[^<]+?\?>", "", paths)
-							paths = regex.sub(r"</?svg[^<]*?>", "", paths)
-							paths = regex.sub(r"<title>[^<]+?</title>", "", paths)
-							paths = regex.sub(r"<desc>[^<]+?</desc>", "", paths)
-
-							# `paths` is now our "duplicate".  Add a 2px stroke.
-							paths = paths.replace("<path", f"<path style=\"stroke: #ffffff; stroke-width: {stroke_width}px;\"")
-
-							# Inject the duplicate under the old SVG paths.  We do this by only replacing the first regex match for <g> or <path>
-							svg = regex.sub(r"(<g|<path)", f"{paths}\\1", svg, 1)
-
-							# If this SVG specifies height/width, then increase height and width by 2 pixels and translate everything by 1px
-							try:
-								height = int(regex.search(r"<svg[^>]+?height=\"([0-9]+)\"", svg).group(1)) + stroke_width
-								svg = regex.sub(r"<svg([^<]*?)height=\"[0-9]+\"", f"<svg\\1height=\"{height}\"", svg)
-
-								width = int(regex.search(r"<svg[^>]+?width=\"([0-9]+)\"", svg).group(1)) + stroke_width
-								svg = regex.sub(r"<svg([^<]*?)width=\"[0-9]+\"", f"<svg\\1width=\"{width}\"", svg)
-
-								# Add a grouping element to translate everything over 1px
-								svg = regex.sub(r"(<g|<path)", "<g transform=\"translate({amount}, {amount})\">\n\\1".format(amount=(stroke_width / 2)), svg, 1)
-								svg = svg.replace("</svg>", "</g>\n</svg>")
-							except AttributeError:
-								# Thrown when the regex doesn't match (i.e. SVG doesn't specify height/width)
-								pass
-
-							file.seek(0)
-							file.write(svg)
-							file.truncate()
-
-					# Convert SVGs to PNGs at 2x resolution
-					# Path arguments must be cast to string
-					svg2png(url=str(filename), write_to=str(filename.parent / (str(filename.stem) + ".png")), scale=2)
-					(filename).unlink()
-
-				if filename.suffix == ".xhtml":
-					with open(filename, "r+", encoding="utf-8") as file:
-						xhtml = file.read()
-						processed_xhtml = xhtml
-
-						# Check if there's any MathML to convert.
-						# We expect MathML to be the "content" type (versus the "presentational" type).
-						# We use an XSL transform to convert from "content" to "presentational" MathML.
-						# If we start with presentational, then nothing will be changed.
-						# Kobo supports presentational MathML. After we build kobo, we convert the presentational MathML to PNG for the rest of the builds.
-						mathml_transform = None
-						for line in regex.findall(r"<(?:m:)?math[^>]*?>(.+?)</(?:m:)?math>", processed_xhtml, flags=regex.DOTALL):
-							mathml_content_tree = se.easy_xml.EasyXhtmlTree("<?xml version=\"1.0\" encoding=\"utf-8\"?><math xmlns=\"http://www.w3.org/1998/Math/MathML\">{}</math>".format(regex.sub(r"<(/?)m:", "<\\1", line)))
-
-							# Initialize the transform object, if we haven't yet
-							if not mathml_transform:
-								with importlib_resources.path("se.data", "mathmlcontent2presentation.xsl") as mathml_xsl_filename:
-									mathml_transform = etree.XSLT(etree.parse(str(mathml_xsl_filename)))
-
-							# Transform the mathml and get a string representation
-							# XSLT comes from https://github.com/fred-wang/webextension-content-mathml-polyfill
-							mathml_presentation_tree = mathml_transform(mathml_content_tree.etree)
-							mathml_presentation_xhtml = etree.tostring(mathml_presentation_tree, encoding="unicode", pretty_print=True, with_tail=False).strip()
-
-							# Plop our string back in to the XHTML we're processing
-							processed_xhtml = regex.sub(r"<(?:m:)?math[^>]*?>\{}\</(?:m:)?math>".format(regex.escape(line)), mathml_presentation_xhtml, processed_xhtml, flags=regex.MULTILINE)
-
-						if filename.name == "endnotes.xhtml":
-							# iOS renders the left-arrow-hook character as an emoji; this fixes it and forces it to render as text.
-							# See https://github.com/standardebooks/tools/issues/73
-							# See http://mts.io/2015/04/21/unicode-symbol-render-text-emoji/
-							processed_xhtml = processed_xhtml.replace("\u21a9", "\u21a9\ufe0e")
-
-						# Since we added an outlining stroke to the titlepage/publisher logo images, we
-						# want to remove the se:color-depth.black-on-transparent semantic
-						if filename.name in ("colophon.xhtml", "imprint.xhtml", "titlepage.xhtml"):
-							processed_xhtml = regex.sub(r"\s*se:color-depth\.black-on-transparent\s*", "", processed_xhtml)
-
-						# Add ARIA roles, which are just mostly duplicate attributes to epub:type
-						for role in ARIA_ROLES:
-							processed_xhtml = regex.sub(fr"(epub:type=\"[^\"]*?{role}[^\"]*?\")", f"\\1 role=\"doc-{role}\"", processed_xhtml)
-
-						# Some ARIA roles can't apply to some elements.
-						# For example, epilogue can't apply to <article>
-						processed_xhtml = regex.sub(r"<article ([^>]*?)role=\"doc-epilogue\"", "<article \\1", processed_xhtml)
-
-						if filename.name == "toc.xhtml":
-							landmarks_xhtml = regex.findall(r"<nav epub:type=\"landmarks\">.*?</nav>", processed_xhtml, flags=regex.DOTALL)
-							landmarks_xhtml = regex.sub(r" role=\"doc-.*?\"", "", landmarks_xhtml[0])
-							processed_xhtml = regex.sub(r"<nav epub:type=\"landmarks\">.*?</nav>", landmarks_xhtml, processed_xhtml, flags=regex.DOTALL)
-
-						# But, remove ARIA roles we added to h# tags, because tyically those roles are for sectioning content.
-						# For example, we might have an h2 that is both a title and dedication. But ARIA can't handle it being a dedication.
-						# See The Man Who Was Thursday by G K Chesterton
-						processed_xhtml = regex.sub(r"(<h[1-6] [^>]*) role=\".*?\">", "\\1>", processed_xhtml)
-
-						# Google Play Books chokes on https XML namespace identifiers (as of at least 2017-07)
-						processed_xhtml = processed_xhtml.replace("https://standardebooks.org/vocab/1.0", "http://standardebooks.org/vocab/1.0")
-
-						# We converted svgs to pngs, so replace references
-						processed_xhtml = processed_xhtml.replace("cover.svg", "cover.jpg")
-						processed_xhtml = processed_xhtml.replace(".svg", ".png")
-
-						# To get popup footnotes in iBooks, we have to change epub:endnote to epub:footnote.
-						# Remember to get our custom style selectors too.
-						processed_xhtml = regex.sub(r"epub:type=\"([^\"]*?)endnote([^\"]*?)\"", "epub:type=\"\\1footnote\\2\"", processed_xhtml)
-						processed_xhtml = regex.sub(r"class=\"([^\"]*?)epub-type-endnote([^\"]*?)\"", "class=\"\\1epub-type-footnote\\2\"", processed_xhtml)
-
-						# Include extra lang tag for accessibility compatibility.
-						processed_xhtml = regex.sub(r"xml:lang\=\"([^\"]+?)\"", "lang=\"\\1\" xml:lang=\"\\1\"", processed_xhtml)
-
-						# Typography: replace double and triple em dash characters with extra em dashes.
-						processed_xhtml = processed_xhtml.replace("⸺", f"—{se.WORD_JOINER}—")
-						processed_xhtml = processed_xhtml.replace("⸻", f"—{se.WORD_JOINER}—{se.WORD_JOINER}—")
-
-						# Typography: replace some other less common characters.
-						processed_xhtml = processed_xhtml.replace("⅒", "1/10")
-						processed_xhtml = processed_xhtml.replace("℅", "c/o")
-						processed_xhtml = processed_xhtml.replace("✗", "×")
-						processed_xhtml = processed_xhtml.replace(" ", f"{se.NO_BREAK_SPACE}{se.NO_BREAK_SPACE}") # em-space to two nbsps
-
-						# Many e-readers don't support the word joiner character (U+2060).
-						# They DO, however, support the now-deprecated zero-width non-breaking space (U+FEFF)
-						# For epubs, do this replacement.  Kindle now seems to handle everything fortunately.
-						processed_xhtml = processed_xhtml.replace(se.WORD_JOINER, se.ZERO_WIDTH_SPACE)
-
-						# Some minor code style cleanup
-						processed_xhtml = processed_xhtml.replace(" >", ">")
-						processed_xhtml = regex.sub(r"""\s*epub:type=""\s*""", "", processed_xhtml)
-
-						if processed_xhtml != xhtml:
-							file.seek(0)
-							file.write(processed_xhtml)
-							file.truncate()
-
-				if filename.suffix == ".css":
-					with open(filename, "r+", encoding="utf-8") as file:
-						css = file.read()
-						processed_css = css
-
-						# To get popup footnotes in iBooks, we have to change epub:endnote to epub:footnote.
-						# Remember to get our custom style selectors too.
-						processed_css = processed_css.replace("endnote", "footnote")
-
-						# page-break-* is deprecated in favor of break-*. Add page-break-* aliases for compatibility in older ereaders.
-						processed_css = regex.sub(r"(\s+)break-(.+?:\s.+?;)", "\\1break-\\2\t\\1page-break-\\2", processed_css)
-
-						# `page-break-*: page;` should be come `page-break-*: always;`
-						processed_css = regex.sub(r"(\s+)page-break-(before|after):\s+page;", "\\1page-break-\\2: always;", processed_css)
-
-						if processed_css != css:
-							file.seek(0)
-							file.write(processed_css)
-							file.truncate()
-
-		if build_kobo:
-			with tempfile.TemporaryDirectory() as temp_directory:
-				kobo_work_directory = Path(temp_directory)
-				copy_tree(str(work_epub_root_directory), str(kobo_work_directory))
-
-				for root, _, filenames in os.walk(kobo_work_directory):
-					# Add a note to content.opf indicating this is a transform build
-					for filename_string in fnmatch.filter(filenames, "content.opf"):
-						with open(Path(root) / filename_string, "r+", encoding="utf-8") as file:
-							xhtml = file.read()
-
-							xhtml = regex.sub(r"<dc:publisher", "<meta property=\"se:transform\">kobo</meta>\n\t\t<dc:publisher", xhtml)
-
-							file.seek(0)
-							file.write(xhtml)
-							file.truncate()
-
-					# Kobo .kepub files need each clause wrapped in a special <span> tag to enable highlighting.
-					# Do this here. Hopefully Kobo will get their act together soon and drop this requirement.
-					for filename_string in fnmatch.filter(filenames, "*.xhtml"):
-						kobo.paragraph_counter = 1
-						kobo.segment_counter = 1
+			# Don't mess with the ToC, since if we have ol/li > first-child selectors we could screw it up
+			if filename.name == "toc.xhtml":
+				continue
 
-						filename = (Path(root) / filename_string).resolve()
-
-						# Don't add spans to the ToC
-						if filename.name == "toc.xhtml":
-							continue
-
-						with open(filename, "r+", encoding="utf-8") as file:
-							xhtml = file.read()
-
-							# Note: Kobo supports CSS hyphenation, but it can be improved with soft hyphens.
-							# However we can't insert them, because soft hyphens break the dictionary search when
-							# a word is highlighted.
+			xhtml = build_tree.read_text(path)
+			span.add_file(xhtml)
+			processed_xhtml = cache.apply("css-simplification", 2, lambda xhtml: _simplify_xhtml_css(xhtml, selectors, filename), xhtml, *selectors)
 
-							# Kobos don't have fonts that support the ↩ character in endnotes, so replace it with ←
-							if filename.name == "endnotes.xhtml":
-								# Note that we replaced ↩ with \u21a9\ufe0e in an earlier iOS compatibility fix
-								xhtml = regex.sub(r"epub:type=\"backlink\">\u21a9\ufe0e</a>", "epub:type=\"backlink\">←</a>", xhtml)
+			if processed_xhtml != xhtml:
+				build_tree.write_text(path, processed_xhtml)
 
-							# We have to remove the default namespace declaration from our document, otherwise
-							# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
-							try:
-								tree = etree.fromstring(str.encode(xhtml.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")))
-							except Exception as ex:
-								raise se.InvalidXhtmlException(f"Error parsing XHTML file: [path][link=file://{filename}]{filename}[/][/]. Exception: {ex}")
+	# Done simplifying CSS and tags!
 
-							kobo.add_kobo_spans_to_node(tree.xpath("./body", namespaces=se.XHTML_NAMESPACES)[0])
-
-							xhtml = etree.tostring(tree, encoding="unicode", pretty_print=True, with_tail=False)
-							xhtml = regex.sub(r"<html:span", "<span", xhtml)
-							xhtml = regex.sub(r"html:span>", "span>", xhtml)
-							xhtml = regex.sub(r"<span xmlns:html=\"http://www.w3.org/1999/xhtml\"", "<span", xhtml)
-							xhtml = regex.sub(r"<html", "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<html xmlns=\"http://www.w3.org/1999/xhtml\"", xhtml)
+	# Swap the SVG cover for the JPG we rendered
+	build_tree.write("epub/images/cover.jpg", cover_jpg)
+	build_tree.remove("epub/images/cover.svg")
 
-							file.seek(0)
-							file.write(xhtml)
-							file.truncate()
+	# Massage image references in content.opf
+	metadata_xml = metadata_xml.replace("cover.svg", "cover.jpg")
+	metadata_xml = metadata_xml.replace(".svg", ".png")
+	metadata_xml = metadata_xml.replace("id=\"cover.jpg\" media-type=\"image/svg+xml\"", "id=\"cover.jpg\" media-type=\"image/jpeg\"")
+	metadata_xml = metadata_xml.replace("image/svg+xml", "image/png")
+	metadata_xml = regex.sub(r" properties=\"([^\"]*?)svg([^\"]*?)\"", r''' properties="\1\2"''', metadata_xml) # We may also have the `mathml` property
+	metadata_xml = regex.sub(r" properties=\"([^\s]*?)\s\"", r''' properties="\1"''', metadata_xml) # Clean up trailing white space in property attributes introduced by the above line
+	metadata_xml = regex.sub(r" properties=\"\s*\"", "", metadata_xml) # Remove any now-empty property attributes
 
-				# All done, clean the output
-				# Note that we don't clean .xhtml files, because the way kobo spans are added means that it will screw up spaces inbetween endnotes.
-				for filepath in se.get_target_filenames([kobo_work_directory], (".svg", ".opf", ".ncx")):
-					se.formatting.format_xml_file(filepath)
+	# Add an element noting the version of the se tools that built this ebook
+	metadata_xml = regex.sub(r"<dc:publisher", f"<meta property=\"se:built-with\">{se.VERSION}</meta>\n\t\t<dc:publisher", metadata_xml)
 
-				se.epub.write_epub(kobo_work_directory, output_directory / kobo_output_filename)
+	# Google Play Books chokes on https XML namespace identifiers (as of at least 2017-07)
+	metadata_xml = metadata_xml.replace("https://standardebooks.org/vocab/1.0", "http://standardebooks.org/vocab/1.0")
 
-		# Now work on more epub2 compatibility
+	# Output the modified content.opf so that we can build the kobo book before making more epub2 compatibility hacks
+	build_tree.write_text("epub/content.opf", metadata_xml)
 
-		# Recurse over css files to make some compatibility replacements.
-		for root, _, filenames in os.walk(work_epub_root_directory):
-			for filename_string in filenames:
-				filename = Path(root) / filename_string
-
-				if filename.suffix == ".css":
-					with open(filename, "r+", encoding="utf-8") as file:
-						css = file.read()
-						processed_css = css
-
-						processed_css = regex.sub(r"(page\-break\-(before|after|inside)\s*:\s*(.+))", "\\1\n\t-webkit-column-break-\\2: \\3 /* For Readium */", processed_css)
-						processed_css = regex.sub(r"^\s*hyphens\s*:\s*(.+)", "\thyphens: \\1\n\tadobe-hyphenate: \\1\n\t-webkit-hyphens: \\1\n\t-epub-hyphens: \\1\n\t-moz-hyphens: \\1", processed_css, flags=regex.MULTILINE)
-						processed_css = regex.sub(r"^\s*hyphens\s*:\s*none;", "\thyphens: none;\n\tadobe-text-layout: optimizeSpeed; /* For Nook */", processed_css, flags=regex.MULTILINE)
-
-						if processed_css != css:
-							file.seek(0)
-							file.write(processed_css)
-							file.truncate()
-
-		# Sort out MathML compatibility
-		has_mathml = "mathml" in metadata_xml
-		if has_mathml:
-			# We import this late because we don't want to load selenium if we're not going to use it!
-			from se import browser # pylint: disable=import-outside-toplevel
-
-			# We wrap this whole thing in a try block, because we need to call
-			# driver.quit() if execution is interrupted (like by ctrl + c, or by an unhandled exception). If we don't call driver.quit(),
-			# Firefox will stay around as a zombie process even if the Python script is dead.
-			try:
-				driver = browser.initialize_selenium_firefox_webdriver()
-
-				mathml_count = 1
-				for root, _, filenames in os.walk(work_epub_root_directory):
-					for filename_string in filenames:
-						filename = Path(root) / filename_string
-						if filename.suffix == ".xhtml":
-							with open(filename, "r+", encoding="utf-8") as file:
-								xhtml = file.read()
-								processed_xhtml = xhtml
-								replaced_mathml: List[str] = []
-
-								# Check if there's MathML we want to convert
-								# We take a naive approach and use some regexes to try to simplify simple MathML expressions.
-								# For each MathML expression, if our round of regexes finishes and there is still MathML in the processed result, we abandon the attempt and render to PNG using Firefox.
-								for line in regex.findall(r"<(?:m:)?math[^>]*?>(?:.+?)</(?:m:)?math>", processed_xhtml, flags=regex.DOTALL):
-									if line not in replaced_mathml:
-										replaced_mathml.append(line) # Store converted lines to save time in case we have multiple instances of the same MathML
-										mathml_tree = se.easy_xml.EasyXhtmlTree("<?xml version=\"1.0\" encoding=\"utf-8\"?>{}".format(regex.sub(r"<(/?)m:", "<\\1", line)))
-										processed_line = line
-
-										# If the mfenced element has more than one child, they are separated by commas when rendered.
-										# This is too complex for our naive regexes to work around. So, if there is an mfenced element with more than one child, abandon the attempt.
-										if not mathml_tree.css_select("mfenced > * + *"):
-											processed_line = regex.sub(r"</?(?:m:)?math[^>]*?>", "", processed_line)
-											processed_line = regex.sub(r"<!--.+?-->", "", processed_line)
-											processed_line = regex.sub(r"<(?:m:)?mfenced/>", "()", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi)>(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "<i>\\4</i><\\2><i>\\6</i></\\2>", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi)>(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "<i>\\4</i><\\2>\\6</\\2>", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mn)>(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "\\4<\\2>\\6</\\2>", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mn)>(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "\\4<\\2><i>\\6</i></\\2>", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi) mathvariant=\"normal\">(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "\\4<\\2><i>\\6</i></\\2>", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi) mathvariant=\"normal\">(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "\\4<\\2>\\6</\\2>", processed_line)
-											processed_line = regex.sub(fr"<(?:m:)?mo>{se.FUNCTION_APPLICATION}</(?:m:)?mo>", "", processed_line, flags=regex.IGNORECASE) # The ignore case flag is required to match here with the special FUNCTION_APPLICATION character, it's unclear why
-											processed_line = regex.sub(r"<(?:m:)?mfenced><((?:m:)(?:mo|mi|mn|mrow))>(.+?)</\1></(?:m:)?mfenced>", "(<\\1>\\2</\\1>)", processed_line)
-											processed_line = regex.sub(r"<(?:m:)?mrow>([^>].+?)</(?:m:)?mrow>", "\\1", processed_line)
-											processed_line = regex.sub(r"<(?:m:)?mi>([^<]+?)</(?:m:)?mi>", "<i>\\1</i>", processed_line)
-											processed_line = regex.sub(r"<(?:m:)?mi mathvariant=\"normal\">([^<]+?)</(?:m:)?mi>", "\\1", processed_line)
-											processed_line = regex.sub(r"<(?:m:)?mo>([+\-−=×])</(?:m:)?mo>", " \\1 ", processed_line)
-											processed_line = regex.sub(r"<((?:m:)?m[no])>(.+?)</\1>", "\\2", processed_line)
-											processed_line = regex.sub(r"</?(?:m:)?mrow>", "", processed_line)
-											processed_line = processed_line.strip()
-											processed_line = regex.sub(r"</i><i>", "", processed_line, flags=regex.DOTALL)
-
-										# Did we succeed? Is there any more MathML in our string?
-										if regex.findall("</?(?:m:)?m", processed_line):
-											# Failure! Abandon all hope, and use Firefox to convert the MathML to PNG.
-											se.images.render_mathml_to_png(driver, regex.sub(r"<(/?)m:", "<\\1", line), work_epub_root_directory / "epub" / "images" / f"mathml-{mathml_count}.png", work_epub_root_directory / "epub" / "images" / f"mathml-{mathml_count}-2x.png")
-
-											processed_xhtml = processed_xhtml.replace(line, f"<img class=\"mathml epub-type-se-image-color-depth-black-on-transparent\" epub:type=\"se:image.color-depth.black-on-transparent\" src=\"../images/mathml-{mathml_count}.png\" srcset=\"../images/mathml-{mathml_count}-2x.png 2x, ../images/mathml-{mathml_count}.png 1x\" />")
-											mathml_count = mathml_count + 1
-										else:
-											# Success! Replace the MathML with our new string.
-											processed_xhtml = processed_xhtml.replace(line, processed_line)
-
-								if processed_xhtml != xhtml:
-									file.seek(0)
-									file.write(processed_xhtml)
-									file.truncate()
-			except KeyboardInterrupt as ex:
-				# Bubble the exception up, but proceed to `finally` so we quit the driver
-				raise ex
-			finally:
-				try:
-					driver.quit()
-				except Exception:
-					# We might get here if we ctrl + c before selenium has finished initializing the driver
-					pass
+	# Recurse over xhtml files to make some compatibility replacements, and collect the SVGs to convert to PNGs
+	svgs: Dict[str, bytes] = {}
 
-		# Include epub2 cover metadata
-		cover_id = self.metadata_dom.xpath("//item[@properties=\"cover-image\"]/@id")[0].replace(".svg", ".jpg")
-		metadata_xml = regex.sub(r"(<metadata[^>]+?>)", f"\\1\n\t\t<meta content=\"{cover_id}\" name=\"cover\" />", metadata_xml)
+	for path in build_tree.paths():
+		filename = self.path / "src" / path
 
-		# Add metadata to content.opf indicating this file is a Standard Ebooks compatibility build
-		metadata_xml = metadata_xml.replace("<dc:publisher", "<meta property=\"se:transform\">compatibility</meta>\n\t\t<dc:publisher")
+		if filename.suffix == ".svg":
+			with stats.span("svg-to-png") as span:
+				svg = build_tree.read(path)
+				span.add_file(svg)
 
-		# Add any new MathML images we generated to the manifest
-		if has_mathml:
-			for root, _, filenames in os.walk(work_epub_root_directory / "epub" / "images"):
-				filenames = natsorted(filenames)
-				filenames.reverse()
-				for filename_string in filenames:
-					filename = Path(root) / filename_string
-					if filename.name.startswith("mathml-"):
-						metadata_xml = metadata_xml.replace("<manifest>", f"<manifest><item href=\"images/{filename.name}\" id=\"{filename.name}\" media-type=\"image/png\"/>")
+				# For night mode compatibility, give the titlepage and publisher logo a 1px white stroke
+				if filename.name == "titlepage.svg":
+					svg = _add_svg_outer_stroke(svg.decode("utf-8"), SVG_TITLEPAGE_OUTER_STROKE_WIDTH).encode("utf-8")
+				elif filename.name == "logo.svg":
+					svg = _add_svg_outer_stroke(svg.decode("utf-8"), SVG_OUTER_STROKE_WIDTH).encode("utf-8")
 
-			metadata_xml = regex.sub(r"properties=\"([^\"]*?)mathml([^\"]*?)\"", "properties=\"\\1\\2\"", metadata_xml)
+				svgs[path] = svg
 
-		metadata_xml = regex.sub(r"properties=\"\s*\"", "", metadata_xml)
+		if filename.suffix == ".xhtml":
+			with stats.span("compatibility-replacements") as span:
+				xhtml = build_tree.read_text(path)
+				span.add_file(xhtml)
+				processed_xhtml = cache.apply("compatibility-replacements", 1, lambda xhtml: _make_xhtml_compatible(xhtml, filename.name), xhtml, filename.name)
 
-		# Generate our NCX file for epub2 compatibility.
-		# First find the ToC file.
-		toc_filename = self.metadata_dom.xpath("//item[@properties=\"nav\"]/@href")[0]
-		metadata_xml = metadata_xml.replace("<spine>", "<spine toc=\"ncx\">")
-		metadata_xml = metadata_xml.replace("<manifest>", "<manifest><item href=\"toc.ncx\" id=\"ncx\" media-type=\"application/x-dtbncx+xml\" />")
+				if processed_xhtml != xhtml:
+					build_tree.write_text(path, processed_xhtml)
 
-		# Now use an XSLT transform to generate the NCX
-		with importlib_resources.path("se.data", "navdoc2ncx.xsl") as navdoc2ncx_xsl_filename:
-			toc_tree = se.epub.convert_toc_to_ncx(work_epub_root_directory, toc_filename, navdoc2ncx_xsl_filename)
+		if filename.suffix == ".css":
+			with stats.span("compatibility-replacements") as span:
+				css = build_tree.read_text(path)
+				span.add_file(css)
+				processed_css = css
 
-		# Convert the <nav> landmarks element to the <guide> element in content.opf
-		guide_xhtml = "<guide>"
-		for element in toc_tree.xpath("//nav[@epub:type=\"landmarks\"]/ol/li/a"):
-			element_xhtml = element.tostring()
-			element_xhtml = regex.sub(r"epub:type=\"([^\"]*)(\s*frontmatter\s*|\s*backmatter\s*)([^\"]*)\"", "type=\"\\1\\3\"", element_xhtml)
-			element_xhtml = regex.sub(r"epub:type=\"[^\"]*(acknowledgements|bibliography|colophon|copyright-page|cover|dedication|epigraph|foreword|glossary|index|loi|lot|notes|preface|bodymatter|titlepage|toc)[^\"]*\"", "type=\"\\1\"", element_xhtml)
-			element_xhtml = element_xhtml.replace("type=\"copyright-page", "type=\"copyright page")
+				# To get popup footnotes in iBooks, we have to change epub:endnote to epub:footnote.
+				# Remember to get our custom style selectors too.
+				processed_css = processed_css.replace("endnote", "footnote")
 
-			# We add the 'text' attribute to the titlepage to tell the reader to start there
-			element_xhtml = element_xhtml.replace("type=\"titlepage", "type=\"title-page text")
+				# Add page-break-* aliases for older ereaders
+				processed_css = _CSS_PAGE_BREAK_REWRITER.sub(processed_css)
 
-			element_xhtml = regex.sub(r"type=\"\s*\"", "", element_xhtml)
-			element_xhtml = element_xhtml.replace("<a", "<reference")
-			element_xhtml = regex.sub(r">(.+)</a>", " title=\"\\1\" />", element_xhtml)
+				if processed_css != css:
+					build_tree.write_text(path, processed_css)
 
-			# Replace instances of the `role` attribute since it's illegal in content.opf
-			element_xhtml = regex.sub(r" role=\".*?\"", "", element_xhtml)
+	with stats.span("svg-to-png"):
+		# Convert SVGs to PNGs at 2x resolution
+		for path, png in _rasterize_svgs(cache, svgs, 2).items():
+			build_tree.write(Path(path).with_suffix(".png").as_posix(), png)
+			build_tree.remove(path)
 
-			guide_xhtml = guide_xhtml + element_xhtml
+	return build_tree, metadata_xml
 
-		guide_xhtml = guide_xhtml + "</guide>"
+def _add_kobo_spans(xhtml: str, filename: Path) -> str:
+	"""
+	Wrap each clause of an XHTML file in the <span> elements that Kobo needs to enable highlighting.
 
-		metadata_xml = metadata_xml.replace("</package>", "") + guide_xhtml + "</package>"
+	INPUTS
+	xhtml: The XHTML to add spans to
+	filename: The path of the XHTML file
 
-		# Guide is done, now write content.opf and clean it.
-		# Output the modified content.opf before making more epub2 compatibility hacks.
-		with open(work_epub_root_directory / "epub" / "content.opf", "w", encoding="utf-8") as file:
-			file.write(metadata_xml)
-			file.truncate()
+	OUTPUTS
+	The XHTML with Kobo spans.
+	"""
 
-		# All done, clean the output
-		for filepath in se.get_target_filenames([work_epub_root_directory], (".xhtml", ".svg", ".opf", ".ncx")):
-			se.formatting.format_xml_file(filepath)
+	# Note: Kobo supports CSS hyphenation, but it can be improved with soft hyphens.
+	# However we can't insert them, because soft hyphens break the dictionary search when
+	# a word is highlighted.
 
-		# Write the compatible epub
-		se.epub.write_epub(work_epub_root_directory, output_directory / epub_output_filename)
+	# Kobos don't have fonts that support the ↩ character in endnotes, so replace it with ←
+	if filename.name == "endnotes.xhtml":
+		# Note that we replaced ↩ with \u21a9\ufe0e in an earlier iOS compatibility fix
+		xhtml = regex.sub(r"epub:type=\"backlink\">\u21a9\ufe0e</a>", "epub:type=\"backlink\">←</a>", xhtml)
 
-		if run_epubcheck:
-			# Path arguments must be cast to string for Windows compatibility.
-			with importlib_resources.path("se.data.epubcheck", "epubcheck.jar") as jar_path:
-				try:
-					epubcheck_result = subprocess.run(["java", "-jar", str(jar_path), "--quiet", str(output_directory / epub_output_filename)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
-					epubcheck_result.check_returncode()
-				except subprocess.CalledProcessError:
-					output = epubcheck_result.stdout.decode().strip()
-					# Get the epubcheck version to print to the console
-					version_output = subprocess.run(["java", "-jar", str(jar_path), "--version"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False).stdout.decode().strip()
-					version = regex.search(r"[0-9]+\.([0-9]+\.?)*", version_output, flags=regex.MULTILINE).group(0)
-
-					# The last two lines from epubcheck output are not necessary. Remove them here.
-					# Remove them as lines instead of as a matching regex to work with localized output strings.
-					split_output = output.split("\n")
-					output = "\n".join(split_output[:-2])
-
-					# Try to linkify files in output if we can find them
-					try:
-						output = regex.sub(r"(ERROR\(.+?\): )(.+?)(\([0-9]+,[0-9]+\))", lambda match: match.group(1) + "[path][link=file://" + str(self.path / "src" / regex.sub(fr"^\..+?\.epub{os.sep}", "", match.group(2))) + "]" + match.group(2) + "[/][/]" + match.group(3), output)
-					except:
-						# If something goes wrong, just pass through the usual output
-						pass
-
-					raise se.BuildFailedException(f"[bash]epubcheck[/] v{version} failed with:\n{output}")
-
-		if build_kindle:
-			# There's a bug in Calibre <= 3.48.0 where authors who have more than one MARC relator role
-			# display as "unknown author" in the Kindle interface.
-			# See: https://bugs.launchpad.net/calibre/+bug/1844578
-			# Until the bug is fixed, we simply remove any other MARC relator on the dc:creator element.
-			# Once the bug is fixed, we can remove this block.
-			with open(work_epub_root_directory / "epub" / "content.opf", "r+", encoding="utf-8") as file:
-				xhtml = file.read()
+	# We have to remove the default namespace declaration from our document, otherwise
+	# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
+	try:
+		tree = etree.fromstring(str.encode(xhtml.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")))
+	except Exception as ex:
+		raise se.InvalidXhtmlException(f"Error parsing XHTML file: [path][link=file://{filename}]{filename}[/][/]. Exception: {ex}")
 
+	kobo.add_kobo_spans_to_node(tree.xpath("./body", namespaces=se.XHTML_NAMESPACES)[0])
+
+	xhtml = etree.tostring(tree, encoding="unicode", pretty_print=True, with_tail=False)
+	xhtml = regex.sub(r"<html:span", "<span", xhtml)
+	xhtml = regex.sub(r"html:span>", "span>", xhtml)
+	xhtml = regex.sub(r"<span xmlns:html=\"http://www.w3.org/1999/xhtml\"", "<span", xhtml)
+	xhtml = regex.sub(r"<html", "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<html xmlns=\"http://www.w3.org/1999/xhtml\"", xhtml)
+
+	return xhtml
+
+
+def _build_kobo(self, stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, output_path: Path, compression_level: Optional[int]) -> None:
+	"""
+	Build a Kobo .kepub.epub file from the compatible build tree.
+	"""
+
+	# Branch the build tree; the kobo build shares file contents with the main build until it changes them
+	kobo_tree = build_tree.copy()
+
+	# Add a note to content.opf indicating this is a transform build
+	xhtml = kobo_tree.read_text("epub/content.opf")
+
+	xhtml = regex.sub(r"<dc:publisher", "<meta property=\"se:transform\">kobo</meta>\n\t\t<dc:publisher", xhtml)
+
+	kobo_tree.write_text("epub/content.opf", xhtml)
+
+	with stats.span("kobo-spans") as span:
+		# Kobo .kepub files need each clause wrapped in a special <span> tag to enable highlighting.
+		# Do this here. Hopefully Kobo will get their act together soon and drop this requirement.
+		keys: Dict[str, str] = {}
+		files_to_process: Dict[str, Tuple[str, Path]] = {}
+
+		for path in kobo_tree.paths((".xhtml",)):
+			filename = self.path / "src" / path
+
+			# Don't add spans to the ToC
+			if filename.name == "toc.xhtml":
+				continue
+
+			xhtml = kobo_tree.read_text(path)
+			span.add_file(xhtml)
+
+			keys[path] = cache.get_key("kobo-spans", 1, xhtml, filename.name)
+			processed_xhtml = cache.get(keys[path])
+
+			if processed_xhtml is None:
+				files_to_process[path] = (xhtml, filename)
+			else:
+				kobo_tree.write(path, processed_xhtml)
+
+		if len(files_to_process) > 1:
+			# Adding spans is pure Python, so process files in separate processes instead of threads
+			with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(files_to_process), os.cpu_count() or 1)) as executor:
+				processed_files = dict(zip(files_to_process, executor.map(_add_kobo_spans, *zip(*files_to_process.values()))))
+		else:
+			processed_files = {path: _add_kobo_spans(xhtml, filename) for path, (xhtml, filename) in files_to_process.items()}
+
+		for path, processed_xhtml in processed_files.items():
+			cache.put(keys[path], processed_xhtml.encode("utf-8"))
+			kobo_tree.write_text(path, processed_xhtml)
+
+	# All done, clean the output
+	# Note that we don't clean .xhtml files, because the way kobo spans are added means that it will screw up spaces inbetween endnotes.
+	_format_tree(stats, cache, kobo_tree, kobo_tree.paths((".svg", ".opf", ".ncx")))
+
+	_write_epub(stats, "kepub-zip", kobo_tree, output_path, compression_level)
+
+def _simplify_mathml(mathml: str) -> Optional[str]:
+	"""
+	Try to convert a simple MathML expression to plain XHTML, using some naive regexes.
+
+	INPUTS
+	mathml: A string of MathML
+
+	OUTPUTS
+	The XHTML equivalent of the MathML, or None if the expression is too complex and has to be rendered to an image.
+	"""
+
+	mathml_tree = se.easy_xml.EasyXhtmlTree("<?xml version=\"1.0\" encoding=\"utf-8\"?>{}".format(regex.sub(r"<(/?)m:", "<\\1", mathml)))
+	processed_line = mathml
+
+	# If the mfenced element has more than one child, they are separated by commas when rendered.
+	# This is too complex for our naive regexes to work around. So, if there is an mfenced element with more than one child, abandon the attempt.
+	if not mathml_tree.css_select("mfenced > * + *"):
+		processed_line = regex.sub(r"</?(?:m:)?math[^>]*?>", "", processed_line)
+		processed_line = regex.sub(r"<!--.+?-->", "", processed_line)
+		processed_line = regex.sub(r"<(?:m:)?mfenced/>", "()", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi)>(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "<i>\\4</i><\\2><i>\\6</i></\\2>", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi)>(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "<i>\\4</i><\\2>\\6</\\2>", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mn)>(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "\\4<\\2>\\6</\\2>", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mn)>(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "\\4<\\2><i>\\6</i></\\2>", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi) mathvariant=\"normal\">(.+?)</\3><((?:m:)?mi)>(.+?)</\5></\1>", "\\4<\\2><i>\\6</i></\\2>", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m(sub|sup))><((?:m:)?mi) mathvariant=\"normal\">(.+?)</\3><((?:m:)?mn)>(.+?)</\5></\1>", "\\4<\\2>\\6</\\2>", processed_line)
+		processed_line = regex.sub(fr"<(?:m:)?mo>{se.FUNCTION_APPLICATION}</(?:m:)?mo>", "", processed_line, flags=regex.IGNORECASE) # The ignore case flag is required to match here with the special FUNCTION_APPLICATION character, it's unclear why
+		processed_line = regex.sub(r"<(?:m:)?mfenced><((?:m:)(?:mo|mi|mn|mrow))>(.+?)</\1></(?:m:)?mfenced>", "(<\\1>\\2</\\1>)", processed_line)
+		processed_line = regex.sub(r"<(?:m:)?mrow>([^>].+?)</(?:m:)?mrow>", "\\1", processed_line)
+		processed_line = regex.sub(r"<(?:m:)?mi>([^<]+?)</(?:m:)?mi>", "<i>\\1</i>", processed_line)
+		processed_line = regex.sub(r"<(?:m:)?mi mathvariant=\"normal\">([^<]+?)</(?:m:)?mi>", "\\1", processed_line)
+		processed_line = regex.sub(r"<(?:m:)?mo>([+\-−=×])</(?:m:)?mo>", " \\1 ", processed_line)
+		processed_line = regex.sub(r"<((?:m:)?m[no])>(.+?)</\1>", "\\2", processed_line)
+		processed_line = regex.sub(r"</?(?:m:)?mrow>", "", processed_line)
+		processed_line = processed_line.strip()
+		processed_line = regex.sub(r"</i><i>", "", processed_line, flags=regex.DOTALL)
+
+	# Did we succeed? Is there any more MathML in our string?
+	if regex.findall("</?(?:m:)?m", processed_line):
+		return None
+
+	return processed_line
+
+def _build_epub2_tree(self, stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, metadata_xml: str, cover_id: str, toc_filename: str) -> se.epub.BuildTree:
+	"""
+	Finish epub2 compatibility on the compatible build tree: CSS aliases, MathML fallbacks, the NCX, and the <guide> element.
+	"""
+
+	build_tree = build_tree.copy()
+
+	with stats.span("compatibility-replacements") as span:
+		# Recurse over css files to make some compatibility replacements.
+		for path in build_tree.paths((".css",)):
+			css = build_tree.read_text(path)
+			span.add_file(css)
+			processed_css = css
+
+			# Add column break aliases for Readium, and hyphenation aliases for other ereaders
+			processed_css = _CSS_EPUB2_REWRITER.sub(processed_css)
+
+			if processed_css != css:
+				build_tree.write_text(path, processed_css)
+
+	# Sort out MathML compatibility
+	has_mathml = "mathml" in metadata_xml
+	if has_mathml:
+		with stats.span("mathml") as span:
+			# Check if there's MathML we want to convert
+			# We take a naive approach and use some regexes to try to simplify simple MathML expressions.
+			# For each MathML expression, if our round of regexes finishes and there is still MathML in the processed result, we abandon the attempt and render to PNG using Firefox.
+			# Each unique expression is simplified, or rendered, only once per book; identical expressions share one image.
+			file_mathml: Dict[str, List[str]] = {}
+			replacements: Dict[str, str] = {}
+			image_numbers: Dict[str, int] = {}
+
+			for path in build_tree.paths((".xhtml",)):
+				xhtml = build_tree.read_text(path)
+				span.add_file(xhtml)
+				file_mathml[path] = []
+
+				for line in regex.findall(r"<(?:m:)?math[^>]*?>(?:.+?)</(?:m:)?math>", xhtml, flags=regex.DOTALL):
+					if line not in file_mathml[path]:
+						file_mathml[path].append(line)
+
+					if line not in replacements:
+						processed_line = _simplify_mathml(line)
+
+						if processed_line is None:
+							# Failure! Abandon all hope, and use Firefox to convert the MathML to PNG.
+							mathml = regex.sub(r"<(/?)m:", "<\\1", line)
+							image_number = image_numbers.setdefault(mathml, len(image_numbers) + 1)
+							processed_line = f"<img class=\"mathml epub-type-se-image-color-depth-black-on-transparent\" epub:type=\"se:image.color-depth.black-on-transparent\" src=\"../images/mathml-{image_number}.png\" srcset=\"../images/mathml-{image_number}-2x.png 2x, ../images/mathml-{image_number}.png 1x\" />"
+
+						replacements[line] = processed_line
+
+			# Render every expression that isn't in the cache in a single page load
+			pngs: Dict[str, Tuple[bytes, bytes]] = {}
+			for mathml in image_numbers:
+				png = cache.get(cache.get_key("mathml-png", 2, mathml))
+				png_2x = cache.get(cache.get_key("mathml-png-2x", 2, mathml))
+
+				if png is not None and png_2x is not None:
+					pngs[mathml] = (png, png_2x)
+
+			mathml_to_render = [mathml for mathml in image_numbers if mathml not in pngs]
+
+			if mathml_to_render:
+				# We import this late because we don't want to load selenium if we're not going to use it!
+				from se import browser # pylint: disable=import-outside-toplevel
+
+				# Borrow a warm browser from the process-wide pool; if the build is interrupted, the pool quits the driver
+				with browser.get_browser_pool().driver() as driver:
+					for mathml, (png, png_2x) in zip(mathml_to_render, se.images.render_mathml_to_pngs(driver, mathml_to_render)):
+						cache.put(cache.get_key("mathml-png", 2, mathml), png)
+						cache.put(cache.get_key("mathml-png-2x", 2, mathml), png_2x)
+						pngs[mathml] = (png, png_2x)
+
+			for mathml, image_number in image_numbers.items():
+				build_tree.write(f"epub/images/mathml-{image_number}.png", pngs[mathml][0])
+				build_tree.write(f"epub/images/mathml-{image_number}-2x.png", pngs[mathml][1])
+
+			for path, lines in file_mathml.items():
+				xhtml = build_tree.read_text(path)
 				processed_xhtml = xhtml
 
-				for match in regex.findall(r"<meta property=\"role\" refines=\"#author\" scheme=\"marc:relators\">.*?</meta>", xhtml):
-					if ">aut<" not in match:
-						processed_xhtml = processed_xhtml.replace(match, "")
+				for line in lines:
+					processed_xhtml = processed_xhtml.replace(line, replacements[line])
 
 				if processed_xhtml != xhtml:
-					file.seek(0)
-					file.write(processed_xhtml)
-					file.truncate()
+					build_tree.write_text(path, processed_xhtml)
+
+	# Include epub2 cover metadata
+	metadata_xml = regex.sub(r"(<metadata[^>]+?>)", f"\\1\n\t\t<meta content=\"{cover_id}\" name=\"cover\" />", metadata_xml)
 
-			# Kindle doesn't go more than 2 levels deep for ToC, so flatten it here.
-			with open(work_epub_root_directory / "epub" / toc_filename, "r+", encoding="utf-8") as file:
-				xhtml = file.read()
+	# Add metadata to content.opf indicating this file is a Standard Ebooks compatibility build
+	metadata_xml = metadata_xml.replace("<dc:publisher", "<meta property=\"se:transform\">compatibility</meta>\n\t\t<dc:publisher")
 
-				soup = BeautifulSoup(xhtml, "lxml")
+	# Add any new MathML images we generated to the manifest
+	if has_mathml:
+		filenames = natsorted([Path(path).name for path in build_tree.paths() if path.startswith("epub/images/mathml-")])
+		filenames.reverse()
+		for filename in filenames:
+			metadata_xml = metadata_xml.replace("<manifest>", f"<manifest><item href=\"images/{filename}\" id=\"{filename}\" media-type=\"image/png\"/>")
 
-				for match in soup.select("ol > li > ol > li > ol"):
-					match.parent.insert_after(match)
-					match.unwrap()
+		metadata_xml = regex.sub(r"properties=\"([^\"]*?)mathml([^\"]*?)\"", "properties=\"\\1\\2\"", metadata_xml)
 
-				file.seek(0)
-				file.write(str(soup))
-				file.truncate()
+	metadata_xml = regex.sub(r"properties=\"\s*\"", "", metadata_xml)
 
-			# Rebuild the NCX
-			with importlib_resources.path("se.data", "navdoc2ncx.xsl") as navdoc2ncx_xsl_filename:
-				toc_tree = se.epub.convert_toc_to_ncx(work_epub_root_directory, toc_filename, navdoc2ncx_xsl_filename)
+	# Generate our NCX file for epub2 compatibility.
+	metadata_xml = metadata_xml.replace("<spine>", "<spine toc=\"ncx\">")
+	metadata_xml = metadata_xml.replace("<manifest>", "<manifest><item href=\"toc.ncx\" id=\"ncx\" media-type=\"application/x-dtbncx+xml\" />")
 
-			# Clean just the ToC and NCX
-			for filepath in [work_epub_root_directory / "epub" / "toc.ncx", work_epub_root_directory / "epub" / toc_filename]:
-				se.formatting.format_xml_file(filepath)
+	with stats.span("ncx"):
+		# Now use an XSLT transform to generate the NCX
+		toc_tree = se.epub.convert_toc_to_ncx(build_tree, toc_filename)
 
-			# Convert endnotes to Kindle popup compatible notes
-			if (work_epub_root_directory / "epub/text/endnotes.xhtml").is_file():
-				with open(work_epub_root_directory / "epub/text/endnotes.xhtml", "r+", encoding="utf-8") as file:
-					xhtml = file.read()
+	# Convert the <nav> landmarks element to the <guide> element in content.opf
+	guide_xhtml = "<guide>"
+	for element in toc_tree.xpath("//nav[@epub:type=\"landmarks\"]/ol/li/a"):
+		element_xhtml = element.tostring()
+		element_xhtml = regex.sub(r"epub:type=\"([^\"]*)(\s*frontmatter\s*|\s*backmatter\s*)([^\"]*)\"", "type=\"\\1\\3\"", element_xhtml)
+		element_xhtml = regex.sub(r"epub:type=\"[^\"]*(acknowledgements|bibliography|colophon|copyright-page|cover|dedication|epigraph|foreword|glossary|index|loi|lot|notes|preface|bodymatter|titlepage|toc)[^\"]*\"", "type=\"\\1\"", element_xhtml)
+		element_xhtml = element_xhtml.replace("type=\"copyright-page", "type=\"copyright page")
 
-					# We have to remove the default namespace declaration from our document, otherwise
-					# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
-					try:
-						tree = etree.fromstring(str.encode(xhtml.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")))
-					except Exception as ex:
-						raise se.InvalidXhtmlException(f"Error parsing XHTML [path][link=file://{(work_epub_root_directory / 'epub/text/endnotes.xhtml').resolve()}]endnotes.xhtml[/][/]. Exception: {ex}")
+		# We add the 'text' attribute to the titlepage to tell the reader to start there
+		element_xhtml = element_xhtml.replace("type=\"titlepage", "type=\"title-page text")
 
-					notes = tree.xpath("//li[@epub:type=\"endnote\" or @epub:type=\"footnote\"]", namespaces=se.XHTML_NAMESPACES)
+		element_xhtml = regex.sub(r"type=\"\s*\"", "", element_xhtml)
+		element_xhtml = element_xhtml.replace("<a", "<reference")
+		element_xhtml = regex.sub(r">(.+)</a>", " title=\"\\1\" />", element_xhtml)
 
-					processed_endnotes = ""
+		# Replace instances of the `role` attribute since it's illegal in content.opf
+		element_xhtml = regex.sub(r" role=\".*?\"", "", element_xhtml)
 
-					for note in notes:
-						note_id = note.get("id")
-						note_number = note_id.replace("note-", "")
+		guide_xhtml = guide_xhtml + element_xhtml
 
-						# First, fixup the reference link for this endnote
-						try:
-							ref_link = etree.tostring(note.xpath("p[last()]/a[last()]")[0], encoding="unicode", pretty_print=True, with_tail=False).replace(" xmlns:epub=\"http://www.idpf.org/2007/ops\"", "").strip()
-						except Exception:
-							raise se.InvalidXhtmlException(f"Can’t find ref link for [url]#{note_id}[/].")
+	guide_xhtml = guide_xhtml + "</guide>"
 
-						new_ref_link = regex.sub(r">.*?</a>", ">" + note_number + "</a>.", ref_link)
+	metadata_xml = metadata_xml.replace("</package>", "") + guide_xhtml + "</package>"
 
-						# Now remove the wrapping li node from the note
-						note_text = regex.sub(r"^<li[^>]*?>(.*)</li>$", r"\1", etree.tostring(note, encoding="unicode", pretty_print=True, with_tail=False), flags=regex.IGNORECASE | regex.DOTALL)
+	# Guide is done, now write content.opf and clean it.
+	# Output the modified content.opf before making more epub2 compatibility hacks.
+	build_tree.write_text("epub/content.opf", metadata_xml)
 
-						# Insert our new ref link
-						result = regex.subn(r"^\s*<p([^>]*?)>", "<p\\1 id=\"" + note_id + "\">" + new_ref_link + " ", note_text)
+	# All done, clean the output
+	_format_tree(stats, cache, build_tree, [path for path in build_tree.paths((".xhtml", ".svg", ".opf", ".ncx")) if Path(path).name not in se.IGNORED_FILENAMES])
 
-						# Sometimes there is no leading <p> tag (for example, if the endnote starts with a blockquote
-						# If that's the case, just insert one in front.
-						note_text = result[0]
-						if result[1] == 0:
-							note_text = "<p id=\"" + note_id + "\">" + new_ref_link + "</p>" + note_text
+	return build_tree
 
-						# Now remove the old ref_link
-						note_text = note_text.replace(ref_link, "")
+def _run_epubcheck(self, stats: BuildStats, cache: se.cache.BuildCache, epub_path: Path) -> None:
+	"""
+	Run epubcheck on a compatible epub, raising se.BuildFailedException if it fails.
 
-						# Trim trailing spaces left over after removing the ref link
-						note_text = regex.sub(r"\s+</p>", "</p>", note_text).strip()
+	Epubs are validated by the process-wide `se.epubcheck.EpubcheckRunner`, so building many books in one process only starts one JVM.
+	Epubs are byte-reproducible, so if this exact epub already passed this version of epubcheck, we don't run it again.
+	"""
 
-						# Sometimes ref links are in their own p tag--remove that too
-						note_text = regex.sub(r"<p>\s*</p>", "", note_text)
+	with stats.span("epubcheck") as span:
+		epub = epub_path.read_bytes()
+		span.add_file(epub)
 
-						processed_endnotes += note_text + "\n"
+		runner = se.epubcheck.get_epubcheck_runner()
+		version = runner.version
+		cache_key = cache.get_key("epubcheck", 1, epub, version)
 
-					# All done with endnotes, so drop them back in
-					xhtml = regex.sub(r"<ol>.*</ol>", processed_endnotes, xhtml, flags=regex.IGNORECASE | regex.DOTALL)
+		if cache.get(cache_key) is not None:
+			return
 
-					file.seek(0)
-					file.write(xhtml)
-					file.truncate()
+		passed, output = runner.check(epub_path)
 
-				# While Kindle now supports soft hyphens, popup endnotes break words but don't insert the hyphen characters.  So for now, remove soft hyphens from the endnotes file.
-				with open(work_epub_root_directory / "epub" / "text" / "endnotes.xhtml", "r+", encoding="utf-8") as file:
-					xhtml = file.read()
-					processed_xhtml = xhtml
+		if not passed:
+			# Try to linkify files in output if we can find them
+			try:
+				output = regex.sub(r"(ERROR\(.+?\): )(.+?)(\([0-9]+,[0-9]+\))", lambda match: match.group(1) + "[path][link=file://" + str(self.path / "src" / regex.sub(fr"^\..+?\.epub{os.sep}", "", match.group(2))) + "]" + match.group(2) + "[/][/]" + match.group(3), output)
+			except:
+				# If something goes wrong, just pass through the usual output
+				pass
 
-					processed_xhtml = processed_xhtml.replace(se.SHY_HYPHEN, "")
+			raise se.BuildFailedException(f"[bash]epubcheck[/] v{version} failed with:\n{output}")
 
-					if processed_xhtml != xhtml:
-						file.seek(0)
-						file.write(processed_xhtml)
-						file.truncate()
+		# Only remember passes, because the output of a failure links to files in the source directory, which may have moved
+		cache.put(cache_key, b"passed")
 
-			# Do some compatibility replacements
-			for root, _, filenames in os.walk(work_epub_root_directory):
-				for filename_string in filenames:
-					filename = Path(root) / filename_string
-					if filename.suffix == ".xhtml":
-						with open(filename, "r+", encoding="utf-8") as file:
-							xhtml = file.read()
-							processed_xhtml = xhtml
+_CALIBRE_VERSIONS: Dict[str, str] = {}
 
-							# Kindle doesn't recognize most zero-width spaces or word joiners, so just remove them.
-							# It does recognize the word joiner character, but only in the old mobi7 format.  The new format renders them as spaces.
-							processed_xhtml = processed_xhtml.replace(se.ZERO_WIDTH_SPACE, "")
+def _get_calibre_version(ebook_convert_path: Path) -> str:
+	"""
+	Return the version string reported by `ebook-convert --version`, remembering it for the life of the process.
+	"""
 
-							# Remove the epub:type attribute, as Calibre turns it into just "type"
-							processed_xhtml = regex.sub(r"epub:type=\"[^\"]*?\"", "", processed_xhtml)
+	version = _CALIBRE_VERSIONS.get(str(ebook_convert_path))
 
-							if processed_xhtml != xhtml:
-								file.seek(0)
-								file.write(processed_xhtml)
-								file.truncate()
+	if version is None:
+		# Path arguments must be cast to string for Windows compatibility.
+		version = subprocess.run([str(ebook_convert_path), "--version"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False).stdout.decode().strip().split("\n")[0]
+		_CALIBRE_VERSIONS[str(ebook_convert_path)] = version
+
+	return version
+
+def _convert_kindle(self, stats: BuildStats, cache: se.cache.BuildCache, build_tree: se.epub.BuildTree, ebook_convert_path: Path, toc_filename: str, cover_href: str, epub_output_filename: str, kindle_output_filename: str) -> bytes:
+	"""
+	Convert the epub2 build tree to a Kindle .azw3 file, and return its contents. The ASIN isn't set yet; see `_output_kindle()`.
+
+	Calibre is slow, so its output is cached, keyed by the exact epub we send it and the version of Calibre.
+	"""
 
-			# Include compatibility CSS
-			with open(work_epub_root_directory / "epub" / "css" / "core.css", "a", encoding="utf-8") as core_css_file:
-				with importlib_resources.open_text("se.data.templates", "kindle.css", encoding="utf-8") as compatibility_css_file:
-					core_css_file.write(compatibility_css_file.read())
+	build_tree = build_tree.copy()
 
-			# Add soft hyphens
-			for filepath in se.get_target_filenames([work_epub_root_directory], (".xhtml",)):
-				se.typography.hyphenate_file(filepath, None, True)
+	with stats.span("kindle-compatibility"):
+		# There's a bug in Calibre <= 3.48.0 where authors who have more than one MARC relator role
+		# display as "unknown author" in the Kindle interface.
+		# See: https://bugs.launchpad.net/calibre/+bug/1844578
+		# Until the bug is fixed, we simply remove any other MARC relator on the dc:creator element.
+		# Once the bug is fixed, we can remove this block.
+		xhtml = build_tree.read_text("epub/content.opf")
 
-			# Build an epub file we can send to Calibre
-			se.epub.write_epub(work_epub_root_directory, work_directory / epub_output_filename)
+		processed_xhtml = xhtml
 
-			# Generate the Kindle file
-			# We place it in the work directory because later we have to update the asin, and the mobi.update_asin() function will write to the final output directory
-			cover_path = work_epub_root_directory / "epub" / self.metadata_dom.xpath("//item[@properties=\"cover-image\"]/@href")[0].replace(".svg", ".jpg")
+		for match in regex.findall(r"<meta property=\"role\" refines=\"#author\" scheme=\"marc:relators\">.*?</meta>", xhtml):
+			if ">aut<" not in match:
+				processed_xhtml = processed_xhtml.replace(match, "")
 
-			# Path arguments must be cast to string for Windows compatibility.
-			return_code = subprocess.run([str(ebook_convert_path), str(work_directory / epub_output_filename), str(work_directory / kindle_output_filename), "--pretty-print", "--no-inline-toc", "--max-toc-links=0", "--prefer-metadata-cover", f"--cover={cover_path}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False).returncode
+		if processed_xhtml != xhtml:
+			build_tree.write_text("epub/content.opf", processed_xhtml)
 
-			if return_code:
-				raise se.InvalidSeEbookException("[bash]ebook-convert[/] failed.")
+		# Kindle doesn't go more than 2 levels deep for ToC, so flatten it here.
+		xhtml = build_tree.read_text(f"epub/{toc_filename}")
 
-			# Success, extract the Kindle cover thumbnail
+		soup = BeautifulSoup(xhtml, "lxml")
+
+		for match in soup.select("ol > li > ol > li > ol"):
+			match.parent.insert_after(match)
+			match.unwrap()
+
+		build_tree.write_text(f"epub/{toc_filename}", str(soup))
+
+		# Rebuild the NCX
+		toc_tree = se.epub.convert_toc_to_ncx(build_tree, toc_filename)
+
+		# Clean just the ToC and NCX
+		_format_tree(stats, cache, build_tree, ["epub/toc.ncx", f"epub/{toc_filename}"])
+
+		# Convert endnotes to Kindle popup compatible notes
+		if "epub/text/endnotes.xhtml" in build_tree:
+			xhtml = build_tree.read_text("epub/text/endnotes.xhtml")
+
+			# We have to remove the default namespace declaration from our document, otherwise
+			# xpath won't find anything at all.  See http://stackoverflow.com/questions/297239/why-doesnt-xpath-work-when-processing-an-xhtml-document-with-lxml-in-python
+			try:
+				tree = etree.fromstring(str.encode(xhtml.replace(" xmlns=\"http://www.w3.org/1999/xhtml\"", "")))
+			except Exception as ex:
+				raise se.InvalidXhtmlException(f"Error parsing XHTML [path][link=file://{self.path / 'src/epub/text/endnotes.xhtml'}]endnotes.xhtml[/][/]. Exception: {ex}")
+
+			notes = tree.xpath("//li[@epub:type=\"endnote\" or @epub:type=\"footnote\"]", namespaces=se.XHTML_NAMESPACES)
+
+			processed_endnotes = ""
+
+			for note in notes:
+				note_id = note.get("id")
+				note_number = note_id.replace("note-", "")
+
+				# First, fixup the reference link for this endnote
+				try:
+					ref_link = etree.tostring(note.xpath("p[last()]/a[last()]")[0], encoding="unicode", pretty_print=True, with_tail=False).replace(" xmlns:epub=\"http://www.idpf.org/2007/ops\"", "").strip()
+				except Exception:
+					raise se.InvalidXhtmlException(f"Can’t find ref link for [url]#{note_id}[/].")
+
+				new_ref_link = regex.sub(r">.*?</a>", ">" + note_number + "</a>.", ref_link)
+
+				# Now remove the wrapping li node from the note
+				note_text = regex.sub(r"^<li[^>]*?>(.*)</li>$", r"\1", etree.tostring(note, encoding="unicode", pretty_print=True, with_tail=False), flags=regex.IGNORECASE | regex.DOTALL)
+
+				# Insert our new ref link
+				result = regex.subn(r"^\s*<p([^>]*?)>", "<p\\1 id=\"" + note_id + "\">" + new_ref_link + " ", note_text)
+
+				# Sometimes there is no leading <p> tag (for example, if the endnote starts with a blockquote
+				# If that's the case, just insert one in front.
+				note_text = result[0]
+				if result[1] == 0:
+					note_text = "<p id=\"" + note_id + "\">" + new_ref_link + "</p>" + note_text
+
+				# Now remove the old ref_link
+				note_text = note_text.replace(ref_link, "")
+
+				# Trim trailing spaces left over after removing the ref link
+				note_text = regex.sub(r"\s+</p>", "</p>", note_text).strip()
+
+				# Sometimes ref links are in their own p tag--remove that too
+				note_text = regex.sub(r"<p>\s*</p>", "", note_text)
+
+				processed_endnotes += note_text + "\n"
+
+			# All done with endnotes, so drop them back in
+			xhtml = regex.sub(r"<ol>.*</ol>", processed_endnotes, xhtml, flags=regex.IGNORECASE | regex.DOTALL)
+
+			build_tree.write_text("epub/text/endnotes.xhtml", xhtml)
+
+			# While Kindle now supports soft hyphens, popup endnotes break words but don't insert the hyphen characters.  So for now, remove soft hyphens from the endnotes file.
+			xhtml = build_tree.read_text("epub/text/endnotes.xhtml")
+			processed_xhtml = xhtml
+
+			processed_xhtml = processed_xhtml.replace(se.SHY_HYPHEN, "")
+
+			if processed_xhtml != xhtml:
+				build_tree.write_text("epub/text/endnotes.xhtml", processed_xhtml)
+
+		# Do some compatibility replacements
+		for path in build_tree.paths((".xhtml",)):
+			xhtml = build_tree.read_text(path)
+			processed_xhtml = xhtml
+
+			# Kindle doesn't recognize most zero-width spaces or word joiners, so just remove them.
+			# It does recognize the word joiner character, but only in the old mobi7 format.  The new format renders them as spaces.
+			processed_xhtml = processed_xhtml.replace(se.ZERO_WIDTH_SPACE, "")
+
+			# Remove the epub:type attribute, as Calibre turns it into just "type"
+			processed_xhtml = regex.sub(r"epub:type=\"[^\"]*?\"", "", processed_xhtml)
+
+			if processed_xhtml != xhtml:
+				build_tree.write_text(path, processed_xhtml)
+
+		# Include compatibility CSS
+		build_tree.write_text("epub/css/core.css", build_tree.read_text("epub/css/core.css") + se.resources.get_template("kindle.css"))
+
+	with stats.span("hyphenation") as span:
+		# Add soft hyphens
+		for path in build_tree.paths((".xhtml",)):
+			if Path(path).name not in se.IGNORED_FILENAMES:
+				xhtml = build_tree.read_text(path)
+				span.add_file(xhtml)
+				build_tree.write_text(path, cache.apply("hyphenation", 1, lambda xhtml: se.typography.hyphenate(xhtml, None, True), xhtml))
+
+	with stats.span("ebook-convert") as span:
+		# `ebook-convert` can only read from disk, so this is the one step that needs a temporary directory
+		with tempfile.TemporaryDirectory() as temp_directory:
+			work_directory = Path(temp_directory)
+
+			# Build an epub file we can send to Calibre. Epubs are byte-reproducible, so the epub itself can be the cache key.
+			se.epub.write_epub(build_tree, work_directory / epub_output_filename)
+			epub = (work_directory / epub_output_filename).read_bytes()
+			span.add_file(epub)
+
+			cover = build_tree.read(f"epub/{cover_href}")
+			cache_key = cache.get_key("azw3", 1, epub, cover, _get_calibre_version(ebook_convert_path))
+			azw3 = cache.get(cache_key)
+
+			if azw3 is None:
+				cover_path = work_directory / Path(cover_href).name
+				with open(cover_path, "wb") as file:
+					file.write(cover)
+
+				# Generate the Kindle file
+				# Path arguments must be cast to string for Windows compatibility.
+				return_code = subprocess.run([str(ebook_convert_path), str(work_directory / epub_output_filename), str(work_directory / kindle_output_filename), "--pretty-print", "--no-inline-toc", "--max-toc-links=0", "--prefer-metadata-cover", f"--cover={cover_path}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False).returncode
+
+				if return_code:
+					raise se.InvalidSeEbookException("[bash]ebook-convert[/] failed.")
+
+				azw3 = (work_directory / kindle_output_filename).read_bytes()
+				cache.put(cache_key, azw3)
+
+	return azw3
+
+def _output_kindle(stats: BuildStats, build_tree: se.epub.BuildTree, azw3: bytes, asin: str, output_directory: Path, kindle_output_filename: str) -> None:
+	"""
+	Write a converted Kindle .azw3 file with its ASIN set, and its cover thumbnail, to the output directory.
+	"""
+
+	with stats.span("kindle-asin"):
+		with tempfile.TemporaryDirectory() as temp_directory:
+			azw3_path = Path(temp_directory) / kindle_output_filename
+
+			with open(azw3_path, "wb") as file:
+				file.write(azw3)
 
 			# Update the ASIN in the generated file
-			mobi.update_asin(asin, work_directory / kindle_output_filename, output_directory / kindle_output_filename)
+			mobi.update_asin(asin, azw3_path, output_directory / kindle_output_filename)
+
+	with stats.span("kindle-thumbnail"):
+		# Extract the thumbnail
+		kindle_cover_thumbnail = Image.open(io.BytesIO(build_tree.read("epub/images/cover.jpg")))
+		kindle_cover_thumbnail = kindle_cover_thumbnail.convert("RGB") # Remove alpha channel from PNG if necessary
+		kindle_cover_thumbnail = kindle_cover_thumbnail.resize((432, 648))
+		kindle_cover_thumbnail.save(output_directory / f"thumbnail_{asin}_EBOK_portrait.jpg")
+
+def build(self, run_epubcheck: bool, build_kobo: bool, build_kindle: bool, output_directory: Path, proof: bool, build_covers: bool, targets: Optional[List[str]] = None, use_cache: bool = True, compression_level: Optional[int] = None) -> BuildStats:
+	"""
+	Entry point for `se build`
+
+	The build is a graph of stages; see `_BuildGraph`. `targets` is a list of artifacts to build, from BUILD_TARGETS;
+	it defaults to the compatible epub and the pure epub3. `build_kobo` and `build_kindle` add the kepub and azw3 targets.
+
+	Per-file transforms reuse their output from earlier builds from the on-disk `se.cache.BuildCache`, unless `use_cache` is False.
+
+	`compression_level` is the zlib level to deflate the output epubs with, from 0 (fastest) to 9 (smallest); see `se.epub.write_epub()`.
+
+	If the SeEpub was created with a Git revision, the source files and the release metadata come from that commit, and the working tree is never read.
+	"""
 
-			# Extract the thumbnail
-			kindle_cover_thumbnail = Image.open(work_epub_root_directory / "epub" / "images" / "cover.jpg")
-			kindle_cover_thumbnail = kindle_cover_thumbnail.convert("RGB") # Remove alpha channel from PNG if necessary
-			kindle_cover_thumbnail = kindle_cover_thumbnail.resize((432, 648))
-			kindle_cover_thumbnail.save(output_directory / f"thumbnail_{asin}_EBOK_portrait.jpg")
+	targets = list(targets) if targets is not None else ["epub", "epub3"]
+
+	if build_kobo and "kepub" not in targets:
+		targets.append("kepub")
+
+	if build_kindle and "azw3" not in targets:
+		targets.append("azw3")
+
+	for target in targets:
+		if target not in BUILD_TARGETS:
+			raise se.InvalidArgumentsException(f"Unknown build target: [text]{target}[/]. Valid targets are: {', '.join(BUILD_TARGETS)}.")
+
+	# Check for some required tools
+	if "azw3" in targets:
+		which_ebook_convert = shutil.which("ebook-convert")
+		if which_ebook_convert:
+			ebook_convert_path = Path(which_ebook_convert)
+		else:
+			# Look for default Mac calibre app path if none found in path
+			ebook_convert_path = Path("/Applications/calibre.app/Contents/MacOS/ebook-convert")
+			if not ebook_convert_path.exists():
+				raise se.MissingDependencyException("Couldn’t locate [bash]ebook-convert[/]. Is [bash]calibre[/] installed?")
+
+	if run_epubcheck:
+		if not shutil.which("java"):
+			raise se.MissingDependencyException("Couldn’t locate [bash]java[/]. Is it installed?")
+
+	# Check the output directory and create it if it doesn't exist
+	try:
+		output_directory = output_directory.resolve()
+		output_directory.mkdir(parents=True, exist_ok=True)
+	except Exception:
+		raise se.FileExistsException(f"Couldn’t create output directory: [path][link=file://{output_directory}]{output_directory}[/][/].")
+
+	# All clear to start building!
+	metadata_xml = self.metadata_xml
+
+	stats = BuildStats()
+	build_start = time.perf_counter()
+	loaded_resources = se.resources.get_load_times()
+
+	# Load the shared templates now, so that the stages running on different threads don't wait on each other to load them
+	with stats.span("resources"):
+		se.resources.preload(templates=se.resources.BUILD_TEMPLATES)
+
+	# Read the epub into memory; every later step works on this tree instead of on a copy of the repository on disk.
+	# Only the files in the build input manifest are read.
+	# If we're building a Git revision, the files are read straight from the repository's object database instead of from the working tree.
+	with stats.span("read") as span:
+		if self.commit:
+			build_tree = se.epub.BuildTree.from_git(self.commit.tree / "src", _get_build_input_paths(self))
+		else:
+			build_tree = se.epub.BuildTree.from_directory(self.path / "src", _get_build_input_paths(self))
+
+		span.files = len(build_tree)
+		span.bytes = build_tree.size
+
+	stats.input_files = len(build_tree)
+	stats.input_bytes = build_tree.size
+	if self.commit:
+		for item in self.commit.tree.traverse():
+			if item.type == "blob":
+				stats.skipped_files += 1
+				stats.skipped_bytes += item.size
+	else:
+		for root, dirnames, filenames in os.walk(self.path):
+			# The Git object database isn't part of the ebook, and a commit's tree doesn't include it either
+			dirnames[:] = [dirname for dirname in dirnames if dirname != ".git"]
+			for filename in filenames:
+				stats.skipped_files += 1
+				stats.skipped_bytes += (Path(root) / filename).lstat().st_size
+	stats.skipped_files -= stats.input_files
+	stats.skipped_bytes -= stats.input_bytes
+
+	# By convention the ASIN is set to the SHA-1 sum of the book's identifying URL
+	try:
+		identifier = self.metadata_dom.xpath("//dc:identifier")[0].inner_xml().replace("url:", "")
+		asin = sha1(identifier.encode("utf-8")).hexdigest()
+	except:
+		raise se.InvalidSeEbookException(f"Missing [xml]<dc:identifier>[/] element in [path][link=file://{self.metadata_file_path}]{self.metadata_file_path}[/][/].")
+
+	if not self.metadata_dom.xpath("//dc:title"):
+		raise se.InvalidSeEbookException(f"Missing [xml]<dc:title>[/] element in [path][link=file://{self.metadata_file_path}]{self.metadata_file_path}[/][/].")
+
+	output_filename = identifier.replace("https://standardebooks.org/ebooks/", "").replace("/", "_")
+	url_author = ""
+	for author in self.metadata_dom.xpath("//dc:creator"):
+		url_author = url_author + se.formatting.make_url_safe(author.inner_xml()) + "_"
+
+	url_author = url_author.rstrip("_")
+
+	epub_output_filename = f"{output_filename}{'.proof' if proof else ''}.epub"
+	epub3_output_filename = f"{output_filename}{'.proof' if proof else ''}.epub3"
+	kobo_output_filename = f"{output_filename}{'.proof' if proof else ''}.kepub.epub"
+	kindle_output_filename = f"{output_filename}{'.proof' if proof else ''}.azw3"
+
+	# Clean up old output files if any
+	se.quiet_remove(output_directory / f"thumbnail_{asin}_EBOK_portrait.jpg")
+	se.quiet_remove(output_directory / "cover.jpg")
+	se.quiet_remove(output_directory / "cover-thumbnail.jpg")
+	se.quiet_remove(output_directory / epub_output_filename)
+	se.quiet_remove(output_directory / epub3_output_filename)
+	se.quiet_remove(output_directory / kobo_output_filename)
+	se.quiet_remove(output_directory / kindle_output_filename)
+
+	# Are we including proofreading CSS?
+	if proof:
+		build_tree.write_text("epub/css/local.css", build_tree.read_text("epub/css/local.css") + se.resources.get_template("proofreading.css"))
+
+	# Update the release date in the metadata and colophon
+	if self.last_commit:
+		last_updated_iso = regex.sub(r"\.[0-9]+$", "", self.last_commit.timestamp.isoformat()) + "Z"
+		last_updated_iso = regex.sub(r"\+.+?Z$", "Z", last_updated_iso)
+		# In the line below, we can't use %l (unpadded 12 hour clock hour) because it isn't portable to Windows.
+		# Instead we use %I (padded 12 hour clock hour) and then do a string replace to remove leading zeros.
+		last_updated_friendly = f"{self.last_commit.timestamp:%B %e, %Y, %I:%M <abbr class=\"time eoc\">%p</abbr>}".replace(" 0", " ")
+		last_updated_friendly = regex.sub(r"\s+", " ", last_updated_friendly).replace("AM", "a.m.").replace("PM", "p.m.").replace(" <abbr", " <abbr")
+
+		# Set modified date in content.opf
+		self.metadata_xml = regex.sub(r"<meta property=\"dcterms:modified\">[^<]+?</meta>", f"<meta property=\"dcterms:modified\">{last_updated_iso}</meta>", self.metadata_xml)
+
+		build_tree.write_text("epub/content.opf", self.metadata_xml)
+
+		# Update the colophon with release info
+		xhtml = build_tree.read_text("epub/text/colophon.xhtml")
+
+		xhtml = xhtml.replace("<p>The first edition of this ebook was released on<br/>", f"<p>This edition was released on<br/>\n\t\t\t<b>{last_updated_friendly}</b><br/>\n\t\t\tand is based on<br/>\n\t\t\t<b>revision {self.last_commit.short_sha}</b>.<br/>\n\t\t\tThe first edition of this ebook was released on<br/>")
+
+		build_tree.write_text("epub/text/colophon.xhtml", xhtml)
+
+	# Find the metadata the later stages need now, so that they don't have to share the metadata DOM between threads
+	cover_href = self.metadata_dom.xpath("//item[@properties=\"cover-image\"]/@href")[0].replace(".svg", ".jpg")
+	cover_id = self.metadata_dom.xpath("//item[@properties=\"cover-image\"]/@id")[0].replace(".svg", ".jpg")
+	toc_filename = self.metadata_dom.xpath("//item[@properties=\"nav\"]/@href")[0]
+
+	# Now build the graph of stages. `build_tree` is the pure epub3 tree, and stages that change it work on a copy.
+	cache = se.cache.BuildCache(enabled=use_cache)
+	graph = _BuildGraph()
+	graph.add_stage("epub3", lambda: _write_epub(stats, "epub3-zip", build_tree, output_directory / epub3_output_filename, compression_level))
+	graph.add_stage("cover", lambda: _render_cover(stats, cache, build_tree))
+	graph.add_stage("covers", lambda cover_jpg: _output_covers(stats, cache, build_tree, cover_jpg, output_directory), ("cover",))
+	graph.add_stage("compatibility", lambda cover_jpg: _build_compatibility_tree(self, stats, cache, build_tree, metadata_xml, cover_jpg), ("cover",))
+	graph.add_stage("kepub", lambda compatibility: _build_kobo(self, stats, cache, compatibility[0], output_directory / kobo_output_filename, compression_level), ("compatibility",))
+	graph.add_stage("epub2", lambda compatibility: _build_epub2_tree(self, stats, cache, compatibility[0], compatibility[1], cover_id, toc_filename), ("compatibility",))
+	graph.add_stage("epub", lambda epub2_tree: _write_epub(stats, "epub-zip", epub2_tree, output_directory / epub_output_filename, compression_level), ("epub2",))
+	graph.add_stage("epubcheck", lambda _: _run_epubcheck(self, stats, cache, output_directory / epub_output_filename), ("epub",))
+
+	graph.add_stage("azw3-convert", lambda epub2_tree: _convert_kindle(self, stats, cache, epub2_tree, ebook_convert_path, toc_filename, cover_href, epub_output_filename, kindle_output_filename), ("epub2",))
+
+	# Calibre runs at the same time as epubcheck, but if epubcheck fails, don't create a Kindle file
+	graph.add_stage("azw3", lambda epub2_tree, azw3, *_: _output_kindle(stats, epub2_tree, azw3, asin, output_directory, kindle_output_filename), ("epub2", "azw3-convert", "epubcheck") if run_epubcheck else ("epub2", "azw3-convert"))
+
+	graph.run(targets + (["epubcheck"] if run_epubcheck else []) + (["covers"] if build_covers else []))
+
+	# Pruning has to look at every entry in the cache, so only do it if this build might have added some
+	if cache.misses:
+		with stats.span("cache-prune"):
+			cache.prune()
+
+	stats.cache_hits = cache.hits
+	stats.cache_misses = cache.misses
+	stats.wall_time = time.perf_counter() - build_start
+	stats.resource_load_times = {name: load_time for name, load_time in se.resources.get_load_times().items() if name not in loaded_resources}
+
+	return stats
@@ -3,10 +3,12 @@
 Defines various spelling-related helper functions.
 """
 
-from typing import Set
-import importlib_resources
+import functools
+from enum import Enum
+from typing import Dict, List, Optional, Set, Tuple, Union
 import regex
 import se
+import se.resources
 
 DICTIONARY: Set[str] = set()	# Store our hyphenation dictionary so we don't re-read the file on every pass
 
@@ -42,8 +44,7 @@ def modernize_hyphenation(xhtml: str) -> str:
 
 	# First, initialize our dictionary if we haven't already
 	if not se.spelling.DICTIONARY:
-		with importlib_resources.open_text("se.data", "words") as dictionary:
-			se.spelling.DICTIONARY = {line.strip().lower() for line in dictionary}
+		se.spelling.DICTIONARY = se.resources.get_words()
 
 	# Easy fix for a common case
 	xhtml = regex.sub(r"\b([Nn])ow-a-days\b", r"\1owadays", xhtml)	# now-a-days -> nowadays
@@ -108,10 +109,359 @@ def detect_problem_spellings(xhtml: str) -> list:
 
 	return output
 
+class _WordPart(Enum):
+	"""
+	Enum to indicate which part of a word an archaic spelling matches.
+	"""
+
+	WORD = 0	# The whole word, like `develope`
+	START = 1	# The start of a word, like `expence` in `expences`
+	END = 2		# The end of a word, like `chateau` in `chateau`
+	ANYWHERE = 3	# Anywhere in a word, like `exion` in `connexion`
+
+class _ArchaicSpelling:
+	"""
+	An archaic spelling of a word or part of a word, and its modern spelling.
+
+	If the archaic spelling starts with a lowercase letter, the same spelling with a capital first letter is also modernized,
+	and the modern spelling is capitalized to match, unless `capitalized` is False.
+	"""
+
+	def __init__(self, archaic: Union[str, Tuple[str, ...]], modern: str, part: _WordPart = _WordPart.WORD, capitalized: bool = True, not_before: Tuple[str, ...] = (), not_after: Tuple[str, ...] = (), languages: Optional[Tuple[str, ...]] = None):
+		self.part = part
+		self.languages = languages
+		self._not_before = not_before
+		self.forms: List[Tuple[str, str]] = [] # Tuples of the archaic and modern spellings, including capitalized ones, in the order they're tried
+
+		for form in ((archaic,) if isinstance(archaic, str) else archaic):
+			self.forms.append((form, modern))
+
+			if capitalized and form[0].upper() != form[0]:
+				self.forms.append((form[0].upper() + form[1:], modern[0].upper() + modern[1:]))
+
+		self._replacements = dict(self.forms)
+
+		if part == _WordPart.ANYWHERE:
+			lookbehind = f"(?<!{'|'.join(not_after)})" if not_after else ""
+			self._regex = regex.compile(lookbehind + "(?:" + "|".join(regex.escape(form) for form, _ in self.forms) + ")")
+
+	def apply(self, word: str) -> str:
+		"""
+		Return a word with this archaic spelling modernized.
+		"""
+
+		if self.part == _WordPart.WORD:
+			return self._replacements.get(word, word)
+
+		if self.part == _WordPart.ANYWHERE:
+			return self._regex.sub(lambda match: self._replacements[match.group()], word)
+
+		for form, modern in self.forms:
+			if self.part == _WordPart.START and word.startswith(form) and not word.startswith(self._not_before, len(form)):
+				return modern + word[len(form):]
+
+			if self.part == _WordPart.END and word.endswith(form):
+				return word[:-len(form)] + modern
+
+		return word
+
+# ADDING NEW WORDS TO THIS LIST:
+# A good way to check if a word is "archaic" is to do a Google N-Gram search: https://books.google.com/ngrams/graph?case_insensitive=on&year_start=1800&year_end=2000&smoothing=3
+# Remember that en-US and en-GB differ significantly, and just because a word might seem strange to you, doesn't mean it's not the common case in the other variant.
+# If Google N-Gram shows that a word has declined significantly in usage in BOTH en-US and en-GB (or the SE editor-in-chief makes an exception) then it may be a good candidate to add to this list.
+#
+# These are applied to each word in order, so a later spelling sees the result of earlier ones. Spellings that span several words, or that
+# depend on the punctuation around a word, go in _ARCHAIC_PHRASES instead.
+_ARCHAIC_SPELLINGS = [
+	_ArchaicSpelling("develope", "develop"),
+	_ArchaicSpelling("oker", "ocher"),
+	_ArchaicSpelling("wellnigh", "well-nigh"),
+	_ArchaicSpelling(("hindustanee", "hindoostanee"), "hindustani", _WordPart.START),
+	_ArchaicSpelling("hindoo", "hindu", _WordPart.START),
+	_ArchaicSpelling("expence", "expense", _WordPart.START),
+	_ArchaicSpelling("lotos", "lotus", _WordPart.START),
+	_ArchaicSpelling("scollop", "scallop", _WordPart.START),
+	_ArchaicSpelling(("subtile", "subtil"), "subtle", _WordPart.START, not_before=("ize", "izing")), # But "subtilize" and "subtilizing"
+	_ArchaicSpelling("quoiff", "coif", _WordPart.START),
+	_ArchaicSpelling("indorse", "endorse", _WordPart.START),
+	_ArchaicSpelling("intrust", "entrust", _WordPart.START),
+	_ArchaicSpelling(("phantasy", "phantasie"), "fantasy", _WordPart.START),
+	_ArchaicSpelling("phantastic", "fantastic", _WordPart.START),
+	_ArchaicSpelling("phrensy", "frenzy", _WordPart.START),
+	_ArchaicSpelling("menage", "ménage"),
+	_ArchaicSpelling("hypothenuse", "hypotenuse", _WordPart.ANYWHERE),
+	_ArchaicSpelling("naïve", "naive", _WordPart.ANYWHERE),
+	_ArchaicSpelling(("naïveté", "naïvete", "naiveté"), "naivete", _WordPart.ANYWHERE),
+	_ArchaicSpelling(("protege", "protegé", "protége"), "protégé", _WordPart.ANYWHERE),
+	_ArchaicSpelling("facade", "façade", _WordPart.ANYWHERE),
+	_ArchaicSpelling(("chateaus", "cateaus"), "châteaus", _WordPart.END),
+	_ArchaicSpelling(("chateau", "cateau"), "château", _WordPart.END),
+	_ArchaicSpelling("habitue", "habitué", _WordPart.ANYWHERE),
+	_ArchaicSpelling("blase", "blasé"),
+	_ArchaicSpelling("cafe", "café"),
+	_ArchaicSpelling("cafes", "cafés"), # We break up cafe so that we don't catch 'cafeteria'
+	_ArchaicSpelling("mêlée", "melee", _WordPart.ANYWHERE),
+	_ArchaicSpelling("fete", "fête"),
+	_ArchaicSpelling("fetes", "fêtes"),
+	_ArchaicSpelling("feted", "fêted"),
+	_ArchaicSpelling("rôle", "role"),
+	_ArchaicSpelling("coö", "coo", _WordPart.START), # As in coöperate
+	_ArchaicSpelling("reë", "ree", _WordPart.START), # As in reëvaluate
+	_ArchaicSpelling("daïs", "dais"),
+	_ArchaicSpelling("canape", "canapé", _WordPart.START),
+	_ArchaicSpelling("precis", "précis"),
+	_ArchaicSpelling("eclat", "éclat"),
+	_ArchaicSpelling("entree", "entrée"),
+	_ArchaicSpelling("entrees", "entrées"),
+	_ArchaicSpelling("fiance", "fiancé", _WordPart.START),
+	_ArchaicSpelling("outre", "outré"),
+	_ArchaicSpelling("fetich", "fetish", _WordPart.START),
+	_ArchaicSpelling("pigstye", "pigsty"),
+	_ArchaicSpelling("pigstyes", "pigsties"),
+	_ArchaicSpelling("clew", "clue"),
+	_ArchaicSpelling("clews", "clues"),
+	_ArchaicSpelling("employé", "employee", _WordPart.START),
+	_ArchaicSpelling("burthen", "burden", _WordPart.START),
+	_ArchaicSpelling("disburthen", "disburden", _WordPart.START),
+	_ArchaicSpelling(("Elysee", "Elysée", "Élysee"), "Élysée", _WordPart.START),
+	_ArchaicSpelling("incase", "encase", _WordPart.START),
+	_ArchaicSpelling("inclose", "enclose", _WordPart.START),
+	_ArchaicSpelling("waggon", "wagon", _WordPart.START),
+	_ArchaicSpelling("swop", "swap", _WordPart.START),
+	_ArchaicSpelling("lacquey", "lackey", _WordPart.START),
+	_ArchaicSpelling("kiosque", "kiosk", _WordPart.START),
+	_ArchaicSpelling("depôt", "depot", _WordPart.START),
+	_ArchaicSpelling("exion", "ection", _WordPart.ANYWHERE, capitalized=False, not_after=("Compl", "compl")), # connexion, reflexion, etc., but "complexion"
+	_ArchaicSpelling("dulness", "dullness", _WordPart.START),
+	_ArchaicSpelling("fiord", "fjord", _WordPart.START),
+	_ArchaicSpelling("fulness", "fullness"), # But not for ex. thoughtfulness
+	_ArchaicSpelling("shew", "show", _WordPart.START),
+	_ArchaicSpelling("trowsers", "trousers", _WordPart.START),
+	_ArchaicSpelling("biass", "bias", _WordPart.ANYWHERE), # (un)biass(ed)
+	_ArchaicSpelling("chuse", "choose", _WordPart.START),
+	_ArchaicSpelling("chusing", "choosing", _WordPart.START),
+	_ArchaicSpelling("controul", "control"),
+	_ArchaicSpelling("controuls", "controls"),
+	_ArchaicSpelling("controuling", "controlling", _WordPart.START),
+	_ArchaicSpelling("controuled", "controlled", _WordPart.START),
+	_ArchaicSpelling("surprize", "surprise", _WordPart.START),
+	_ArchaicSpelling("surprizing", "surprising", _WordPart.START),
+	_ArchaicSpelling("doat", "dote"),
+	_ArchaicSpelling("doated", "doted", _WordPart.START),
+	_ArchaicSpelling("doating", "doting", _WordPart.START),
+	_ArchaicSpelling("stopt", "stopped", _WordPart.START),
+	_ArchaicSpelling("stept", "stepped", _WordPart.START),
+	_ArchaicSpelling("secresy", "secrecy", _WordPart.START),
+	_ArchaicSpelling("mesalliance", "mésalliance", _WordPart.START),
+	_ArchaicSpelling("sate", "sat"),
+	_ArchaicSpelling("attache", "attaché"),
+	_ArchaicSpelling(("neglige", "negligé", "negligée", "néglige", "négligé", "négligee", "négligée"), "negligee"),
+	_ArchaicSpelling(("negliges", "negligés", "negligées", "négliges", "négligés", "négligees", "négligées"), "negligees"),
+	_ArchaicSpelling("focuss", "focus", _WordPart.START),
+	_ArchaicSpelling("nee", "née"),
+	_ArchaicSpelling("senor", "señor", _WordPart.START), # senores, senorita/s, etc.
+	_ArchaicSpelling(("gramm", "gramme"), "gram"),
+	_ArchaicSpelling(("gramms", "grammes"), "grams"),
+	_ArchaicSpelling("alarum", "alarm"),
+	_ArchaicSpelling("bowlder", "boulder"),
+	_ArchaicSpelling("bowlders", "boulders"),
+	_ArchaicSpelling("distingue", "distingué"),
+	_ArchaicSpelling(("ecarte", "ecarté", "écarte"), "écarté"),
+	_ArchaicSpelling("pere", "père"), # e.g. père la chaise
+	_ArchaicSpelling("3d", "3rd"), # Warning: check that we don't convert 3d in the "3 pence" sense!
+	_ArchaicSpelling("2d", "2nd"), # Warning: check that we don't convert 2d in the "2 pence" sense!
+	_ArchaicSpelling(("miauw", "miaow"), "meow", _WordPart.START),
+	_ArchaicSpelling("caviare", "caviar", _WordPart.START),
+	_ArchaicSpelling(("sureté", "surete", "sûrete"), "sûreté", _WordPart.START),
+	_ArchaicSpelling("seance", "séance", _WordPart.START),
+	_ArchaicSpelling("empale", "impale", _WordPart.START),
+	_ArchaicSpelling("tabu", "taboo"),
+	_ArchaicSpelling("tabus", "taboos"),
+	_ArchaicSpelling("kidnaping", "kidnapping"),
+	_ArchaicSpelling("Quixotic", "quixotic"),
+	_ArchaicSpelling("partizan", "partisan", _WordPart.ANYWHERE),
+	_ArchaicSpelling("nonplused", "nonplussed", _WordPart.ANYWHERE),
+	_ArchaicSpelling("reärrangement", "rearrangement", _WordPart.START),
+	_ArchaicSpelling("muntru", "mantra"),
+	_ArchaicSpelling("muntrus", "mantras"),
+	_ArchaicSpelling("huzzy", "hussy"),
+	_ArchaicSpelling("huzzies", "hussies"),
+	_ArchaicSpelling("hiccough", "hiccup", _WordPart.START),
+	_ArchaicSpelling("roue", "roué"),
+	_ArchaicSpelling("roues", "roués"),
+	_ArchaicSpelling(("emigre", "emigré", "émigre"), "émigré", _WordPart.START, not_before=("e",)), # But not emigrée, which is French
+
+	# Normalize some names
+	_ArchaicSpelling("Moliere", "Molière", _WordPart.ANYWHERE),
+	_ArchaicSpelling("Tolstoi", "Tolstoy", _WordPart.ANYWHERE),
+	_ArchaicSpelling("Buonaparte", "Bonaparte", _WordPart.ANYWHERE),
+	_ArchaicSpelling("Raffaelle", "Raphael", _WordPart.ANYWHERE),
+	_ArchaicSpelling("Vergil", "Virgil", _WordPart.START),
+	_ArchaicSpelling("Vishnoo", "Vishnu", _WordPart.START),
+	_ArchaicSpelling("Pekin", "Peking"),
+	_ArchaicSpelling("Cracow", "Krakow", _WordPart.START),
+	_ArchaicSpelling("Kief", "Kiev", _WordPart.START),
+	_ArchaicSpelling("Roumanian", "Romanian", _WordPart.START),
+	_ArchaicSpelling("renascence", "renaissance", _WordPart.START),
+	_ArchaicSpelling("Thibet", "Tibet", _WordPart.START),
+	_ArchaicSpelling("Timbuctoo", "Timbuktu", _WordPart.START),
+	_ArchaicSpelling("Rumania", "Romania", _WordPart.START),
+	_ArchaicSpelling("Tokio", "Tokyo", _WordPart.START),
+	_ArchaicSpelling(("Tchekhov", "Tchekov"), "Chekhov", _WordPart.START),
+	_ArchaicSpelling("Vereshtchagin", "Vereshchagin", _WordPart.START),
+	_ArchaicSpelling("Soudan", "Sudan", _WordPart.START),
+
+	# Remove archaic diphthongs
+	_ArchaicSpelling(("mediæval", "mediaeval"), "medieval", _WordPart.START),
+	_ArchaicSpelling("Cæsar", "Caesar", _WordPart.ANYWHERE),
+	_ArchaicSpelling("Crœsus", "Croesus", _WordPart.ANYWHERE),
+	_ArchaicSpelling("æon", "aeon"),
+	_ArchaicSpelling("Æschylus", "Aeschylus", _WordPart.ANYWHERE),
+	_ArchaicSpelling("æsthet", "aesthet", _WordPart.ANYWHERE), # aesthetic, aesthete, etc.
+	_ArchaicSpelling("hyæna", "hyena", _WordPart.START),
+	_ArchaicSpelling("Œdip", "Oedip", _WordPart.ANYWHERE), # Oedipus, Oedipal
+	_ArchaicSpelling("pæan", "paean", _WordPart.START),
+	_ArchaicSpelling("vertebræ", "vertebrae", _WordPart.START),
+
+	# Canadian spelling follows US
+	_ArchaicSpelling("cosey", "cozy", _WordPart.START, languages=("en-US", "en-CA")),
+
+	# Australian spelling follows GB
+	_ArchaicSpelling("cosey", "cosy", _WordPart.START, languages=("en-GB", "en-AU")),
+
+	# US spelling is unique
+	_ArchaicSpelling(("manœuver", "manœuvre"), "maneuver", _WordPart.START, languages=("en-US",)), # Omit last letter to catch both maneuverS and maneuverING
+	_ArchaicSpelling("manœuvering", "maneuvering", _WordPart.START, languages=("en-US",)),
+	_ArchaicSpelling(("manœuver", "manœuvre"), "manoeuvre", _WordPart.START, languages=("en-GB", "en-AU", "en-CA")),
+	_ArchaicSpelling("manœuvring", "manoeuvring", _WordPart.START, languages=("en-GB", "en-AU", "en-CA")),
+	_ArchaicSpelling("manoeuvreing", "manoeuvring", _WordPart.START, languages=("en-GB", "en-AU", "en-CA"))
+]
+
+# Archaic spellings that span several words or depend on the punctuation around a word, in order, as tuples of a regex, its replacement,
+# and the words that every match contains at least one of as a whole word. A regex with no words is always applied.
+_ARCHAIC_PHRASES = [(regex.compile(pattern), replacement, words) for pattern, replacement, words in [
+	(r"\b([Tt]he|[Aa]nd|[Oo]r) what not(?! to)\b", r"\1 whatnot", ("not",)),	# what not -> whatnot
+	(r"\b([Gg])ood[\-]bye?\b", r"\1oodbye", ("by", "bye")),				# good-by -> goodbye
+	(r"\b([Gg])ood\sbye\b", r"\1oodbye", ("bye",)),				# good bye -> goodbye (Note that we can't do `good by` -> `goodby` because one might do good by someone.
+	(r"\b([Gg])ood[\-\s]?bye?s\b", r"\1oodbyes", ("bys", "byes", "goodbys", "goodbyes", "Goodbys", "Goodbyes")),			# good bys -> goodbyes
+	(r"[‘’]([Bb])us\b", r"\1us", ("bus", "Bus")),					# ’bus -> bus
+	(r"&amp;c\.", r"etc.", ("c",)),						# &c. -> etc.
+	(r"([Tt])ete-a-tete", r"\1ête-à-tête", ("a",)),				# tete-a-tete -> tête-à-tête
+	(r"([Vv])is-a-vis", r"\1is-à-vis", ("a",)),				# vis-a-vis _> vis-à-vis
+	(r"\b([Bb])bee[’']s[ \-]wax\b", r"\1eeswax", ("wax",)),			# bee’s-wax -> beeswax
+	(r"\b([Cc])oup\-de\-grace", r"\1oup-de-grâce", ("de",)),			# coup-de-grace -> coup-de-grâce
+	(r"\b([Gg])ood\-night", r"\1ood night", ("good", "Good")),			# good-night -> good night
+	(r"\b([Gg])ood\-morning", r"\1ood morning", ("good", "Good")),			# good-morning -> good morning
+	(r"\b([Gg])ood\-evening", r"\1ood evening", ("good", "Good")),			# good-evening -> good evening
+	(r"\b([Gg])ood\-day", r"\1ood day", ("good", "Good")),				# good-day -> good day
+	(r"\b([Gg])ood\-afternoon", r"\1ood afternoon", ("good", "Good")),		# good-afternoon -> good afternoon
+	(r"\b([Bb])ete noir", r"\1ête noir", ("bete", "Bete")),				# bete noir -> bête noir
+	(r"\ba la\b", r"à la", ("la",)),						# a la -> à la
+	(r"\ba propos\b", r"apropos", ("propos",)),					# a propos -> apropos
+	(r"\bper cent(s?)\b", r"percent\1", ("per",)),				# per cent -> percent
+	(r"\bpercent\.(\s+[\p{Lowercase_Letter}])", r"percent\1", ("percent",)),	# percent. followed by lowercase -> percent
+	(r"\bpercent\.,\b", r"percent,", ("percent",)),				# per cent. -> percent
+	(r"\b[ÀA]\s?propos\b", r"Apropos", ("propos", "Apropos", "Àpropos")),				# à propos -> apropos
+	(r"\b[àa]\s?propos\b", r"apropos", ("propos", "apropos", "àpropos")),				# à propos -> apropos
+	(r"\b([Nn])ew comer(s?)\b", r"\1ewcomer\2", ("comer", "comers")),			# new comer -> newcomer
+	(r"\b([Pp])ease\b(?![ \-]pudding)", r"\1eas", ("pease", "Pease")),	# pease -> peas (but "pease pudding")
+	(r"\b([Ss])uch like\b", r"\1uchlike", ("like",)),				# such like -> suchlike
+	(r"\b(?<!ancien )([Rr])égime", r"\1egime", ()),			# régime -> regime (but "ancien régime")
+	(r"\b([Ll])aw suit", r"\1awsuit", ("law", "Law")),				# law suit -> lawsuit
+	(r"\b([Cc])ocoa-?nut", r"\1oconut", ()),				# cocoanut / cocoa-nut -> coconut
+	(r"\b([Bb])ric-à-brac", r"\1ric-a-brac", ("bric", "Bric")),			# bric-à-brac -> bric-a-brac
+	(r"['’]([Pp])hone", r"\1hone", ()),					# ’phone -> phone; note that we can't use \b on the left because it won't match for some reason
+	(r"\b([Pp])orte[\- ]coch[eè]re\b", r"\1orte-cochère", ("porte", "Porte")),		# porte-cochere -> porte-cochère
+	(r"\b([Ss])hort cut(s?)\b", r"\1hortcut\2", ("cut", "cuts")),			# short cut -> shortcut
+	(r"\b([Mm])ise[ \-]en[ \-]sc[eè]ne", r"\1ise-en-scène", ("en",)),	# mise en scene -> mise-en-scène
+	(r"\b([Ee])au[ \-]de[ \-]Cologne\b", r"\1au de cologne", ("Cologne",)),	# eau de Cologne -> eau de cologne
+	(r"\b([Tt])able(s?) d’hote\b", r"\1able\2 d’hôte", ("hote",)),		# table d'hote -> table d'hôte
+	(r"\b([Ee])au(x?)[ \-]de[ \-]vie\b", r"\1au\2-de-vie", ("vie",)),		# eau de vie -> eau-de-vie
+	(r"\b([Ss])ha’n’t", r"\1han’t", ("n",)),				# sha'n't -> shan't (see https://english.stackexchange.com/questions/71414/apostrophes-in-contractions-shant-shant-or-shant)
+	(r"\b([Ff])in[\- ]de[\- ]siecle", r"\1in de siècle", ("de",)),		# fin de siecle -> fin de siècle
+	(r"([^\p{Lowercase_Letter}]’[Tt])\s(is|were|was|isn’t)\b", r"\1\2", ("t", "T")),	# 't is, 't was, 't were 't isn't -> 'tis, 'twas, 'twere, 't isn't
+	(r"\b([Uu])p stairs\b", r"\1pstairs", ("stairs",)),				# up stairs -> upstairs
+	(r"(?<!up and )(?<!up or )\b([Dd])own stairs\b", r"\1ownstairs", ("stairs",)),	# down stairs -> downstairs, but not "up (or|and) down stairs"
+	(r"\b([Ii])dee fixe\b", r"\1dée fixe", ("fixe",)),				# idee fixe -> idée fixe
+	(r"\b([Ss])treet[\s\-]arab\b", r"\1treet Arab", ("arab",)),		# street-arab -> street Arab
+
+	# Normalize some names
+	(r"Shake?spea?r([^ie])", r"Shakespeare\1", ()),			# Shakespear/Shakspeare -> Shakespeare
+	(r"Shake?spea?re", r"Shakespeare", ()),				# Shakespear/Shakspeare -> Shakespeare
+	(r"Shakspea?rean", r"Shakespearean", ()),				# Shaksperean -> Shakespearean
+	(r"Shakspea?re?’s", r"Shakespeare’s", ()),				# Shakspere’s -> Shakespeare’s
+	(r"Michael Angelo", r"Michaelangelo", ()),				# Michael Angelo -> Michaelangelo
+	(r"\bBuenos Ayres\b", r"Buenos Aires", ("Ayres",)),				# Buenos Ayres -> Buenos Aires
+	(r"\bJack-in-the-box", "jack-in-the-box", ()),			# Jack-in-the-box -> jack-in-the-box
+
+	# Remove spaces before contractions like n’t eg "is n’t" -> "isn’t"
+	(r" n’t\b", "n’t", ("n",)),
+
+	# Remove roman ordinals
+	(r"<span epub:type=\"z3998:roman\">(.*?)</span>(st|nd|rd|th)\b", r"<span epub:type=\"z3998:roman\">\1</span>", ())
+]]
+
+_WORD_REGEX = regex.compile(r"\w+")
+_ARCHAIC_SPELLING_INDEXES: Dict[str, Tuple[List[_ArchaicSpelling], Set[str], Dict[int, Set[str]], Dict[int, Set[str]], Set[str]]] = {}
+
+def _get_archaic_spelling_index(language: str) -> Tuple[List[_ArchaicSpelling], Set[str], Dict[int, Set[str]], Dict[int, Set[str]], Set[str]]:
+	"""
+	Return the archaic spellings for a language, and the forms they match, so that a word can be checked for any of them with a few lookups.
+
+	OUTPUTS
+	A tuple of the archaic spellings in order; the set of whole words; dicts of word starts and word ends by length; and the set of forms that can appear anywhere in a word.
+	"""
+
+	index = _ARCHAIC_SPELLING_INDEXES.get(language)
+
+	if index is None:
+		spellings = [spelling for spelling in _ARCHAIC_SPELLINGS if spelling.languages is None or language in spelling.languages]
+		words: Set[str] = set()
+		starts: Dict[int, Set[str]] = {}
+		ends: Dict[int, Set[str]] = {}
+		anywhere: Set[str] = set()
+
+		for spelling in spellings:
+			for form, _ in spelling.forms:
+				if spelling.part == _WordPart.WORD:
+					words.add(form)
+				elif spelling.part == _WordPart.START:
+					starts.setdefault(len(form), set()).add(form)
+				elif spelling.part == _WordPart.END:
+					ends.setdefault(len(form), set()).add(form)
+				else:
+					anywhere.add(form)
+
+		index = (spellings, words, starts, ends, anywhere)
+		_ARCHAIC_SPELLING_INDEXES[language] = index
+
+	return index
+
+@functools.lru_cache(maxsize=se.WORD_CACHE_SIZE)
+def _modernize_word(word: str, language: str) -> str:
+	"""
+	Return a word with its archaic spellings modernized.
+
+	Books reuse the same words over and over, so the modern spellings of the most recently used words are remembered.
+	"""
+
+	spellings, words, starts, ends, anywhere = _get_archaic_spelling_index(language)
+	modern_word = word
+
+	# Most words have no archaic spellings, so check that before trying each spelling in order
+	if word in words or any(word[:length] in forms for length, forms in starts.items()) or any(word[-length:] in forms for length, forms in ends.items()) or any(form in word for form in anywhere):
+		for spelling in spellings:
+			modern_word = spelling.apply(modern_word)
+
+	return modern_word
+
 def modernize_spelling(xhtml: str) -> str:
 	"""
 	Convert old-timey spelling on a case-by-case basis.
 
+	Each distinct word is looked up in _ARCHAIC_SPELLINGS once, and then the regexes in _ARCHAIC_PHRASES are applied in order,
+	skipping those whose words aren't in the text.
+
 	INPUTS
 	xhtml: A string of XHTML to modernize
 
@@ -121,231 +471,27 @@ def modernize_spelling(xhtml: str) -> str:
 
 	language = get_xhtml_language(xhtml)
 
-	# ADDING NEW WORDS TO THIS LIST:
-	# A good way to check if a word is "archaic" is to do a Google N-Gram search: https://books.google.com/ngrams/graph?case_insensitive=on&year_start=1800&year_end=2000&smoothing=3
-	# Remember that en-US and en-GB differ significantly, and just because a word might seem strange to you, doesn't mean it's not the common case in the other variant.
-	# If Google N-Gram shows that a word has declined significantly in usage in BOTH en-US and en-GB (or the SE editor-in-chief makes an exception) then it may be a good candidate to add to this list.
-
-	xhtml = regex.sub(r"\b([Dd])evelope\b", r"\1evelop", xhtml)			# develope -> develop
-	xhtml = regex.sub(r"\b([Oo])ker\b", r"\1cher", xhtml)				# oker -> ocher
-	xhtml = regex.sub(r"\b([Ww])ellnigh\b", r"\1ell-nigh", xhtml)			# wellnigh -> well-nigh
-	xhtml = regex.sub(r"\b([Tt]he|[Aa]nd|[Oo]r) what not(?! to)\b", r"\1 whatnot", xhtml)	# what not -> whatnot
-	xhtml = regex.sub(r"\b([Gg])ood[\-]bye?\b", r"\1oodbye", xhtml)			# good-by -> goodbye
-	xhtml = regex.sub(r"\b([Gg])ood\sbye\b", r"\1oodbye", xhtml)			# good bye -> goodbye (Note that we can't do `good by` -> `goodby` because one might do good by someone.
-	xhtml = regex.sub(r"\b([Gg])ood[\-\s]?bye?s\b", r"\1oodbyes", xhtml)		# good bys -> goodbyes
-	xhtml = regex.sub(r"\b([Hh])ind(u|oo)stanee", r"\1industani", xhtml)		# hindoostanee -> hindustani
-	xhtml = regex.sub(r"\b([Hh])indoo", r"\1indu", xhtml)				# hindoo -> hindu
-	xhtml = regex.sub(r"\b([Ee])xpence", r"\1xpense", xhtml)			# expence -> expense
-	xhtml = regex.sub(r"\b([Ll])otos", r"\1otus", xhtml)				# lotos -> lotus
-	xhtml = regex.sub(r"\b([Ss])collop", r"\1callop", xhtml)			# scollop -> scallop
-	xhtml = regex.sub(r"\b([Ss])ubtile?(?!(ize|izing))", r"\1ubtle", xhtml)		# subtil -> subtle (but "subtilize" and "subtilizing")
-	xhtml = regex.sub(r"\bQuoiff", r"Coif", xhtml)					# quoiff -> coif
-	xhtml = regex.sub(r"\bquoiff", r"coif", xhtml)					# quoiff -> coif
-	xhtml = regex.sub(r"\bIndorse", r"Endorse", xhtml)				# Indorse -> Endorse
-	xhtml = regex.sub(r"\bindorse", r"endorse", xhtml)				# indorse -> endorse
-	xhtml = regex.sub(r"\bIntrust", r"Entrust", xhtml)				# Intrust -> Entrust
-	xhtml = regex.sub(r"\bintrust", r"entrust", xhtml)				# intrust -> entrust
-	xhtml = regex.sub(r"\bPhantas(y|ie)", r"Fantasy", xhtml)			# Phantasie -> Fantasy
-	xhtml = regex.sub(r"\bphantas(y|ie)", r"fantasy", xhtml)			# phantasie -> fantasy
-	xhtml = regex.sub(r"\bPhantastic", r"Fantastic", xhtml)				# Phantastic -> Fantastic
-	xhtml = regex.sub(r"\bphantastic", r"fantastic", xhtml)				# phantastic -> fantastic
-	xhtml = regex.sub(r"\bPhrensy", r"Frenzy", xhtml)				# Phrensy -> Frenzy
-	xhtml = regex.sub(r"\bphrensy", r"frenzy", xhtml)				# phrensy -> frenzy
-	xhtml = regex.sub(r"\b([Mm])enage\b", r"\1énage", xhtml)			# menage -> ménage
-	xhtml = regex.sub(r"([Hh])ypothenuse", r"\1ypotenuse", xhtml)			# hypothenuse -> hypotenuse
-	xhtml = regex.sub(r"[‘’]([Bb])us\b", r"\1us", xhtml)				# ’bus -> bus
-	xhtml = regex.sub(r"([Nn])aïve", r"\1aive", xhtml)				# naïve -> naive
-	xhtml = regex.sub(r"([Nn])a[ïi]vet[ée]", r"\1aivete", xhtml)			# naïveté -> naivete
-	xhtml = regex.sub(r"&amp;c\.", r"etc.", xhtml)					# &c. -> etc.
-	xhtml = regex.sub(r"([Pp])rot[ée]g[ée]", r"\1rotégé", xhtml)			# protege -> protégé
-	xhtml = regex.sub(r"([Tt])ete-a-tete", r"\1ête-à-tête", xhtml)			# tete-a-tete -> tête-à-tête
-	xhtml = regex.sub(r"([Vv])is-a-vis", r"\1is-à-vis", xhtml)			# vis-a-vis _> vis-à-vis
-	xhtml = regex.sub(r"([Ff])acade", r"\1açade", xhtml)				# facade -> façade
-	xhtml = regex.sub(r"([Cc])h?ateau(s?\b)", r"\1hâteau\2", xhtml)			# chateau -> château
-	xhtml = regex.sub(r"([Hh])abitue", r"\1abitué", xhtml)				# habitue -> habitué
-	xhtml = regex.sub(r"\b([Bb])lase\b", r"\1lasé", xhtml)				# blase -> blasé
-	xhtml = regex.sub(r"\b([Bb])bee[’']s[ \-]wax\b", r"\1eeswax", xhtml)		# bee’s-wax -> beeswax
-	xhtml = regex.sub(r"\b([Cc])afe\b", r"\1afé", xhtml)				# cafe -> café
-	xhtml = regex.sub(r"\b([Cc])afes\b", r"\1afés", xhtml)				# cafes -> cafés; We break up cafe so that we don't catch 'cafeteria'
-	xhtml = regex.sub(r"([Mm])êlée", r"\1elee", xhtml)				# mêlée -> melee
-	xhtml = regex.sub(r"\b([Ff])ete([sd])?\b", r"\1ête\2", xhtml)			# fete -> fête
-	xhtml = regex.sub(r"\b([Rr])ôle\b", r"\1ole", xhtml)				# rôle -> role
-	xhtml = regex.sub(r"\b([Cc])oö", r"\1oo", xhtml)				# coö -> coo (as in coöperate)
-	xhtml = regex.sub(r"\b([Rr])eë", r"\1ee", xhtml)				# reë -> ree (as in reëvaluate)
-	xhtml = regex.sub(r"\b([Dd])aïs\b", r"\1ais", xhtml)				# daïs -> dais
-	xhtml = regex.sub(r"\b([Cc])oup\-de\-grace", r"\1oup-de-grâce", xhtml)		# coup-de-grace -> coup-de-grâce
-	xhtml = regex.sub(r"\b([Cc])anape", r"\1anapé", xhtml)				# canape -> canapé
-	xhtml = regex.sub(r"\b([Pp])recis\b", r"\1récis", xhtml)			# precis -> précis
-	xhtml = regex.sub(r"\b([Gg])ood\-night", r"\1ood night", xhtml)			# good-night -> good night
-	xhtml = regex.sub(r"\b([Gg])ood\-morning", r"\1ood morning", xhtml)		# good-morning -> good morning
-	xhtml = regex.sub(r"\b([Gg])ood\-evening", r"\1ood evening", xhtml)		# good-evening -> good evening
-	xhtml = regex.sub(r"\b([Gg])ood\-day", r"\1ood day", xhtml)			# good-day -> good day
-	xhtml = regex.sub(r"\b([Gg])ood\-afternoon", r"\1ood afternoon", xhtml)		# good-afternoon -> good afternoon
-	xhtml = regex.sub(r"\b([Bb])ete noir", r"\1ête noir", xhtml)			# bete noir -> bête noir
-	xhtml = regex.sub(r"\bEclat\b", r"Éclat", xhtml)				# Eclat -> Éclat
-	xhtml = regex.sub(r"\beclat\b", r"éclat", xhtml)				# eclat -> éclat
-	xhtml = regex.sub(r"\ba la\b", r"à la", xhtml)					# a la -> à la
-	xhtml = regex.sub(r"\ba propos\b", r"apropos", xhtml)				# a propos -> apropos
-	xhtml = regex.sub(r"\bper cent(s?)\b", r"percent\1", xhtml)			# per cent -> percent
-	xhtml = regex.sub(r"\bpercent\.(\s+[\p{Lowercase_Letter}])", r"percent\1", xhtml)		# percent. followed by lowercase -> percent
-	xhtml = regex.sub(r"\bpercent\.,\b", r"percent,", xhtml)			# per cent. -> percent
-	xhtml = regex.sub(r"\b([Ee])ntree(s?)\b", r"\1ntrée\2", xhtml)			# entree -> entrée
-	xhtml = regex.sub(r"\b([Ff])iance", r"\1iancé", xhtml)				# fiance -> fiancé
-	xhtml = regex.sub(r"\b([Oo])utre\b", r"\1utré", xhtml)				# outre -> outré
-	xhtml = regex.sub(r"\b([Ff])etich", r"\1etish", xhtml)				# fetich -> fetish
-	xhtml = regex.sub(r"\b([Pp])igstye\b", r"\1igsty", xhtml)			# pigstye -> pigsty
-	xhtml = regex.sub(r"\b([Pp])igstyes\b", r"\1igsties", xhtml)			# pigstyes -> pigsties
-	xhtml = regex.sub(r"\b([Cc])lew(s?)\b", r"\1lue\2", xhtml)			# clew -> clue
-	xhtml = regex.sub(r"\b[ÀA]\s?propos\b", r"Apropos", xhtml)			# à propos -> apropos
-	xhtml = regex.sub(r"\b[àa]\s?propos\b", r"apropos", xhtml)			# à propos -> apropos
-	xhtml = regex.sub(r"\b([Nn])ew comer(s?)\b", r"\1ewcomer\2", xhtml)		# new comer -> newcomer
-	xhtml = regex.sub(r"\b([Pp])ease\b(?![ \-]pudding)", r"\1eas", xhtml)		# pease -> peas (but "pease pudding")
-	xhtml = regex.sub(r"\b([Ss])uch like\b", r"\1uchlike", xhtml)			# such like -> suchlike
-	xhtml = regex.sub(r"\b([Ee])mployé", r"\1mployee", xhtml)			# employé -> employee
-	xhtml = regex.sub(r"\b(?<!ancien )([Rr])égime", r"\1egime", xhtml)		# régime -> regime (but "ancien régime")
-	xhtml = regex.sub(r"\b([Bb])urthen", r"\1urden", xhtml)				# burthen -> burden
-	xhtml = regex.sub(r"\b([Dd])isburthen", r"\1isburden", xhtml)			# disburthen -> disburthen
-	xhtml = regex.sub(r"\b[EÉ]lys[eé]e", r"Élysée", xhtml)				# Elysee -> Élysée
-	xhtml = regex.sub(r"\b([Ll])aw suit", r"\1awsuit", xhtml)			# law suit -> lawsuit
-	xhtml = regex.sub(r"\bIncase", r"Encase", xhtml)				# Incase -> Encase
-	xhtml = regex.sub(r"\bincase", r"encase", xhtml)				# incase -> encase
-	xhtml = regex.sub(r"\bInclose", r"Enclose", xhtml)				# Inclose -> Enclose
-	xhtml = regex.sub(r"\binclose", r"enclose", xhtml)				# inclose -> enclose
-	xhtml = regex.sub(r"\b([Cc])ocoa-?nut", r"\1oconut", xhtml)			# cocoanut / cocoa-nut -> coconut
-	xhtml = regex.sub(r"\b([Ww])aggon", r"\1agon", xhtml)				# waggon -> wagon
-	xhtml = regex.sub(r"\b([Ss])wop", r"\1wap", xhtml)				# swop -> swap
-	xhtml = regex.sub(r"\b([Ll])acquey", r"\1ackey", xhtml)				# lacquey -> lackey
-	xhtml = regex.sub(r"\b([Bb])ric-à-brac", r"\1ric-a-brac", xhtml)		# bric-à-brac -> bric-a-brac
-	xhtml = regex.sub(r"\b([Kk])iosque", r"\1iosk", xhtml)				# kiosque -> kiosk
-	xhtml = regex.sub(r"\b([Dd])epôt", r"\1epot", xhtml)				# depôt -> depot
-	xhtml = regex.sub(r"(?<![Cc]ompl)exion", r"ection", xhtml)			# -extion -> -exction (connexion, reflexion, etc., but "complexion")
-	xhtml = regex.sub(r"\b([Dd])ulness", r"\1ullness", xhtml)			# dulness -> dullness
-	xhtml = regex.sub(r"\b([Ff])iord", r"\1jord", xhtml)				# fiord -> fjord
-	xhtml = regex.sub(r"\b([Ff])ulness\b", r"\1ullness", xhtml)			# fulness -> fullness (but not for ex. thoughtfulness)
-	xhtml = regex.sub(r"['’]([Pp])hone", r"\1hone", xhtml)				# ’phone -> phone; note that we can't use \b on the left because it won't match for some reason
-	xhtml = regex.sub(r"\b([Ss])hew", r"\1how", xhtml)				# shew -> show
-	xhtml = regex.sub(r"\b([Tt])rowsers", r"\1rousers", xhtml)			# trowsers -> trousers
-	xhtml = regex.sub(r"([Bb])iass", r"\1ias", xhtml)				# (un)biass(ed) -> (un)bias(ed)
-	xhtml = regex.sub(r"\b([Cc])huse", r"\1hoose", xhtml)				# chuse -> choose
-	xhtml = regex.sub(r"\b([Cc])husing", r"\1hoosing", xhtml)			# chusing -> choosing
-	xhtml = regex.sub(r"\b([Cc])ontroul(s?)\b", r"\1ontrol\2", xhtml)		# controul -> control
-	xhtml = regex.sub(r"\b([Cc])ontroul(ing|ed)", r"\1ontroll\2", xhtml)		# controuling/ed -> controlling/ed
-	xhtml = regex.sub(r"\b([Ss])urpriz(e|ing)", r"\1urpris\2", xhtml)		# surprize->surprise, surprizing->surprising
-	xhtml = regex.sub(r"\b([Dd])oat\b", r"\1ote", xhtml)				# doat -> dote
-	xhtml = regex.sub(r"\b([Dd])oat(ed|ing)", r"\1ot\2", xhtml)			# doating -> doting
-	xhtml = regex.sub(r"\b([Ss])topt", r"\1topped", xhtml)				# stopt -> stopped
-	xhtml = regex.sub(r"\b([Ss])tept", r"\1tepped", xhtml)				# stept -> stepped
-	xhtml = regex.sub(r"\b([Ss])ecresy", r"\1ecrecy", xhtml)			# secresy -> secrecy
-	xhtml = regex.sub(r"\b([Mm])esalliance", r"\1ésalliance", xhtml)		# mesalliance -> mésalliance
-	xhtml = regex.sub(r"\b([Ss])ate\b", r"\1at", xhtml)				# sate -> sat
-	xhtml = regex.sub(r"\b([Aa])ttache\b", r"\1ttaché", xhtml)			# attache -> attaché
-	xhtml = regex.sub(r"\b([Pp])orte[\- ]coch[eè]re\b", r"\1orte-cochère", xhtml)	# porte-cochere -> porte-cochère
-	xhtml = regex.sub(r"\b([Nn])[eé]glig[eé]e?(s?)\b", r"\1egligee\2", xhtml)		# négligée -> negligee
-	xhtml = regex.sub(r"\b([Ss])hort cut(s?)\b", r"\1hortcut\2", xhtml)		# short cut -> shortcut
-	xhtml = regex.sub(r"\b([Ff])ocuss", r"\1ocus", xhtml)				# focuss -> focus
-	xhtml = regex.sub(r"\b([Mm])ise[ \-]en[ \-]sc[eè]ne", r"\1ise-en-scène", xhtml)	# mise en scene -> mise-en-scène
-	xhtml = regex.sub(r"\b([Nn])ee\b", r"\1ée", xhtml)				# nee -> née
-	xhtml = regex.sub(r"\b([Ee])au[ \-]de[ \-]Cologne\b", r"\1au de cologne", xhtml)	# eau de Cologne -> eau de cologne
-	xhtml = regex.sub(r"\b([Ss])enor", r"\1eñor", xhtml)				# senor -> señor (senores, senorita/s, etc.)
-	xhtml = regex.sub(r"\b([Gg])ramme?(s)?\b", r"\1ram\2", xhtml)			# gramm/grammes -> gram/grams
-	xhtml = regex.sub(r"\b([Aa])larum\b", r"\1larm", xhtml)				# alarum -> alarm
-	xhtml = regex.sub(r"\b([Bb])owlder(s?)\b", r"\1oulder\2", xhtml)		# bowlder/bowlders -> boulder/boulders
-	xhtml = regex.sub(r"\b([Dd])istingue\b", r"\1istingué", xhtml)			# distingue -> distingué
-	xhtml = regex.sub(r"\b[EÉ]cart[eé]\b", r"Écarté", xhtml)			# Ecarte -> Écarté
-	xhtml = regex.sub(r"\b[eé]cart[eé]\b", r"écarté", xhtml)			# ecarte -> écarté
-	xhtml = regex.sub(r"\b([Pp])ere\b", r"\1ère", xhtml)				# pere -> père (e.g. père la chaise)
-	xhtml = regex.sub(r"\b([Tt])able(s?) d’hote\b", r"\1able\2 d’hôte", xhtml)	# table d'hote -> table d'hôte
-	xhtml = regex.sub(r"\b([Ee])au(x?)[ \-]de[ \-]vie\b", r"\1au\2-de-vie", xhtml)	# eau de vie -> eau-de-vie
-	xhtml = regex.sub(r"\b3d\b", r"3rd", xhtml)						# 3d -> 3rd (warning: check that we don't convert 3d in the "3 pence" sense!)
-	xhtml = regex.sub(r"\b2d\b", r"2nd", xhtml)						# 2d -> 2nd (warning: check that we don't convert 2d in the "2 pence" sense!)
-	xhtml = regex.sub(r"\b([Mm])ia[uo]w", r"\1eow", xhtml)				# miauw, miaow -> meow
-	xhtml = regex.sub(r"\b([Cc])aviare", r"\1aviar", xhtml)				# caviare -> caviar
-	xhtml = regex.sub(r"\b([Ss])ha’n’t", r"\1han’t", xhtml)				# sha'n't -> shan't (see https://english.stackexchange.com/questions/71414/apostrophes-in-contractions-shant-shant-or-shant)
-	xhtml = regex.sub(r"\b([Ss])[uû]ret[eé]", r"\1ûreté", xhtml)			# Surete -> Sûreté
-	xhtml = regex.sub(r"\b([Ss])eance", r"\1éance", xhtml)				# seance -> séance
-	xhtml = regex.sub(r"\b([Ff])in[\- ]de[\- ]siecle", r"\1in de siècle", xhtml)		# fin de siecle -> fin de siècle
-	xhtml = regex.sub(r"\bEmpale", r"Impale", xhtml)				# Empale -> Impale
-	xhtml = regex.sub(r"\bempale", r"impale", xhtml)				# empale -> impale
-	xhtml = regex.sub(r"\b([Tt])abu(s?)\b", r"\1aboo\2", xhtml)			# tabu -> taboo
-	xhtml = regex.sub(r"\b([Kk])idnaping\b", r"\1idnapping", xhtml)			# kidnaping -> kidnapping
-	xhtml = regex.sub(r"\bQuixotic\b", r"quixotic", xhtml)				# Quixotic -> quixotic
-	xhtml = regex.sub(r"([^\p{Lowercase_Letter}]’[Tt])\s(is|were|was|isn’t)\b", r"\1\2", xhtml)		# 't is, 't was, 't were 't isn't -> 'tis, 'twas, 'twere, 't isn't
-	xhtml = regex.sub(r"\b([Uu])p stairs\b", r"\1pstairs", xhtml)			# up stairs -> upstairs
-	xhtml = regex.sub(r"(?<!up and )(?<!up or )\b([Dd])own stairs\b", r"\1ownstairs", xhtml)		# down stairs -> downstairs, but not "up (or|and) down stairs"
-	xhtml = regex.sub(r"([Pp])artizan", r"\1artisan", xhtml)			# partizan -> partisan
-	xhtml = regex.sub(r"([Nn])onplused", r"\1onplussed", xhtml)			# nonplused -> nonplussed
-	xhtml = regex.sub(r"\b([Rr])eärrangement", r"\1earrangement", xhtml)		# reärrangement -> rearrangement
-	xhtml = regex.sub(r"\b([Mm])untru(s?)\b", r"\1antra\2", xhtml)			# muntru -> mantra
-	xhtml = regex.sub(r"\b([Hh])uzz(y|ies)\b", r"\1uss\2", xhtml)			# huzzy -> hussy
-	xhtml = regex.sub(r"\b([Hh])iccough", r"\1iccup", xhtml)			# hiccough -> hiccup
-	xhtml = regex.sub(r"\b([Rr])oue(s?)\b", r"\1oué\2", xhtml)			# roue -> roué
-	xhtml = regex.sub(r"\b([Ii])dee fixe\b", r"\1dée fixe\2", xhtml)		# idee fixe -> idée fixe
-	xhtml = regex.sub(r"\b([Ss])treet[\s\-]arab\b", r"\1treet Arab", xhtml)		# street-arab -> street Arab
-	xhtml = regex.sub(r"\b[EÉ]migr[eé](?!e)", r"Émigré", xhtml)			# Emigre -> Émigré (but not emigrée, which is French)
-	xhtml = regex.sub(r"\b[eé]migr[eé](?!e)", r"émigré", xhtml)			# emigre -> émigré (but not emigrée, which is French)
+	words = set(_WORD_REGEX.findall(xhtml))
+	modern_words = {}
 
-	# Normalize some names
-	xhtml = regex.sub(r"Moliere", r"Molière", xhtml)				# Moliere -> Molière
-	xhtml = regex.sub(r"Tolstoi", r"Tolstoy", xhtml)				# Tolstoi -> Tolstoy
-	xhtml = regex.sub(r"Buonaparte", r"Bonaparte", xhtml)				# Buonaparte -> Bonaparte
-	xhtml = regex.sub(r"Shake?spea?r([^ie])", r"Shakespeare\1", xhtml)		# Shakespear/Shakspeare -> Shakespeare
-	xhtml = regex.sub(r"Shake?spea?re", r"Shakespeare", xhtml)			# Shakespear/Shakspeare -> Shakespeare
-	xhtml = regex.sub(r"Shakspea?rean", r"Shakespearean", xhtml)			# Shaksperean -> Shakespearean
-	xhtml = regex.sub(r"Shakspea?re?’s", r"Shakespeare’s", xhtml)			# Shakspere’s -> Shakespeare’s
-	xhtml = regex.sub(r"Raffaelle", r"Raphael", xhtml)				# Raffaelle -> Raphael
-	xhtml = regex.sub(r"Michael Angelo", r"Michaelangelo", xhtml)			# Michael Angelo -> Michaelangelo
-	xhtml = regex.sub(r"\bVergil", r"Virgil", xhtml)				# Vergil -> Virgil
-	xhtml = regex.sub(r"\bVishnoo", r"Vishnu", xhtml)				# Vishnoo -> Vishnu
-	xhtml = regex.sub(r"\bPekin\b", r"Peking", xhtml)				# Pekin -> Peking
-	xhtml = regex.sub(r"\bBuenos Ayres\b", r"Buenos Aires", xhtml)			# Buenos Ayres -> Buenos Aires
-	xhtml = regex.sub(r"\bCracow", r"Krakow", xhtml)				# Cracow -> Krakow
-	xhtml = regex.sub(r"\bKief", r"Kiev", xhtml)					# Kief -> Kiev
-	xhtml = regex.sub(r"\bRoumanian", r"Romanian", xhtml)				# Roumanian -> Romanian
-	xhtml = regex.sub(r"\b([Rr])enascence", r"\1enaissance", xhtml)			# renascence -> renaissance
-	xhtml = regex.sub(r"\bThibet", r"Tibet", xhtml)					# Thibet -> Tibet
-	xhtml = regex.sub(r"\bTimbuctoo", r"Timbuktu", xhtml)				# Timbuctoo -> Timbuktu
-	xhtml = regex.sub(r"\bRumania", r"Romania", xhtml)				# Rumania -> Romania
-	xhtml = regex.sub(r"\bTokio", r"Tokyo", xhtml)					# Tokio -> Tokyo
-	xhtml = regex.sub(r"\bTchekh?ov", r"Chekhov", xhtml)				# Tchekhov -> Chekhov
-	xhtml = regex.sub(r"\bVereshtchagin", r"Vereshchagin", xhtml)			# Vereshtchagin -> Vereshchagin
-	xhtml = regex.sub(r"\bSoudan", "Sudan", xhtml)					# Soudan -> Sudan
-	xhtml = regex.sub(r"\bJack-in-the-box", "jack-in-the-box", xhtml)		# Jack-in-the-box -> jack-in-the-box
-
-	# Remove archaic diphthongs
-	xhtml = regex.sub(r"\b([Mm])edi(æ|ae)val", r"\1edieval", xhtml)
-	xhtml = xhtml.replace("Cæsar", "Caesar")
-	xhtml = xhtml.replace("Crœsus", "Croesus")
-	xhtml = xhtml.replace("\bæon\b", "aeon")
-	xhtml = xhtml.replace("\bÆon\b", "Aeon")
-	xhtml = xhtml.replace("Æschylus", "Aeschylus")
-	xhtml = xhtml.replace("æsthet", "aesthet") # aesthetic, aesthete, etc.
-	xhtml = xhtml.replace("Æsthet", "Aesthet") # Aesthetic, Aesthete, etc.
-	xhtml = regex.sub(r"\b([Hh])yæna", r"\1yena", xhtml)
-	xhtml = xhtml.replace("Œdip", "Oedip") # Oedipus, Oedipal
-	xhtml = regex.sub(r"\b([Pp])æan", r"\1aean", xhtml)
-	xhtml = regex.sub(r"\b([Vv])ertebræ", r"\1ertebrae", xhtml)
+	for word in words:
+		modern_word = _modernize_word(word, language)
 
-	# Remove spaces before contractions like n’t eg "is n’t" -> "isn’t"
-	xhtml = regex.sub(r" n’t\b", "n’t", xhtml)
+		if modern_word != word:
+			modern_words[word] = modern_word
 
-	# Remove roman ordinals
-	xhtml = regex.sub(r"<span epub:type=\"z3998:roman\">(.*?)</span>(st|nd|rd|th)\b", r"<span epub:type=\"z3998:roman\">\1</span>", xhtml)
+	if modern_words:
+		xhtml = regex.sub(r"\b(?:" + "|".join(regex.escape(word) for word in modern_words) + r")\b", lambda match: modern_words[match.group()], xhtml)
 
-	# Canadian spelling follows US
-	if language in ["en-US", "en-CA"]:
-		xhtml = regex.sub(r"\b([Cc])osey", r"\1ozy", xhtml)
+		for modern_word in modern_words.values():
+			words.update(_WORD_REGEX.findall(modern_word))
 
-	# Australian spelling follows GB
-	if language in ["en-GB", "en-AU"]:
-		xhtml = regex.sub(r"\b([Cc])osey", r"\1osy", xhtml)
+	for pattern, replacement, required_words in _ARCHAIC_PHRASES:
+		if not required_words or not words.isdisjoint(required_words):
+			xhtml, count = pattern.subn(replacement, xhtml)
 
-	# US spelling is unique
-	if language == "en-US":
-		xhtml = regex.sub(r"\b([Mm])anœuv(?:er|re)", r"\1aneuver", xhtml) # Omit last letter to catch both maneuverS and maneuverING
-		xhtml = regex.sub(r"\b([Mm])anœuvering", r"\1aneuvering", xhtml)
-	else:
-		xhtml = regex.sub(r"\b([Mm])anœuv(?:er|re)", r"\1anoeuvre", xhtml)
-		xhtml = regex.sub(r"\b([Mm])anœuvring", r"\1anoeuvring", xhtml)
-		xhtml = regex.sub(r"\b([Mm])anoeuvreing", r"\1anoeuvring", xhtml)
+			# A replacement can join or create words that a later regex needs
+			if count:
+				words.update(_WORD_REGEX.findall(xhtml))
 
 	return xhtml
@@ -3,257 +3,408 @@
 Defines various typography-related functions
 """
 
+import functools
 import html
+import itertools
+import time
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional, Union
 import regex
 import smartypants
 from bs4 import BeautifulSoup
-from hyphen import Hyphenator
-from hyphen.dictools import list_installed
 import se
 
 
-def typogrify(xhtml: str, smart_quotes: bool = True) -> str:
+class _TypogrifyRule:
 	"""
-	Typogrify a string of XHTML according to SE house style.
+	One step of `typogrify()`: a regex substitution, a plain string replacement, or a function that takes a string and returns it changed.
 
-	INPUTS
-	xhtml: A string of well-formed XHTML.
-	smart_quotes: True to convert straight quotes to curly quotes.
+	If `required` is set, the rule is skipped unless that regex is found. Searching for a literal is much faster than a substitution
+	that starts with a character class or a lookbehind, and most rules change nothing in most files.
+	"""
 
-	OUTPUTS
-	A string of typogrified XHTML.
+	def __init__(self, pattern: Union[str, Callable[[str], str]], replacement: str = "", flags: int = 0, literal: bool = False, required: Optional[str] = None):
+		self.name = pattern if isinstance(pattern, str) else pattern.__name__
+		self._required = regex.compile(required) if required else None
+
+		if callable(pattern):
+			self._apply = pattern
+		elif literal:
+			self._apply = lambda xhtml: xhtml.replace(pattern, replacement)
+		else:
+			compiled_pattern = regex.compile(pattern, flags)
+			self._apply = lambda xhtml: compiled_pattern.sub(replacement, xhtml)
+
+	def apply(self, xhtml: str) -> str:
+		"""
+		Apply this rule to a string.
+		"""
+
+		if self._required and not self._required.search(xhtml):
+			return xhtml
+
+		return self._apply(xhtml)
+
+_DASH_REGEX = regex.compile(r"[–—]")
+_WHITESPACE_REGEX = regex.compile(r"\s*")
+_WHITESPACE_BEFORE_REGEX = regex.compile(r"\s*", flags=regex.REVERSE)
+_EM_DASHES_REGEX = regex.compile(fr"(?<=[^\s{se.WORD_JOINER}{se.NO_BREAK_SPACE}{se.HAIR_SPACE}])([—⸻]+)|[—⸻]+")
+_TWO_EM_DASHES_REGEX = regex.compile(fr"(?<=[^\s{se.WORD_JOINER}{se.NO_BREAK_SPACE}{se.HAIR_SPACE}])(⸺+)|⸺+")
+
+def _remove_spaces_around_dashes(xhtml: str) -> str:
 	"""
+	Remove spaces around en and em dashes, if the dash follows a character that isn't a period or a space.
 
-	if smart_quotes:
-		# Some Gutenberg works have a weird single quote style: `this is a quote'.  Clean that up here before running Smartypants.
-		xhtml = xhtml.replace("`", "'")
+	This gives the same result as `regex.sub(r"(?<!<br/)([^\\.\\s])\\s*([–—])\\s*", r"\\1\\2", xhtml)`, but only looks at dashes,
+	instead of trying that pattern at every character. As in that substitution, a dash that ends one match can't be the character
+	before the next one.
+	"""
+
+	output = []
+	last_end = 0
+
+	for match in _DASH_REGEX.finditer(xhtml):
+		dash = match.start()
+		before = _WHITESPACE_BEFORE_REGEX.match(xhtml, 0, dash).start() - 1
+
+		# We do a negative lookbehind for <br/ to prevent newlines/indents after <br/>s from being included
+		if before < last_end or xhtml[before] == "." or xhtml.endswith("<br/", 0, before):
+			continue
+
+		output.append(xhtml[last_end:before + 1])
+		output.append(match.group())
+		last_end = _WHITESPACE_REGEX.match(xhtml, dash + 1).end()
+
+	output.append(xhtml[last_end:])
+
+	return "".join(output)
+
+def _add_word_joiners_before_dashes(dashes_regex: regex.Pattern, xhtml: str) -> str:
+	"""
+	Add a word joiner between a character that isn't a space and a following dash matched by `dashes_regex`.
+
+	This gives the same result as substituting `([^\\s...])(DASH)` with `\\1{se.WORD_JOINER}\\2`, but only looks at runs of
+	dashes. A dash that ends one match can't be the character before the next one, so in a run of dashes every other dash gets
+	a word joiner, starting with the first if it follows a character that isn't a space, or the second if it doesn't.
+	"""
+
+	def add_word_joiners(match: regex.Match) -> str:
+		first = 0 if match.group(1) else 1
+
+		return "".join(f"{se.WORD_JOINER}{dash}" if index % 2 == first else dash for index, dash in enumerate(match.group()))
+
+	return dashes_regex.sub(add_word_joiners, xhtml)
+
+def _add_word_joiners_before_em_dashes(xhtml: str) -> str:
+	"""
+	Add a word joiner between letters or punctuation and a following em dash or three-em dash.
+	"""
+
+	return _add_word_joiners_before_dashes(_EM_DASHES_REGEX, xhtml)
+
+def _add_word_joiners_before_two_em_dashes(xhtml: str) -> str:
+	"""
+	Add a word joiner between letters or punctuation and a following two-em dash.
+	"""
+
+	return _add_word_joiners_before_dashes(_TWO_EM_DASHES_REGEX, xhtml)
 
-		# First, convert entities.  Sometimes Gutenberg has entities instead of straight quotes.
-		xhtml = html.unescape(xhtml) # This converts html entites to unicode
-		xhtml = regex.sub(r"&([^#\p{Lowercase_Letter}])", r"&amp;\1", xhtml) # Oops!  html.unescape also unescapes plain ampersands...
+def _remove_word_joiners_from_alt_attributes(xhtml: str) -> str:
+	"""
+	Replace no-break spaces with spaces, and remove word joiners, in `alt` attributes.
+	"""
+
+	for match in regex.findall(fr"alt=\"[^\"]*?[{se.NO_BREAK_SPACE}{se.WORD_JOINER}][^\"]*?\"", xhtml):
+		xhtml = xhtml.replace(match, match.replace(se.NO_BREAK_SPACE, " ").replace(se.WORD_JOINER, ""))
+
+	return xhtml
+
+# The rules `typogrify()` applies to convert straight quotes to curly quotes, in order
+_TYPOGRIFY_SMART_QUOTES_RULES = [
+	# Some Gutenberg works have a weird single quote style: `this is a quote'.  Clean that up here before running Smartypants.
+	_TypogrifyRule("`", "'", literal=True),
+
+	# First, convert entities.  Sometimes Gutenberg has entities instead of straight quotes.
+	_TypogrifyRule(html.unescape), # This converts html entites to unicode
+	_TypogrifyRule(r"&([^#\p{Lowercase_Letter}])", r"&amp;\1", required="&"), # Oops!  html.unescape also unescapes plain ampersands...
 
-		# Replace rsquo character with an escape sequence. We can't use HTML comments
-		# because rsquo may appear inside alt attributes, and that would break smartypants.
-		# When we encounter an actual rsquo, it's 99% correct as-is.
-		xhtml = xhtml.replace("’", "!#se:rsquo#!")
+	# Replace rsquo character with an escape sequence. We can't use HTML comments
+	# because rsquo may appear inside alt attributes, and that would break smartypants.
+	# When we encounter an actual rsquo, it's 99% correct as-is.
+	_TypogrifyRule("’", "!#se:rsquo#!", literal=True),
 
-		xhtml = smartypants.smartypants(xhtml) # Attr.u *should* output unicode characters instead of HTML entities, but it doesn't work
+	_TypogrifyRule(smartypants.smartypants), # Attr.u *should* output unicode characters instead of HTML entities, but it doesn't work
 
-		# Convert entities again
-		xhtml = html.unescape(xhtml) # This converts html entites to unicode
-		xhtml = regex.sub(r"&([^#\p{Lowercase_Letter}])", r"&amp;\1", xhtml) # Oops!  html.unescape also unescapes plain ampersands...
+	# Convert entities again
+	_TypogrifyRule(html.unescape), # This converts html entites to unicode
+	_TypogrifyRule(r"&([^#\p{Lowercase_Letter}])", r"&amp;\1", required="&") # Oops!  html.unescape also unescapes plain ampersands...
+]
 
+# The rules `typogrify()` applies to dashes, in order
+_TYPOGRIFY_DASH_RULES = [
 	# Replace no-break hyphen with regular hyphen
-	xhtml = xhtml.replace(se.NO_BREAK_HYPHEN, "-")
+	_TypogrifyRule(se.NO_BREAK_HYPHEN, "-", literal=True),
 
 	# Replace sequential em dashes with the two or three em dash character
-	xhtml = xhtml.replace("———", "⸻")
-	xhtml = xhtml.replace("——", "⸺")
+	_TypogrifyRule("———", "⸻", literal=True),
+	_TypogrifyRule("——", "⸺", literal=True),
 
 	# Smartypants doesn't do well on em dashes followed by open quotes. Fix that here
-	xhtml = regex.sub(r"—”([\p{Letter}])", r"—“\1", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"—’([\p{Letter}])", r"—‘\1", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"-“</p>", r"—”</p>", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"‘”</p>", fr"’{se.HAIR_SPACE}”</p>", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"—”([\p{Letter}])", r"—“\1", flags=regex.IGNORECASE, required="—”"),
+	_TypogrifyRule(r"—’([\p{Letter}])", r"—‘\1", flags=regex.IGNORECASE, required="—’"),
+	_TypogrifyRule(r"-“</p>", r"—”</p>", flags=regex.IGNORECASE, required="-“<"),
+	_TypogrifyRule(r"‘”</p>", fr"’{se.HAIR_SPACE}”</p>", flags=regex.IGNORECASE, required="‘”<"),
 
 	# Now that we've fixed Smartypants' output, put our quotes back in
-	xhtml = xhtml.replace("!#se:rsquo#!", "’")
+	_TypogrifyRule("!#se:rsquo#!", "’", literal=True),
 
 	# Remove spaces between en and em dashes
 	# Note that we match at least one character before the dashes, so that we don't catch start-of-line em dashes like in poetry.
-	# We do a negative lookbehind for <br/ to prevent newlines/indents after <br/>s from being included
-	xhtml = regex.sub(r"(?<!<br/)([^\.\s])\s*([–—])\s*", r"\1\2", xhtml, flags=regex.DOTALL)
+	_TypogrifyRule(_remove_spaces_around_dashes),
 
 	# First, remove stray word joiners
-	xhtml = xhtml.replace(se.WORD_JOINER, "")
+	_TypogrifyRule(se.WORD_JOINER, "", literal=True),
 
 	# Some older texts use the ,— construct; remove that archaichism
-	xhtml = xhtml.replace(",—", "—")
+	_TypogrifyRule(",—", "—", literal=True),
 
 	# Fix some common em-dash transcription errors
-	xhtml = regex.sub(r"([:;])-([\p{Letter}])", r"\1—\2", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"([\p{Letter}])-“", r"\1—“", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"([:;])-([\p{Letter}])", r"\1—\2", flags=regex.IGNORECASE, required=r"[:;]-"),
+	_TypogrifyRule(r"([\p{Letter}])-“", r"\1—“", flags=regex.IGNORECASE, required="-“"),
 
 	# Em dashes and two-em-dashes can be broken before, so add a word joiner between letters/punctuation and the following em dash
-	xhtml = regex.sub(fr"([^\s{se.WORD_JOINER}{se.NO_BREAK_SPACE}{se.HAIR_SPACE}])([—⸻])", fr"\1{se.WORD_JOINER}\2", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(_add_word_joiners_before_em_dashes),
 
 	# Add en dashes; don't replace match that is within an html tag, since ids and attrs often contain the pattern DIGIT-DIGIT
-	xhtml = regex.sub(r"(?<!<[^>]*)([0-9]+)\-([0-9]+)", r"\1–\2", xhtml)
+	_TypogrifyRule(r"(?<!<[^>]*)([0-9]+)\-([0-9]+)", r"\1–\2"),
 
 	# Add a word joiner on both sides of en dashes
-	xhtml = regex.sub(fr"{se.WORD_JOINER}?–{se.WORD_JOINER}?", fr"{se.WORD_JOINER}–{se.WORD_JOINER}", xhtml)
+	_TypogrifyRule(fr"{se.WORD_JOINER}?–{se.WORD_JOINER}?", fr"{se.WORD_JOINER}–{se.WORD_JOINER}", required="–"),
 
 	# Add a word joiner if eliding a word with a two-em-dash
 	# Word joiner isn't necessary if punctuation follows
 	# Note the \p{{P}}.  We must double-curl {} because that's the escape sequence when using .format().  The actual regex should be \p{P} to match punctuation
-	xhtml = regex.sub(fr"([^\s{se.WORD_JOINER}{se.NO_BREAK_SPACE}{se.HAIR_SPACE}])⸺", fr"\1{se.WORD_JOINER}⸺", xhtml)
-	xhtml = regex.sub(fr"⸺([^\s\p{{P}}{se.WORD_JOINER}])", fr"⸺{se.WORD_JOINER}\1", xhtml)
+	_TypogrifyRule(_add_word_joiners_before_two_em_dashes),
+	_TypogrifyRule(fr"⸺([^\s\p{{P}}{se.WORD_JOINER}])", fr"⸺{se.WORD_JOINER}\1"),
 
 	# Add a space between text and —th, which is usually an obscured number. I.e. "The —th battalion"
-	xhtml = regex.sub(fr"([\p{{Lowercase_Letter}}]){se.WORD_JOINER}—th\b", r"\1 —th", xhtml)
+	_TypogrifyRule(fr"([\p{{Lowercase_Letter}}]){se.WORD_JOINER}—th\b", r"\1 —th", required=fr"{se.WORD_JOINER}—th"),
 
 	# Remove word joiners from following opening tags--they're usually never correct
-	xhtml = regex.sub(fr"<([\p{{Letter}}]+)([^>]*?)>{se.WORD_JOINER}", r"<\1\2>", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"(?<=<[\p{{Letter}}]+[^>]*>){se.WORD_JOINER}", "", flags=regex.IGNORECASE),
 
 	# Finally fix some other mistakes
-	xhtml = xhtml.replace("—-", "—")
+	_TypogrifyRule("—-", "—", literal=True),
 
 	# Replace two-em-dashes with an em-dash, but try to exclude ones being used for elision
-	xhtml = regex.sub(fr"([I\p{{Lowercase_Letter}}>\.]{se.WORD_JOINER})⸺”", r"\1—”", xhtml)
-	xhtml = regex.sub(fr"([^\s‘“—][a-z\.]{se.WORD_JOINER})⸺\s?", r"\1—", xhtml)
+	_TypogrifyRule(fr"([I\p{{Lowercase_Letter}}>\.]{se.WORD_JOINER})⸺”", r"\1—”", required=fr"{se.WORD_JOINER}⸺”"),
+	_TypogrifyRule(fr"([^\s‘“—][a-z\.]{se.WORD_JOINER})⸺\s?", r"\1—", required=fr"{se.WORD_JOINER}⸺"),
 
 	# Remove spaces after two-em-dashes that do not appear to be elision
-	xhtml = regex.sub(fr"(\p{{Letter}}{{2,}}{se.WORD_JOINER})⸺\s", r"\1—", xhtml)
+	_TypogrifyRule(fr"(?<=\p{{Letter}}{{2}}{se.WORD_JOINER})⸺\s", "—")
+]
 
+# The rules `typogrify()` applies to abbreviations, in order
+_TYPOGRIFY_ABBREVIATION_RULES = [
 	# Replace Mr., Mrs., and other abbreviations, and include a non-breaking space
-	xhtml = regex.sub(r"\b(Mr|Mr?s|Drs?|Profs?|Lieut|Fr|Lt|Capt|Pvt|Esq|Mt|St|MM|Mmes?|Mlles?)\.?(</abbr>)?\s+", fr"\1.\2{se.NO_BREAK_SPACE}", xhtml)
+	_TypogrifyRule(r"\b(Mr|Mr?s|Drs?|Profs?|Lieut|Fr|Lt|Capt|Pvt|Esq|Mt|St|MM|Mmes?|Mlles?)\.?(</abbr>)?\s+", fr"\1.\2{se.NO_BREAK_SPACE}"),
 
 	# \P{} is the inverse of \p{}, so this regex matches any of the abbrs followed by any punctuation except a period. We also 'or' against a word joiner,
 	# in case Mr. is run up against an em dash.
-	xhtml = regex.sub(fr"\b(Mr|Mr?s|Drs?|Profs?|Lieut|Fr|Lt|Capt|Pvt|Esq|Mt|St|MM|Mmes?|Mlles?)\.?(</abbr>)?([^\P{{Punctuation}}\.]|{se.WORD_JOINER})", r"\1.\2\3", xhtml)
+	_TypogrifyRule(fr"\b(Mr|Mr?s|Drs?|Profs?|Lieut|Fr|Lt|Capt|Pvt|Esq|Mt|St|MM|Mmes?|Mlles?)\.?(</abbr>)?([^\P{{Punctuation}}\.]|{se.WORD_JOINER})", r"\1.\2\3"),
 
-	xhtml = regex.sub(r"\bNo\.\s+([0-9]+)", fr"No.{se.NO_BREAK_SPACE}\1", xhtml)
-	xhtml = regex.sub(r"<abbr>No\.</abbr>\s+", fr"<abbr>No.</abbr>{se.NO_BREAK_SPACE}", xhtml)
+	_TypogrifyRule(r"\bNo\.\s+([0-9]+)", fr"No.{se.NO_BREAK_SPACE}\1"),
+	_TypogrifyRule(r"<abbr>No\.</abbr>\s+", fr"<abbr>No.</abbr>{se.NO_BREAK_SPACE}"),
 
-	xhtml = regex.sub(r"([0-9]+)\s<abbr", fr"\1{se.NO_BREAK_SPACE}<abbr", xhtml)
+	_TypogrifyRule(r"([0-9]+)\s<abbr", fr"\1{se.NO_BREAK_SPACE}<abbr", required="<abbr")
+]
 
-	# A note on spacing:
-	# 					ibooks	kindle (mobi7)
-	# thin space U+2009:			yes	yes
-	# word joiner U+2060:			no	yes
-	# zero-width no-break space U+FEFF:	yes	yes
-	# narrow no-break space U+202F:		no	yes
-	# punctuation space U+2008:		yes	yes
+# A note on spacing:
+# 					ibooks	kindle (mobi7)
+# thin space U+2009:			yes	yes
+# word joiner U+2060:			no	yes
+# zero-width no-break space U+FEFF:	yes	yes
+# narrow no-break space U+202F:		no	yes
+# punctuation space U+2008:		yes	yes
 
+# The rules `typogrify()` applies to elision, spacing, and quotes, in order
+_TYPOGRIFY_SPACING_RULES = [
 	# Fix common abbreviatons
-	xhtml = regex.sub(r"(\s)‘a’(\s)", r"\1’a’\2", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"(\s)‘a’(\s)", r"\1’a’\2", flags=regex.IGNORECASE, required="‘[aA]’"),
 
 	# Years
-	xhtml = regex.sub(r"‘([0-9]{2,}[^\p{Letter}0-9’])", r"’\1", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"‘([0-9]{2,}[^\p{Letter}0-9’])", r"’\1", flags=regex.IGNORECASE, required="‘"),
 
-	xhtml = regex.sub(r"‘([Aa]ve|[Oo]me|[Ii]m|[Mm]idst|[Gg]ainst|[Nn]eath|[Ee]m|[Cc]os|[Tt]is|[Tt]isn’t|[Tt]was|[Tt]wixt|[Tt]were|[Tt]would|[Tt]wouldn|[Tt]ween|[Tt]will|[Rr]ound|[Pp]on|[Uu]ns?|[Uu]d|[Cc]ept|[Oo]w|[Aa]ppen|[Ee])\b", r"’\1", xhtml)
+	_TypogrifyRule(r"‘([Aa]ve|[Oo]me|[Ii]m|[Mm]idst|[Gg]ainst|[Nn]eath|[Ee]m|[Cc]os|[Tt]is|[Tt]isn’t|[Tt]was|[Tt]wixt|[Tt]were|[Tt]would|[Tt]wouldn|[Tt]ween|[Tt]will|[Rr]ound|[Pp]on|[Uu]ns?|[Uu]d|[Cc]ept|[Oo]w|[Aa]ppen|[Ee])\b", r"’\1", required="‘"),
 
-	xhtml = regex.sub(r"\b‘e\b", r"’e", xhtml)
-	xhtml = regex.sub(r"\b‘([Ee])r\b", r"’\1r", xhtml)
-	xhtml = regex.sub(r"\b‘([Ee])re\b", r"’\1re", xhtml)
-	xhtml = regex.sub(r"\b‘([Aa])ppen\b", r"’\1ppen", xhtml)
-	xhtml = regex.sub(r"\b‘([Aa])ven\b", r"’\1ven", xhtml) #  'aven't
+	_TypogrifyRule(r"\b‘e\b", r"’e"),
+	_TypogrifyRule(r"\b‘([Ee])r\b", r"’\1r"),
+	_TypogrifyRule(r"\b‘([Ee])re\b", r"’\1re"),
+	_TypogrifyRule(r"\b‘([Aa])ppen\b", r"’\1ppen"),
+	_TypogrifyRule(r"\b‘([Aa])ven\b", r"’\1ven"), #  'aven't
 
 	# nth (as in nth degree)
-	xhtml = regex.sub(r"\bn\-?th\b", r"<i>n</i>th", xhtml)
+	_TypogrifyRule(r"\bn\-?th\b", r"<i>n</i>th", required=r"n\-?th"),
 
 	# Remove double spaces that use se.NO_BREAK_SPACE for spacing
-	xhtml = regex.sub(fr"{se.NO_BREAK_SPACE}[{se.NO_BREAK_SPACE} ]+", r" ", xhtml)
-	xhtml = regex.sub(fr" [{se.NO_BREAK_SPACE} ]+", r" ", xhtml)
+	_TypogrifyRule(fr"{se.NO_BREAK_SPACE}[{se.NO_BREAK_SPACE} ]+", r" "),
+	_TypogrifyRule(fr" [{se.NO_BREAK_SPACE} ]+", r" "),
 
 	# House style: remove spacing from common Latinisms
-	xhtml = regex.sub(r"([Ii])\.\s+e\.", r"\1.e.", xhtml)
-	xhtml = regex.sub(r"([Ee])\.\s+g\.", r"\1.g.", xhtml)
+	_TypogrifyRule(r"([Ii])\.\s+e\.", r"\1.e."),
+	_TypogrifyRule(r"([Ee])\.\s+g\.", r"\1.g."),
 
 	# WARNING! This and below can remove the ending period of a sentence, if AD or BC is the last word!  We need interactive S&R for this
-	xhtml = regex.sub(r"([\d\s])A\.\s+D\.", r"\1AD", xhtml)
-	xhtml = regex.sub(r"B\.\s+C\.", r"BC", xhtml)
+	_TypogrifyRule(r"([\d\s])A\.\s+D\.", r"\1AD", required=r"A\.\s+D\."),
+	_TypogrifyRule(r"B\.\s+C\.", r"BC"),
 
 	# Put spacing next to close quotes
-	xhtml = regex.sub(fr"“[\s{se.NO_BREAK_SPACE}]*‘", fr"“{se.HAIR_SPACE}‘", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"’[\s{se.NO_BREAK_SPACE}]*”", fr"’{se.HAIR_SPACE}”", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"“[\s{se.NO_BREAK_SPACE}]*’", fr"“{se.HAIR_SPACE}’", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"‘[\s{se.NO_BREAK_SPACE}]*“", fr"‘{se.HAIR_SPACE}“", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"‘[\s{se.NO_BREAK_SPACE}]*’", fr"‘{se.HAIR_SPACE}’", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"“[\s{se.NO_BREAK_SPACE}]*‘", fr"“{se.HAIR_SPACE}‘", flags=regex.IGNORECASE, required="“"),
+	_TypogrifyRule(fr"’[\s{se.NO_BREAK_SPACE}]*”", fr"’{se.HAIR_SPACE}”", flags=regex.IGNORECASE, required="’"),
+	_TypogrifyRule(fr"“[\s{se.NO_BREAK_SPACE}]*’", fr"“{se.HAIR_SPACE}’", flags=regex.IGNORECASE, required="“"),
+	_TypogrifyRule(fr"‘[\s{se.NO_BREAK_SPACE}]*“", fr"‘{se.HAIR_SPACE}“", flags=regex.IGNORECASE, required="‘"),
+	_TypogrifyRule(fr"‘[\s{se.NO_BREAK_SPACE}]*’", fr"‘{se.HAIR_SPACE}’", flags=regex.IGNORECASE, required="‘"),
 
 	# We require a non-letter char at the end, otherwise we might match a contraction: “Hello,” ’e said.
-	xhtml = regex.sub(fr"”[\s{se.NO_BREAK_SPACE}]*’([^\p{{Letter}}])", fr"”{se.HAIR_SPACE}’\1", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"”[\s{se.NO_BREAK_SPACE}]*’([^\p{{Letter}}])", fr"”{se.HAIR_SPACE}’\1", flags=regex.IGNORECASE, required="”")
+]
 
+# The rules `typogrify()` applies to ellipses, in order
+_TYPOGRIFY_ELLIPSIS_RULES = [
 	# Fix ellipses spacing
-	xhtml = regex.sub(r"\s*\.\s*\.\s*\.\s*", r"…", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"[\s{se.NO_BREAK_SPACE}]?…[\s{se.NO_BREAK_SPACE}]?\.", fr".{se.HAIR_SPACE}…", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"[\s{se.NO_BREAK_SPACE}]?…[\s{se.NO_BREAK_SPACE}]?", fr"{se.HAIR_SPACE}… ", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"<p([^>]*?)>{se.HAIR_SPACE}…", r"<p\1>…", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"\s*\.\s*\.\s*\.\s*", r"…", flags=regex.IGNORECASE, required=r"\.\s*\.\s*\."),
+	_TypogrifyRule(fr"[\s{se.NO_BREAK_SPACE}]?…[\s{se.NO_BREAK_SPACE}]?\.", fr".{se.HAIR_SPACE}…", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"[\s{se.NO_BREAK_SPACE}]?…[\s{se.NO_BREAK_SPACE}]?", fr"{se.HAIR_SPACE}… ", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"(?<=<p[^>]*>){se.HAIR_SPACE}(?=…)", "", flags=regex.IGNORECASE),
 
 	# Remove spaces between opening tags and ellipses
-	xhtml = regex.sub(fr"(<[\p{{Letter}}0-9]+[^<]+?>)[\s{se.NO_BREAK_SPACE}]+?…", r"\1…", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"(<[\p{{Letter}}0-9]+[^<]+?>)[\s{se.NO_BREAK_SPACE}]+?…", r"\1…", flags=regex.IGNORECASE, required="…"),
 
 	# Remove spaces between closing tags and ellipses
-	xhtml = regex.sub(fr"…[\s{se.NO_BREAK_SPACE}]?(</[\p{{Letter}}0-9]+>)", r"…\1", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"…[\s{se.NO_BREAK_SPACE}]+([\)”’])(?![\p{{Letter}}])", r"…\1", xhtml, flags=regex.IGNORECASE) # If followed by a letter, the single quote is probably a leading elision
-	xhtml = regex.sub(fr"([\(“‘])[\s{se.NO_BREAK_SPACE}]+…", r"\1…", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"…[\s{se.NO_BREAK_SPACE}]?([\!\?\.\;\,])", fr"…{se.HAIR_SPACE}\1", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"([\!\?\.\;”’])[\s{se.NO_BREAK_SPACE}]?…", fr"\1{se.HAIR_SPACE}…", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(fr"\,[\s{se.NO_BREAK_SPACE}]?…", fr",{se.HAIR_SPACE}…", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"…[\s{se.NO_BREAK_SPACE}]?(</[\p{{Letter}}0-9]+>)", r"…\1", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"…[\s{se.NO_BREAK_SPACE}]+([\)”’])(?![\p{{Letter}}])", r"…\1", flags=regex.IGNORECASE, required="…"), # If followed by a letter, the single quote is probably a leading elision
+	_TypogrifyRule(fr"([\(“‘])[\s{se.NO_BREAK_SPACE}]+…", r"\1…", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"…[\s{se.NO_BREAK_SPACE}]?([\!\?\.\;\,])", fr"…{se.HAIR_SPACE}\1", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"([\!\?\.\;”’])[\s{se.NO_BREAK_SPACE}]?…", fr"\1{se.HAIR_SPACE}…", flags=regex.IGNORECASE, required="…"),
+	_TypogrifyRule(fr"\,[\s{se.NO_BREAK_SPACE}]?…", fr",{se.HAIR_SPACE}…", flags=regex.IGNORECASE, required="…"),
 
 	# Remove spaces between ellipses and endnotes directly after
-	xhtml = regex.sub(fr"…[\s{se.NO_BREAK_SPACE}]?(<a[^>]+?id=\"noteref-[0-9]+\"[^>]*?>)", r"…\1", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(fr"…[\s{se.NO_BREAK_SPACE}]?(<a[^>]+?id=\"noteref-[0-9]+\"[^>]*?>)", r"…\1", flags=regex.IGNORECASE, required="…"),
 
 	# Don't use . ... if within a clause
-	xhtml = regex.sub(r"\.(\s…\s[\p{Lowercase_Letter}])", r"\1", xhtml)
+	_TypogrifyRule(r"\.(\s…\s[\p{Lowercase_Letter}])", r"\1", required="…"),
 
 	# Remove period from . .. if after punctuation
-	xhtml = regex.sub(r"([\!\?\,\;\:]\s*)\.(\s…)", r"\1\2", xhtml)
+	_TypogrifyRule(r"([\!\?\,\;\:]\s*)\.(\s…)", r"\1\2", required="…"),
 
 	# Remove a point from four-point ellipses from beginning of paragraph
-	xhtml = regex.sub(r"<p>\. …", "<p>…", xhtml)
+	_TypogrifyRule(r"<p>\. …", "<p>…")
+]
 
+# The rules `typogrify()` applies to numbers and measurements, in order
+_TYPOGRIFY_NUMBER_RULES = [
 	# Add non-breaking spaces between amounts with an abbreviated unit.  E.g. 8 oz., 10 lbs.
-	xhtml = regex.sub(r"([0-9])\s+([\p{Letter}]{1,3}\.)", fr"\1{se.NO_BREAK_SPACE}\2", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"([0-9])\s+([\p{Letter}]{1,3}\.)", fr"\1{se.NO_BREAK_SPACE}\2", flags=regex.IGNORECASE),
 
 	# Add non-breaking spaces between Arabic numbers and AM/PM
-	xhtml = regex.sub(r"([0-9])\s+([ap])\.m\.", fr"\1{se.NO_BREAK_SPACE}\2.m.", xhtml, flags=regex.IGNORECASE)
-	xhtml = regex.sub(r"([0-9])\s+<abbr([^>]*?)>([ap])\.m\.", fr"\1{se.NO_BREAK_SPACE}<abbr\2>\3.m.", xhtml, flags=regex.IGNORECASE)
+	_TypogrifyRule(r"([0-9])\s+([ap])\.m\.", fr"\1{se.NO_BREAK_SPACE}\2.m.", flags=regex.IGNORECASE, required=r"[aApP]\.[mM]\."),
+	_TypogrifyRule(r"([0-9])\s+<abbr([^>]*?)>([ap])\.m\.", fr"\1{se.NO_BREAK_SPACE}<abbr\2>\3.m.", flags=regex.IGNORECASE, required=r">[aApP]\.[mM]\."),
 
-	xhtml = xhtml.replace("Ph.D", "PhD")
-	xhtml = regex.sub(r"P\.?\s*S\.", r"P.S.", xhtml)
+	_TypogrifyRule("Ph.D", "PhD", literal=True),
+	_TypogrifyRule(r"P\.?\s*S\.", r"P.S."),
 
 	# Fractions
-	xhtml = xhtml.replace("1/4", "¼")
-	xhtml = xhtml.replace("1/2", "½")
-	xhtml = xhtml.replace("3/4", "¾")
-	xhtml = xhtml.replace("1/3", "⅓")
-	xhtml = xhtml.replace("2/3", "⅔")
-	xhtml = xhtml.replace("1/5", "⅕")
-	xhtml = xhtml.replace("2/5", "⅖")
-	xhtml = xhtml.replace("3/5", "⅗")
-	xhtml = xhtml.replace("4/5", "⅘")
-	xhtml = xhtml.replace("1/6", "⅙")
-	xhtml = xhtml.replace("5/6", "⅚")
-	xhtml = xhtml.replace("1/8", "⅛")
-	xhtml = xhtml.replace("3/8", "⅜")
-	xhtml = xhtml.replace("5/8", "⅝")
-	xhtml = xhtml.replace("7/8", "⅞")
+	_TypogrifyRule("1/4", "¼", literal=True),
+	_TypogrifyRule("1/2", "½", literal=True),
+	_TypogrifyRule("3/4", "¾", literal=True),
+	_TypogrifyRule("1/3", "⅓", literal=True),
+	_TypogrifyRule("2/3", "⅔", literal=True),
+	_TypogrifyRule("1/5", "⅕", literal=True),
+	_TypogrifyRule("2/5", "⅖", literal=True),
+	_TypogrifyRule("3/5", "⅗", literal=True),
+	_TypogrifyRule("4/5", "⅘", literal=True),
+	_TypogrifyRule("1/6", "⅙", literal=True),
+	_TypogrifyRule("5/6", "⅚", literal=True),
+	_TypogrifyRule("1/8", "⅛", literal=True),
+	_TypogrifyRule("3/8", "⅜", literal=True),
+	_TypogrifyRule("5/8", "⅝", literal=True),
+	_TypogrifyRule("7/8", "⅞", literal=True),
 
 	# Remove spaces between whole numbers and fractions
-	xhtml = regex.sub(r"([0-9,]+)\s+([¼½¾⅔⅕⅖⅗⅘⅙⅚⅛⅜⅝⅞])", r"\1\2", xhtml)
+	_TypogrifyRule(r"([0-9,]+)\s+([¼½¾⅔⅕⅖⅗⅘⅙⅚⅛⅜⅝⅞])", r"\1\2", required="[¼½¾⅔⅕⅖⅗⅘⅙⅚⅛⅜⅝⅞]"),
 
 	# Use the Unicode Minus glyph (U+2212) for negative numbers
-	xhtml = regex.sub(r"([\s>])\-([0-9,]+)", r"\1−\2", xhtml)
+	_TypogrifyRule(r"([\s>])\-([0-9,]+)", r"\1−\2", required=r"\-[0-9,]"),
 
 	# Convert L to £ if next to a number
-	xhtml = regex.sub(r"L([0-9]+)", r"£\1", xhtml)
+	_TypogrifyRule(r"L([0-9]+)", r"£\1"),
 
 	# Make sure there are periods after old-style shilling/pence denominations
-	xhtml = regex.sub(r"\b([0-9]+)s\.? ([0-9]+)d\.?", r"\1s. \2d.", xhtml)
+	_TypogrifyRule(r"\b([0-9]+)s\.? ([0-9]+)d\.?", r"\1s. \2d.", required="[0-9]d"),
 
 	# Remove periods after pounds if followed by shillings
-	xhtml = regex.sub(r"£([0-9]+)\.? ([0-9]+)s\.?", r"£\1 \2s.", xhtml)
+	_TypogrifyRule(r"£([0-9]+)\.? ([0-9]+)s\.?", r"£\1 \2s.")
+]
 
+# The rules `typogrify()` applies last, in order
+_TYPOGRIFY_CLEANUP_RULES = [
 	# Remove word joiners if the em dash is preceded by a space
-	xhtml = regex.sub(fr"(\s+){se.WORD_JOINER}—", r"\1—", xhtml)
+	_TypogrifyRule(fr"(?<=\s){se.WORD_JOINER}(?=—)", ""),
 
 	# Remove periods from O.K. (also, it is not an abbreviation)
-	xhtml = regex.sub(r"O\.K\.", r"OK", xhtml)
-	xhtml = regex.sub(r"OK([”’]\s+[\p{Uppercase_Letter}])", r"OK.\1", xhtml)
-	xhtml = regex.sub(r"(“[^”]+?)OK ([\p{Uppercase_Letter}]\w+)", r"\1OK.” \2", xhtml)
+	_TypogrifyRule(r"O\.K\.", r"OK"),
+	_TypogrifyRule(r"OK([”’]\s+[\p{Uppercase_Letter}])", r"OK.\1"),
+	_TypogrifyRule(r"(“[^”]+?)OK ([\p{Uppercase_Letter}]\w+)", r"\1OK.” \2", required="OK "),
 
 	# Remove spaces between ellipses and noterefs
-	xhtml = regex.sub(r""" … (<a[^>]+?epub:type="noteref">)""", r" …\1", xhtml)
+	_TypogrifyRule(r""" … (<a[^>]+?epub:type="noteref">)""", r" …\1"),
 
 	# Add an &nbsp; before &amp;
-	xhtml = regex.sub(r" &amp;", f"{se.NO_BREAK_SPACE}&amp;", xhtml)
+	_TypogrifyRule(r" &amp;", f"{se.NO_BREAK_SPACE}&amp;"),
 
 	# Remove word joiners and nbsp from img alt attributes
-	for match in regex.findall(fr"alt=\"[^\"]*?[{se.NO_BREAK_SPACE}{se.WORD_JOINER}][^\"]*?\"", xhtml):
-		xhtml = xhtml.replace(match, match.replace(se.NO_BREAK_SPACE, " ").replace(se.WORD_JOINER, ""))
+	_TypogrifyRule(_remove_word_joiners_from_alt_attributes)
+]
+
+# The stages of `typogrify()` after smart quotes, in order, as tuples of the stage's name and its rules
+_TYPOGRIFY_STAGES = [
+	("dashes", _TYPOGRIFY_DASH_RULES),
+	("abbreviations", _TYPOGRIFY_ABBREVIATION_RULES),
+	("spacing", _TYPOGRIFY_SPACING_RULES),
+	("ellipses", _TYPOGRIFY_ELLIPSIS_RULES),
+	("numbers", _TYPOGRIFY_NUMBER_RULES),
+	("cleanup", _TYPOGRIFY_CLEANUP_RULES)
+]
+
+def typogrify(xhtml: str, smart_quotes: bool = True, timings: Optional[Dict[str, float]] = None) -> str:
+	"""
+	Typogrify a string of XHTML according to SE house style.
+
+	The rules are applied to the whole string in order, in stages. Each stage's rules are compiled once, when this module is imported.
+
+	INPUTS
+	xhtml: A string of well-formed XHTML.
+	smart_quotes: True to convert straight quotes to curly quotes.
+	timings: An optional dict that the number of seconds spent in each rule is added to, keyed by `stage: rule`.
+
+	OUTPUTS
+	A string of typogrified XHTML.
+	"""
+
+	stages = _TYPOGRIFY_STAGES
+
+	if smart_quotes:
+		stages = [("smart quotes", _TYPOGRIFY_SMART_QUOTES_RULES)] + stages
+
+	for stage, rules in stages:
+		for rule in rules:
+			if timings is None:
+				xhtml = rule.apply(xhtml)
+			else:
+				start = time.perf_counter()
+				xhtml = rule.apply(xhtml)
+				name = f"{stage}: {rule.name}"
+				timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
 
 	return xhtml
 
@@ -280,6 +431,31 @@ def hyphenate_file(filename: Path, language: Optional[str], ignore_h_tags: bool
 			file.write(processed_xhtml)
 			file.truncate()
 
+_HYPHENATORS: Dict[str, Any] = {} # pyhyphen Hyphenators by language, shared by every call in the process
+_HYPHENATION_SEGMENT_REGEX = regex.compile(r"<[^<>]*>?|[^<]+")
+_H_OPENING_TAG_REGEX = regex.compile("^h[1-6]$")
+_H_CLOSING_TAG_REGEX = regex.compile("^/h[1-6]$")
+
+@functools.lru_cache(maxsize=se.WORD_CACHE_SIZE)
+def _hyphenate_word(hyphenator: Any, language: str, word: str) -> str:
+	"""
+	Return a word with soft hyphens between its syllables.
+
+	Books reuse the same words over and over, so the most recently used words are remembered across files.
+	"""
+
+	hyphenated_word = word
+
+	# 100 is the hard coded max word length in the hyphenator module
+	# Check here to avoid an error
+	if len(word) < 100:
+		syllables = hyphenator.syllables(word)
+
+		if syllables:
+			hyphenated_word = "\u00AD".join(syllables)
+
+	return hyphenated_word
+
 def hyphenate(xhtml: str, language: Optional[str], ignore_h_tags: bool = False) -> str:
 	"""
 	Add soft hyphens to a string of XHTML.
@@ -293,7 +469,10 @@ def hyphenate(xhtml: str, language: Optional[str], ignore_h_tags: bool = False)
 	A string of XHTML with soft hyphens inserted in words. The output is not guaranteed to be pretty-printed.
 	"""
 
-	hyphenators: Dict[str, Hyphenator] = {}
+	# We import this late because pyhyphen is slow to load, and most commands that use this module don't hyphenate
+	from hyphen import Hyphenator # pylint: disable=import-outside-toplevel
+	from hyphen.dictools import list_installed # pylint: disable=import-outside-toplevel
+
 	soup = BeautifulSoup(xhtml, "lxml")
 
 	if language is None:
@@ -305,82 +484,73 @@ def hyphenate(xhtml: str, language: Optional[str], ignore_h_tags: bool = False)
 			except Exception:
 				raise se.InvalidLanguageException("No [attr]xml:lang[/] or [attr]lang[/] attribute on [xhtml]<html>[/] element; couldn’t guess file language.")
 
-	try:
-		language = language.replace("-", "_")
-		if language not in hyphenators:
-			hyphenators[language] = Hyphenator(language)
-	except Exception:
-		raise se.MissingDependencyException(f"Hyphenator for language [text]{language}[/] not available.\nInstalled hyphenators: {list_installed()}.")
-
-	text = str(soup.body)
-	result = text
-	word = ""
-	in_tag = False
-	tag_name = ""
-	reading_tag_name = False
-	in_h_tag = False
-	pos = 1
-	h_opening_tag_pattern = regex.compile("^h[1-6]$")
-	h_closing_tag_pattern = regex.compile("^/h[1-6]$")
+	language = language.replace("-", "_")
 
-	# The general idea here is to read the whole contents of the <body> tag character by character.
-	# If we hit a <, we ignore the contents until we hit the next >.
-	# Otherwise, we consider a word to be an unbroken sequence of alphanumeric characters.
-	# We can't just split at whitespace because HTML tags can contain whitespace (attributes for example)
-	for char in text:
-		process = False
-
-		if char == "<":
-			process = True
-			in_tag = True
-			reading_tag_name = True
-			tag_name = ""
-		elif in_tag and char == ">":
-			in_tag = False
-			reading_tag_name = False
-			word = ""
-		elif in_tag and char == " ":
-			reading_tag_name = False
-		elif in_tag and reading_tag_name:
-			tag_name = tag_name + char
-		elif not in_tag and char.isalnum():
-			word = word + char
-		elif not in_tag:
-			process = True
-
-		# Do we ignore <h1-6> tags?
-		if not reading_tag_name and h_opening_tag_pattern.match(tag_name):
-			in_h_tag = True
-
-		if not reading_tag_name and h_closing_tag_pattern.match(tag_name):
-			in_h_tag = False
-
-		if ignore_h_tags and in_h_tag:
-			process = False
-
-		if process:
-			if word != "":
-				new_word = word
-
-				# 100 is the hard coded max word length in the hyphenator module
-				# Check here to avoid an error
-				if len(word) < 100:
-					syllables = hyphenators[language].syllables(word)
-
-					if syllables:
-						new_word = "\u00AD".join(syllables)
-
-				result = result[:pos - len(word) - 1] + new_word + char + result[pos:]
-				pos = pos + len(new_word) - len(word)
-			word = ""
-
-		pos = pos + 1
+	hyphenator = _HYPHENATORS.get(language)
+
+	if hyphenator is None:
+		# Creating a hyphenator can download its dictionary, so don't hold the lock while we do it. If another thread creates one for
+		# the same language at the same time, `setdefault()` makes sure that every thread uses the same one.
+		try:
+			hyphenator = Hyphenator(language)
+		except Exception:
+			raise se.MissingDependencyException(f"Hyphenator for language [text]{language}[/] not available.\nInstalled hyphenators: {list_installed()}.")
+
+		hyphenator = _HYPHENATORS.setdefault(language, hyphenator)
+
+	result = _hyphenate_markup(str(soup.body), hyphenator, language, ignore_h_tags)
 
 	xhtml = regex.sub(r"<body.+<\/body>", "", xhtml, flags=regex.DOTALL)
 	xhtml = xhtml.replace("</head>", f"</head>\n\t{result}")
 
 	return xhtml
 
+def _hyphenate_markup(markup: str, hyphenator: Any, language: str, ignore_h_tags: bool) -> str:
+	"""
+	Add soft hyphens to the words in a string of markup, like the serialized <body> element, but not to its tags.
+	"""
+
+	segments = []
+	in_h_tag = False
+
+	# The general idea here is to read the whole markup as a sequence of tags and text.
+	# We ignore the contents of tags, and in text, we consider a word to be an unbroken sequence of alphanumeric characters.
+	# We can't just split at whitespace because HTML tags can contain whitespace (attributes for example)
+	for match in _HYPHENATION_SEGMENT_REGEX.finditer(markup):
+		segment = match.group()
+
+		if segment.startswith("<"):
+			segments.append(segment)
+
+			# The tag name ends at the first space, or at the end of the tag
+			if " " in segment or segment.endswith(">"):
+				tag_name = segment[1:].rstrip(">").split(" ", 1)[0]
+
+				# Do we ignore <h1-6> tags?
+				if _H_OPENING_TAG_REGEX.match(tag_name):
+					in_h_tag = True
+
+				if _H_CLOSING_TAG_REGEX.match(tag_name):
+					in_h_tag = False
+
+		elif ignore_h_tags and in_h_tag:
+			segments.append(segment)
+
+		else:
+			position = match.start()
+
+			for is_word, characters in itertools.groupby(segment, str.isalnum):
+				word = "".join(characters)
+				position += len(word)
+
+				# A word at the very end of the markup isn't followed by anything, so it's left alone
+				if is_word and position < len(markup):
+					segments.append(_hyphenate_word(hyphenator, language, word))
+				else:
+					segments.append(word)
+
+	return "".join(segments)
+
 def guess_quoting_style(xhtml: str) -> str:
 	"""
 	Guess whether the passed XHTML quotation is British or American style.
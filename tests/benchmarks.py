@@ -0,0 +1,102 @@
+"""
+Benchmarks that compare the se tools with the implementations they replaced, which are kept in this directory as references.
+
+Run them from the repository root, like `python tests/benchmarks.py format syllables`.
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import regex
+
+import se
+import se.formatting
+import se.resources
+import formatting_reference
+import statistics_reference
+
+
+def _best_time(function: Callable[[], object], repeat: int) -> float:
+	"""Return the fastest of `repeat` runs of a function, in seconds."""
+	times = []
+
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - start)
+
+	return min(times)
+
+def _print_results(results: List[tuple]) -> None:
+	"""Print a list of (name, seconds) tuples, with each one's speedup over the first."""
+	baseline = results[0][1]
+
+	for name, seconds in results:
+		print(f"{name:<40} {seconds:>9.3f} s {baseline / seconds:>8.1f}×")
+
+def benchmark_syllables(repeat: int) -> None:
+	"""Count the syllables of every word in the bundled word list."""
+	words = sorted(se.resources.get_words())
+	count_syllables = se.formatting._get_syllable_count.__wrapped__ # pylint: disable=protected-access
+
+	def memoized():
+		se.formatting._get_syllable_count.cache_clear() # pylint: disable=protected-access
+		for word in words:
+			se.formatting._get_syllable_count(word) # pylint: disable=protected-access
+
+	print(f"Syllables of {len(words):,} words, best of {repeat}:")
+	_print_results([
+		("reference", _best_time(lambda: [statistics_reference.get_syllable_count(word) for word in words], repeat)),
+		("single-pass scanner", _best_time(lambda: [count_syllables(word) for word in words], repeat)),
+		("single-pass scanner, memoized", _best_time(memoized, repeat)),
+		("memoized, every word already seen", _best_time(lambda: [se.formatting._get_syllable_count(word) for word in words], repeat)) # pylint: disable=protected-access
+	])
+
+def _make_endnotes(count: int) -> str:
+	"""Return an unformatted endnotes file with `count` notes, made by repeating the note in the formatting test data."""
+	with open(Path(__file__).parent / "data" / "formatting" / "in" / "endnotes.xhtml", "r", encoding="utf-8") as file:
+		xhtml = file.read()
+
+	note = regex.search(r"<li .+</li>", xhtml, flags=regex.DOTALL).group(0)
+	notes = "".join(regex.sub(r"note(ref)?-127", lambda match, number=number: f"note{match.group(1) or ''}-{number}", note) for number in range(1, count + 1))
+
+	return regex.sub(r"\n\s*", "", xhtml.replace(note, notes))
+
+def _make_glossary(count: int) -> str:
+	"""Return an unformatted glossary file with `count` terms."""
+	terms = "".join(f"<dt epub:type=\"glossterm\"><dfn>Term {number}</dfn></dt><dd epub:type=\"glossdef\"><p>The <i>meaning</i> of term {number}, which is explained at some length, with a <a href=\"chapter-1.xhtml#p-{number}\">reference</a>.</p></dd>" for number in range(1, count + 1))
+
+	return f"<?xml version=\"1.0\" encoding=\"utf-8\"?><html xmlns=\"http://www.w3.org/1999/xhtml\" xmlns:epub=\"http://www.idpf.org/2007/ops\" epub:prefix=\"z3998: http://www.daisy.org/z3998/2012/vocab/structure/, se: https://standardebooks.org/vocab/1.0\" xml:lang=\"en-GB\"><head><title>Glossary</title><link href=\"../css/core.css\" rel=\"stylesheet\" type=\"text/css\"/></head><body epub:type=\"backmatter\"><section id=\"glossary\" epub:type=\"glossary\"><h2 epub:type=\"title\">Glossary</h2><dl>{terms}</dl></section></body></html>"
+
+def benchmark_format(repeat: int) -> None:
+	"""Format large endnotes and glossary files."""
+	for name, xhtml in (("endnotes, 400 notes", _make_endnotes(400)), ("glossary, 4,000 terms", _make_glossary(4000))):
+		if se.formatting.format_xhtml(xhtml) != formatting_reference.format_xhtml(xhtml):
+			raise se.InvalidXhtmlException(f"The formatters disagree about the {name}.")
+
+		print(f"format_xhtml(), {name} ({len(xhtml.encode('utf-8')) // 1024:,} KiB), best of {repeat}:")
+		_print_results([
+			("c14n reference", _best_time(lambda xhtml=xhtml: formatting_reference.format_xhtml(xhtml), repeat)),
+			("streaming formatter", _best_time(lambda xhtml=xhtml: se.formatting.format_xhtml(xhtml), repeat))
+		])
+
+def main() -> None:
+	"""Run the requested benchmarks."""
+	benchmarks = {"format": benchmark_format, "syllables": benchmark_syllables}
+
+	parser = argparse.ArgumentParser(description="Compare the speed of the se tools with the implementations they replaced.")
+	parser.add_argument("-r", "--repeat", type=int, default=3, help="how many times to run each benchmark; the fastest run is reported")
+	parser.add_argument("benchmarks", metavar="BENCHMARK", nargs="*", help=f"the benchmarks to run, from {', '.join(benchmarks)}; defaults to all of them")
+	args = parser.parse_args()
+
+	for name in args.benchmarks:
+		if name not in benchmarks:
+			parser.error(f"unknown benchmark: {name}")
+
+	for name in args.benchmarks or benchmarks:
+		benchmarks[name](args.repeat)
+
+if __name__ == "__main__":
+	main()
@@ -19,6 +19,15 @@ def pytest_addoption(parser):
 	parser.addoption("--save-golden-files", action="store_true", default=False, help="Save updated versions of all golden output files")
 	parser.addoption("--save-new-draft", action="store_true", default=False, help="Update draft ebook used as base for other tests")
 
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path_factory, monkeypatch) -> Path:
+	"""Point the se tools' cache, including the build cache, at an empty
+	temporary directory, so that tests never read or write the user's cache.
+	"""
+	cache_home = tmp_path_factory.mktemp("cache")
+	monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+	return cache_home
+
 @pytest.fixture(name="book_name", scope="session")
 def fixture_book_name():
 	"""Return name of draft book generated by '--save-new-draft' option."""
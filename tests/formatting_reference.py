@@ -0,0 +1,346 @@
+"""
+The c14n-based XML formatter that se.formatting used before its streaming formatter, kept as a reference for differential tests.
+"""
+
+import unicodedata
+
+import regex
+from lxml import etree
+
+import se
+import se.formatting
+
+
+def _indent(tree, space="\t"):
+	"""
+	Indent an lxml tree using the given space characters.
+	"""
+
+	if len(tree) > 0:
+		level = 0
+		indentation = "\n" + level * space
+		_indent_children(tree, 1, space, [indentation, indentation + space])
+	else:
+		tree.text = "\n"
+
+def _indent_children(elem, level, one_space, indentations, has_child_tails=False):
+	"""
+	Recursive helper function implementing indent levels for lxml tree.
+	"""
+
+	# Reuse indentation strings for speed.
+	if len(indentations) <= level:
+		indentations.append(indentations[-1] + one_space)
+
+	# Start a new indentation level for the first child.
+	child_indentation = indentations[level]
+
+	# Check if any children have tail content
+	if not has_child_tails:
+		if len(elem) > 0 and elem.text and not regex.match(r"^[\n\t ]+$", elem.text):
+			has_child_tails = True
+		else:
+			for child in elem:
+				if (child.tail and not regex.match(r"^[\n\t ]+$", child.tail)):
+					has_child_tails = True
+					break
+
+	# If elem text is empty, start a new indentation level
+	if not elem.text or regex.match(r"^[\n\t ]+$", elem.text):
+		if has_child_tails:
+			elem.text = ""
+		else:
+			elem.text = child_indentation
+	else:
+		_unwrap_text(elem, remove_trailing_space=False)
+
+	# Recursively indent all children.
+	for child in elem:
+		if len(child) > 0:
+			if has_child_tails:
+				next_level = level
+			else:
+				next_level = level + 1
+			_indent_children(child, next_level, one_space, indentations, has_child_tails)
+
+		next_child = child.getnext()
+
+		# Remove line wraps and extra whitespace from child text (except meta tags)
+		if child.text and not regex.match(r"^[\n\t ]+$", child.text):
+			if child.tag is etree.Comment:
+				child.text = regex.sub(r" *\n[\n\t ]*", child_indentation, child.text)
+			elif child.tag != "{http://www.idpf.org/2007/opf}meta":
+				_unwrap_text(child, remove_trailing_space=True)
+				child.text = regex.sub(r"[\t ]+", " ", child.text)
+
+		# Handle different cases for indentation in child tail content
+		if not child.tail or regex.match(r"^[\n\t ]+$", child.tail):
+			if next_child is None:
+				if has_child_tails:
+					child.tail = ""
+				else:
+					child_indentation = indentations[level - 1]
+					child.tail = child_indentation
+			elif child.tag == "{http://www.w3.org/1999/xhtml}br":
+				if has_child_tails:
+					child_indentation = indentations[level - 1]
+				child.tail = child_indentation
+			elif not has_child_tails and next_child.tag == "{http://www.w3.org/1999/xhtml}br":
+				child.tail = child_indentation
+			elif not has_child_tails and not child.tail and next_child.tag in se.formatting.PHRASING_TAGS:
+				child.tail = ""
+			elif has_child_tails:
+				if not child.tail or next_child.tag == "{http://www.w3.org/1999/xhtml}br":
+					child.tail = ""
+				else:
+					child.tail = " "
+			else:
+				child.tail = child_indentation
+		else:
+			# Remove line wraps and extra whitespace in child tail
+			_unwrap_tail(child, remove_trailing_space=next_child is None)
+			child.tail = regex.sub(r"[\t ]+", " ", child.tail)
+			# Add special indentation for br tag with non-empty tail
+			if child.tag == "{http://www.w3.org/1999/xhtml}br":
+				child_indentation = indentations[level - 1]
+				child.tail = child_indentation + child.tail
+
+def _unwrap_text(elem: etree.Element, remove_trailing_space: bool):
+	"""
+	Remove line wraps from text content of element.
+	"""
+	elem.text = regex.sub(r"^\n[\n\t ]*", "", elem.text)
+	if remove_trailing_space:
+		elem.text = regex.sub(r"\n[\n\t ]*$", "", elem.text)
+	elem.text = regex.sub(r" *\n[\n\t ]*", " ", elem.text)
+
+def _unwrap_tail(elem: etree.Element, remove_trailing_space: bool):
+	"""
+	Remove line wraps from tail content of element.
+	"""
+	if elem.tag == "{http://www.w3.org/1999/xhtml}br":
+		elem.tail = regex.sub(r"^\n[\n\t ]*", "", elem.tail)
+	else:
+		elem.tail = regex.sub(r"^\n[\n\t ]*", " ", elem.tail)
+	if remove_trailing_space:
+		elem.tail = regex.sub(r"\n[\n\t ]*$", "", elem.tail)
+	elem.tail = regex.sub(r" *\n[\n\t ]*", " ", elem.tail)
+
+def _format_style_elements(tree: etree.ElementTree):
+	"""
+	Find <style> elements in an XML etree, and pretty-print the CSS inside of them.
+	The passed tree is modified in-place.
+
+	INPUTS
+	tree: An XML etree.
+
+	OUTPUTS
+	None.
+	"""
+
+	try:
+		for node in tree.xpath("//svg:style", namespaces={"xhtml": "http://www.w3.org/1999/xhtml", "svg": "http://www.w3.org/2000/svg"}):
+			css = se.formatting.format_css(node.text)
+
+			# Get the <style> element's indentation
+			indent = node.xpath("preceding-sibling::text()[1]")[0].replace("\n", "")
+
+			# Indent the CSS one level deeper than the <style> element
+			css = ''.join(indent + "\t" + line + "\n" for line in css.splitlines())
+			css = css.strip("\n")
+			css = regex.sub(r"^\s+$", "", css, flags=regex.MULTILINE) # Remove indents from lines that are just white space
+
+			node.text = "\n" + css + "\n" + indent
+	except se.InvalidCssException as ex:
+		raise ex
+	except Exception as ex:
+		raise se.InvalidCssException(f"Couldn’t parse CSS. Exception: {ex}")
+
+def _format_xml_str(xml: str) -> etree.ElementTree:
+	"""
+	Given a string of well-formed XML, return a pretty-printed etree.
+
+	INPUTS
+	xml: A string of well-formed XML.
+
+	OUTPUTS
+	An etree representing the pretty-printed XML.
+	"""
+
+	tree = etree.fromstring(str.encode(xml))
+	canonical_bytes = etree.tostring(tree, method="c14n")
+	tree = etree.fromstring(canonical_bytes)
+	_indent(tree, space="\t")
+
+	# Remove white space around attribute values
+	for node in tree.xpath("//*[attribute::*[re:test(., '^\\s+') or re:test(., '\\s+$')]]", namespaces={"re": "http://exslt.org/regular-expressions"}):
+		for attribute in node.keys():
+			value = node.get(attribute)
+			value = regex.sub(r"^\s+", "", value)
+			value = regex.sub(r"\s+$", "", value)
+			node.set(attribute, value)
+
+	return tree
+
+def _xml_tree_to_string(tree: etree.ElementTree, doctype: str = None) -> str:
+	"""
+	Given an XML etree, return a string representing the etree's XML.
+
+	INPUTS
+	tree: An XML etree.
+
+	OUTPUTS
+	A string representing the etree's XML.
+	"""
+
+	xml = """<?xml version="1.0" encoding="utf-8"?>\n""" + etree.tostring(tree, encoding="unicode", doctype=doctype) + "\n"
+
+	# Normalize unicode characters
+	xml = unicodedata.normalize("NFC", xml)
+
+	return xml
+
+def format_xml(xml: str) -> str:
+	"""
+	Pretty-print well-formed XML.
+
+	INPUTS
+	xml: A string of well-formed XML.
+
+	OUTPUTS
+	A string of pretty-printed XML.
+	"""
+
+	try:
+		tree = _format_xml_str(xml)
+	except Exception as ex:
+		raise se.InvalidXmlException(f"Couldn’t parse XML file. Exception: {ex}")
+
+
+	# Pull out the doctype if there is one, as etree seems to eat it
+	doctypes = regex.search(r"<!doctype[^>]+?>", xml, flags=regex.IGNORECASE)
+
+	return _xml_tree_to_string(tree, doctypes.group(0) if doctypes else None)
+
+def format_xhtml(xhtml: str) -> str:
+	"""
+	Pretty-print well-formed XHTML.
+
+	INPUTS
+	xhtml: A string of well-formed XHTML
+
+	OUTPUTS
+	A string of pretty-printed XHTML.
+	"""
+
+	# Epub3 doesn't allow named entities, so convert them to their unicode equivalents
+	# But, don't unescape the content.opf long-description accidentally
+	xhtml = regex.sub(r"&#?\w+;", se.formatting._replace_character_references, xhtml)
+
+	# Remove unnecessary doctypes which can cause xmllint to hang
+	xhtml = regex.sub(r"<!DOCTYPE[^>]+?>", "", xhtml, flags=regex.DOTALL)
+
+	# Remove white space between opening/closing tag and text nodes
+	# We do this first so that we can still format line breaks after <br/>
+	# Exclude comments
+	xhtml = regex.sub(r"(<(?:[^!/][^>]*?[^/]|[a-z])>)\s+([^\s<])", r"\1\2", xhtml, flags=regex.IGNORECASE)
+	xhtml = regex.sub(r"([^\s>])\s+(</[^>]+?>)", r"\1\2", xhtml, flags=regex.IGNORECASE)
+
+	try:
+		tree = _format_xml_str(xhtml)
+	except Exception as ex:
+		raise se.InvalidXhtmlException(f"Couldn’t parse XHTML file. Exception: {ex}")
+
+	# Lowercase attribute names
+	for node in tree.xpath("//*[attribute::*[re:test(local-name(), '[A-Z]')]]", namespaces=se.XHTML_NAMESPACES):
+		for key, value in node.items(): # Iterate over attributes
+			node.attrib.pop(key) # Remove the attribute
+			node.attrib[key.lower()] = value # Re-add the attribute, lowercased
+
+	# Lowercase tag names
+	for node in tree.xpath("//*[re:test(local-name(), '[A-Z]')]", namespaces=se.XHTML_NAMESPACES):
+		node.tag = node.tag.lower()
+
+	# Format <style> elements
+	_format_style_elements(tree)
+
+	# Remove white space between non-tags and <br/>
+	xhtml = regex.sub(r"([^>\s])\s+<br/>", r"\1<br/>", _xml_tree_to_string(tree))
+
+	return xhtml
+
+def format_opf(xml: str) -> str:
+	"""
+	Pretty-print well-formed OPF XML.
+
+	INPUTS
+	xml: A string of well-formed OPF XML
+
+	OUTPUTS
+	A string of pretty-printed XML.
+	"""
+
+	# Replace html entities in the long description so we can clean it too.
+	# We re-establish them later. Don't use html.unescape because that will unescape
+	# things like &amp; which would make an invalid XML document. (&amp; may appear in translator info,
+	# or other parts of the metadata that are not the long description.
+	xml = xml.replace("&lt;", "<")
+	xml = xml.replace("&gt;", ">")
+	xml = xml.replace("&amp;amp;", "&amp;") # Unescape escaped ampersands, which appear in the long description only
+
+	# Canonicalize and format XML
+	try:
+		tree = _format_xml_str(xml)
+	except Exception as ex:
+		raise se.InvalidXmlException(f"Couldn’t parse OPF file. Exception: {ex}")
+
+	# Format the long description, then escape it
+	for node in tree.xpath("/opf:package/opf:metadata/opf:meta[@property='se:long-description']", namespaces={"opf": "http://www.idpf.org/2007/opf"}):
+		# Convert the node contents to escaped text.
+		xhtml = node.text # This preserves the initial newline and indentation
+
+		if xhtml is None:
+			xhtml = ""
+
+		for child in node:
+			xhtml += etree.tostring(child, encoding="unicode")
+
+		# After composing the string, lxml adds namespaces to every tag. The only way to remove them is with regex.
+		xhtml = regex.sub(r"\sxmlns(:.+?)?=\"[^\"]+?\"", "", xhtml)
+
+		# Remove the children so that we can replace them with the escaped xhtml
+		for child in node:
+			node.remove(child)
+
+		node.text = xhtml
+
+	return _xml_tree_to_string(tree)
+
+def format_svg(svg: str) -> str:
+	"""
+	Pretty-print well-formed SVG XML.
+
+	INPUTS
+	svg: A string of well-formed SVG XML.
+
+	OUTPUTS
+	A string of pretty-printed SVG XML.
+	"""
+
+	try:
+		tree = _format_xml_str(svg)
+	except Exception as ex:
+		raise se.InvalidXmlException(f"Couldn’t parse SVG file. Exception: {ex}")
+
+	# Make sure viewBox is correctly-cased
+	for node in tree.xpath("/svg:svg", namespaces={"svg": "http://www.w3.org/2000/svg"}):
+		for key, value in node.items(): # Iterate over attributes
+			if key.lower() == "viewbox":
+				node.attrib.pop(key) # Remove the attribute
+				node.attrib["viewBox"] = value # Re-add the attribute, correctly-cased
+				break
+
+	# Format <style> elements
+	_format_style_elements(tree)
+
+	return _xml_tree_to_string(tree)
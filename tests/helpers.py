@@ -3,11 +3,17 @@ Common helper functions for tests.
 """
 
 import filecmp
+import hashlib
+import io
 import shlex
 import shutil
 import subprocess
 from pathlib import Path
+from typing import List
+
+import lxml.html
 import pytest
+from PIL import Image
 
 
 def run(cmd: str) -> subprocess.CompletedProcess:
@@ -110,3 +116,96 @@ def output_is_golden(out: str, golden_file: Path, update_golden: bool) ->bool:
 		assert file.read() == out
 
 	return True
+
+class LocalElement:
+	"""
+	An element "rendered" by a `LocalDriver`.
+	"""
+
+	def __init__(self, markup: str):
+		self.markup = markup
+
+	@property
+	def screenshot_as_png(self) -> bytes:
+		"""
+		Return a PNG of the element: a black box on a white background, whose size and position are derived from the element's markup.
+		"""
+
+		digest = hashlib.sha256(self.markup.encode("utf-8")).digest()
+		width = 32 + digest[0]
+		height = 16 + digest[1] % 64
+
+		image = Image.new("RGB", (width + 8, height + 8), (255, 255, 255))
+		image.paste((0, 0, 0), (4 + digest[2] % 4, 4 + digest[3] % 4, width, height))
+
+		output = io.BytesIO()
+		image.save(output, format="PNG")
+
+		return output.getvalue()
+
+	def screenshot(self, filename: str) -> bool:
+		"""
+		Save a PNG of the element to a file.
+		"""
+
+		with open(filename, "wb") as file:
+			file.write(self.screenshot_as_png)
+
+		return True
+
+class LocalDriver:
+	"""
+	A stand-in for a Selenium webdriver that doesn't need a browser.
+
+	It implements the small part of the webdriver API that we use. Pages are parsed with lxml instead of being laid out,
+	and elements render to images derived from their markup: identical markup renders identically, and different markup
+	renders differently.
+	"""
+
+	def __init__(self):
+		self._tree = lxml.html.fromstring("<html><head></head><body></body></html>")
+		self.has_quit = False
+
+	def get(self, url: str) -> None:
+		"""
+		Load a page from a `file://` URL, or `about:blank`.
+		"""
+
+		if url == "about:blank":
+			self._tree = lxml.html.fromstring("<html><head></head><body></body></html>")
+		else:
+			with open(url.replace("file://", "", 1), "rb") as file:
+				self._tree = lxml.html.fromstring(file.read())
+
+	def find_element_by_tag_name(self, name: str) -> LocalElement:
+		"""
+		Return the first element with the given tag name.
+		"""
+
+		return self.find_elements_by_tag_name(name)[0]
+
+	def find_elements_by_tag_name(self, name: str) -> List[LocalElement]:
+		"""
+		Return all elements with the given tag name.
+		"""
+
+		return [LocalElement(lxml.html.tostring(element, encoding="unicode")) for element in self._tree.getroottree().iter(name)]
+
+	def find_elements_by_css_selector(self, selector: str) -> List[LocalElement]:
+		"""
+		Return all elements matching a CSS selector.
+		"""
+
+		return [LocalElement(lxml.html.tostring(element, encoding="unicode")) for element in self._tree.cssselect(selector)]
+
+	def delete_all_cookies(self) -> None:
+		"""
+		Delete all cookies. Local pages don't have any, so this does nothing.
+		"""
+
+	def quit(self) -> None:
+		"""
+		Close the "browser".
+		"""
+
+		self.has_quit = True
@@ -0,0 +1,72 @@
+"""
+The character-by-character hyphenation loop that se.typography used before it read markup as tags and text, kept as a reference for differential tests.
+"""
+
+import regex
+
+
+def hyphenate_markup(text: str, hyphenator, ignore_h_tags: bool) -> str:
+	"""
+	Add soft hyphens to the words in a string of markup.
+	"""
+
+	result = text
+	word = ""
+	in_tag = False
+	tag_name = ""
+	reading_tag_name = False
+	in_h_tag = False
+	pos = 1
+	h_opening_tag_pattern = regex.compile("^h[1-6]$")
+	h_closing_tag_pattern = regex.compile("^/h[1-6]$")
+
+	for char in text:
+		process = False
+
+		if char == "<":
+			process = True
+			in_tag = True
+			reading_tag_name = True
+			tag_name = ""
+		elif in_tag and char == ">":
+			in_tag = False
+			reading_tag_name = False
+			word = ""
+		elif in_tag and char == " ":
+			reading_tag_name = False
+		elif in_tag and reading_tag_name:
+			tag_name = tag_name + char
+		elif not in_tag and char.isalnum():
+			word = word + char
+		elif not in_tag:
+			process = True
+
+		# Do we ignore <h1-6> tags?
+		if not reading_tag_name and h_opening_tag_pattern.match(tag_name):
+			in_h_tag = True
+
+		if not reading_tag_name and h_closing_tag_pattern.match(tag_name):
+			in_h_tag = False
+
+		if ignore_h_tags and in_h_tag:
+			process = False
+
+		if process:
+			if word != "":
+				new_word = word
+
+				# 100 is the hard coded max word length in the hyphenator module
+				# Check here to avoid an error
+				if len(word) < 100:
+					syllables = hyphenator.syllables(word)
+
+					if syllables:
+						new_word = "­".join(syllables)
+
+				result = result[:pos - len(word) - 1] + new_word + char + result[pos:]
+				pos = pos + len(new_word) - len(word)
+			word = ""
+
+		pos = pos + 1
+
+	return result
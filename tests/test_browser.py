@@ -0,0 +1,60 @@
+"""
+Tests for the browser pool, using the local stand-in driver instead of Firefox.
+"""
+
+from pathlib import Path
+
+import pytest
+
+import se.browser
+import se.images
+from helpers import LocalDriver
+
+
+def test_pool_reuses_and_recycles_drivers(tmp_path: Path):
+	"""Check that drivers are reused between uses, and replaced after their page limit"""
+	started = []
+
+	def factory():
+		started.append(LocalDriver())
+		return started[-1]
+
+	pool = se.browser.BrowserPool(max_pages=2, driver_factory=factory)
+	page = tmp_path / "page.html"
+	page.write_text("<html><body><p>Hello</p></body></html>")
+
+	for _ in range(3):
+		with pool.driver() as driver:
+			driver.get(f"file://{page}")
+
+	# The first driver loads two pages and is quit; the second is still in the pool
+	assert len(started) == 2
+	assert started[0].has_quit
+	assert not started[1].has_quit
+
+	pool.close()
+	assert started[1].has_quit
+
+def test_pool_quits_driver_on_exception():
+	"""Check that a driver in use when an exception is raised isn't returned to the pool"""
+	pool = se.browser.BrowserPool(driver_factory=LocalDriver)
+
+	with pytest.raises(RuntimeError):
+		with pool.driver() as driver:
+			raise RuntimeError()
+
+	assert driver.driver.has_quit
+
+	with pool.driver() as new_driver:
+		assert new_driver.driver is not driver.driver
+
+def test_render_mathml_with_local_driver():
+	"""Check that MathML renders consistently with the stand-in driver"""
+	driver = LocalDriver()
+	mathml = ["<math><mi>x</mi></math>", "<math><mi>y</mi></math>", "<math><mi>x</mi></math>"]
+
+	pngs = se.images.render_mathml_to_pngs(driver, mathml)
+
+	assert len(pngs) == 3
+	assert pngs[0] == pngs[2]
+	assert pngs[0] != pngs[1]
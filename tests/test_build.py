@@ -3,7 +3,16 @@ Tests for "se build" command.
 """
 
 from pathlib import Path
-from helpers import must_run, assemble_book
+from typing import Callable, List, Set
+
+import pytest
+
+import se
+import se.browser
+import se.cache
+import se.epub
+import se.se_epub_build
+from helpers import must_run, assemble_book, LocalDriver
 
 def test_build_clean(draft_dir: Path, work_dir: Path, data_dir: Path, book_name: str):
 	"""Run the build command on a known-clean book and verify that
@@ -16,3 +25,149 @@ def test_build_clean(draft_dir: Path, work_dir: Path, data_dir: Path, book_name:
 	for suffix in ["epub", "epub3", "azw3", "kepub.epub"]:
 		file = work_dir / (book_name + "." + suffix)
 		assert file.is_file()
+
+def _make_graph(calls: List[str], fail: str = "") -> se.se_epub_build._BuildGraph: # pylint: disable=protected-access
+	"""Return a graph with the same stages as `se build`, where each stage records that it ran and returns its name.
+	The stage named by `fail` raises an exception instead.
+	"""
+	def stage(name: str) -> Callable:
+		def function(*args):
+			calls.append(name)
+			if name == fail:
+				raise se.BuildFailedException(f"{name} failed.")
+			return (name, args)
+		return function
+
+	graph = se.se_epub_build._BuildGraph() # pylint: disable=protected-access
+	graph.add_stage("epub3", stage("epub3"))
+	graph.add_stage("cover", stage("cover"))
+	graph.add_stage("covers", stage("covers"), ("cover",))
+	graph.add_stage("compatibility", stage("compatibility"), ("cover",))
+	graph.add_stage("kepub", stage("kepub"), ("compatibility",))
+	graph.add_stage("epub2", stage("epub2"), ("compatibility",))
+	graph.add_stage("epub", stage("epub"), ("epub2",))
+	graph.add_stage("epubcheck", stage("epubcheck"), ("epub",))
+	graph.add_stage("azw3-convert", stage("azw3-convert"), ("epub2",))
+	graph.add_stage("azw3", stage("azw3"), ("epub2", "azw3-convert", "epubcheck"))
+	return graph
+
+@pytest.mark.parametrize("targets, stages", [
+	(["epub3"], {"epub3"}),
+	(["epub"], {"cover", "compatibility", "epub2", "epub"}),
+	(["kepub"], {"cover", "compatibility", "kepub"}),
+	(["epub", "epubcheck"], {"cover", "compatibility", "epub2", "epub", "epubcheck"}),
+	(["epub3", "covers"], {"epub3", "cover", "covers"}),
+	(["azw3"], {"cover", "compatibility", "epub2", "epub", "epubcheck", "azw3-convert", "azw3"})
+])
+def test_build_graph_targets(targets: List[str], stages: Set[str]):
+	"""Only the stages that the targets need are run, and each runs once, after its dependencies."""
+	calls: List[str] = []
+	results = _make_graph(calls).run(targets)
+
+	assert set(calls) == stages
+	assert len(calls) == len(stages)
+	assert set(results) == stages
+
+	for name in ("compatibility", "epub2", "epub", "epubcheck", "azw3"):
+		if name in calls:
+			assert calls.index("cover") < calls.index(name)
+
+def test_build_graph_results():
+	"""Each stage receives the results of its dependencies, in the order the dependencies were given."""
+	results = _make_graph([]).run(["azw3"])
+
+	assert results["azw3"][1] == (results["epub2"], results["azw3-convert"], results["epubcheck"])
+	assert results["epub"][1] == (results["epub2"],)
+	assert results["cover"][1] == ()
+
+def test_build_graph_failure():
+	"""A stage's exception reaches the caller, and the stages that depend on it don't run."""
+	calls: List[str] = []
+
+	with pytest.raises(se.BuildFailedException, match="epub2 failed"):
+		_make_graph(calls, fail="epub2").run(["epub3", "kepub", "azw3"])
+
+	assert "epub2" in calls
+	assert not {"epub", "epubcheck", "azw3-convert", "azw3"} & set(calls)
+
+def test_build_graph_unknown_dependency():
+	"""A stage can't depend on a stage that isn't in the graph."""
+	graph = se.se_epub_build._BuildGraph() # pylint: disable=protected-access
+
+	with pytest.raises(se.InvalidArgumentsException):
+		graph.add_stage("epub", lambda epub2: None, ("epub2",))
+
+CHAPTER = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xmlns:m="http://www.w3.org/1998/Math/MathML" epub:prefix="z3998: http://www.daisy.org/z3998/2012/vocab/structure/, se: https://standardebooks.org/vocab/1.0" xml:lang="en-GB">
+	<head>
+		<title>{title}</title>
+		<link href="../css/core.css" rel="stylesheet" type="text/css"/>
+	</head>
+	<body epub:type="bodymatter z3998:fiction">
+		<section id="{id}" epub:type="chapter">
+			<p>{math}</p>
+		</section>
+	</body>
+</html>
+"""
+
+FRACTION = "<m:math alttext=\"a over b\"><m:mfrac><m:mi>a</m:mi><m:mi>b</m:mi></m:mfrac></m:math>"
+ROOT = "<m:math alttext=\"root x\"><m:msqrt><m:mi>x</m:mi></m:msqrt></m:math>"
+SIMPLE = "<m:math alttext=\"x\"><m:mi>x</m:mi></m:math>"
+
+class _CountingDriver(LocalDriver):
+	"""A stand-in webdriver that records the pages it loads, apart from the blank page the pool resets drivers to."""
+	pages: List[str] = []
+
+	def get(self, url: str) -> None:
+		if url != "about:blank":
+			_CountingDriver.pages.append(url)
+		super().get(url)
+
+def _build_mathml_tree(draft_dir: Path, cache: se.cache.BuildCache) -> se.epub.BuildTree:
+	"""Run the epub2 stage on the draft book with two chapters of MathML, and return its tree."""
+	build_tree = se.epub.BuildTree.from_directory(draft_dir / "src")
+	build_tree.write_text("epub/text/chapter-1.xhtml", CHAPTER.format(title="I", id="chapter-1", math=f"{FRACTION} and {SIMPLE} and {FRACTION}"))
+	build_tree.write_text("epub/text/chapter-2.xhtml", CHAPTER.format(title="II", id="chapter-2", math=f"{ROOT} and {FRACTION}"))
+
+	metadata_xml = build_tree.read_text("epub/content.opf").replace("<manifest>", "<manifest>\n\t\t<item href=\"text/chapter-1.xhtml\" id=\"chapter-1.xhtml\" media-type=\"application/xhtml+xml\" properties=\"mathml\"/>\n\t\t<item href=\"text/chapter-2.xhtml\" id=\"chapter-2.xhtml\" media-type=\"application/xhtml+xml\" properties=\"mathml\"/>")
+
+	return se.se_epub_build._build_epub2_tree(None, se.se_epub_build.BuildStats(), cache, build_tree, metadata_xml, "cover.jpg", "toc.xhtml") # pylint: disable=protected-access
+
+def test_build_mathml(draft_dir: Path, tmp_path: Path, monkeypatch):
+	"""MathML that can't be simplified is rendered in one page load, once per expression in the whole book, and later builds
+	take the images from the cache without a browser.
+	"""
+	_CountingDriver.pages = []
+	pool = se.browser.BrowserPool(driver_factory=_CountingDriver)
+	monkeypatch.setattr(se.browser, "get_browser_pool", lambda: pool)
+	cache = se.cache.BuildCache(tmp_path / "cache")
+
+	try:
+		build_tree = _build_mathml_tree(draft_dir, cache)
+	finally:
+		pool.close()
+
+	assert len(_CountingDriver.pages) == 1
+	assert sorted(path for path in build_tree.paths() if "mathml-" in path) == ["epub/images/mathml-1-2x.png", "epub/images/mathml-1.png", "epub/images/mathml-2-2x.png", "epub/images/mathml-2.png"]
+	assert build_tree.read("epub/images/mathml-1.png") != build_tree.read("epub/images/mathml-2.png")
+
+	chapter_1 = build_tree.read_text("epub/text/chapter-1.xhtml")
+	chapter_2 = build_tree.read_text("epub/text/chapter-2.xhtml")
+	assert "<m:math" not in chapter_1 + chapter_2
+	assert chapter_1.count("src=\"../images/mathml-1.png\"") == 2
+	assert chapter_2.count("src=\"../images/mathml-1.png\"") == 1
+	assert chapter_2.count("src=\"../images/mathml-2.png\"") == 1
+	assert "<i>x</i>" in chapter_1
+	assert "images/mathml-1.png" in build_tree.read_text("epub/content.opf")
+
+	# A second build gets every image from the cache, so it never needs a browser
+	def no_browser_pool():
+		pytest.fail("The browser pool was used, but every MathML image was in the cache.")
+
+	monkeypatch.setattr(se.browser, "get_browser_pool", no_browser_pool)
+	cached_tree = _build_mathml_tree(draft_dir, cache)
+
+	assert len(_CountingDriver.pages) == 1
+	for path in build_tree.paths():
+		assert cached_tree.read(path) == build_tree.read(path)
@@ -0,0 +1,120 @@
+"""
+Tests for the on-disk build cache.
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import se.cache
+
+
+def test_default_directory(isolated_cache: Path):
+	"""The cache follows XDG_CACHE_HOME, which the tests point at a temporary directory."""
+	assert se.cache.BuildCache().directory == isolated_cache / "se" / "build"
+
+def test_get_put(tmp_path: Path):
+	"""A value that was put can be got back, and misses and hits are counted."""
+	cache = se.cache.BuildCache(tmp_path)
+	key = cache.get_key("test", 1, "input")
+
+	assert cache.get(key) is None
+	cache.put(key, b"output")
+	assert cache.get(key) == b"output"
+	assert (cache.hits, cache.misses) == (1, 1)
+
+def test_key():
+	"""Keys depend on the transform, its version, its input, its context, and the source of the tools."""
+	cache = se.cache.BuildCache()
+	key = cache.get_key("test", 1, "input", "context")
+
+	assert key == cache.get_key("test", 1, b"input", b"context")
+	assert key != cache.get_key("other", 1, "input", "context")
+	assert key != cache.get_key("test", 2, "input", "context")
+	assert key != cache.get_key("test", 1, "other", "context")
+	assert key != cache.get_key("test", 1, "input", "other")
+	assert key != cache.get_key("test", 1, "inputcontext")
+
+def test_key_includes_source_hash(monkeypatch):
+	"""Changing the source of the tools without bumping a version changes every key."""
+	cache = se.cache.BuildCache()
+	key = cache.get_key("test", 1, "input")
+
+	monkeypatch.setattr(se.cache, "get_source_hash", lambda: "0" * 64)
+	assert key != cache.get_key("test", 1, "input")
+
+def test_apply(tmp_path: Path):
+	"""A transform runs once, and its output is reused afterwards, as the same type as its input."""
+	cache = se.cache.BuildCache(tmp_path)
+	calls = []
+
+	def transform(data):
+		calls.append(data)
+		return data.upper()
+
+	assert cache.apply("test", 1, transform, "text") == "TEXT"
+	assert cache.apply("test", 1, transform, "text") == "TEXT"
+	assert cache.apply("test", 1, transform, b"bytes") == b"BYTES"
+	assert cache.apply("test", 1, transform, b"bytes") == b"BYTES"
+	assert calls == ["text", b"bytes"]
+
+def test_disabled(tmp_path: Path):
+	"""A disabled cache, as used by --no-cache, runs every transform and never reads or writes the cache directory."""
+	enabled_cache = se.cache.BuildCache(tmp_path)
+	key = enabled_cache.get_key("test", 1, "text")
+	enabled_cache.put(key, b"CACHED")
+
+	cache = se.cache.BuildCache(tmp_path / "disabled", enabled=False)
+	cache.put(key, b"output")
+	assert cache.get(key) is None
+	assert cache.apply("test", 1, str.upper, "text") == "TEXT"
+	assert not (tmp_path / "disabled").exists()
+
+	cache = se.cache.BuildCache(tmp_path, enabled=False)
+	assert cache.apply("test", 1, str.upper, "text") == "TEXT"
+
+def test_put_is_atomic(tmp_path: Path, monkeypatch):
+	"""An entry is either written completely or not at all, and no temporary files are left behind."""
+	cache = se.cache.BuildCache(tmp_path)
+	key = cache.get_key("test", 1, "input")
+
+	def fail_replace(source, destination):
+		raise OSError("No space left on device")
+
+	with monkeypatch.context() as patch:
+		patch.setattr(os, "replace", fail_replace)
+		cache.put(key, b"output")
+
+	assert cache.get(key) is None
+	assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+	cache.put(key, b"output")
+	assert cache.get(key) == b"output"
+	assert [path.name for path in tmp_path.rglob("*") if path.is_file()] == [key]
+
+def test_unwritable(tmp_path: Path):
+	"""The cache is best-effort, so a directory that can't be written to acts like an empty cache."""
+	(tmp_path / "file").write_bytes(b"")
+	cache = se.cache.BuildCache(tmp_path / "file")
+
+	assert cache.apply("test", 1, str.upper, "text") == "TEXT"
+
+@pytest.mark.parametrize("max_size, remaining", [(30, ["c", "a", "d"]), (20, ["a", "d"]), (0, [])])
+def test_prune(tmp_path: Path, max_size: int, remaining: list):
+	"""Pruning evicts the least recently used entries until the cache fits in its maximum size."""
+	cache = se.cache.BuildCache(tmp_path, max_size=max_size)
+	keys = {name: cache.get_key("test", 1, name) for name in "abcd"}
+
+	for age, name in enumerate("abcd"):
+		cache.put(keys[name], b"0123456789")
+		path = tmp_path / keys[name][0:2] / keys[name]
+		os.utime(path, (1000000 + age, 1000000 + age))
+
+	# Reading an entry makes it the most recently used
+	cache.get(keys["a"])
+	os.utime(tmp_path / keys["d"][0:2] / keys["d"])
+
+	cache.prune()
+
+	assert sorted(path.name for path in tmp_path.rglob("*") if path.is_file()) == sorted(keys[name] for name in remaining)
@@ -0,0 +1,70 @@
+"""
+Tests for writing epub files.
+"""
+
+import os
+import zipfile
+from pathlib import Path
+
+import se.epub
+
+
+def _make_tree() -> se.epub.BuildTree:
+	"""Return a small BuildTree with a file of every kind that an epub stores."""
+	tree = se.epub.BuildTree()
+	tree.write_text("epub/text/chapter-1.xhtml", "<p>Call me Ishmael.</p>" * 100)
+	tree.write_text("epub/content.opf", "<package/>")
+	tree.write_text("META-INF/container.xml", "<container/>")
+	tree.write_text("mimetype", "application/epub+zip")
+
+	for path in ("epub/images/cover.jpg", "epub/images/titlepage.png", "epub/images/map.gif", "epub/fonts/league-spartan.woff", "epub/fonts/league-spartan.woff2", "epub/images/logo.JPEG"):
+		tree.write(path, bytes(1000))
+
+	return tree
+
+def test_write_epub_reproducible(tmp_path: Path):
+	"""The same files always result in a byte-identical epub, whether they're written from a tree or from a directory."""
+	tree = _make_tree()
+	se.epub.write_epub(tree, tmp_path / "first.epub")
+	se.epub.write_epub(tree.copy(), tmp_path / "second.epub")
+
+	# Files on disk have their own timestamps and permissions, which must not end up in the epub
+	directory = tmp_path / "book"
+	for path in tree.paths():
+		(directory / path).parent.mkdir(parents=True, exist_ok=True)
+		(directory / path).write_bytes(tree.read(path))
+		(directory / path).chmod(0o600)
+		os.utime(directory / path, (1600000000, 1600000000))
+
+	se.epub.write_epub(directory, tmp_path / "third.epub")
+
+	assert (tmp_path / "first.epub").read_bytes() == (tmp_path / "second.epub").read_bytes() == (tmp_path / "third.epub").read_bytes()
+
+def test_write_epub_compression(tmp_path: Path):
+	"""`mimetype` comes first, followed by `container.xml`, and it and files that are already compressed are stored instead of deflated."""
+	se.epub.write_epub(_make_tree(), tmp_path / "book.epub")
+
+	with zipfile.ZipFile(tmp_path / "book.epub") as epub_file:
+		infos = epub_file.infolist()
+		assert [info.filename for info in infos[:2]] == ["mimetype", "META-INF/container.xml"]
+
+		for info in infos:
+			stored = info.filename == "mimetype" or info.filename.lower().endswith((".jpg", ".jpeg", ".png", ".gif", ".woff", ".woff2"))
+			assert info.compress_type == (zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED), info.filename
+			assert info.date_time == se.epub.EPUB_ZIP_DATE_TIME
+
+		assert epub_file.read("epub/images/cover.jpg") == bytes(1000)
+
+def test_write_epub_compression_level(tmp_path: Path):
+	"""The compression level only changes how text files are deflated, and each level is still reproducible."""
+	tree = _make_tree()
+
+	for level in (None, 0, 9):
+		se.epub.write_epub(tree, tmp_path / f"{level}-first.epub", level)
+		se.epub.write_epub(tree, tmp_path / f"{level}-second.epub", level)
+		assert (tmp_path / f"{level}-first.epub").read_bytes() == (tmp_path / f"{level}-second.epub").read_bytes()
+
+		with zipfile.ZipFile(tmp_path / f"{level}-first.epub") as epub_file:
+			assert {path: epub_file.read(path) for path in epub_file.namelist()} == {path: tree.read(path) for path in tree.paths()}
+
+	assert (tmp_path / "0-first.epub").stat().st_size > (tmp_path / "9-first.epub").stat().st_size
@@ -0,0 +1,145 @@
+"""
+Tests for running epubcheck, with a stand-in for Java so that Java isn't needed.
+"""
+
+import sys
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import se
+import se.cache
+import se.epubcheck
+import se.se_epub_build
+
+# A stand-in for `java` that pretends to run epubcheck.jar or BatchCheck.java. Epubs with `invalid` in their name fail,
+# epubs with `crash` in their name make the JVM exit, and if $FAKE_JAVA_CANT_RUN_SOURCE is set, source files can't be run.
+FAKE_JAVA = """
+import os, sys
+
+if sys.argv[1] == "-jar":
+	if sys.argv[3] == "--version":
+		print("EPUBCheck v4.2.4")
+		sys.exit(0)
+
+	if "invalid" in sys.argv[4]:
+		print(f"ERROR(RSC-005): {sys.argv[4]}/epub/text/chapter-1.xhtml(1,2): Error while parsing file.\\n\\nCheck finished with errors\\nMessages: 0 fatals / 1 error / 0 warnings / 0 infos")
+		sys.exit(1)
+
+	print("No errors or warnings detected.\\nepubcheck completed")
+	sys.exit(0)
+
+if os.environ.get("FAKE_JAVA_CANT_RUN_SOURCE"):
+	print("error: can't find main(String[]) method in class: BatchCheck")
+	sys.exit(1)
+
+boundary = sys.argv[-1]
+print("Picked up JAVA_TOOL_OPTIONS: -Xmx1g")
+print(f"{boundary} ready", flush=True)
+
+for path in sys.stdin:
+	path = path.strip()
+
+	if "crash" in path:
+		sys.exit(1)
+
+	if "invalid" in path:
+		print(f"ERROR(RSC-005): {path}/epub/text/chapter-1.xhtml(1,2): Error while parsing file.")
+		print(f"{boundary} failed", flush=True)
+	else:
+		print(f"{boundary} passed", flush=True)
+"""
+
+@pytest.fixture(name="java")
+def fixture_java(tmp_path: Path) -> str:
+	"""Return the path of an executable stand-in for `java`."""
+	java = tmp_path / "java"
+	java.write_text(f"#!{sys.executable}\n{FAKE_JAVA}", encoding="utf-8")
+	java.chmod(0o755)
+	return str(java)
+
+def test_batch(java: str):
+	"""Many epubs are validated by one JVM, and each epub only gets its own messages."""
+	runner = se.epubcheck.EpubcheckRunner(java=java)
+
+	try:
+		assert runner.check(Path("book-1.epub")) == (True, "")
+		passed, output = runner.check(Path("invalid-book.epub"))
+		assert not passed
+		assert output == "ERROR(RSC-005): invalid-book.epub/epub/text/chapter-1.xhtml(1,2): Error while parsing file."
+		assert runner.check(Path("book-2.epub")) == (True, "")
+		assert runner.jvms_started == 1
+	finally:
+		runner.close()
+
+def test_no_batch(java: str, monkeypatch):
+	"""If Java can't run BatchCheck.java, each epub is validated with `java -jar`, and epubcheck's summary is removed."""
+	monkeypatch.setenv("FAKE_JAVA_CANT_RUN_SOURCE", "1")
+	runner = se.epubcheck.EpubcheckRunner(java=java)
+
+	try:
+		assert runner.check(Path("book-1.epub"))[0]
+		assert runner.check(Path("invalid-book.epub")) == (False, "ERROR(RSC-005): invalid-book.epub/epub/text/chapter-1.xhtml(1,2): Error while parsing file.")
+		assert runner.check(Path("book-2.epub"))[0]
+
+		# One attempt at the batch JVM, and then one JVM for each epub
+		assert runner.jvms_started == 4
+	finally:
+		runner.close()
+
+def test_batch_restart(java: str):
+	"""If the JVM dies, the epub it was validating is validated on its own, and the next epub starts a new JVM."""
+	runner = se.epubcheck.EpubcheckRunner(java=java)
+
+	try:
+		assert runner.check(Path("book-1.epub"))[0]
+		assert runner.check(Path("crash.epub"))[0]
+		assert runner.check(Path("book-2.epub"))[0]
+		assert runner.check(Path("book-3.epub"))[0]
+		assert runner.jvms_started == 3
+	finally:
+		runner.close()
+
+def test_version_from_jar(tmp_path: Path):
+	"""The version is read from the jar's Maven metadata, without starting Java."""
+	jar_path = tmp_path / "epubcheck.jar"
+
+	with zipfile.ZipFile(jar_path, "w") as jar:
+		jar.writestr("META-INF/maven/org.w3c/epubcheck/pom.properties", "#Generated by Maven\ngroupId=org.w3c\nartifactId=epubcheck\nversion=4.2.4\n")
+
+	assert se.epubcheck.get_epubcheck_version(jar_path, str(tmp_path / "no-java")) == "4.2.4"
+
+def test_version_from_java(tmp_path: Path, java: str):
+	"""If the jar doesn't have Maven metadata, epubcheck is asked for its version, once."""
+	jar_path = tmp_path / "epubcheck.jar"
+
+	with zipfile.ZipFile(jar_path, "w") as jar:
+		jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\n")
+
+	assert se.epubcheck.get_epubcheck_version(jar_path, java) == "4.2.4"
+	assert se.epubcheck.get_epubcheck_version(jar_path, str(tmp_path / "no-java")) == "4.2.4"
+
+def test_run_epubcheck_caches_passes(tmp_path: Path, java: str, monkeypatch):
+	"""An epub that passed isn't validated again, but one that failed is."""
+	runner = se.epubcheck.EpubcheckRunner(java=java)
+	monkeypatch.setattr(se.epubcheck, "_EPUBCHECK_RUNNER", runner)
+	cache = se.cache.BuildCache(tmp_path / "cache")
+	book = SimpleNamespace(path=tmp_path)
+
+	try:
+		for name in ("book.epub", "invalid-book.epub"):
+			(tmp_path / name).write_bytes(name.encode("utf-8"))
+
+		se.se_epub_build._run_epubcheck(book, se.se_epub_build.BuildStats(), cache, tmp_path / "book.epub") # pylint: disable=protected-access
+		se.se_epub_build._run_epubcheck(book, se.se_epub_build.BuildStats(), cache, tmp_path / "book.epub") # pylint: disable=protected-access
+
+		for _ in range(2):
+			with pytest.raises(se.BuildFailedException, match="Error while parsing file"):
+				se.se_epub_build._run_epubcheck(book, se.se_epub_build.BuildStats(), cache, tmp_path / "invalid-book.epub") # pylint: disable=protected-access
+
+		assert runner.jvms_started == 1
+		assert (cache.hits, cache.misses) == (1, 3)
+	finally:
+		runner.close()
@@ -6,7 +6,13 @@ from pathlib import Path
 
 import pytest
 
+import se
+import se.cache
+import se.formatting
+import se.resources
 from se.formatting import format_xml
+import formatting_reference
+import statistics_reference
 
 
 TESTS = [
@@ -52,3 +58,116 @@ def test_format_xml(data_dir: Path, test_name: str):
 	"""
 
 	assert_match(data_dir, test_name)
+
+@pytest.mark.parametrize("test_name", TESTS)
+@pytest.mark.parametrize("function_name", ["format_xml", "format_xhtml", "format_svg", "format_opf"])
+def test_format_matches_reference(data_dir: Path, test_name: str, function_name: str):
+	"""
+	Test that the streaming formatter matches the c14n-based formatter it replaced
+	"""
+
+	with open(f"{data_dir}/formatting/in/{test_name}.xhtml", "r") as file:
+		xml = file.read()
+
+	assert getattr(se.formatting, function_name)(xml) == getattr(formatting_reference, function_name)(xml)
+
+def test_text_statistics_add_up():
+	"""
+	Test that the statistics of separate strings add up to the statistics of the strings joined together
+	"""
+
+	xhtmls = ["<h2>Chapter I</h2>", "<p>It was a dark and stormy night. The rain fell in torrents, except", "<p>at occasional intervals.</p><p>“Who’s there?” he asked. “It’s—me.”</p>", "<p>The end</p>"]
+	statistics = sum((se.formatting.get_text_statistics(xhtml) for xhtml in xhtmls), se.formatting.TextStatistics())
+
+	assert statistics.word_count == se.formatting.get_word_count(" ".join(xhtmls))
+	assert statistics.flesch_reading_ease == se.formatting.get_flesch_reading_ease(" ".join(xhtmls))
+
+XHTML_FILES = sorted((Path(__file__).parent / "data").glob("**/*.xhtml"))
+
+@pytest.mark.parametrize("filename", XHTML_FILES, ids=lambda filename: str(filename.relative_to(Path(__file__).parent / "data")))
+def test_text_statistics_match_reference(filename: Path):
+	"""Check that the word count and reading ease of each XHTML file in the test data match the functions they replaced"""
+	with open(filename, "r", encoding="utf-8") as file:
+		xhtml = file.read()
+
+	assert se.formatting.get_word_count(xhtml) == statistics_reference.get_word_count(xhtml)
+	assert se.formatting.get_flesch_reading_ease(xhtml) == statistics_reference.get_flesch_reading_ease(xhtml)
+
+def test_book_text_statistics_match_reference():
+	"""Check that the reading ease of all of the test data, counted per file and added up, matches the reading ease of the files joined together"""
+	text = ""
+
+	for filename in XHTML_FILES:
+		with open(filename, "r", encoding="utf-8") as file:
+			text += " " + file.read()
+
+	statistics = sum(se.formatting.get_text_statistics_for_files(XHTML_FILES), se.formatting.TextStatistics())
+
+	assert statistics.word_count == statistics_reference.get_word_count(text)
+	assert statistics.flesch_reading_ease == statistics_reference.get_flesch_reading_ease(text)
+
+def test_syllable_count_matches_reference():
+	"""Check that the syllable counter counts every word in the bundled word list, and some words that aren't in it, like the counter it replaced"""
+	words = sorted(se.resources.get_words()) + ["doesn't", "couldn’t", "isnt", "mcdonald", "trial", "bias", "coinciding", "preaching", "1890", "by", "y"]
+	mismatches = [(word, se.formatting._get_syllable_count(word), statistics_reference.get_syllable_count(word)) for word in words if se.formatting._get_syllable_count(word) != statistics_reference.get_syllable_count(word)] # pylint: disable=protected-access
+
+	assert mismatches == []
+
+def test_format_xml_strings(data_dir: Path):
+	"""
+	Test that formatting several strings at once gives the same results, in the same order, as formatting them one by one
+	"""
+
+	xmls = []
+
+	for test_name in TESTS:
+		with open(f"{data_dir}/formatting/in/{test_name}.xhtml", "r") as file:
+			xmls.append((file.read(), ".xhtml"))
+
+	xmls.append(("<svg xmlns=\"http://www.w3.org/2000/svg\" viewBox=\"0 0 1 1\"><title>Test</title></svg>", ".svg"))
+
+	assert list(se.formatting.format_xml_strings(xmls)) == [se.formatting.format_xml_for_suffix(xml, suffix) for xml, suffix in xmls]
+	assert list(se.formatting.format_xml_strings(xmls[0:1])) == [se.formatting.format_xml_for_suffix(*xmls[0])]
+	assert not list(se.formatting.format_xml_strings([]))
+
+def test_format_xml_strings_exception():
+	"""
+	Test that an exception formatting one string is raised when the iterator reaches that string
+	"""
+
+	xmls = [("<html><p>One</p></html>", ".xml"), ("<html><p>Two</html>", ".xml"), ("<html><p>Three</p></html>", ".xml")]
+	processed_xmls = se.formatting.format_xml_strings(xmls)
+
+	assert next(processed_xmls) == se.formatting.format_xml(xmls[0][0])
+
+	with pytest.raises(se.InvalidXmlException):
+		next(processed_xmls)
+
+def test_known_formatted(tmp_path: Path):
+	"""
+	Test that only XML marked as formatted, for the same suffix, is known to be formatted
+	"""
+
+	cache = se.cache.BuildCache(tmp_path)
+	xml = "<p>Text</p>\n"
+
+	assert not se.formatting.is_known_formatted(cache, xml, ".xml")
+
+	se.formatting.mark_known_formatted(cache, xml, ".xml")
+
+	assert se.formatting.is_known_formatted(cache, xml, ".xml")
+	assert se.formatting.is_known_formatted(cache, xml.encode("utf-8"), ".xml")
+	assert not se.formatting.is_known_formatted(cache, xml, ".xhtml")
+	assert not se.formatting.is_known_formatted(cache, "<p>Other text</p>\n", ".xml")
+	assert not se.formatting.is_known_formatted(se.cache.BuildCache(tmp_path, enabled=False), xml, ".xml")
+
+@pytest.mark.parametrize("test_name", ["semanticate", "semanticate-fixes"])
+def test_semanticate_rerun(data_dir: Path, test_name: str):
+	"""
+	Test that running semanticate on its own output changes nothing
+	"""
+
+	with open(f"{data_dir}/semanticate/out/{test_name}.xhtml", "r") as file:
+		xhtml = file.read()
+
+	assert se.formatting.semanticate(xhtml) == xhtml
@@ -4,6 +4,8 @@ Tests for commands the cleanup or transform the epub text.
 
 from pathlib import Path
 import pytest
+import se.cache
+import se.formatting
 from helpers import assemble_book, must_run, files_are_golden
 
 TEXT_CMDS = [
@@ -29,3 +31,26 @@ def test_text_cmds(data_dir: Path, draft_dir: Path, work_dir: Path, cmd_name: st
 	text_dir = book_dir / "src" / "epub" / "text"
 	golden_dir = data_dir / cmd_name / "out"
 	assert files_are_golden(in_dir, text_dir, golden_dir, update_golden)
+
+def test_clean_cache(data_dir: Path, work_dir: Path):
+	"""Check that clean skips files that the cache knows are clean, unless
+	it's run with --no-cache."""
+	with open(data_dir / "formatting" / "in" / "paragraph.xhtml", "r", encoding="utf-8") as file:
+		xhtml = file.read()
+	formatted_xhtml = se.formatting.format_xhtml(xhtml)
+	assert xhtml != formatted_xhtml
+
+	# Pretend that an earlier run found the unformatted file clean
+	filename = work_dir / "paragraph.xhtml"
+	filename.write_text(xhtml, encoding="utf-8")
+	se.formatting.mark_known_formatted(se.cache.BuildCache(), xhtml, ".xhtml")
+
+	must_run(f"se clean {filename}")
+	assert filename.read_text(encoding="utf-8") == xhtml
+
+	must_run(f"se clean --no-cache {filename}")
+	assert filename.read_text(encoding="utf-8") == formatted_xhtml
+
+	# A clean file is remembered as clean
+	must_run(f"se clean {filename}")
+	assert se.formatting.is_known_formatted(se.cache.BuildCache(), formatted_xhtml, ".xhtml")
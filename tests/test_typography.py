@@ -0,0 +1,148 @@
+"""
+Unit tests for typography functions.
+"""
+
+import shutil
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+import se.typography
+import hyphenation_reference
+from helpers import must_run
+
+
+XHTML = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en-US">
+	<head>
+		<title>Chapter 1</title>
+	</head>
+	<body epub:type="bodymatter z3998:fiction">
+		<section id="chapter-1" epub:type="chapter">
+			<h2
+				epub:type="title">Extraordinary Misadventures</h2>
+			<p
+				class="continued">The magnificent <i>spectacularly</i> unbelievable naïveté of Œdipus’s encyclopædia, in 1887.</p>
+			<h3>Interminable Conversations</h3>
+			<p>Nevertheless, everybody understood.</p>
+		</section>
+	</body>
+</html>
+"""
+
+MARKUP = [
+	"<body><h2 epub:type=\"title\">Extraordinary Misadventures</h2><p class=\"continued\">Remarkable <i>spectacularly</i> unbelievable</p></body>",
+	"<body><p>The naïveté of Œdipus’s encyclopædia, in 1887; straße and Ærøskøbing.</p></body>",
+	"<body><p>Unclosed <b>tag at the end</b>",
+	"<p>Nevertheless</p>extraordinarily",
+	"<h1>Heading without a closing tag<p>paragraph",
+	"<h2 class=\"x\">Heading <span>with <h4>nested</h4> headings</span></h2> afterwards<br/>unbelievable",
+	"<p>Attributes like <a href=\"#extraordinary-misadventures\" title=\"unbelievable words\">links</a> are ignored</p>",
+	"< p>Stray < characters > and > everywhere <",
+	"",
+]
+
+class CountingHyphenator:
+	"""
+	A stand-in for a pyhyphen Hyphenator that splits words in half, and counts how many words it was asked to split.
+	"""
+
+	def __init__(self):
+		self.calls = 0
+
+	def syllables(self, word: str) -> list:
+		"""
+		Return the two halves of a word, or an empty list if it's too short to split.
+		"""
+
+		self.calls += 1
+
+		return [word[:len(word) // 2], word[len(word) // 2:]] if len(word) > 3 else []
+
+@pytest.fixture(name="hyphenator", scope="module")
+def fixture_hyphenator():
+	"""Return a real hyphenator for en_US."""
+	from hyphen import Hyphenator # pylint: disable=import-outside-toplevel
+
+	return Hyphenator("en_US")
+
+@pytest.mark.parametrize("ignore_h_tags", [False, True])
+@pytest.mark.parametrize("markup", MARKUP)
+def test_hyphenate_matches_reference(hyphenator, markup: str, ignore_h_tags: bool):
+	"""The tag-and-text reader gives the same output as the character-by-character loop it replaced."""
+	assert se.typography._hyphenate_markup(markup, hyphenator, "en_US", ignore_h_tags) == hyphenation_reference.hyphenate_markup(markup, hyphenator, ignore_h_tags) # pylint: disable=protected-access
+
+def test_hyphenate_last_word():
+	"""A word at the very end of the markup isn't hyphenated, because nothing follows it."""
+	assert se.typography._hyphenate_markup("<p>Nevertheless</p>extraordinarily", CountingHyphenator(), "test", False) == "<p>Nevert­heless</p>extraordinarily" # pylint: disable=protected-access
+
+def test_hyphenate_xhtml():
+	"""Words in text are hyphenated, including non-ASCII words, but tags and their attributes aren't, even if they span lines."""
+	xhtml = se.typography.hyphenate(XHTML, None)
+
+	assert "<h2 epub:type=\"title\">Ex­traor­di­nary Misad­ven­tures</h2>" in xhtml
+	assert "<i>spec­tac­u­larly</i>" in xhtml
+	assert "Œdi­pus’s en­cy­clopæ­dia" in xhtml
+	assert 'epub:type="title"' in xhtml
+	assert 'class="continued"' in xhtml
+	assert "<title>Chapter 1</title>" in xhtml
+
+def test_hyphenate_ignore_h_tags():
+	"""With ignore_h_tags, words in <h1-6> elements aren't hyphenated, even if their opening tag spans lines, but other words are."""
+	xhtml = se.typography.hyphenate(XHTML, "en-US", True)
+
+	assert "Extraordinary Misadventures</h2>" in xhtml
+	assert "Interminable Conversations</h3>" in xhtml
+	assert "<i>spec­tac­u­larly</i>" in xhtml
+	assert "Nev­er­the­less" in xhtml
+
+def test_hyphenate_missing_language():
+	"""A language without a hyphenator raises an error."""
+	with pytest.raises(se.MissingDependencyException):
+		se.typography.hyphenate(XHTML, "xx-XX")
+
+def test_hyphenated_words_cache():
+	"""Hyphenated words are remembered, per language."""
+	se.typography._hyphenate_word.cache_clear() # pylint: disable=protected-access
+	hyphenator = CountingHyphenator()
+
+	for word in ("alpha", "bravo", "alpha", "alpha"):
+		se.typography._hyphenate_word(hyphenator, "test", word) # pylint: disable=protected-access
+
+	assert hyphenator.calls == 2
+	assert se.typography._hyphenate_word(hyphenator, "test", "bravo") == "br­avo" # pylint: disable=protected-access
+	assert hyphenator.calls == 2
+
+	se.typography._hyphenate_word(hyphenator, "other", "bravo") # pylint: disable=protected-access
+	assert hyphenator.calls == 3
+
+@pytest.mark.parametrize("smart_quotes", [True, False])
+def test_typogrify_timings(data_dir: Path, smart_quotes: bool):
+	"""Timing typogrify doesn't change its output, and every rule it ran is timed under its stage's name."""
+	with open(data_dir / "typogrify" / "in" / "typogrify-rules.xhtml", "r", encoding="utf-8") as file:
+		xhtml = file.read()
+
+	timings: Dict[str, float] = {}
+
+	assert se.typography.typogrify(xhtml, smart_quotes, timings) == se.typography.typogrify(xhtml, smart_quotes)
+	assert {name.split(": ", 1)[0] for name in timings} == {"smart quotes", "dashes", "abbreviations", "spacing", "ellipses", "numbers", "cleanup"} - (set() if smart_quotes else {"smart quotes"})
+	assert "dashes: _remove_spaces_around_dashes" in timings
+	assert all(seconds >= 0 for seconds in timings.values())
+
+	# Timings add up over several calls
+	first_timings = dict(timings)
+	se.typography.typogrify(xhtml, smart_quotes, timings)
+	assert timings.keys() == first_timings.keys()
+	assert all(timings[name] >= first_timings[name] for name in timings)
+
+def test_typogrify_timings_command(data_dir: Path, work_dir: Path, capfd):
+	"""`se typogrify --timings` typogrifies the file and prints a table of timings with a total."""
+	shutil.copy(data_dir / "typogrify" / "in" / "typogrify-rules.xhtml", work_dir)
+
+	must_run(f"se typogrify --timings {work_dir / 'typogrify-rules.xhtml'}")
+	out, _ = capfd.readouterr()
+
+	assert "dashes: _remove_spaces_around_dashes" in out
+	assert "total" in out
+	assert (work_dir / "typogrify-rules.xhtml").read_text(encoding="utf-8") == (data_dir / "typogrify" / "out" / "typogrify-rules.xhtml").read_text(encoding="utf-8")